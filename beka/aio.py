@@ -0,0 +1,323 @@
+"""Run BGP sessions on asyncio instead of eventlet
+
+BgpProtocol drives a StateMachine from an asyncio transport, and AsyncBeka
+is a Beka that accepts its passive peerings with an asyncio server.
+Neither needs eventlet to be running or sockets to be monkey patched.
+"""
+
+import asyncio
+import time
+
+from .beka import Beka
+from .bgp_message import BgpMessage, BgpMessageParser, BgpMessagePacker
+from .bgp_message import MessageParseError
+from .chopper import Chopper
+from .diagnostics import Diagnostics
+from .error import IdleError
+from .event import EventMessageReceived, EventShutdown, EventTimerExpired
+from .metrics import LatencyHistogram, session_counters
+
+
+class BgpProtocol(asyncio.Protocol):
+    """An asyncio Protocol for one BGP session
+
+    Route updates are passed to route_handler if one is given, otherwise
+    they can be consumed with "async for route_update in route_updates()".
+    """
+
+    def __init__(
+        self,
+        state_machine,
+        route_handler=None,
+        error_handler=None,
+        attribute_cache_size=0,
+    ):
+        self.state_machine = state_machine
+        self.route_handler = route_handler
+        self.error_handler = error_handler
+        self.transport = None
+        self.peer_address = None
+        self.peer_port = None
+        self.chopper = Chopper(None)
+        self.parser = BgpMessageParser(attribute_cache_size=attribute_cache_size)
+        self.diagnostics = None
+        self.packer = BgpMessagePacker()
+        self.route_queue = asyncio.Queue()
+        self.timer_handle = None
+        self.timer_deadline = None
+        self.closed = None
+        self.start_time = int(time.time())
+        self.bytes_sent = 0
+        self.messages_sent = 0
+        self.messages_sent_by_type = [0] * 256
+        self.messages_received = [0] * 256
+        self.bytes_received = 0
+        self.output_pauses = 0
+        self.parse_latency = LatencyHistogram()
+        self.handler_latency = LatencyHistogram()
+
+    def uptime(self):
+        return int(time.time()) - self.start_time
+
+    def counters(self):
+        # messages are written to the transport as soon as they are packed
+        return session_counters(self, 0, self.route_queue.qsize())
+
+    def connection_made(self, transport):
+        self.transport = transport
+        peername = transport.get_extra_info("peername")
+        if isinstance(peername, tuple):
+            self.peer_address, self.peer_port = peername[:2]
+        self.diagnostics = Diagnostics(self.peer_address, self.error_handler)
+        self.parser.diagnostics = self.diagnostics
+        loop = asyncio.get_running_loop()
+        self.closed = loop.create_future()
+        self.state_machine.open_handler = self.open_handler
+
+    def open_handler(self, capabilities):
+        self.parser.capabilities = capabilities
+        self.packer.capabilities = capabilities
+
+    def data_received(self, data):
+        try:
+            messages = self.chopper.feed(data)
+        except ValueError as e:
+            self.fail(e)
+            return
+        try:
+            events = self.timed_parse_messages(messages)
+            self.handle_events(events, time.time())
+        except IdleError as e:
+            self.fail(e)
+        except ValueError as e:
+            # a message too malformed to recover from (RFC 7606 3)
+            if isinstance(e, MessageParseError):
+                self.flush([e.notification()], [])
+            self.fail("Malformed message: %s" % e)
+
+    def timed_parse_messages(self, messages):
+        """parse_messages, sampling how long a batch takes to parse"""
+        if not self.parse_latency.sample():
+            return self.parse_messages(messages)
+        start = time.perf_counter()
+        events = list(self.parse_messages(messages))
+        self.parse_latency.observe(time.perf_counter() - start)
+        return events
+
+    def parse_messages(self, messages):
+        """Return received events for a batch of messages from the Chopper"""
+        messages_received = self.messages_received
+        for message_type, serialised_message in messages:
+            messages_received[message_type] += 1
+            self.bytes_received += BgpMessage.HEADER_LENGTH + len(serialised_message)
+        return (
+            EventMessageReceived(self.parser.parse(message_type, serialised_message))
+            for message_type, serialised_message in messages
+        )
+
+    def eof_received(self):
+        self.fail("Peer closed the connection")
+
+    def kick_timers(self):
+        self.timer_handle = None
+        self.timer_deadline = None
+        try:
+            self.handle_events([EventTimerExpired()], time.time())
+        except IdleError as e:
+            self.fail(e)
+
+    def schedule_timers(self):
+        """Arrange for kick_timers to run when the next timer expires"""
+        deadline = self.state_machine.next_deadline()
+        if deadline == self.timer_deadline or self.transport is None:
+            return
+        if self.timer_handle is not None:
+            self.timer_handle.cancel()
+            self.timer_handle = None
+        self.timer_deadline = deadline
+        if deadline is not None:
+            loop = asyncio.get_running_loop()
+            self.timer_handle = loop.call_later(
+                max(0, deadline - time.time()), self.kick_timers
+            )
+
+    def send_route_changes(self, route_changes, routes_version=None):
+        """Advertise RouteAdditions and withdraw RouteRemovals on this session"""
+        self.flush(
+            self.state_machine.advertise_route_changes(route_changes, routes_version),
+            [],
+        )
+        self.schedule_timers()
+
+    def handle_events(self, events, tick):
+        """Run events through the state machine and flush what it produces"""
+        output_messages = []
+        route_updates = []
+        try:
+            for event in events:
+                self.state_machine.event(event, tick, output_messages, route_updates)
+        finally:
+            self.flush(output_messages, route_updates)
+        self.schedule_timers()
+
+    def flush(self, output_messages, route_updates):
+        """Send messages and deliver route updates"""
+        if output_messages and self.transport is not None:
+            packed_messages = [
+                self.pack_message(message) for message in output_messages
+            ]
+            buffer = b"".join(packed_messages)
+            self.transport.write(buffer)
+            self.bytes_sent += len(buffer)
+            self.messages_sent += len(packed_messages)
+
+        for route_update in route_updates:
+            if self.route_handler:
+                self.timed_call(self.route_handler, route_update)
+            else:
+                self.route_queue.put_nowait(route_update)
+
+    def pack_message(self, message):
+        # messages packed in advance come from an UpdateCache
+        message_type = getattr(message, "MSG_TYPE", BgpMessage.UPDATE_MESSAGE)
+        self.messages_sent_by_type[message_type] += 1
+        return self.packer.pack(message)
+
+    def timed_call(self, handler, argument):
+        """Call a route handler, sampling how long it takes"""
+        if not self.handler_latency.sample():
+            handler(argument)
+            return
+        start = time.perf_counter()
+        handler(argument)
+        self.handler_latency.observe(time.perf_counter() - start)
+
+    async def route_updates(self):
+        """Yield route updates until the session closes"""
+        while True:
+            route_update = await self.route_queue.get()
+            if route_update is None:
+                return
+            yield route_update
+
+    def pause_writing(self):
+        # stop reading from a peer that is not keeping up with our output
+        self.output_pauses += 1
+        self.transport.pause_reading()
+
+    def resume_writing(self):
+        self.transport.resume_reading()
+
+    def fail(self, reason):
+        if self.error_handler:
+            self.error_handler("Peering %s: %s" % (self.peer_address, reason))
+        self.close()
+
+    def shutdown(self):
+        try:
+            self.handle_events([EventShutdown()], time.time())
+        except IdleError:
+            pass
+        self.close()
+
+    def close(self):
+        if self.transport is None:
+            return
+        self.transport.close()
+        self.transport = None
+
+    def connection_lost(self, exc):
+        self.transport = None
+        if self.timer_handle is not None:
+            self.timer_handle.cancel()
+            self.timer_handle = None
+        self.flush([], self.state_machine.withdraw_all_routes())
+        self.route_queue.put_nowait(None)
+        if self.closed is not None and not self.closed.done():
+            self.closed.set_result(exc)
+
+
+class BekaProtocol(BgpProtocol):
+    """A BgpProtocol for a passive peering accepted by AsyncBeka"""
+
+    def __init__(self, beka):
+        super().__init__(
+            None, beka.route_handler, beka.error_handler, beka.attribute_cache_size
+        )
+        self.beka = beka
+        self.peer = None
+
+    def connection_made(self, transport):
+        peer_ip = transport.get_extra_info("peername")[0]
+        if peer_ip not in self.beka.peers:
+            if self.error_handler:
+                self.error_handler(
+                    "Rejecting connection from %s:%d"
+                    % transport.get_extra_info("peername")[:2]
+                )
+            transport.close()
+            return
+        self.peer = self.beka.peers[peer_ip]
+        self.state_machine = self.beka.build_state_machine(self.peer)
+        super().connection_made(transport)
+        self.beka.peerings.append(self)
+        if self.beka.peer_up_handler:
+            self.beka.peer_up_handler(peer_ip, self.peer["peer_as"])
+
+    def connection_lost(self, exc):
+        if self.peer is None:
+            return
+        super().connection_lost(exc)
+        self.beka.peerings.remove(self)
+        if self.beka.peer_down_handler:
+            self.beka.peer_down_handler(self.peer["peer_ip"], self.peer["peer_as"])
+
+
+class AsyncBeka(Beka):
+    """A Beka that serves passive peerings on the running asyncio loop
+
+    Batched route delivery is not supported; pass a route_handler, or
+    iterate over each BekaProtocol's route_updates(). Nor are parse_pool
+    and metrics_address, though MetricsExporter(async_beka).render() works.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        if self.batch_route_handler:
+            raise ValueError("AsyncBeka does not support batch_route_handler")
+        if self.parse_pool is not None:
+            raise ValueError("AsyncBeka does not support parse_pool")
+        if self.metrics_address is not None:
+            raise ValueError("AsyncBeka does not support metrics_address")
+        self.server = None
+
+    def init_eventlet(self):
+        """Timers run on the asyncio loop, and metrics are not served"""
+
+    async def start(self):
+        loop = asyncio.get_running_loop()
+        self.server = await loop.create_server(
+            lambda: BekaProtocol(self), self.local_address, self.bgp_port
+        )
+        return self.server
+
+    # a coroutine, unlike Beka.run, as it runs on the asyncio loop
+    async def run(self):  # pytype: disable=signature-mismatch
+        # pylint: disable=invalid-overridden-method
+        await self.start()
+        async with self.server:
+            await self.server.serve_forever()
+
+    def schedule_route_changes(self):
+        loop = asyncio.get_running_loop()
+        return loop.call_later(self.route_change_delay, self.flush_route_changes)
+
+    def shutdown(self):
+        if self.route_change_timer is not None:
+            self.route_change_timer.cancel()
+            self.route_change_timer = None
+        if self.server:
+            self.server.close()
+        for peering in list(self.peerings):
+            peering.shutdown()
+        self.stop_sharing_prefixes()
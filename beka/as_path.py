@@ -0,0 +1,336 @@
+"""The AS_PATH path attribute
+
+An AsPath keeps the segments of the path as arrays of AS numbers, so AS_SET
+and AS_SEQUENCE segments survive a parse and pack round trip, and caches
+its packed 2 and 4 byte encodings. Identical paths are interned, so parsing
+a path that is already in use returns the existing object without decoding.
+The intern tables hold their paths strongly and are emptied when they reach
+MAX_INTERNED entries, which is cheaper per path than weak references on the
+parse path, at the cost of a full table sometimes holding two copies of a
+path.
+
+For compatibility with code that used plain strings, an AsPath compares
+equal to, and hashes like, its string form: the AS numbers separated by
+spaces, with AS_SETs in braces, eg "65001 65002 {65003 65004}". It is not
+a str, though, so code that split the string should iterate over the
+AsPath, which yields the AS numbers as ints, or use str(as_path).
+"""
+
+from array import array
+import sys
+
+AS_SET = 1
+AS_SEQUENCE = 2
+
+AS_NUMBER_FORMATS = {2: "H", 4: "I"}
+MAX_SEGMENT_LENGTH = 255
+# stands in for 4 byte AS numbers in 2 byte AS paths (RFC 6793)
+AS_TRANS = 23456
+
+
+def as_array(as_numbers):
+    return array("I", as_numbers)
+
+
+def pack_numbers(numbers, as_number_length):
+    """Pack AS numbers in network byte order"""
+    packed = array("I" if as_number_length == 4 else "H", numbers)
+    if sys.byteorder == "little":
+        packed.byteswap()
+    return packed.tobytes()
+
+
+class AsPath:
+    """An AS_PATH made of (segment type, AS numbers) segments
+
+    AsPaths are shared between routes, so they should be treated as
+    immutable.
+    """
+
+    __slots__ = (
+        "segments",
+        "_string",
+        "_hash",
+        "_length",
+        "_packed",
+        "_prepended",
+    )
+
+    MAX_INTERNED = 1 << 16
+    # keyed by the 4 byte encoding, and by the 2 byte encoding of paths
+    # parsed from 2 byte speakers
+    _interned = {}
+    _unpacked_as2 = {}
+
+    def __init__(self, segments):
+        self.segments = tuple(
+            (segment_type, as_array(numbers)) for segment_type, numbers in segments
+        )
+        self._reset()
+
+    @classmethod
+    def from_arrays(cls, segments, as_number_length=None, packed=None):
+        """Build an AsPath that takes ownership of segments, a tuple of
+        (segment type, array("I")) pairs, without copying it
+
+        packed, if given, is the path's encoding with as_number_length byte
+        AS numbers.
+        """
+        as_path = cls.__new__(cls)
+        as_path.segments = segments
+        as_path._string = None
+        as_path._hash = None
+        as_path._length = None
+        as_path._packed = {} if packed is None else {as_number_length: packed}
+        as_path._prepended = None
+        return as_path
+
+    def _reset(self):
+        self._string = None
+        self._hash = None
+        self._length = None
+        self._packed = {}
+        self._prepended = None
+
+    @classmethod
+    def intern(cls, segments):
+        """Return the shared AsPath for these segments"""
+        return cls.intern_path(cls(segments))
+
+    @classmethod
+    def intern_path(cls, as_path):
+        """Return the shared AsPath equal to as_path, sharing as_path if
+        there is none yet"""
+        return cls._store(cls._interned, as_path.pack(4), as_path)
+
+    @classmethod
+    def _store(cls, table, key, as_path):
+        existing = table.get(key)
+        if existing is not None:
+            return existing
+        if len(table) >= cls.MAX_INTERNED:
+            table.clear()
+        table[key] = as_path
+        return as_path
+
+    @classmethod
+    def from_sequence(cls, as_numbers):
+        return cls.intern([(AS_SEQUENCE, as_numbers)] if as_numbers else [])
+
+    @classmethod
+    def from_string(cls, string):
+        """Parse the string form, eg "65001 65002 {65003 65004}"."""
+        segments = []
+        as_set = None
+        for token in string.replace("{", " { ").replace("}", " } ").split():
+            if token == "{":
+                if as_set is not None:
+                    raise ValueError("AS_PATH: Nested AS_SET in %r" % string)
+                as_set = []
+            elif token == "}":
+                if as_set is None:
+                    raise ValueError("AS_PATH: Unmatched } in %r" % string)
+                segments.append((AS_SET, as_set))
+                as_set = None
+            elif as_set is not None:
+                as_set.append(int(token))
+            elif segments and segments[-1][0] == AS_SEQUENCE:
+                segments[-1][1].append(int(token))
+            else:
+                segments.append((AS_SEQUENCE, [int(token)]))
+        if as_set is not None:
+            raise ValueError("AS_PATH: Unterminated AS_SET in %r" % string)
+        return cls.intern(segments)
+
+    @classmethod
+    def coerce(cls, as_path):
+        """Return as_path as an AsPath, parsing it if it is a string"""
+        if isinstance(as_path, AsPath):
+            return as_path
+        return cls.from_string(as_path or "")
+
+    @classmethod
+    def unpack(cls, packed_as_path, as_number_length=4):
+        """Parse a packed AS_PATH attribute, reusing an interned AsPath
+        with the same encoding if there is one"""
+        packed_as_path = bytes(packed_as_path)
+        # the interned paths are keyed by their 4 byte encoding
+        table = cls._interned if as_number_length == 4 else cls._unpacked_as2
+        as_path = table.get(packed_as_path)
+        if as_path is not None:
+            return as_path
+
+        number_format = AS_NUMBER_FORMATS[as_number_length]
+        end = len(packed_as_path)
+        if (
+            end > 2
+            and packed_as_path[0] == AS_SEQUENCE
+            and packed_as_path[1] * as_number_length + 2 == end
+        ):
+            # the common case, a single AS_SEQUENCE
+            numbers = array(number_format, packed_as_path[2:])
+            if sys.byteorder == "little":
+                numbers.byteswap()
+            if as_number_length != 4:
+                numbers = as_array(numbers)
+            segments = ((AS_SEQUENCE, numbers),)
+            return cls._store_unpacked(
+                table, packed_as_path, segments, as_number_length
+            )
+
+        segments = []
+        canonical = True
+        offset = 0
+        while offset < end:
+            if offset + 2 > end:
+                raise ValueError("AS_PATH: Segment header runs past end")
+            segment_type, count = packed_as_path[offset], packed_as_path[offset + 1]
+            if segment_type not in (AS_SET, AS_SEQUENCE):
+                raise ValueError("AS_PATH: Unknown segment type %d" % segment_type)
+            offset += 2
+            next_offset = offset + count * as_number_length
+            if next_offset > end:
+                raise ValueError("AS_PATH: Segment runs past end")
+            numbers = array(number_format, packed_as_path[offset:next_offset])
+            if sys.byteorder == "little":
+                numbers.byteswap()
+            if as_number_length != 4:
+                numbers = as_array(numbers)
+            segments.append((segment_type, numbers))
+            # pack drops empty segments, which would change the encoding
+            canonical = canonical and count > 0
+            offset = next_offset
+
+        if not canonical:
+            return cls.intern_path(cls.from_arrays(tuple(segments)))
+        return cls._store_unpacked(
+            table, packed_as_path, tuple(segments), as_number_length
+        )
+
+    @classmethod
+    def _store_unpacked(cls, table, packed_as_path, segments, as_number_length):
+        """Intern a newly unpacked path, which unpack found no entry for"""
+        as_path = cls.from_arrays(segments, as_number_length, packed_as_path)
+        if as_number_length != 4:
+            as_path = cls.intern_path(as_path)
+        if len(table) >= cls.MAX_INTERNED:
+            table.clear()
+        table[packed_as_path] = as_path
+        return as_path
+
+    def pack(self, as_number_length=4):
+        """Return the packed attribute with 2 or 4 byte AS numbers"""
+        packed = self._packed.get(as_number_length)
+        if packed is None:
+            chunks = []
+            for segment_type, numbers in self.segments:
+                if as_number_length == 2:
+                    numbers = [
+                        number if number <= 0xFFFF else AS_TRANS for number in numbers
+                    ]
+                for start in range(0, len(numbers), MAX_SEGMENT_LENGTH):
+                    chunk = numbers[start : start + MAX_SEGMENT_LENGTH]
+                    chunks.append(bytes((segment_type, len(chunk))))
+                    chunks.append(pack_numbers(chunk, as_number_length))
+            packed = b"".join(chunks)
+            self._packed[as_number_length] = packed
+        return packed
+
+    def __len__(self):
+        """The path length used in route selection: an AS_SET counts as one"""
+        if self._length is None:
+            length = 0
+            for segment_type, numbers in self.segments:
+                length += len(numbers) if segment_type == AS_SEQUENCE else 1
+            self._length = length
+        return self._length
+
+    def __iter__(self):
+        for _segment_type, numbers in self.segments:
+            yield from numbers
+
+    def __contains__(self, as_number):
+        for _segment_type, numbers in self.segments:
+            if as_number in numbers:
+                return True
+        return False
+
+    def has_loop(self, local_as):
+        """True if local_as already appears in the path (RFC 4271 9.1.2)"""
+        return local_as in self
+
+    def prepend(self, as_number, count=1):
+        """Return the path with as_number added to the front count times
+
+        The result is remembered, as a path tends to be prepended with the
+        same local AS each time it is advertised.
+        """
+        key = as_number, count
+        if self._prepended is None:
+            self._prepended = {}
+        elif key in self._prepended:
+            return self._prepended[key]
+
+        segments = list(self.segments)
+        if segments and segments[0][0] == AS_SEQUENCE:
+            numbers = as_array([as_number] * count) + segments[0][1]
+            segments[0] = AS_SEQUENCE, numbers
+        else:
+            segments.insert(0, (AS_SEQUENCE, [as_number] * count))
+        as_path = self.intern(segments)
+        self._prepended[key] = as_path
+        return as_path
+
+    def has_as_set(self):
+        """True if the path has an AS_SET, deprecated by RFC 6472"""
+        for segment_type, _numbers in self.segments:
+            if segment_type == AS_SET:
+                return True
+        return False
+
+    def first_as(self):
+        """The AS of the neighbour that sent the path, or None"""
+        if self.segments and self.segments[0][0] == AS_SEQUENCE:
+            return self.segments[0][1][0]
+        return None
+
+    def origin_as(self):
+        """The AS that originated the route, or None if that is ambiguous"""
+        if self.segments and self.segments[-1][0] == AS_SEQUENCE:
+            return self.segments[-1][1][-1]
+        return None
+
+    def __reduce__(self):
+        # unpickles to the interned AsPath in the receiving process
+        return AsPath.unpack, (self.pack(4), 4)
+
+    def __str__(self):
+        if self._string is None:
+            parts = []
+            for segment_type, numbers in self.segments:
+                string = " ".join("%d" % number for number in numbers)
+                if segment_type == AS_SET:
+                    string = "{%s}" % string
+                parts.append(string)
+            self._string = " ".join(parts)
+        return self._string
+
+    def __repr__(self):
+        return 'AsPath.from_string("%s")' % self
+
+    def __hash__(self):
+        if self._hash is None:
+            self._hash = hash(str(self))
+        return self._hash
+
+    def __eq__(self, other):
+        if self is other:
+            return True
+        if isinstance(other, AsPath):
+            return self.pack(4) == other.pack(4)
+        if isinstance(other, str):
+            return str(self) == other
+        return NotImplemented
+
+    def __bool__(self):
+        return bool(self.segments)
@@ -0,0 +1,53 @@
+"""A cache of decoded path attributes, keyed by their packed bytes"""
+
+from collections import OrderedDict
+
+
+class AttributeCache:
+    """Least recently used cache of decoded path attribute dicts, and the
+    notes made while decoding them
+
+    In a table dump many consecutive UPDATEs carry the same path attribute
+    bytes and differ only in their NLRI, so decoding them once and reusing
+    the result saves most of the work of parsing. The decoded values are
+    shared between messages, so they are all immutable: AsPath, IPAddress
+    and str, and tuples in place of the arrays of communities and cluster
+    lists.
+    """
+
+    DEFAULT_MAX_SIZE = 4096
+
+    def __init__(self, max_size=DEFAULT_MAX_SIZE):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        path_attributes = self.entries.get(key)
+        if path_attributes is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return path_attributes
+
+    def put(self, key, path_attributes):
+        self.entries[key] = path_attributes
+        if len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        self.entries.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "size": len(self.entries),
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+    def __len__(self):
+        return len(self.entries)
@@ -1,16 +1,35 @@
-from copy import copy
+from collections import OrderedDict
+
+from eventlet import spawn, spawn_after
 
 from .stream_server import StreamServer
 
 from .state_machine import StateMachine
-from .peering import Peering
+from .peering import Peering, TimerScheduler
+from .as_path import AsPath
 from .route import RouteAddition, RouteRemoval
 from .ip import IPAddress, IPPrefix
+from .update_cache import UpdateCache
+from .bgp_message import intern_prefixes
+from .metrics import MetricsExporter
 
 DEFAULT_BGP_PORT = 179
 
 
 class Beka(object):
+    """Accepts passive BGP peerings and exchanges routes with them
+
+    share_prefixes=True turns on bgp_message.intern_prefixes(), so that
+    every parser in the process shares one object per prefix, and
+    shutdown() turns it off again. It is process wide, so only one Beka in
+    a process should use it.
+
+    attribute_cache_size is passed on to each peering's BgpMessageParser,
+    to cache the path attributes of peers that repeat them.
+    """
+
+    DEFAULT_ROUTE_CHANGE_DELAY = 0.1
+
     def __init__(
         self,
         local_address,
@@ -21,6 +40,15 @@ class Beka(object):
         peer_down_handler,
         route_handler,
         error_handler,
+        batch_route_handler=None,
+        batch_max_routes=Peering.DEFAULT_BATCH_MAX_ROUTES,
+        batch_max_delay=Peering.DEFAULT_BATCH_MAX_DELAY,
+        adj_rib_in=False,
+        route_change_delay=DEFAULT_ROUTE_CHANGE_DELAY,
+        parse_pool=None,
+        metrics_address=None,
+        share_prefixes=False,
+        attribute_cache_size=0,
     ):
         self.local_address = local_address
         self.bgp_port = bgp_port
@@ -30,14 +58,41 @@ class Beka(object):
         self.peer_down_handler = peer_down_handler
         self.route_handler = route_handler
         self.error_handler = error_handler
+        self.batch_route_handler = batch_route_handler
+        self.batch_max_routes = batch_max_routes
+        self.batch_max_delay = batch_max_delay
+        self.adj_rib_in = adj_rib_in
+        self.route_change_delay = route_change_delay
+        self.parse_pool = parse_pool
+        self.metrics_address = metrics_address
+        self.share_prefixes = share_prefixes
+        self.attribute_cache_size = attribute_cache_size
 
         self.peers = {}
         self.peerings = []
         self.stream_server = None
-        self.routes_to_advertise = []
+        self.timer_scheduler = None
+        self.timer_greenlet = None
+        self.routes = OrderedDict()
+        self.routes_version = 0
+        self.pending_route_changes = OrderedDict()
+        self.route_change_timer = None
+        self.update_cache = UpdateCache()
+        self.metrics_exporter = None
+        self.metrics_greenlet = None
+        self.init_eventlet()
 
         if not self.bgp_port:
             self.bgp_port = DEFAULT_BGP_PORT
+        if share_prefixes:
+            # peers sending the same table share one object per prefix
+            intern_prefixes()
+
+    def init_eventlet(self):
+        """Build the timer scheduler and metrics exporter that run() starts
+        on eventlet"""
+        self.timer_scheduler = TimerScheduler()
+        self.metrics_exporter = MetricsExporter(self)
 
     def add_neighbor(self, connect_mode, peer_ip, peer_as):
         if connect_mode != "passive":
@@ -47,26 +102,83 @@ class Beka(object):
 
         self.peers[peer_ip] = {"peer_ip": peer_ip, "peer_as": peer_as}
 
+    @property
+    def routes_to_advertise(self):
+        return list(self.routes.values())
+
     def add_route(self, prefix, next_hop):
-        self.routes_to_advertise.append(
-            RouteAddition(
+        self.add_routes([(prefix, next_hop)])
+
+    def add_routes(self, routes):
+        """Originate (prefix, next_hop) routes, replacing any for the same prefix"""
+        for prefix, next_hop in routes:
+            route = RouteAddition(
                 prefix=IPPrefix.from_string(prefix),
                 next_hop=IPAddress.from_string(next_hop),
-                as_path="",
+                as_path=AsPath.from_sequence([]),
                 origin="IGP",
             )
-        )
+            existing = self.routes.get(route.prefix)
+            if existing is not None and existing == route:
+                continue
+            self.routes[route.prefix] = route
+            self.route_changed(route)
+
+    def withdraw_route(self, prefix):
+        self.withdraw_routes([prefix])
+
+    def withdraw_routes(self, prefixes):
+        """Stop originating these prefixes"""
+        for prefix in prefixes:
+            prefix = IPPrefix.from_string(prefix)
+            if self.routes.pop(prefix, None) is None:
+                continue
+            self.route_changed(RouteRemoval(prefix))
+
+    def route_changed(self, route):
+        self.routes_version += 1
+        if not self.peerings:
+            # new sessions are sent the whole table when they come up
+            return
+        self.pending_route_changes.pop(route.prefix, None)
+        self.pending_route_changes[route.prefix] = route
+        if self.route_change_timer is None:
+            self.route_change_timer = self.schedule_route_changes()
+
+    def schedule_route_changes(self):
+        """Arrange for flush_route_changes to be called, returning a timer
+        with a cancel() method"""
+        return spawn_after(self.route_change_delay, self.flush_route_changes)
+
+    def flush_route_changes(self):
+        """Send the changes made since the last flush to every peering
+
+        Changes to the same prefix are coalesced, so a route that is added
+        and then withdrawn again before the flush is only withdrawn.
+        """
+        self.route_change_timer = None
+        route_changes = list(self.pending_route_changes.values())
+        self.pending_route_changes.clear()
+        if not route_changes:
+            return
+        for peering in self.peerings:
+            peering.send_route_changes(route_changes, self.routes_version)
 
     def neighbor_states(self):
         states = []
         for peering in self.peerings:
-            states.append(
-                (peering.peer_address, {"info": {"uptime": peering.uptime()}})
-            )
+            info = {"uptime": peering.uptime()}
+            info.update(peering.counters())
+            states.append((peering.peer_address, {"info": info}))
 
         return states
 
     def run(self):
+        self.timer_greenlet = spawn(self.timer_scheduler.run)
+        if self.metrics_address is not None:
+            self.metrics_greenlet = spawn(
+                self.metrics_exporter.serve, self.metrics_address
+            )
         self.stream_server = StreamServer(
             (self.local_address, self.bgp_port), self.handle
         )
@@ -80,20 +192,19 @@ class Beka(object):
             socket.close()
             return
         peer = self.peers[peer_ip]
-        state_machine = StateMachine(
-            local_as=self.local_as,
-            peer_as=peer["peer_as"],
-            router_id=self.router_id,
-            local_address=self.local_address,
-            neighbor=peer["peer_ip"],
-        )
-        state_machine.routes_to_advertise = copy(self.routes_to_advertise)
+        state_machine = self.build_state_machine(peer)
         peering = Peering(
             state_machine,
             address,
             socket,
             self.route_handler,
             error_handler=self.error_handler,
+            batch_route_handler=self.batch_route_handler,
+            batch_max_routes=self.batch_max_routes,
+            batch_max_delay=self.batch_max_delay,
+            timer_scheduler=self.timer_scheduler,
+            parse_pool=self.parse_pool,
+            attribute_cache_size=self.attribute_cache_size,
         )
         self.peerings.append(peering)
         self.peer_up_handler(peer_ip, peer["peer_as"])
@@ -101,11 +212,42 @@ class Beka(object):
         self.peer_down_handler(peer_ip, peer["peer_as"])
         self.peerings.remove(peering)
 
+    def build_state_machine(self, peer, **kwargs):
+        state_machine = StateMachine(
+            local_as=self.local_as,
+            peer_as=peer["peer_as"],
+            router_id=self.router_id,
+            local_address=self.local_address,
+            neighbor=peer["peer_ip"],
+            batch_route_updates=bool(self.batch_route_handler),
+            adj_rib_in=self.adj_rib_in,
+            **kwargs
+        )
+        state_machine.routes_to_advertise = self.routes_to_advertise
+        state_machine.routes_version = self.routes_version
+        state_machine.update_cache = self.update_cache
+        return state_machine
+
     def shutdown(self):
+        if self.route_change_timer is not None:
+            self.route_change_timer.cancel()
+            self.route_change_timer = None
         if self.stream_server:
             self.stream_server.stop()
         for peering in self.peerings:
             peering.shutdown()
+        if self.timer_greenlet is not None:
+            self.timer_greenlet.kill()
+            self.timer_greenlet = None
+        if self.metrics_greenlet is not None:
+            self.metrics_exporter.stop()
+            self.metrics_greenlet.kill()
+            self.metrics_greenlet = None
+        self.stop_sharing_prefixes()
+
+    def stop_sharing_prefixes(self):
+        if self.share_prefixes:
+            intern_prefixes(False)
 
     def listening_on(self, address, port):
         return self.local_address == address and self.bgp_port == port
@@ -1,8 +1,11 @@
+from array import array
 import struct
 import socket
-from .packing_tools import bytes_to_short, bytes_to_integer
+import sys
 from .ip import IP4Prefix, IP4Address
-from .ip import IP6Prefix, IP6Address
+from .ip import IP6Prefix, IP6Address, PrefixPool
+from .as_path import AsPath, AS_TRANS
+from .attribute_cache import AttributeCache
 from io import BytesIO
 
 
@@ -13,17 +16,102 @@ class BgpMessage(object):
     KEEPALIVE_MESSAGE = 4
     MARKER = b"\xFF" * 16
     HEADER_LENGTH = 19
+    MAX_LENGTH = 4096
+    EXTENDED_MAX_LENGTH = 65535
 
 
 PARSERS = {}
 
 
 class BgpMessageParser(object):
-    def __init__(self):
+    """Parses message bodies from a Chopper
+
+    With lazy=True, UPDATEs are returned as LazyBgpUpdateMessages. Given an
+    attribute_cache_size, decoded path attributes are kept in an
+    AttributeCache of that many entries. The cache only pays for itself
+    when UPDATEs often repeat the same attribute bytes, so it is off by
+    default. Cached communities and cluster lists are tuples, not arrays,
+    as every message with those attribute bytes shares them.
+
+    If diagnostics is a Diagnostics that is enabled, the notes made while
+    parsing OPENs and UPDATEs are reported to it.
+    """
+
+    def __init__(
+        self,
+        lazy=False,
+        attribute_cache_size=0,
+        diagnostics=None,
+    ):
         self.capabilities = {}
+        self.lazy = lazy
+        self.attribute_cache = (
+            AttributeCache(attribute_cache_size) if attribute_cache_size else None
+        )
+        self.diagnostics = diagnostics
 
     def parse(self, message_type, serialised_message):
-        return PARSERS[message_type](serialised_message, self.capabilities)
+        """Parse a message, raising MessageParseError if it is malformed"""
+        try:
+            diagnostics = self.diagnostics
+            if diagnostics is not None and diagnostics.enabled():
+                return self.parse_with_notes(
+                    message_type, serialised_message, diagnostics
+                )
+            if message_type == BgpMessage.UPDATE_MESSAGE:
+                update_class = LazyBgpUpdateMessage if self.lazy else BgpUpdateMessage
+                return update_class.parse(
+                    serialised_message, self.capabilities, self.attribute_cache
+                )
+            return PARSERS[message_type](serialised_message, self.capabilities)
+        except ValueError as error:
+            raise MessageParseError(message_type, str(error)) from error
+
+    def parse_with_notes(self, message_type, serialised_message, diagnostics):
+        notes = []
+        if message_type == BgpMessage.UPDATE_MESSAGE and self.lazy:
+            # the path attributes are noted when they are decoded
+            return LazyBgpUpdateMessage(
+                bytes(serialised_message),
+                self.capabilities,
+                self.attribute_cache,
+                diagnostics,
+            )
+        if message_type == BgpMessage.UPDATE_MESSAGE:
+            message = BgpUpdateMessage.parse(
+                serialised_message, self.capabilities, self.attribute_cache, notes
+            )
+        elif message_type == BgpMessage.OPEN_MESSAGE:
+            message = BgpOpenMessage.parse(serialised_message, self.capabilities, notes)
+        else:
+            message = PARSERS[message_type](serialised_message, self.capabilities)
+        for kind, detail in notes:
+            diagnostics.report(kind, detail)
+        return message
+
+
+class MessageParseError(ValueError):
+    """A received message is too malformed to use, so the session must be
+    reset (RFC 7606 3)"""
+
+    def __init__(self, message_type, reason):
+        super().__init__(message_type, reason)
+        self.message_type = message_type
+        self.reason = reason
+
+    def __str__(self):
+        return self.reason
+
+    def notification(self):
+        """The NOTIFICATION to send to the peer before closing the session"""
+        if self.message_type == BgpMessage.UPDATE_MESSAGE:
+            return BgpNotificationMessage(
+                BgpNotificationMessage.UPDATE_MESSAGE_ERROR,
+                BgpNotificationMessage.MALFORMED_ATTRIBUTE_LIST,
+            )
+        if self.message_type == BgpMessage.OPEN_MESSAGE:
+            return BgpNotificationMessage(BgpNotificationMessage.OPEN_MESSAGE_ERROR)
+        return BgpNotificationMessage(BgpNotificationMessage.MESSAGE_HEADER_ERROR)
 
 
 def register_parser(cls):
@@ -36,6 +124,9 @@ class BgpMessagePacker(object):
         self.capabilities = {}
 
     def pack(self, message):
+        if isinstance(message, bytes):
+            # already packed, for example by an UpdateCache
+            return message
         packed_message = message.pack(self.capabilities)
         length = BgpMessage.HEADER_LENGTH + len(packed_message)
         header = struct.pack("!16sHB", BgpMessage.MARKER, length, message.MSG_TYPE)
@@ -61,20 +152,26 @@ def parse_fourbyteas(serialised_capability):
     return peer_as
 
 
+def parse_extendedmessage(serialised_capability):
+    return True
+
+
 capability_parsers = {
     1: parse_multiprotocol,
     2: parse_routerefresh,
+    6: parse_extendedmessage,
     65: parse_fourbyteas,
 }
 
 capability_keys = {
     1: "multiprotocol",
     2: "routerefresh",
+    6: "extendedmessage",
     65: "fourbyteas",
 }
 
 
-def parse_capabilities(serialised_capabilities):
+def parse_capabilities(serialised_capabilities, notes=None):
     stream = BytesIO(serialised_capabilities)
     capabilities = {}
 
@@ -91,8 +188,9 @@ def parse_capabilities(serialised_capabilities):
             capabilities[capability_key].append(
                 capability_parsers[capability_code](serialised_capability)
             )
-        else:
-            print("WARNING did not recognise capability code %d" % capability_code)
+        elif notes is not None:
+            # unknown capabilities are ignored (RFC 5492)
+            notes.append(("unknown_capability", capability_code))
 
     return capabilities
 
@@ -112,6 +210,10 @@ def pack_routerefresh(route_refresh):
     return b""
 
 
+def pack_extendedmessage(extended_message):
+    return b""
+
+
 def pack_fourbyteas(fourbyteas):
     return struct.pack("!I", fourbyteas)
 
@@ -119,12 +221,14 @@ def pack_fourbyteas(fourbyteas):
 capability_packers = {
     "multiprotocol": pack_multiprotocol,
     "routerefresh": pack_routerefresh,
+    "extendedmessage": pack_extendedmessage,
     "fourbyteas": pack_fourbyteas,
 }
 
 capability_numbers = {
     "multiprotocol": 1,
     "routerefresh": 2,
+    "extendedmessage": 6,
     "fourbyteas": 65,
 }
 
@@ -153,7 +257,7 @@ def merge_dict_of_lists(main_dict, new_dict):
             main_dict[key] += new_list
 
 
-def parse_optional_parameters(serialised_optional_parameters):
+def parse_optional_parameters(serialised_optional_parameters, notes=None):
     stream = BytesIO(serialised_optional_parameters)
     capabilities = {}
 
@@ -168,7 +272,7 @@ def parse_optional_parameters(serialised_optional_parameters):
             )
         serialised_capabilities = stream.read(parameter_length)
 
-        next_capabilities = parse_capabilities(serialised_capabilities)
+        next_capabilities = parse_capabilities(serialised_capabilities, notes)
         merge_dict_of_lists(capabilities, next_capabilities)
 
     return capabilities
@@ -186,7 +290,7 @@ class BgpOpenMessage(BgpMessage):
         self.capabilities = capabilities
 
     @classmethod
-    def parse(cls, serialised_message, _capabilities):
+    def parse(cls, serialised_message, _capabilities, notes=None):
         (
             version,
             peer_as,
@@ -195,7 +299,7 @@ class BgpOpenMessage(BgpMessage):
             optional_parameters_length,
         ) = struct.unpack("!BHH4sB", serialised_message[:10])
         capabilities = parse_optional_parameters(
-            serialised_message[10 : 10 + optional_parameters_length]
+            serialised_message[10 : 10 + optional_parameters_length], notes
         )
         return cls(version, peer_as, hold_time, IP4Address(identifier), capabilities)
 
@@ -249,69 +353,143 @@ def unpack_prefix(prefix):
     return prefix + b"\x00" * num_extra_bytes
 
 
-def parse_nlri(serialised_nlri):
-    stream = BytesIO(serialised_nlri)
+PREFIX_PADDING = [b"\x00" * n for n in range(17)]
+
+# shared by every parser in the process once intern_prefixes() is called
+prefix_pool = None
+
+
+def intern_prefixes(enabled=True):
+    """Make parsed prefixes share one object per prefix across the process,
+    returning the PrefixPool, or None if disabled"""
+    global prefix_pool  # pylint: disable=global-statement
+    if not enabled:
+        prefix_pool = None
+    elif prefix_pool is None:
+        prefix_pool = PrefixPool()
+    return prefix_pool
+
+
+def unpack_prefixes(view, offset, end, prefix_class, address_length):
+    """Walk a run of (length, prefix) pairs in a memoryview without copying"""
+    if prefix_pool is not None:
+        return unpack_interned_prefixes(
+            view, offset, end, prefix_class, address_length, prefix_pool
+        )
     prefixes = []
+    append = prefixes.append
+    max_bit_length = address_length * 8
+
+    while offset < end:
+        prefix_length = view[offset]
+        if prefix_length > max_bit_length:
+            raise ValueError("NLRI: Got invalid prefix length: %d" % prefix_length)
+        byte_length = (prefix_length + 7) >> 3
+        offset += 1
+        next_offset = offset + byte_length
+        if next_offset > end:
+            raise ValueError("NLRI: Prefix runs past end of field")
+        prefix = view[offset:next_offset].tobytes()
+        if byte_length != address_length:
+            prefix += PREFIX_PADDING[address_length - byte_length]
+        append(prefix_class(prefix, prefix_length))
+        offset = next_offset
+
+    return prefixes
 
-    while True:
-        serialised_length = stream.read(1)
-        if len(serialised_length) == 0:
-            break
-        prefix_length = ord(serialised_length)
-        packed_prefix = stream.read(prefix_byte_length(prefix_length))
-        prefix = unpack_prefix(packed_prefix)
-        prefixes.append(IP4Prefix(prefix, prefix_length))
+
+def unpack_interned_prefixes(view, offset, end, prefix_class, address_length, pool):
+    """unpack_prefixes, returning prefixes from pool where they exist"""
+    prefixes = []
+    append = prefixes.append
+    interned = pool.pool(prefix_class)
+    max_bit_length = address_length * 8
+
+    while offset < end:
+        prefix_length = view[offset]
+        if prefix_length > max_bit_length:
+            raise ValueError("NLRI: Got invalid prefix length: %d" % prefix_length)
+        byte_length = (prefix_length + 7) >> 3
+        next_offset = offset + 1 + byte_length
+        if next_offset > end:
+            raise ValueError("NLRI: Prefix runs past end of field")
+        key = view[offset:next_offset].tobytes()
+        prefix = interned.get(key)
+        if prefix is None:
+            packed = key[1:]
+            if byte_length != address_length:
+                packed += PREFIX_PADDING[address_length - byte_length]
+            prefix = prefix_class(packed, prefix_length)
+            interned[key] = prefix
+        append(prefix)
+        offset = next_offset
 
     return prefixes
 
 
+def iter_prefixes(view, offset, end, prefix_class, address_length):
+    """Like unpack_prefixes, but yield the prefixes one at a time"""
+    max_bit_length = address_length * 8
+
+    while offset < end:
+        prefix_length = view[offset]
+        if prefix_length > max_bit_length:
+            raise ValueError("NLRI: Got invalid prefix length: %d" % prefix_length)
+        byte_length = (prefix_length + 7) >> 3
+        offset += 1
+        next_offset = offset + byte_length
+        if next_offset > end:
+            raise ValueError("NLRI: Prefix runs past end of field")
+        prefix = view[offset:next_offset].tobytes()
+        if byte_length != address_length:
+            prefix += PREFIX_PADDING[address_length - byte_length]
+        yield prefix_class(prefix, prefix_length)
+        offset = next_offset
+
+
+def count_prefixes(view, offset, end):
+    """Count the prefixes in a run of (length, prefix) pairs"""
+    count = 0
+    while offset < end:
+        offset += 1 + ((view[offset] + 7) >> 3)
+        count += 1
+    if offset != end:
+        raise ValueError("NLRI: Prefix runs past end of field")
+    return count
+
+
+def parse_nlri(serialised_nlri):
+    view = memoryview(serialised_nlri)
+    return unpack_prefixes(view, 0, len(view), IP4Prefix, IP4_LENGTH)
+
+
 ORIGIN_CODES = {0: "IGP", 1: "EGP", 2: "INCOMPLETE"}
 
 
 def parse_origin(packed_origin):
-    return ORIGIN_CODES[ord(packed_origin)]
+    if len(packed_origin) != 1:
+        raise ValueError("ORIGIN: Got invalid length: %d" % len(packed_origin))
+    if packed_origin[0] not in ORIGIN_CODES:
+        raise ValueError("ORIGIN: Got invalid value: %d" % packed_origin[0])
+    return ORIGIN_CODES[packed_origin[0]]
 
 
-AS_SET_CODE = 1
-AS_SEQUENCE_CODE = 2
 AS_NUMBER_LENGTH = 2
 AS4_NUMBER_LENGTH = 4
 
 
 def parse_as4_path(packed_as_path):
-    # this does as_sets wrong, assumes everything is as_sequence
-    input_stream = BytesIO(packed_as_path)
-    as_numbers = []
-    while True:
-        packed_type_and_count = input_stream.read(2)
-        if len(packed_type_and_count) == 0:
-            break
-        type_code, count = struct.unpack("!BB", packed_type_and_count)
-        if type_code == AS_SET_CODE:
-            print("WARNING received update with AS_SET, treating like AS_SEQUENCE")
-        packed_as_sequence = input_stream.read(count * AS4_NUMBER_LENGTH)
-        as_numbers += struct.unpack("!" + ("I" * count), packed_as_sequence)
-    return " ".join(["%d" % x for x in as_numbers])
+    return AsPath.unpack(packed_as_path, AS4_NUMBER_LENGTH)
 
 
 def parse_as_path(packed_as_path):
-    # this does as_sets wrong, assumes everything is as_sequence
-    input_stream = BytesIO(packed_as_path)
-    as_numbers = []
-    while True:
-        packed_type_and_count = input_stream.read(2)
-        if len(packed_type_and_count) == 0:
-            break
-        type_code, count = struct.unpack("!BB", packed_type_and_count)
-        if type_code == AS_SET_CODE:
-            print("WARNING received update with AS_SET, treating like AS_SEQUENCE")
-        packed_as_sequence = input_stream.read(count * AS_NUMBER_LENGTH)
-        as_numbers += struct.unpack("!" + ("H" * count), packed_as_sequence)
-    return " ".join(["%d" % x for x in as_numbers])
+    return AsPath.unpack(packed_as_path, AS_NUMBER_LENGTH)
 
 
 def parse_next_hop(packed_next_hop):
-    return IP4Address(packed_next_hop)
+    if len(packed_next_hop) != IP4_LENGTH:
+        raise ValueError("NEXT_HOP: Got invalid length: %d" % len(packed_next_hop))
+    return IP4Address(bytes(packed_next_hop))
 
 
 IP6_AFI = 2
@@ -329,77 +507,174 @@ def unpack_prefix6(prefix):
     return prefix + b"\x00" * num_extra_bytes
 
 
-def parse_nlri6(stream):
-    prefixes = []
-
-    while True:
-        serialised_length = stream.read(1)
-        if len(serialised_length) == 0:
-            break
-        prefix_length = ord(serialised_length)
-        packed_prefix = stream.read(prefix_byte_length(prefix_length))
-        prefix = unpack_prefix6(packed_prefix)
-        prefixes.append(IP6Prefix(prefix, prefix_length))
-
-    return prefixes
+def parse_nlri6(serialised_nlri):
+    view = memoryview(serialised_nlri)
+    return unpack_prefixes(view, 0, len(view), IP6Prefix, IP6_LENGTH)
 
 
 def parse_mp_reach_nlri(packed_mp_reach_nlri):
     attributes = {}
-    stream = BytesIO(packed_mp_reach_nlri)
-    afi, safi, next_hop_length = struct.unpack("!HBB", stream.read(4))
+    view = memoryview(packed_mp_reach_nlri)
+    if len(view) < 4:
+        raise ValueError("MP_REACH_NLRI: Got invalid length: %d" % len(view))
+    afi, safi, next_hop_length = struct.unpack_from("!HBB", view)
     if afi != IP6_AFI:
         raise ValueError("MP_REACH_NLRI: Got unsupported AFI: %d" % afi)
     if safi != UNICAST_SAFI:
         raise ValueError("MP_REACH_NLRI: Got unsupported SAFI: %d" % safi)
-    if next_hop_length % IP6_LENGTH != 0:
+    # a global address, optionally followed by a link local one (RFC 2545 3)
+    if next_hop_length not in (IP6_LENGTH, 2 * IP6_LENGTH):
         raise ValueError(
             "MP_REACH_NLRI: Got unsupported next hop length: %d" % next_hop_length
         )
+    # the next hop is followed by a reserved byte
+    if 4 + next_hop_length + 1 > len(view):
+        raise ValueError("MP_REACH_NLRI: Next hop runs past end")
 
+    offset = 4
     attributes["next_hop"] = []
-    for _ in range(next_hop_length // 16):
+    for _ in range(next_hop_length // IP6_LENGTH):
         attributes["next_hop"].append(
-            IP6Address(struct.unpack("!16s", stream.read(IP6_LENGTH))[0])
+            IP6Address(view[offset : offset + IP6_LENGTH].tobytes())
         )
+        offset += IP6_LENGTH
 
-    _reserved_snpa = stream.read(1)
+    # skip the reserved SNPA byte
+    offset += 1
 
-    attributes["nlri"] = parse_nlri6(stream)
+    attributes["nlri"] = unpack_prefixes(view, offset, len(view), IP6Prefix, IP6_LENGTH)
 
     return attributes
 
 
 def parse_mp_unreach_nlri(packed_mp_reach_nlri):
     attributes = {}
-    stream = BytesIO(packed_mp_reach_nlri)
-    afi, safi = struct.unpack("!HB", stream.read(3))
+    view = memoryview(packed_mp_reach_nlri)
+    if len(view) < 3:
+        raise ValueError("MP_UNREACH_NLRI: Got invalid length: %d" % len(view))
+    afi, safi = struct.unpack_from("!HB", view)
     if afi != IP6_AFI:
         raise ValueError("MP_UNREACH_NLRI: Got unsupported AFI: %d" % afi)
     if safi != UNICAST_SAFI:
         raise ValueError("MP_UNREACH_NLRI: Got unsupported SAFI: %d" % safi)
 
-    attributes["withdrawn_routes"] = parse_nlri6(stream)
+    attributes["withdrawn_routes"] = unpack_prefixes(
+        view, 3, len(view), IP6Prefix, IP6_LENGTH
+    )
 
     return attributes
 
 
+def parse_uint32(name):
+    def parse(packed_attribute):
+        if len(packed_attribute) != 4:
+            raise ValueError(
+                "%s: Got invalid length: %d" % (name, len(packed_attribute))
+            )
+        return struct.unpack("!I", packed_attribute)[0]
+
+    return parse
+
+
+def parse_atomic_aggregate(packed_atomic_aggregate):
+    if len(packed_atomic_aggregate) != 0:
+        raise ValueError(
+            "ATOMIC_AGGREGATE: Got invalid length: %d" % len(packed_atomic_aggregate)
+        )
+    return True
+
+
+def parse_aggregator(packed_aggregator):
+    """(AS number, IP4Address), with a 2 or 4 byte AS number"""
+    if len(packed_aggregator) == 6:
+        as_number = struct.unpack_from("!H", packed_aggregator)[0]
+    elif len(packed_aggregator) == 8:
+        as_number = struct.unpack_from("!I", packed_aggregator)[0]
+    else:
+        raise ValueError("AGGREGATOR: Got invalid length: %d" % len(packed_aggregator))
+    return as_number, IP4Address(bytes(packed_aggregator[-4:]))
+
+
+def parse_as4_aggregator(packed_aggregator):
+    if len(packed_aggregator) != 8:
+        raise ValueError(
+            "AS4_AGGREGATOR: Got invalid length: %d" % len(packed_aggregator)
+        )
+    return parse_aggregator(packed_aggregator)
+
+
+def parse_originator_id(packed_originator_id):
+    if len(packed_originator_id) != 4:
+        raise ValueError(
+            "ORIGINATOR_ID: Got invalid length: %d" % len(packed_originator_id)
+        )
+    return IP4Address(bytes(packed_originator_id))
+
+
+def parse_number_array(name, typecode, item_length=None):
+    """Parse a list of big endian numbers into an array"""
+
+    def parse(packed_attribute):
+        numbers = array(typecode)
+        if len(packed_attribute) % (item_length or numbers.itemsize):
+            raise ValueError(
+                "%s: Got invalid length: %d" % (name, len(packed_attribute))
+            )
+        numbers.frombytes(packed_attribute)
+        if sys.byteorder == "little":
+            numbers.byteswap()
+        return numbers
+
+    return parse
+
+
 attribute_parsers = {
     1: parse_origin,
     2: parse_as_path,
     3: parse_next_hop,
+    4: parse_uint32("MULTI_EXIT_DISC"),
+    5: parse_uint32("LOCAL_PREF"),
+    6: parse_atomic_aggregate,
+    7: parse_aggregator,
+    8: parse_number_array("COMMUNITIES", "I"),
+    9: parse_originator_id,
+    10: parse_number_array("CLUSTER_LIST", "I"),
     14: parse_mp_reach_nlri,
     15: parse_mp_unreach_nlri,
+    16: parse_number_array("EXTENDED_COMMUNITIES", "Q"),
     17: parse_as4_path,
+    18: parse_as4_aggregator,
+    # each large community is three 32 bit numbers
+    32: parse_number_array("LARGE_COMMUNITY", "I", 12),
 }
 
+# the attributes decoded into arrays, which are mutable, so are cached as tuples
+ARRAY_ATTRIBUTES = (
+    "communities",
+    "cluster_list",
+    "extended_communities",
+    "large_communities",
+)
+
+AS_PATH_TYPE_CODE = 2
+
 attribute_keys = {
     1: "origin",
     2: "as_path",
     3: "next_hop",
+    4: "med",
+    5: "local_pref",
+    6: "atomic_aggregate",
+    7: "aggregator",
+    8: "communities",
+    9: "originator_id",
+    10: "cluster_list",
     14: "mp_reach_nlri",
     15: "mp_unreach_nlri",
+    16: "extended_communities",
     17: "as4_path",
+    18: "as4_aggregator",
+    32: "large_communities",
 }
 
 ORIGIN_NUMBERS = {"IGP": 0, "EGP": 1, "INCOMPLETE": 2}
@@ -410,31 +685,48 @@ def pack_origin(origin):
 
 
 def pack_as4_path(as_path):
-    if not as_path:
-        return b""
-
-    as_numbers = [int(x) for x in as_path.split(" ")]
-    count = len(as_numbers)
-    header = struct.pack("!BB", AS_SEQUENCE_CODE, count)
-    body = struct.pack("!" + ("I" * count), *as_numbers)
-    return header + body
+    return AsPath.coerce(as_path).pack(AS4_NUMBER_LENGTH)
 
 
 def pack_as_path(as_path):
-    if not as_path:
-        return b""
-
-    as_numbers = [int(x) for x in as_path.split(" ")]
-    count = len(as_numbers)
-    header = struct.pack("!BB", AS_SEQUENCE_CODE, count)
-    body = struct.pack("!" + ("H" * count), *as_numbers)
-    return header + body
+    return AsPath.coerce(as_path).pack(AS_NUMBER_LENGTH)
 
 
 def pack_next_hop(next_hop):
     return next_hop.address
 
 
+def pack_uint32(number):
+    return struct.pack("!I", number)
+
+
+def pack_atomic_aggregate(_atomic_aggregate):
+    return b""
+
+
+def pack_aggregator(aggregator, as_number_length=AS4_NUMBER_LENGTH):
+    as_number, address = aggregator
+    if as_number_length == AS_NUMBER_LENGTH:
+        if as_number > 0xFFFF:
+            as_number = AS_TRANS
+        return struct.pack("!H", as_number) + address.address
+    return struct.pack("!I", as_number) + address.address
+
+
+def pack_originator_id(originator_id):
+    return originator_id.address
+
+
+def pack_number_array(typecode):
+    def pack(numbers):
+        numbers = array(typecode, numbers)
+        if sys.byteorder == "little":
+            numbers.byteswap()
+        return numbers.tobytes()
+
+    return pack
+
+
 def pack_nlri6(nlri):
     packed_nlri = []
 
@@ -481,16 +773,24 @@ attribute_packers = {
     "mp_reach_nlri": pack_mp_reach_nlri,
     "mp_unreach_nlri": pack_mp_unreach_nlri,
     "as4_path": pack_as4_path,
+    "med": pack_uint32,
+    "local_pref": pack_uint32,
+    "atomic_aggregate": pack_atomic_aggregate,
+    "aggregator": pack_aggregator,
+    "communities": pack_number_array("I"),
+    "originator_id": pack_originator_id,
+    "cluster_list": pack_number_array("I"),
+    "extended_communities": pack_number_array("Q"),
+    "as4_aggregator": pack_aggregator,
+    "large_communities": pack_number_array("I"),
 }
 
-attribute_numbers = {
-    "origin": 1,
-    "as_path": 2,
-    "next_hop": 3,
-    "mp_reach_nlri": 14,
-    "mp_unreach_nlri": 15,
-    "as4_path": 17,
-}
+attribute_numbers = {key: type_code for type_code, key in attribute_keys.items()}
+
+OPTIONAL_FLAG = 0x80
+TRANSITIVE_FLAG = 0x40
+PARTIAL_FLAG = 0x20
+EXTENDED_LENGTH_FLAG = 0x10
 
 attribute_flags = {
     "origin": 0x40,
@@ -499,63 +799,258 @@ attribute_flags = {
     "mp_reach_nlri": 0x80,
     "mp_unreach_nlri": 0x80,
     "as4_path": 0xC0,
+    "med": 0x80,
+    "local_pref": 0x40,
+    "atomic_aggregate": 0x40,
+    "aggregator": 0xC0,
+    "communities": 0xC0,
+    "originator_id": 0x80,
+    "cluster_list": 0x80,
+    "extended_communities": 0xC0,
+    "as4_aggregator": 0xC0,
+    "large_communities": 0xC0,
 }
 
 
-def parse_path_attributes(serialised_path_attributes, fourbyteas):
-    stream = BytesIO(serialised_path_attributes)
-    path_attributes = {}
+class AttributeOverrunError(ValueError):
+    """A path attribute runs past the end of the path attribute field
 
-    while True:
-        attribute_header = stream.read(2)
+    The NLRI can still be found from the path attribute field length, so
+    this does not need a session reset (RFC 7606 4).
+    """
 
-        if len(attribute_header) == 0:
-            break
-        flags, type_code = struct.unpack("!BB", attribute_header)
-
-        # TODO factor this pattern out
-        if flags & 0x10:
-            packed_length = stream.read(2)
-            if len(packed_length) == 0:
-                break
-            (length,) = struct.unpack("!H", packed_length)
-        else:
-            packed_length = stream.read(1)
-            if len(packed_length) == 0:
-                break
-            (length,) = struct.unpack("!B", packed_length)
-
-        packed_attribute = stream.read(length)
-
-        if type_code in attribute_parsers:
-            # TODO we're ignoring the flags here, these should at very least be preserved
-            # this is tightly coupled, there's gotta be a better way to do this
-            if fourbyteas and attribute_keys[type_code] == "as_path":
-                path_attributes["as_path"] = parse_as4_path(packed_attribute)
-            else:
-                path_attributes[attribute_keys[type_code]] = attribute_parsers[
-                    type_code
-                ](packed_attribute)
+    def __init__(self, message, type_code=None):
+        super().__init__(message)
+        self.type_code = type_code
+
+
+def iter_path_attributes(view, offset, end):
+    """Yield (flags, type_code, start, end) for each path attribute in a
+    memoryview, without decoding any of them"""
+    while offset < end:
+        if offset + 3 > end:
+            raise AttributeOverrunError("Path attribute header runs past end of field")
+        flags = view[offset]
+        type_code = view[offset + 1]
+
+        if flags & EXTENDED_LENGTH_FLAG:
+            if offset + 4 > end:
+                raise AttributeOverrunError(
+                    "Path attribute header runs past end of field", type_code
+                )
+            length = (view[offset + 2] << 8) | view[offset + 3]
+            offset += 4
         else:
-            print("WARNING did not recognise BGP path attribute type %d" % type_code)
+            length = view[offset + 2]
+            offset += 3
+
+        next_offset = offset + length
+        if next_offset > end:
+            raise AttributeOverrunError(
+                "Path attribute %d runs past end of field" % type_code, type_code
+            )
+
+        yield flags, type_code, offset, next_offset
+        offset = next_offset
+
+
+def unpack_path_attributes(view, offset, end, fourbyteas, notes=None):
+    """Walk the path attribute field of an UPDATE held in a memoryview"""
+    return decode_path_attributes(
+        view, iter_path_attributes(view, offset, end), fourbyteas, notes
+    )
+
+
+MULTIPROTOCOL_TYPE_CODES = (14, 15)
+
+# what to do about a malformed path attribute (RFC 7606 7, RFC 6793 6)
+TREAT_AS_WITHDRAW = "treat-as-withdraw"
+ATTRIBUTE_DISCARD = "attribute-discard"
+ATTRIBUTE_DISCARD_TYPE_CODES = (6, 7, 17, 18)
+
+# the Optional and Transitive bits each known attribute must have
+ATTRIBUTE_CATEGORY_FLAGS = OPTIONAL_FLAG | TRANSITIVE_FLAG
+attribute_category_flags = {
+    type_code: attribute_flags[key] & ATTRIBUTE_CATEGORY_FLAGS
+    for type_code, key in attribute_keys.items()
+}
+
+
+# type code: (key, Optional and Transitive flags, parser), for 2 and 4 byte
+# AS number sessions, so decode_path_attributes does one lookup per attribute
+attribute_decoders = {
+    type_code: (key, attribute_category_flags[type_code], attribute_parsers[type_code])
+    for type_code, key in attribute_keys.items()
+}
+as4_attribute_decoders = dict(attribute_decoders)
+as4_attribute_decoders[AS_PATH_TYPE_CODE] = (
+    "as_path",
+    attribute_category_flags[AS_PATH_TYPE_CODE],
+    parse_as4_path,
+)
+
+
+def add_attribute_error(path_attributes, type_code, reason, notes=None):
+    """List a malformed attribute in path_attributes["attribute_errors"]"""
+    action = (
+        ATTRIBUTE_DISCARD
+        if type_code in ATTRIBUTE_DISCARD_TYPE_CODES
+        else TREAT_AS_WITHDRAW
+    )
+    attribute_error = (type_code, action, reason)
+    path_attributes["attribute_errors"] = path_attributes.get(
+        "attribute_errors", ()
+    ) + (attribute_error,)
+    if notes is not None:
+        notes.append(("malformed_attribute", type_code))
+
+
+def decode_path_attributes(view, attributes, fourbyteas, notes=None):
+    """Decode (flags, type code, start, end) attributes found by
+    iter_path_attributes
+
+    Unrecognised optional transitive attributes are kept undecoded, as
+    (flags, type code, value bytes) in "unknown_attributes", so that they
+    can be passed on. Other unrecognised attributes are dropped. If notes
+    is a list, unrecognised attributes and AS_SETs are noted in it.
+
+    Malformed attributes, including those with the wrong Optional or
+    Transitive flags, are left out and listed as (type code, action,
+    reason) in "attribute_errors", where action is TREAT_AS_WITHDRAW or
+    ATTRIBUTE_DISCARD (RFC 7606). An attribute that runs past the end of
+    the field is listed as TREAT_AS_WITHDRAW, and ends the walk. Only the
+    first of repeated attributes is kept. Malformed or repeated
+    MP_REACH_NLRI and MP_UNREACH_NLRI raise ValueError, as the prefixes
+    they carry cannot be found.
+    """
+    path_attributes = {}
+    decoders = as4_attribute_decoders if fourbyteas else attribute_decoders
+
+    try:
+        for flags, type_code, start, next_offset in attributes:
+            decoder = decoders.get(type_code)
+            if decoder is None:
+                if notes is not None:
+                    notes.append(("unknown_attribute", type_code))
+                if flags & ATTRIBUTE_CATEGORY_FLAGS == ATTRIBUTE_CATEGORY_FLAGS:
+                    unknown_attribute = (
+                        flags,
+                        type_code,
+                        view[start:next_offset].tobytes(),
+                    )
+                    path_attributes["unknown_attributes"] = path_attributes.get(
+                        "unknown_attributes", ()
+                    ) + (unknown_attribute,)
+                continue
+            key, category_flags, parser = decoder
+            if key in path_attributes:
+                if type_code in MULTIPROTOCOL_TYPE_CODES:
+                    raise ValueError("Got repeated path attribute %d" % type_code)
+                continue
+            try:
+                if flags & ATTRIBUTE_CATEGORY_FLAGS != category_flags:
+                    raise ValueError(
+                        "Path attribute %d: Got invalid flags: 0x%02x"
+                        % (type_code, flags)
+                    )
+                value = parser(view[start:next_offset])
+            except ValueError as error:
+                if type_code in MULTIPROTOCOL_TYPE_CODES:
+                    raise
+                add_attribute_error(path_attributes, type_code, str(error), notes)
+                continue
+            path_attributes[key] = value
+    except AttributeOverrunError as error:
+        add_attribute_error(path_attributes, error.type_code, str(error), notes)
+
+    as_path = path_attributes.get("as_path")
+    if notes is not None and isinstance(as_path, AsPath) and as_path.has_as_set():
+        notes.append(("as_set", None))
+    return path_attributes
+
 
+def unpack_cached_path_attributes(
+    view, offset, end, fourbyteas, attribute_cache, notes=None
+):
+    """unpack_path_attributes, reusing the attributes decoded for an earlier
+    UPDATE with the same attribute bytes
+
+    MP_REACH_NLRI and MP_UNREACH_NLRI carry prefixes, so they are left out
+    of the key and decoded every time. Each call returns a new dict, but
+    the values in it are shared with the cache, so communities and cluster
+    lists are tuples rather than arrays. The notes made while decoding are
+    cached along with the attributes, and added to notes on every hit, so
+    that they are made for every UPDATE that carries the attributes.
+    """
+    attributes = []
+    multiprotocol = []
+    spans = []
+    header_start = offset
+    try:
+        for attribute in iter_path_attributes(view, offset, end):
+            next_offset = attribute[3]
+            if attribute[1] in MULTIPROTOCOL_TYPE_CODES:
+                multiprotocol.append(attribute)
+            else:
+                attributes.append(attribute)
+                spans.append(view[header_start:next_offset])
+            header_start = next_offset
+    except AttributeOverrunError:
+        # rare, and decoded as far as the overrun
+        return unpack_path_attributes(view, offset, end, fourbyteas, notes)
+
+    if multiprotocol:
+        key = (fourbyteas, b"".join(spans))
+    else:
+        key = (fourbyteas, view[offset:end].tobytes())
+    cached = attribute_cache.get(key)
+    if cached is None:
+        # noted whether or not anyone is listening, as a later hit might be
+        cached_notes = []
+        cached_attributes = decode_path_attributes(
+            view, attributes, fourbyteas, cached_notes
+        )
+        # shared by every message with these attribute bytes, so immutable
+        for name in ARRAY_ATTRIBUTES:
+            if name in cached_attributes:
+                cached_attributes[name] = tuple(cached_attributes[name])
+        cached = cached_attributes, tuple(cached_notes)
+        attribute_cache.put(key, cached)
+
+    cached_attributes, cached_notes = cached
+    if notes is not None:
+        notes.extend(cached_notes)
+    path_attributes = dict(cached_attributes)
+    if multiprotocol:
+        path_attributes.update(
+            decode_path_attributes(view, multiprotocol, fourbyteas, notes)
+        )
     return path_attributes
 
 
-def parse_withdrawn_routes(serialised_withdrawn_routes):
-    stream = BytesIO(serialised_withdrawn_routes)
-    prefixes = []
+def pack_attribute_header(name, length):
+    if length > 255:
+        return struct.pack(
+            "!BBH",
+            attribute_flags[name] | EXTENDED_LENGTH_FLAG,
+            attribute_numbers[name],
+            length,
+        )
+    return struct.pack("!BBB", attribute_flags[name], attribute_numbers[name], length)
 
-    while True:
-        serialised_length = stream.read(1)
-        if len(serialised_length) == 0:
-            break
-        prefix_length = ord(serialised_length)
-        packed_prefix = stream.read(prefix_byte_length(prefix_length))
-        prefix = unpack_prefix(packed_prefix)
-        prefixes.append(IP4Prefix(prefix, prefix_length))
 
-    return prefixes
+def attribute_header_length(length):
+    return 4 if length > 255 else 3
+
+
+def parse_path_attributes(serialised_path_attributes, fourbyteas):
+    view = memoryview(serialised_path_attributes)
+    return unpack_path_attributes(view, 0, len(view), fourbyteas)
+
+
+def parse_withdrawn_routes(serialised_withdrawn_routes):
+    view = memoryview(serialised_withdrawn_routes)
+    return unpack_prefixes(view, 0, len(view), IP4Prefix, IP4_LENGTH)
 
 
 PATH_ATTRIBUTE_ORDER = {
@@ -563,11 +1058,39 @@ PATH_ATTRIBUTE_ORDER = {
     "as_path": 2,
     "as4_path": 3,
     "next_hop": 4,
-    "mp_reach_nlri": 5,
-    "mp_unreach_nlri": 6,
+    "med": 5,
+    "local_pref": 6,
+    "atomic_aggregate": 7,
+    "aggregator": 8,
+    "as4_aggregator": 9,
+    "communities": 10,
+    "originator_id": 11,
+    "cluster_list": 12,
+    "extended_communities": 13,
+    "large_communities": 14,
+    "mp_reach_nlri": 15,
+    "mp_unreach_nlri": 16,
+    "unknown_attributes": 17,
+    "attribute_errors": 18,
 }
 
 
+def pack_unknown_attributes(unknown_attributes):
+    """Pack attributes kept by decode_path_attributes, with the Partial bit
+    set as we passed them on without recognising them (RFC 4271 5)"""
+    packed_attributes = []
+    for flags, type_code, value in unknown_attributes:
+        flags = (flags | PARTIAL_FLAG) & ~EXTENDED_LENGTH_FLAG
+        if len(value) > 255:
+            header = struct.pack(
+                "!BBH", flags | EXTENDED_LENGTH_FLAG, type_code, len(value)
+            )
+        else:
+            header = struct.pack("!BBB", flags, type_code, len(value))
+        packed_attributes.append(header + value)
+    return b"".join(packed_attributes)
+
+
 @register_parser
 class BgpUpdateMessage(BgpMessage):
     MSG_TYPE = BgpMessage.UPDATE_MESSAGE
@@ -578,20 +1101,39 @@ class BgpUpdateMessage(BgpMessage):
         self.nlri = nlri
 
     @classmethod
-    def parse(cls, serialised_message, capabilities):
-        data_stream = BytesIO(serialised_message)
-        withdrawn_routes_length = bytes_to_short(data_stream.read(2))
-        serialised_withdrawn_routes = data_stream.read(withdrawn_routes_length)
-        withdrawn_routes = parse_withdrawn_routes(serialised_withdrawn_routes)
-
-        total_path_attribute_length = bytes_to_short(data_stream.read(2))
-        serialised_path_attributes = data_stream.read(total_path_attribute_length)
-        path_attributes = parse_path_attributes(
-            serialised_path_attributes, "fourbyteas" in capabilities
+    def parse(cls, serialised_message, capabilities, attribute_cache=None, notes=None):
+        view = memoryview(serialised_message)
+        end = len(view)
+        if end < 4:
+            raise ValueError("UPDATE: Message too short")
+
+        withdrawn_routes_length = (view[0] << 8) | view[1]
+        offset = 2 + withdrawn_routes_length
+        if offset + 2 > end:
+            raise ValueError("UPDATE: Withdrawn routes length too long")
+        # most UPDATEs withdraw nothing
+        withdrawn_routes = (
+            unpack_prefixes(view, 2, offset, IP4Prefix, IP4_LENGTH)
+            if withdrawn_routes_length
+            else []
         )
 
-        serialised_nlri = data_stream.read()
-        nlri = parse_nlri(serialised_nlri)
+        total_path_attribute_length = (view[offset] << 8) | view[offset + 1]
+        offset += 2
+        nlri_offset = offset + total_path_attribute_length
+        if nlri_offset > end:
+            raise ValueError("UPDATE: Path attribute length too long")
+        fourbyteas = "fourbyteas" in capabilities
+        if attribute_cache is None:
+            path_attributes = decode_path_attributes(
+                view, iter_path_attributes(view, offset, nlri_offset), fourbyteas, notes
+            )
+        else:
+            path_attributes = unpack_cached_path_attributes(
+                view, offset, nlri_offset, fourbyteas, attribute_cache, notes
+            )
+
+        nlri = unpack_prefixes(view, nlri_offset, end, IP4Prefix, IP4_LENGTH)
 
         return cls(withdrawn_routes, path_attributes, nlri)
 
@@ -627,17 +1169,20 @@ class BgpUpdateMessage(BgpMessage):
             self.path_attributes.items(), key=lambda x: PATH_ATTRIBUTE_ORDER[x[0]]
         )
         for name, path_attribute in sorted_attribute_pairs:
+            if name == "unknown_attributes":
+                packed_path_attributes.append(pack_unknown_attributes(path_attribute))
+                continue
+            if name == "attribute_errors":
+                continue
             if fourbyteas and name == "as_path":
                 packed_entry = pack_as4_path(path_attribute)
+            elif not fourbyteas and name == "aggregator":
+                packed_entry = pack_aggregator(path_attribute, AS_NUMBER_LENGTH)
             else:
                 packed_entry = attribute_packers[name](path_attribute)
-            packed_header = struct.pack(
-                "!BBB",
-                attribute_flags[name],
-                attribute_numbers[name],
-                len(packed_entry),
+            packed_path_attribute = (
+                pack_attribute_header(name, len(packed_entry)) + packed_entry
             )
-            packed_path_attribute = packed_header + packed_entry
             packed_path_attributes.append(packed_path_attribute)
 
         return b"".join(packed_path_attributes)
@@ -665,6 +1210,252 @@ class BgpUpdateMessage(BgpMessage):
         )
 
 
+# get_attribute keys that describe the whole path attribute field
+WHOLE_FIELD_KEYS = ("unknown_attributes", "attribute_errors")
+
+
+class LazyBgpUpdateMessage(BgpUpdateMessage):
+    """An UPDATE that is only decoded as far as it is used
+
+    Only the field lengths are checked up front. Each path attribute is
+    decoded the first time it is asked for, withdrawn routes and NLRI the
+    first time the lists are used, and iter_nlri() walks the NLRI without
+    building a list at all. Until withdrawn_routes, path_attributes or nlri
+    is assigned to, pack() returns the bytes the message was parsed from.
+    Decoded lists and dicts must not be changed in place; assign a new
+    value instead.
+
+    Path attributes are checked as decode_path_attributes checks them when
+    they are decoded, so a malformed attribute is left out and listed in
+    "attribute_errors", and an unusable MP_REACH_NLRI or MP_UNREACH_NLRI
+    raises MessageParseError. Notes are reported to diagnostics, if given,
+    as they are made.
+    """
+
+    def __init__(
+        self, serialised_message, capabilities, attribute_cache=None, diagnostics=None
+    ):
+        # pylint: disable=super-init-not-called
+        self.serialised_message = serialised_message
+        self.attribute_cache = attribute_cache
+        self.diagnostics = diagnostics
+        self.fourbyteas = "fourbyteas" in capabilities
+        self.view = view = memoryview(serialised_message)
+        end = len(view)
+        if end < 4:
+            raise ValueError("UPDATE: Message too short")
+
+        withdrawn_routes_end = 2 + ((view[0] << 8) | view[1])
+        if withdrawn_routes_end + 2 > end:
+            raise ValueError("UPDATE: Withdrawn routes length too long")
+        path_attributes_start = withdrawn_routes_end + 2
+        nlri_start = path_attributes_start + (
+            (view[withdrawn_routes_end] << 8) | view[withdrawn_routes_end + 1]
+        )
+        if nlri_start > end:
+            raise ValueError("UPDATE: Path attribute length too long")
+
+        self.withdrawn_routes_field = (2, withdrawn_routes_end)
+        self.path_attributes_field = (path_attributes_start, nlri_start)
+        self.nlri_field = (nlri_start, end)
+        self.modified = False
+        self._withdrawn_routes = None
+        self._path_attributes = None
+        self._nlri = None
+        self._attributes = {}
+
+    @classmethod
+    def parse(cls, serialised_message, capabilities, attribute_cache=None, _notes=None):
+        # path attributes are decoded after parse returns, so nothing is noted
+        return cls(bytes(serialised_message), capabilities, attribute_cache)
+
+    def iter_withdrawn_routes(self):
+        start, end = self.withdrawn_routes_field
+        return iter_prefixes(self.view, start, end, IP4Prefix, IP4_LENGTH)
+
+    def iter_nlri(self):
+        if self._nlri is not None:
+            return iter(self._nlri)
+        start, end = self.nlri_field
+        return iter_prefixes(self.view, start, end, IP4Prefix, IP4_LENGTH)
+
+    def nlri_count(self):
+        """The number of IPv4 prefixes in the NLRI field"""
+        if self._nlri is not None:
+            return len(self._nlri)
+        start, end = self.nlri_field
+        return count_prefixes(self.view, start, end)
+
+    def get_attribute(self, key, default=None):
+        """Decode and return a single path attribute, eg as_path, or
+        default if it is missing or malformed"""
+        if self._path_attributes is not None or key in WHOLE_FIELD_KEYS:
+            return self.path_attributes.get(key, default)
+        decoded = self._attributes.get(key)
+        if decoded is None:
+            field_start, field_end = self.path_attributes_field
+            decoded = self.decode_attributes(
+                attribute
+                for attribute in iter_path_attributes(self.view, field_start, field_end)
+                if attribute_keys.get(attribute[1]) == key
+            )
+            self._attributes[key] = decoded
+        return decoded.get(key, default)
+
+    def decode_attributes(self, attributes=None):
+        """Decode attributes found by iter_path_attributes, or the whole
+        path attribute field, reporting what is noted and raising
+        MessageParseError if the message cannot be used"""
+        notes = [] if self.diagnostics is not None else None
+        start, end = self.path_attributes_field
+        try:
+            if attributes is None and self.attribute_cache is not None:
+                decoded = unpack_cached_path_attributes(
+                    self.view, start, end, self.fourbyteas, self.attribute_cache, notes
+                )
+            else:
+                if attributes is None:
+                    attributes = iter_path_attributes(self.view, start, end)
+                decoded = decode_path_attributes(
+                    self.view, attributes, self.fourbyteas, notes
+                )
+        except ValueError as error:
+            raise MessageParseError(BgpMessage.UPDATE_MESSAGE, str(error)) from error
+        if notes:
+            for kind, detail in notes:
+                self.diagnostics.report(kind, detail)
+        return decoded
+
+    @property
+    def withdrawn_routes(self):
+        if self._withdrawn_routes is None:
+            start, end = self.withdrawn_routes_field
+            self._withdrawn_routes = unpack_prefixes(
+                self.view, start, end, IP4Prefix, IP4_LENGTH
+            )
+        return self._withdrawn_routes
+
+    @withdrawn_routes.setter
+    def withdrawn_routes(self, withdrawn_routes):
+        self._withdrawn_routes = withdrawn_routes
+        self.modified = True
+
+    @property
+    def path_attributes(self):
+        if self._path_attributes is None:
+            self._path_attributes = self.decode_attributes()
+        return self._path_attributes
+
+    @path_attributes.setter
+    def path_attributes(self, path_attributes):
+        self._path_attributes = path_attributes
+        self.modified = True
+
+    @property
+    def nlri(self):
+        if self._nlri is None:
+            start, end = self.nlri_field
+            self._nlri = unpack_prefixes(self.view, start, end, IP4Prefix, IP4_LENGTH)
+        return self._nlri
+
+    @nlri.setter
+    def nlri(self, nlri):
+        self._nlri = nlri
+        self.modified = True
+
+    def pack(self, capabilities):
+        if not self.modified and ("fourbyteas" in capabilities) == self.fourbyteas:
+            return self.serialised_message
+        return super().pack(capabilities)
+
+
+class UpdateMessageBuilder(object):
+    """Packs routes into as few UPDATE messages as the size limit allows
+
+    Prefixes keep their order and each message is filled before the next
+    one is started. Messages are yielded as they are built, so large tables
+    can be streamed out without building every message up front.
+    """
+
+    # the message header plus the withdrawn routes and path attribute lengths
+    FIXED_LENGTH = BgpMessage.HEADER_LENGTH + 4
+
+    def __init__(self, fourbyteas=False, max_message_length=BgpMessage.MAX_LENGTH):
+        self.fourbyteas = fourbyteas
+        self.max_message_length = max_message_length
+
+    @staticmethod
+    def chunks(prefixes, space):
+        """Split prefixes into runs that pack into at most space bytes"""
+        chunk = []
+        used = 0
+        for prefix in prefixes:
+            size = 1 + ((prefix.length + 7) >> 3)
+            if used + size > space:
+                if not chunk:
+                    raise ValueError("UPDATE: No room for NLRI in message")
+                yield chunk
+                chunk = []
+                used = 0
+            chunk.append(prefix)
+            used += size
+        if chunk:
+            yield chunk
+
+    def path_attributes_length(self, path_attributes):
+        message = BgpUpdateMessage([], path_attributes, [])
+        return len(message.pack_path_attributes(self.fourbyteas))
+
+    def mp_nlri_space(self, other_attributes_length, mp_fixed_length):
+        """Room for prefixes inside an MP_REACH/MP_UNREACH attribute"""
+        space = (
+            self.max_message_length
+            - self.FIXED_LENGTH
+            - other_attributes_length
+            - attribute_header_length(256)
+            - mp_fixed_length
+        )
+        if mp_fixed_length + space <= 255:
+            # too small to need the extended length header
+            space = min(space + 1, 255 - mp_fixed_length)
+        return space
+
+    def ipv4_updates(self, path_attributes, nlri):
+        space = (
+            self.max_message_length
+            - self.FIXED_LENGTH
+            - self.path_attributes_length(path_attributes)
+        )
+        for chunk in self.chunks(nlri, space):
+            yield BgpUpdateMessage([], path_attributes, chunk)
+
+    def ipv4_withdrawals(self, withdrawn_routes):
+        space = self.max_message_length - self.FIXED_LENGTH
+        for chunk in self.chunks(withdrawn_routes, space):
+            yield BgpUpdateMessage(chunk, {}, [])
+
+    def ipv6_updates(self, path_attributes, next_hops, nlri):
+        # AFI, SAFI, next hop length, next hops and the reserved byte
+        mp_fixed_length = 5 + IP6_LENGTH * len(next_hops)
+        space = self.mp_nlri_space(
+            self.path_attributes_length(path_attributes), mp_fixed_length
+        )
+        for chunk in self.chunks(nlri, space):
+            chunk_path_attributes = dict(path_attributes)
+            chunk_path_attributes["mp_reach_nlri"] = {
+                "next_hop": next_hops,
+                "nlri": chunk,
+            }
+            yield BgpUpdateMessage([], chunk_path_attributes, [])
+
+    def ipv6_withdrawals(self, withdrawn_routes):
+        # AFI and SAFI
+        space = self.mp_nlri_space(0, 3)
+        for chunk in self.chunks(withdrawn_routes, space):
+            path_attributes = {"mp_unreach_nlri": {"withdrawn_routes": chunk}}
+            yield BgpUpdateMessage([], path_attributes, [])
+
+
 @register_parser
 class BgpNotificationMessage(BgpMessage):
     MSG_TYPE = BgpMessage.NOTIFICATION_MESSAGE
@@ -676,6 +1467,9 @@ class BgpNotificationMessage(BgpMessage):
     FINITE_STATE_MACHINE_ERROR = 5
     CEASE = 6
 
+    # UPDATE Message Error subcode
+    MALFORMED_ATTRIBUTE_LIST = 1
+
     def __init__(self, error_code, error_subcode=0, data=b""):
         self.error_code = error_code
         self.error_subcode = error_subcode
@@ -684,7 +1478,7 @@ class BgpNotificationMessage(BgpMessage):
     @classmethod
     def parse(cls, serialised_message, _capabilities):
         error_code, error_subcode = struct.unpack("!BB", serialised_message[:2])
-        data = serialised_message[2:]
+        data = bytes(serialised_message[2:])
         return cls(error_code, error_subcode, data)
 
     def pack(self, _capabilities):
@@ -1,11 +1,41 @@
-import struct
+"""Frame BGP messages from a stream of bytes
+
+Message bodies are handed out as bytes rather than as memoryviews of one
+reused buffer. Callers keep bodies after the next read: a
+LazyBgpUpdateMessage decodes its body when it is used, the ParsePool
+pickles bodies (which memoryviews cannot be) to its workers, and queued
+messages wait for the session greenlet. While any view of a bytearray is
+alive it cannot be resized, and compacting it in place would overwrite
+the bodies still held. So the received data is copied once into an
+immutable chunk, and each body is a bytes slice of that chunk.
+"""
+
+from collections import deque
+
 from .error import SocketClosedError
 from .bgp_message import BgpMessage
 
 
 class Chopper(object):
-    def __init__(self, input_stream):
+    """Splits a stream of bytes into BGP messages
+
+    Data is read in large chunks and every complete message in a chunk is
+    framed at once by next_batch(). Message bodies are bytes slices of the
+    chunk, so they stay valid for as long as the caller holds them.
+    """
+
+    DEFAULT_READ_SIZE = 65536
+
+    def __init__(self, input_stream, read_size=DEFAULT_READ_SIZE):
         self.input_stream = input_stream
+        self.read_size = read_size
+        self.data = b""
+        self.start = 0
+        # data given to feed() that is not yet framed
+        self.buffer = bytearray()
+        self.pending = deque()
+        self.bytes_read = 0
+        self.read_calls = 0
 
     def __iter__(self):
         return self
@@ -14,33 +44,102 @@ class Chopper(object):
         return self.next()
 
     def next(self):
-        header, length, message_type = self.load_header()
-        extra_data_length = length - BgpMessage.HEADER_LENGTH
-        if extra_data_length > 0:
-            serialised_body = self.input_stream.read(extra_data_length)
-            if len(serialised_body) < extra_data_length:
-                raise SocketClosedError(
-                    "Tried to read %d bytes but only got %d"
-                    % (extra_data_length, len(header))
-                )
-        elif extra_data_length < 0:
-            raise ValueError("Invalid BGP length field")
-        else:
-            serialised_body = b""
+        """Return the next (message_type, body)"""
+        if not self.pending:
+            self.pending.extend(self.next_batch())
+        return self.pending.popleft()
+
+    def next_batch(self):
+        """Return a list of (message_type, body) for every complete message
+        that is buffered, reading more data only if there are none"""
+        if self.pending:
+            messages = list(self.pending)
+            self.pending.clear()
+            return messages
+        while True:
+            messages = self.frame_messages()
+            if messages:
+                return messages
+            self.fill()
+
+    def feed(self, data):
+        """Add data received some other way, returning the (message_type,
+        body) of every message that is now complete"""
+        buffer = self.buffer
+        buffer += data
+        complete = len(buffer) >= self.wanted_length(buffer)
+        if not complete and buffer.startswith(BgpMessage.MARKER):
+            # wait for the rest of the message without copying what we have
+            return []
+        self.data = bytes(buffer)
+        self.start = 0
+        try:
+            return self.frame_messages()
+        finally:
+            del buffer[: self.start]
+            self.data = b""
+            self.start = 0
+
+    def frame_messages(self):
+        data = self.data
+        marker = BgpMessage.MARKER
+        header_length = BgpMessage.HEADER_LENGTH
+        start = self.start
+        end = len(data)
+        messages = []
+        append = messages.append
 
-        return message_type, serialised_body
+        while end - start >= header_length:
+            length = (data[start + 16] << 8) | data[start + 17]
+            has_marker = data[start : start + 16] == marker
+            if length < header_length or not has_marker:
+                if messages:
+                    # hand over the good messages, then raise on the next call
+                    break
+                if not has_marker:
+                    raise ValueError("BGP marker missing")
+                raise ValueError("Invalid BGP length field")
+            next_start = start + length
+            if next_start > end:
+                break
+            append((data[start + 18], data[start + header_length : next_start]))
+            start = next_start
 
-    def load_header(self):
-        # TODO handle when stream runs out
-        header = self.input_stream.read(19)
-        if len(header) < 19:
-            raise SocketClosedError(
-                "Tried to read %d bytes but only got %d" % (19, len(header))
-            )
+        self.start = start
+        return messages
 
-        marker, length, message_type = struct.unpack("!16sHB", header)
+    def fill(self):
+        """Read at least until the first unframed message is complete"""
+        data = self.data[self.start :]
+        chunks = [data]
+        buffered = len(data)
+        wanted = self.wanted_length(data)
+        read = getattr(self.input_stream, "read1", None)
+        if read is None:
+            read = self.input_stream.read
+
+        while buffered < wanted:
+            chunk = read(max(self.read_size, wanted - buffered))
+            self.read_calls += 1
+            if not chunk:
+                raise SocketClosedError(
+                    "Tried to read %d bytes but only got %d" % (wanted, buffered)
+                )
+            chunks.append(chunk)
+            buffered += len(chunk)
+            self.bytes_read += len(chunk)
+            if wanted == BgpMessage.HEADER_LENGTH <= buffered:
+                # the header is in, so now we know how much to wait for
+                data = b"".join(chunks)
+                chunks = [data]
+                wanted = self.wanted_length(data)
 
-        if marker == BgpMessage.MARKER:
-            return header, length, message_type
+        self.data = b"".join(chunks)
+        self.start = 0
 
-        raise ValueError("BGP marker missing")
+    @staticmethod
+    def wanted_length(data):
+        """Length of the message starting data, or of a header if unknown"""
+        if len(data) < BgpMessage.HEADER_LENGTH:
+            return BgpMessage.HEADER_LENGTH
+        return max((data[16] << 8) | data[17], BgpMessage.HEADER_LENGTH)
@@ -0,0 +1,127 @@
+"""Rate limited reports of odd but harmless things that peers send
+
+While parsing, the codec can note things that are worth knowing about but
+not worth failing a session over, such as capabilities and path attributes
+that it does not recognise or that are malformed, as (kind, detail) pairs.
+A Peering passes them to its Diagnostics, which counts every one, but only
+reports a few for each kind: a burst of them, and then up to rate per
+second. The rest are summarised once per interval, eg "Peering 192.0.2.1:
+5000 unknown path attribute 99 in last 10s".
+
+Reports go to the Peering's error_handler if it has one, and otherwise to
+the "beka" logger at WARNING. Either way, notes are only collected while
+the "beka" logger is enabled for that level, so raising its level turns
+them off, except for those kept in an AttributeCache along with the
+attributes they are about.
+"""
+
+import logging
+import time
+
+logger = logging.getLogger("beka")
+
+DESCRIPTIONS = {
+    "unknown_capability": "unknown capability %d",
+    "unknown_attribute": "unknown path attribute %d",
+    "malformed_attribute": "malformed path attribute %d",
+    "as_set": "AS_SET in AS_PATH",
+}
+
+
+def describe(kind, detail):
+    if detail is None:
+        return DESCRIPTIONS[kind]
+    return DESCRIPTIONS[kind] % detail
+
+
+class TokenBucket:
+    """Allows a burst of up to burst calls, refilled at rate per second"""
+
+    def __init__(self, rate, burst, clock=time.monotonic):
+        self.rate = rate
+        self.burst = burst
+        self.clock = clock
+        self.tokens = burst
+        self.updated = clock()
+
+    def take(self):
+        """Return True, and use up a token, if one is available"""
+        now = self.clock()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+
+class Diagnostics:
+    """Counts and rate limits the notes from parsing one peer's messages"""
+
+    DEFAULT_RATE = 1.0
+    DEFAULT_BURST = 10
+    DEFAULT_INTERVAL = 10
+
+    def __init__(
+        self,
+        peer,
+        error_handler=None,
+        rate=DEFAULT_RATE,
+        burst=DEFAULT_BURST,
+        interval=DEFAULT_INTERVAL,
+        level=logging.WARNING,
+        clock=time.monotonic,
+    ):
+        self.peer = peer
+        self.error_handler = error_handler
+        self.rate = rate
+        self.burst = burst
+        self.interval = interval
+        self.level = level
+        self.clock = clock
+        # keyed by (kind, detail)
+        self.counts = {}
+        self.suppressed = {}
+        # keyed by kind
+        self.buckets = {}
+        self.interval_start = clock()
+
+    def enabled(self):
+        """True if the "beka" logger is enabled for the report level"""
+        return logger.isEnabledFor(self.level)
+
+    def report(self, kind, detail=None):
+        key = kind, detail
+        self.counts[key] = self.counts.get(key, 0) + 1
+        if self.clock() - self.interval_start >= self.interval:
+            self.flush()
+        bucket = self.buckets.get(kind)
+        if bucket is None:
+            bucket = TokenBucket(self.rate, self.burst, self.clock)
+            self.buckets[kind] = bucket
+        if bucket.take():
+            self.emit(describe(kind, detail))
+        else:
+            self.suppressed[key] = self.suppressed.get(key, 0) + 1
+
+    def flush(self):
+        """Summarise the reports suppressed since the last flush"""
+        now = self.clock()
+        elapsed = now - self.interval_start
+        for (kind, detail), count in self.suppressed.items():
+            self.emit("%d %s in last %ds" % (count, describe(kind, detail), elapsed))
+        self.suppressed = {}
+        self.interval_start = now
+
+    def emit(self, message):
+        if self.error_handler is not None:
+            self.error_handler("Peering %s: %s" % (self.peer, message))
+        else:
+            logger.log(self.level, "Peering %s: %s", self.peer, message)
+
+    def totals(self):
+        """Return how many of each kind of note there have been"""
+        totals = {}
+        for (kind, _detail), count in self.counts.items():
+            totals[kind] = totals.get(kind, 0) + count
+        return totals
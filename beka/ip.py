@@ -1,6 +1,13 @@
-"""IP address and prefix classes"""
+"""IP address and prefix classes
 
+Addresses and prefixes are small value types: they use __slots__, hash and
+order by value, and cache their integer and string forms on first use.
+They should be treated as immutable.
+"""
+
+from abc import ABCMeta, abstractmethod
 import socket
+import weakref
 
 
 def is_ipv6(address_string):
@@ -9,38 +16,90 @@ def is_ipv6(address_string):
     return ":" in address_string
 
 
-class IPBase(object):  # pylint: disable=too-few-public-methods
+class IPBase(metaclass=ABCMeta):  # pylint: disable=too-few-public-methods
     """Abstract base class for IP addresses and prefixes"""
 
+    __slots__ = ()
+
+    INET_TYPE = None
+    VERSION = None
+    WIDTH = None
+    # the class that instances are ordered against, set once it is defined
+    ORDER_TYPE = ()
+
     def __repr__(self):
         return '%s.from_string("%s")' % (self.__class__.__name__, self.__str__())
 
+    @abstractmethod
+    def sort_key(self):
+        """Key that defines the ordering of instances"""
+
+    def __lt__(self, other):
+        if not isinstance(other, self.ORDER_TYPE):
+            return NotImplemented
+        return self.sort_key() < other.sort_key()
+
+    def __le__(self, other):
+        if not isinstance(other, self.ORDER_TYPE):
+            return NotImplemented
+        return self.sort_key() <= other.sort_key()
+
+    def __gt__(self, other):
+        if not isinstance(other, self.ORDER_TYPE):
+            return NotImplemented
+        return self.sort_key() > other.sort_key()
+
+    def __ge__(self, other):
+        if not isinstance(other, self.ORDER_TYPE):
+            return NotImplemented
+        return self.sort_key() >= other.sort_key()
+
 
 class IPAddress(IPBase):  # pylint: disable=too-few-public-methods
     """Abstract base class for IP addresses"""
 
-    INET_TYPE = None
+    __slots__ = ("address", "_int", "_hash", "_string")
 
     def __init__(self, address):
         """Common constructor for IP addresses"""
 
         self.address = address
+        self._int = None
+        self._hash = None
+        self._string = None
 
     def __str__(self):
         """Common str() for IP addresses"""
 
-        address_string = socket.inet_ntop(self.INET_TYPE, self.address)
-        return address_string
+        if self._string is None:
+            self._string = socket.inet_ntop(self.INET_TYPE, self.address)
+        return self._string
+
+    def __int__(self):
+        """The address as an integer"""
+
+        if self._int is None:
+            self._int = int.from_bytes(self.address, "big")
+        return self._int
 
     def __eq__(self, other):
         """Common equality checker for IP addresses"""
 
+        if not isinstance(other, IPAddress):
+            return NotImplemented
         return self.address == other.address
 
     def __hash__(self):
         """Common hash method for IP addresses"""
 
-        return hash(self.address)
+        if self._hash is None:
+            self._hash = hash(self.address)
+        return self._hash
+
+    def sort_key(self):
+        """Key that orders IPv4 before IPv6, then by address"""
+
+        return (self.VERSION, int(self))
 
     @staticmethod
     def from_string(string):
@@ -54,25 +113,80 @@ class IPAddress(IPBase):  # pylint: disable=too-few-public-methods
 class IPPrefix(IPBase):  # pylint: disable=too-few-public-methods
     """Abstract base class for IP prefixes"""
 
-    INET_TYPE = None
+    __slots__ = ("prefix", "length", "_int", "_hash", "_string", "__weakref__")
 
     def __init__(self, prefix, length):
         """Common constructor for IP prefixes"""
 
         self.prefix = prefix
         self.length = length
+        self._int = None
+        self._hash = None
+        self._string = None
 
     def __str__(self):
         """Common str() for IP prefixes"""
 
-        prefix_string = socket.inet_ntop(self.INET_TYPE, self.prefix)
-        return "%s/%d" % (prefix_string, self.length)
+        if self._string is None:
+            prefix_string = socket.inet_ntop(self.INET_TYPE, self.prefix)
+            self._string = "%s/%d" % (prefix_string, self.length)
+        return self._string
+
+    def __int__(self):
+        """The prefix address as an integer, including any host bits"""
+
+        if self._int is None:
+            self._int = int.from_bytes(self.prefix, "big")
+        return self._int
 
     def __eq__(self, other):
         """Common equality checker for IP prefixes"""
 
+        if not isinstance(other, IPPrefix):
+            return NotImplemented
         return self.prefix == other.prefix and self.length == other.length
 
+    def __hash__(self):
+        """Common hash method for IP prefixes"""
+
+        if self._hash is None:
+            self._hash = hash((self.prefix, self.length))
+        return self._hash
+
+    def sort_key(self):
+        """Key that orders IPv4 before IPv6, then by address, then by length
+
+        sorted(prefixes, key=IPPrefix.sort_key) is much faster than relying
+        on the rich comparison methods.
+        """
+
+        return (self.VERSION, int(self), self.length)
+
+    def network(self):
+        """The prefix address as an integer, with host bits cleared"""
+
+        host_bits = self.WIDTH - self.length
+        return (int(self) >> host_bits) << host_bits
+
+    def __contains__(self, other):
+        """True if an address or prefix falls within this prefix"""
+
+        if other.VERSION != self.VERSION:
+            return False
+        if isinstance(other, IPPrefix) and other.length < self.length:
+            return False
+        return (int(self) ^ int(other)) >> (self.WIDTH - self.length) == 0
+
+    def supernet_of(self, other):
+        """True if other is this prefix or a more specific one"""
+
+        return other in self
+
+    def subnet_of(self, other):
+        """True if this prefix is other or a more specific one"""
+
+        return self in other
+
     @staticmethod
     def from_string(string):
         """Common from_string method for IP prefixes"""
@@ -82,10 +196,18 @@ class IPPrefix(IPBase):  # pylint: disable=too-few-public-methods
         return IP4Prefix.build_from_string(string)
 
 
+IPAddress.ORDER_TYPE = IPAddress
+IPPrefix.ORDER_TYPE = IPPrefix
+
+
 class IP4Address(IPAddress):  # pylint: disable=too-few-public-methods
     """An IPv4 address"""
 
+    __slots__ = ()
+
     INET_TYPE = socket.AF_INET
+    VERSION = 4
+    WIDTH = 32
 
     @classmethod
     def build_from_string(cls, address_string):
@@ -99,7 +221,11 @@ class IP4Address(IPAddress):  # pylint: disable=too-few-public-methods
 class IP4Prefix(IPPrefix):  # pylint: disable=too-few-public-methods
     """An IPv4 prefix"""
 
+    __slots__ = ()
+
     INET_TYPE = socket.AF_INET
+    VERSION = 4
+    WIDTH = 32
 
     @classmethod
     def build_from_string(cls, string):
@@ -114,7 +240,11 @@ class IP4Prefix(IPPrefix):  # pylint: disable=too-few-public-methods
 class IP6Address(IPAddress):  # pylint: disable=too-few-public-methods
     """An IPv6 address"""
 
+    __slots__ = ()
+
     INET_TYPE = socket.AF_INET6
+    VERSION = 6
+    WIDTH = 128
 
     @classmethod
     def build_from_string(cls, address_string):
@@ -128,7 +258,11 @@ class IP6Address(IPAddress):  # pylint: disable=too-few-public-methods
 class IP6Prefix(IPPrefix):  # pylint: disable=too-few-public-methods
     """An IPv6 prefix"""
 
+    __slots__ = ()
+
     INET_TYPE = socket.AF_INET6
+    VERSION = 6
+    WIDTH = 128
 
     @classmethod
     def build_from_string(cls, string):
@@ -138,3 +272,25 @@ class IP6Prefix(IPPrefix):  # pylint: disable=too-few-public-methods
         prefix = socket.inet_pton(socket.AF_INET6, prefix_string)
 
         return cls(prefix, int(length_string, 10))
+
+
+class PrefixPool:
+    """Interned prefixes, so that a prefix parsed for many peers is one object
+
+    Prefixes are keyed by their NLRI encoding, the length byte followed by
+    the significant bytes of the prefix, with a pool for each prefix class.
+    Only weak references are held, so prefixes that are no longer in use
+    are dropped from the pool.
+    """
+
+    def __init__(self):
+        self.pools = {
+            IP4Prefix: weakref.WeakValueDictionary(),
+            IP6Prefix: weakref.WeakValueDictionary(),
+        }
+
+    def pool(self, prefix_class):
+        return self.pools[prefix_class]
+
+    def __len__(self):
+        return sum(len(pool) for pool in self.pools.values())
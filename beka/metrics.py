@@ -0,0 +1,263 @@
+"""Per-peering metrics, and an exporter in the Prometheus text format
+
+The counters themselves are plain integer attributes of the session (a
+Peering, or an asyncio BgpProtocol) and its StateMachine, updated inline
+on the receive and send paths; both kinds of session return them from
+counters(). Latencies are sampled into LatencyHistograms: only one call in
+sample_interval is timed, so the _count of a histogram is the number of
+samples, not of calls.
+
+A Beka given a metrics_address serves /metrics from a MetricsExporter.
+"""
+
+import bisect
+import socket
+
+from eventlet import listen, wsgi
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+MESSAGE_TYPE_NAMES = {
+    1: "open",
+    2: "update",
+    3: "notification",
+    4: "keepalive",
+    5: "route_refresh",
+}
+
+
+class LatencyHistogram:
+    """Cumulative histogram of sampled latencies, in seconds"""
+
+    DEFAULT_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0)
+    DEFAULT_SAMPLE_INTERVAL = 16
+
+    def __init__(
+        self, buckets=DEFAULT_BUCKETS, sample_interval=DEFAULT_SAMPLE_INTERVAL
+    ):
+        self.buckets = tuple(buckets)
+        self.sample_interval = sample_interval
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self.calls = 0
+
+    def sample(self):
+        """Return True if this call should be timed"""
+        self.calls += 1
+        return self.calls % self.sample_interval == 0
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(self.buckets, seconds)] += 1
+        self.sum += seconds
+        self.count += 1
+
+    def cumulative_counts(self):
+        """Return (upper bound, count) pairs, ending with ("+Inf", count)"""
+        cumulative = []
+        total = 0
+        for bound, count in zip(self.buckets + ("+Inf",), self.counts):
+            total += count
+            cumulative.append((bound, total))
+        return cumulative
+
+
+def session_counters(session, output_queue, route_queue):
+    """Return the counters of a Peering or BgpProtocol as a dict
+
+    output_queue and route_queue are the number of messages and route
+    updates waiting, which each kind of session keeps differently.
+    """
+    state_machine = session.state_machine
+    return {
+        "messages_received": {
+            name: session.messages_received[message_type]
+            for message_type, name in MESSAGE_TYPE_NAMES.items()
+        },
+        "messages_sent": {
+            name: session.messages_sent_by_type[message_type]
+            for message_type, name in MESSAGE_TYPE_NAMES.items()
+        },
+        "bytes_received": session.bytes_received,
+        "bytes_sent": session.bytes_sent,
+        "prefixes_accepted": {
+            "ipv4": state_machine.ipv4_prefixes_accepted,
+            "ipv6": state_machine.ipv6_prefixes_accepted,
+        },
+        "prefixes_withdrawn": {
+            "ipv4": state_machine.ipv4_prefixes_withdrawn,
+            "ipv6": state_machine.ipv6_prefixes_withdrawn,
+        },
+        "updates_treated_as_withdraw": state_machine.updates_treated_as_withdraw,
+        "attributes_discarded": state_machine.attributes_discarded,
+        "diagnostics": session.diagnostics.totals(),
+        "output_queue": output_queue,
+        "route_queue": route_queue,
+        "output_pauses": session.output_pauses,
+    }
+
+
+def format_labels(labels):
+    return ",".join(
+        '%s="%s"' % (name, str(value).replace("\\", "\\\\").replace('"', '\\"'))
+        for name, value in labels
+    )
+
+
+class MetricFamily:
+    """The samples of one metric, rendered with its HELP and TYPE lines"""
+
+    def __init__(self, name, metric_type, help_text):
+        self.name = name
+        self.metric_type = metric_type
+        self.help_text = help_text
+        self.lines = []
+
+    def add(self, labels, value, suffix=""):
+        self.lines.append(
+            "%s%s{%s} %s" % (self.name, suffix, format_labels(labels), value)
+        )
+
+    def add_histogram(self, labels, histogram):
+        for bound, count in histogram.cumulative_counts():
+            self.add(labels + [("le", bound)], count, "_bucket")
+        self.add(labels, repr(histogram.sum), "_sum")
+        self.add(labels, histogram.count, "_count")
+
+    def render(self):
+        return [
+            "# HELP %s %s" % (self.name, self.help_text),
+            "# TYPE %s %s" % (self.name, self.metric_type),
+        ] + self.lines
+
+
+class MetricsExporter:
+    """Renders the metrics of a Beka's peerings, and serves them over HTTP"""
+
+    def __init__(self, beka):
+        self.beka = beka
+        self.server = None
+
+    def families(self):
+        families = {}
+
+        def family(name, metric_type, help_text):
+            if name not in families:
+                families[name] = MetricFamily(name, metric_type, help_text)
+            return families[name]
+
+        for peering in self.beka.peerings:
+            counters = peering.counters()
+            labels = [("peer", peering.peer_address)]
+            family(
+                "beka_peer_uptime_seconds", "gauge", "Time since the session started"
+            ).add(labels, peering.uptime())
+            for name in MESSAGE_TYPE_NAMES.values():
+                type_labels = labels + [("type", name)]
+                family(
+                    "beka_messages_received_total", "counter", "Messages received"
+                ).add(type_labels, counters["messages_received"][name])
+                family("beka_messages_sent_total", "counter", "Messages sent").add(
+                    type_labels, counters["messages_sent"][name]
+                )
+            family(
+                "beka_bytes_received_total", "counter", "Bytes of messages received"
+            ).add(labels, counters["bytes_received"])
+            family("beka_bytes_sent_total", "counter", "Bytes sent").add(
+                labels, counters["bytes_sent"]
+            )
+            family(
+                "beka_output_queue_messages",
+                "gauge",
+                "Messages waiting to be sent to the peer",
+            ).add(labels, counters["output_queue"])
+            family(
+                "beka_route_queue_updates",
+                "gauge",
+                "Route updates waiting for the route handler",
+            ).add(labels, counters["route_queue"])
+            family(
+                "beka_output_pauses_total",
+                "counter",
+                "Times reading from the peer paused for output to drain",
+            ).add(labels, counters["output_pauses"])
+            for afi in ("ipv4", "ipv6"):
+                afi_labels = labels + [("afi", afi)]
+                family(
+                    "beka_prefixes_accepted_total",
+                    "counter",
+                    "Prefixes announced by the peer and passed on",
+                ).add(afi_labels, counters["prefixes_accepted"][afi])
+                family(
+                    "beka_prefixes_withdrawn_total",
+                    "counter",
+                    "Prefixes withdrawn by the peer and passed on",
+                ).add(afi_labels, counters["prefixes_withdrawn"][afi])
+            family(
+                "beka_updates_treated_as_withdraw_total",
+                "counter",
+                "UPDATEs with malformed path attributes whose routes were withdrawn",
+            ).add(labels, counters["updates_treated_as_withdraw"])
+            family(
+                "beka_attributes_discarded_total",
+                "counter",
+                "Malformed path attributes discarded from UPDATEs",
+            ).add(labels, counters["attributes_discarded"])
+            attribute_cache = getattr(peering.parser, "attribute_cache", None)
+            if attribute_cache is not None:
+                family(
+                    "beka_attribute_cache_hits_total",
+                    "counter",
+                    "Path attribute blocks found already decoded",
+                ).add(labels, attribute_cache.hits)
+                family(
+                    "beka_attribute_cache_misses_total",
+                    "counter",
+                    "Path attribute blocks decoded",
+                ).add(labels, attribute_cache.misses)
+            for kind, count in counters["diagnostics"].items():
+                family(
+                    "beka_diagnostics_total",
+                    "counter",
+                    "Odd but harmless things noted while parsing the peer's messages",
+                ).add(labels + [("kind", kind)], count)
+            family(
+                "beka_parse_seconds",
+                "histogram",
+                "Sampled time to parse a batch of received messages",
+            ).add_histogram(labels, peering.parse_latency)
+            family(
+                "beka_route_handler_seconds",
+                "histogram",
+                "Sampled time spent in the route handler per call",
+            ).add_histogram(labels, peering.handler_latency)
+        return families.values()
+
+    def render(self):
+        lines = []
+        for metric_family in self.families():
+            lines.extend(metric_family.render())
+        return "".join(line + "\n" for line in lines)
+
+    def application(self, environ, start_response):
+        if environ.get("PATH_INFO", "/") not in ("/", "/metrics"):
+            start_response("404 Not Found", [("Content-Type", "text/plain")])
+            return [b"Not found\n"]
+        body = self.render().encode("utf-8")
+        start_response(
+            "200 OK",
+            [("Content-Type", CONTENT_TYPE), ("Content-Length", str(len(body)))],
+        )
+        return [body]
+
+    def serve(self, address):
+        family = socket.AF_INET6 if ":" in address[0] else socket.AF_INET
+        self.server = listen(address, family)
+        try:
+            wsgi.server(self.server, self.application, log_output=False)
+        except OSError:
+            pass
+
+    def stop(self):
+        if self.server is not None:
+            self.server.close()
+            self.server = None
@@ -0,0 +1,172 @@
+"""Parse UPDATE messages in a pool of worker processes
+
+A Peering given a ParsePool parses runs of UPDATEs from each received
+batch in the pool, while OPEN, KEEPALIVE and NOTIFICATION messages and
+small runs of UPDATEs are still parsed inline. The session greenlet polls
+for the results, so other peerings and the timers keep running while a
+large burst of UPDATEs is parsed. Parsed messages are always handed back
+in the order they were received, and anything noted while parsing them in
+a worker is reported to the parser's Diagnostics.
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import sys
+import time
+
+from eventlet import sleep
+
+from .bgp_message import BgpMessage, BgpMessageParser
+
+# each worker process keeps one parser for every batch it is given
+WORKER_PARSER = BgpMessageParser()
+
+
+class NoteCollector:
+    """Stands in for a Diagnostics in a worker process, keeping the notes
+    for the Peering's Diagnostics to report"""
+
+    def __init__(self):
+        self.notes = []
+
+    def enabled(self):
+        return True
+
+    def report(self, kind, detail=None):
+        self.notes.append((kind, detail))
+
+
+def parse_updates(capabilities, serialised_messages, noting=False):
+    """Parse UPDATE bodies, returning the messages and a list of the
+    (kind, detail) notes made if noting; runs in a worker process"""
+    parser = WORKER_PARSER
+    parser.capabilities = capabilities
+    parser.diagnostics = NoteCollector() if noting else None
+    messages = [
+        parser.parse(BgpMessage.UPDATE_MESSAGE, serialised_message)
+        for serialised_message in serialised_messages
+    ]
+    notes = parser.diagnostics.notes if noting else []
+    parser.diagnostics = None
+    return messages, notes
+
+
+class ParsePool:
+    """Offloads UPDATE parsing to worker processes, preserving order
+
+    One ParsePool can be shared by every Peering of a Beka.
+    """
+
+    DEFAULT_BATCH_SIZE = 256
+    DEFAULT_MIN_OFFLOAD = 16
+    POLL_INTERVAL = 0.001
+
+    def __init__(
+        self,
+        workers=None,
+        batch_size=DEFAULT_BATCH_SIZE,
+        min_offload=DEFAULT_MIN_OFFLOAD,
+        executor=None,
+    ):
+        self.workers = workers
+        self.batch_size = batch_size
+        self.min_offload = min_offload
+        self.executor = executor
+        self.queue_depth = 0
+        self.max_queue_depth = 0
+        self.batches = 0
+        self.offloaded = 0
+        self.inline = 0
+        self.parse_time = 0.0
+        self.max_parse_time = 0.0
+
+    def start(self):
+        if self.executor is None:
+            self.executor = ProcessPoolExecutor(
+                self.workers, mp_context=multiprocessing.get_context("spawn")
+            )
+
+    def parse(self, parser, messages):
+        """Parse a batch of (message_type, serialised_message) from Chopper,
+        returning the parsed messages in the same order"""
+        updates = [
+            index
+            for index, (message_type, _) in enumerate(messages)
+            if message_type == BgpMessage.UPDATE_MESSAGE
+        ]
+        if len(updates) < self.min_offload:
+            self.inline += len(messages)
+            return [
+                parser.parse(message_type, serialised_message)
+                for message_type, serialised_message in messages
+            ]
+
+        self.start()
+        diagnostics = parser.diagnostics
+        noting = diagnostics is not None and diagnostics.enabled()
+        parsed = [None] * len(messages)
+        pending = []
+        for offset in range(0, len(updates), self.batch_size):
+            indexes = updates[offset : offset + self.batch_size]
+            future = self.executor.submit(
+                parse_updates,
+                parser.capabilities,
+                [messages[index][1] for index in indexes],
+                noting,
+            )
+            pending.append((indexes, future, time.perf_counter()))
+            self.queue_depth += len(indexes)
+        self.max_queue_depth = max(self.max_queue_depth, self.queue_depth)
+
+        # everything else is parsed here while the pool works on the UPDATEs
+        offloaded = set(updates)
+        for index, (message_type, serialised_message) in enumerate(messages):
+            if index not in offloaded:
+                parsed[index] = parser.parse(message_type, serialised_message)
+        self.inline += len(messages) - len(updates)
+
+        outstanding = len(updates)
+        try:
+            for indexes, future, submitted in pending:
+                while not future.done():
+                    sleep(self.POLL_INTERVAL)
+                batch, notes = future.result()
+                for index, message in zip(indexes, batch):
+                    parsed[index] = message
+                for kind, detail in notes:
+                    diagnostics.report(kind, detail)
+                self.record(len(indexes), time.perf_counter() - submitted)
+                self.queue_depth -= len(indexes)
+                outstanding -= len(indexes)
+        finally:
+            for _, future, _ in pending:
+                future.cancel()
+            self.queue_depth -= outstanding
+        return parsed
+
+    def record(self, count, parse_time):
+        self.batches += 1
+        self.offloaded += count
+        self.parse_time += parse_time
+        self.max_parse_time = max(self.max_parse_time, parse_time)
+
+    def stats(self):
+        return {
+            "queue_depth": self.queue_depth,
+            "max_queue_depth": self.max_queue_depth,
+            "batches": self.batches,
+            "offloaded": self.offloaded,
+            "inline": self.inline,
+            "mean_parse_latency": (
+                self.parse_time / self.batches if self.batches else 0.0
+            ),
+            "max_parse_latency": self.max_parse_time,
+        }
+
+    def shutdown(self):
+        if self.executor is not None:
+            if sys.version_info >= (3, 9):
+                self.executor.shutdown(wait=False, cancel_futures=True)
+            else:
+                self.executor.shutdown(wait=False)
+            self.executor = None
@@ -1,18 +1,89 @@
 import time
 
 from eventlet import sleep, GreenPool
-from eventlet.queue import Queue
+from eventlet.event import Event
+from eventlet.queue import Queue, Empty
 import eventlet.greenthread as greenthread
 
 from .chopper import Chopper
 from .event import EventTimerExpired, EventMessageReceived
-from .bgp_message import BgpMessageParser, BgpMessagePacker
+from .bgp_message import BgpMessage, BgpMessageParser, BgpMessagePacker
+from .bgp_message import MessageParseError
+from .diagnostics import Diagnostics
 from .error import SocketClosedError, IdleError
+from .metrics import LatencyHistogram, session_counters
+from .timer import TimerHeap
+
+
+class TimerScheduler(TimerHeap):
+    """Runs the timers of every session from a single greenlet
+
+    Sessions are scheduled at their StateMachine's next deadline and have
+    timers_due(tick) called once it has passed, so nothing wakes up until
+    a hold or keepalive timer is actually due.
+    """
+
+    def __init__(self, clock=time.time):
+        super().__init__()
+        self.clock = clock
+        self.rescheduled = Event()
+        self.wakeups = 0
+
+    def schedule(self, session, deadline):
+        next_deadline = self.next_deadline()
+        super().schedule(session, deadline)
+        if deadline is not None and (next_deadline is None or deadline < next_deadline):
+            # the greenlet is sleeping until a later deadline
+            if not self.rescheduled.ready():
+                self.rescheduled.send()
+
+    def run_due(self, tick):
+        """Call timers_due on every session that is due, returning how many"""
+        due = self.pop_due(tick)
+        for session in due:
+            session.timers_due(tick)
+        return len(due)
+
+    def wait(self):
+        """Sleep until the next deadline, or until an earlier one is scheduled"""
+        deadline = self.next_deadline()
+        timeout = None if deadline is None else max(0, deadline - self.clock())
+        self.rescheduled.wait(timeout)
+        if self.rescheduled.ready():
+            self.rescheduled = Event()
+
+    def run_once(self):
+        self.wait()
+        self.wakeups += 1
+        return self.run_due(self.clock())
+
+    def run(self):
+        while True:
+            self.run_once()
 
 
 class Peering(object):
+    DEFAULT_BATCH_MAX_ROUTES = 10000
+    DEFAULT_BATCH_MAX_DELAY = 0.1
+    DEFAULT_SEND_BUFFER_SIZE = 65536
+    DEFAULT_MAX_OUTPUT_MESSAGES = 1024
+    OUTPUT_POLL_INTERVAL = 0.01
+
     def __init__(
-        self, state_machine, peer_address, socket, route_handler, error_handler=None
+        self,
+        state_machine,
+        peer_address,
+        socket,
+        route_handler,
+        error_handler=None,
+        batch_route_handler=None,
+        batch_max_routes=DEFAULT_BATCH_MAX_ROUTES,
+        batch_max_delay=DEFAULT_BATCH_MAX_DELAY,
+        send_buffer_size=DEFAULT_SEND_BUFFER_SIZE,
+        max_output_messages=DEFAULT_MAX_OUTPUT_MESSAGES,
+        timer_scheduler=None,
+        parse_pool=None,
+        attribute_cache_size=0,
     ):
         self.input_stream = None
         self.chopper = None
@@ -26,6 +97,27 @@ class Peering(object):
         self.socket = socket
         self.route_handler = route_handler
         self.error_handler = error_handler
+        self.batch_route_handler = batch_route_handler
+        self.batch_max_routes = batch_max_routes
+        self.batch_max_delay = batch_max_delay
+        self.send_buffer_size = send_buffer_size
+        self.max_output_messages = max_output_messages
+        self.timer_scheduler = timer_scheduler
+        self.parse_pool = parse_pool
+        self.attribute_cache_size = attribute_cache_size
+        self.bytes_sent = 0
+        self.messages_sent = 0
+        # indexed by message type
+        self.messages_sent_by_type = [0] * 256
+        self.messages_received = [0] * 256
+        self.bytes_received = 0
+        self.parse_latency = LatencyHistogram()
+        self.handler_latency = LatencyHistogram()
+        self.diagnostics = Diagnostics(self.peer_address, error_handler)
+        self.send_calls = 0
+        self.output_pauses = 0
+        self.output_messages = Queue()
+        self.route_updates = Queue()
         self.start_time = int(time.time())
 
     def uptime(self):
@@ -35,14 +127,21 @@ class Peering(object):
         self.input_stream = self.socket.makefile(mode="rb")
         self.chopper = Chopper(self.input_stream)
         self.pool = GreenPool()
-        self.parser = BgpMessageParser()
+        self.parser = BgpMessageParser(
+            attribute_cache_size=self.attribute_cache_size,
+            diagnostics=self.diagnostics,
+        )
         self.packer = BgpMessagePacker()
         self.state_machine.open_handler = self.open_handler
         self.eventlets = []
 
         self.eventlets.append(self.pool.spawn(self.send_messages))
-        self.eventlets.append(self.pool.spawn(self.print_route_updates))
-        self.eventlets.append(self.pool.spawn(self.kick_timers))
+        if self.batch_route_handler:
+            self.eventlets.append(self.pool.spawn(self.deliver_route_batches))
+        else:
+            self.eventlets.append(self.pool.spawn(self.print_route_updates))
+        if self.timer_scheduler is None:
+            self.eventlets.append(self.pool.spawn(self.kick_timers))
         self.eventlets.append(self.pool.spawn(self.receive_messages))
 
         self.pool.waitall()
@@ -54,54 +153,237 @@ class Peering(object):
     def receive_messages(self):
         while True:
             sleep(0)
+            self.wait_for_output_space()
             try:
-                message_type, serialised_message = self.chopper.next()
+                messages = self.chopper.next_batch()
             except SocketClosedError as e:
                 if self.error_handler:
                     self.error_handler("Peering %s: %s" % (self.peer_address, e))
                 self.shutdown()
                 break
-            message = self.parser.parse(message_type, serialised_message)
-            event = EventMessageReceived(message)
-            tick = int(time.time())
             try:
-                self.state_machine.event(event, tick)
+                self.handle_events(self.timed_parse_messages(messages), time.time())
             except IdleError as e:
                 if self.error_handler:
                     self.error_handler("Peering %s: %s" % (self.peer_address, e))
                 self.shutdown()
                 break
+            except ValueError as e:
+                # a message too malformed to recover from (RFC 7606 3)
+                if self.error_handler:
+                    self.error_handler(
+                        "Peering %s: Malformed message: %s" % (self.peer_address, e)
+                    )
+                if isinstance(e, MessageParseError):
+                    self.queue_output([e.notification()], [])
+                self.shutdown()
+                break
+
+    def timed_parse_messages(self, messages):
+        """parse_messages, sampling how long a batch takes to parse"""
+        if not self.parse_latency.sample():
+            return self.parse_messages(messages)
+        start = time.perf_counter()
+        events = list(self.parse_messages(messages))
+        self.parse_latency.observe(time.perf_counter() - start)
+        return events
+
+    def parse_messages(self, messages):
+        """Return received events for a batch of messages from the Chopper"""
+        messages_received = self.messages_received
+        for message_type, serialised_message in messages:
+            messages_received[message_type] += 1
+            self.bytes_received += BgpMessage.HEADER_LENGTH + len(serialised_message)
+        if self.parse_pool is not None:
+            parsed = self.parse_pool.parse(self.parser, messages)
+            return [EventMessageReceived(message) for message in parsed]
+        return (
+            EventMessageReceived(self.parser.parse(message_type, serialised_message))
+            for message_type, serialised_message in messages
+        )
+
+    def handle_events(self, events, tick):
+        """Run events through the state machine and queue what it produces"""
+        output_messages = []
+        route_updates = []
+        try:
+            for event in events:
+                self.state_machine.event(event, tick, output_messages, route_updates)
+        finally:
+            self.queue_output(output_messages, route_updates)
+        self.reschedule_timers()
+
+    def reschedule_timers(self):
+        if self.timer_scheduler is not None:
+            self.timer_scheduler.schedule(self, self.state_machine.next_deadline())
+
+    def timers_due(self, tick):
+        """Called by the timer_scheduler once a timer deadline has passed"""
+        try:
+            self.handle_events([EventTimerExpired()], tick)
+        except IdleError as e:
+            if self.error_handler:
+                self.error_handler("Peering %s: %s" % (self.peer_address, e))
+            self.shutdown()
+
+    def queue_output(self, output_messages, route_updates):
+        for message in output_messages:
+            self.output_messages.put(message)
+        for route_update in route_updates:
+            self.route_updates.put(route_update)
 
     def send_messages(self):
+        output_messages = self.output_messages
         while True:
             sleep(0)
-            message = self.state_machine.output_messages.get()
-            self.socket.send(self.packer.pack(message))
+            self.send_output([output_messages.get()])
 
     def empty_message_queue(self):
-        while self.state_machine.output_messages.qsize():
-            message = self.state_machine.output_messages.get()
-            self.socket.send(self.packer.pack(message))
+        while self.output_messages.qsize():
+            self.send_output([])
+
+    def send_output(self, messages):
+        """Pack messages, and any others already queued up to send_buffer_size
+        bytes, and send them as one buffer"""
+        output_messages = self.output_messages
+        packed_messages = [self.pack_message(message) for message in messages]
+        size = sum(len(packed_message) for packed_message in packed_messages)
+        while size < self.send_buffer_size and output_messages.qsize():
+            packed_message = self.pack_message(output_messages.get_nowait())
+            packed_messages.append(packed_message)
+            size += len(packed_message)
+        self.send_buffer(b"".join(packed_messages))
+        self.messages_sent += len(packed_messages)
+
+    def pack_message(self, message):
+        # messages packed in advance come from an UpdateCache
+        message_type = getattr(message, "MSG_TYPE", BgpMessage.UPDATE_MESSAGE)
+        self.messages_sent_by_type[message_type] += 1
+        return self.packer.pack(message)
+
+    def send_buffer(self, buffer):
+        """Send all of buffer, carrying on after partial writes"""
+        view = memoryview(buffer)
+        while view:
+            sent = self.socket.send(view)
+            self.send_calls += 1
+            self.bytes_sent += sent
+            view = view[sent:]
+
+    def output_congested(self):
+        return self.output_messages.qsize() >= self.max_output_messages
+
+    def wait_for_output_space(self):
+        """Stop reading from a peer that is not keeping up with our output"""
+        if not self.output_congested():
+            return
+        self.output_pauses += 1
+        while self.output_congested():
+            sleep(self.OUTPUT_POLL_INTERVAL)
+
+    def send_stats(self):
+        return {
+            "bytes_sent": self.bytes_sent,
+            "messages_sent": self.messages_sent,
+            "send_calls": self.send_calls,
+            "output_pauses": self.output_pauses,
+            "bytes_per_send": (
+                self.bytes_sent / self.send_calls if self.send_calls else 0.0
+            ),
+            "messages_per_send": (
+                self.messages_sent / self.send_calls if self.send_calls else 0.0
+            ),
+        }
+
+    def counters(self):
+        return session_counters(
+            self, self.output_messages.qsize(), self.route_updates.qsize()
+        )
 
     def print_route_updates(self):
         while True:
             sleep(0)
-            route_update = self.state_machine.route_updates.get()
-            self.route_handler(route_update)
+            route_update = self.route_updates.get()
+            self.timed_call(self.route_handler, route_update)
+
+    def deliver_route_batches(self):
+        while True:
+            sleep(0)
+            self.timed_call(self.batch_route_handler, self.collect_route_batches())
+
+    def timed_call(self, handler, argument):
+        """Call a route handler, sampling how long it takes"""
+        if not self.handler_latency.sample():
+            handler(argument)
+            return
+        start = time.perf_counter()
+        handler(argument)
+        self.handler_latency.observe(time.perf_counter() - start)
+
+    def collect_route_batches(self):
+        """Block for one RouteBatch, then coalesce by count and time"""
+        route_updates = self.route_updates
+        batch = route_updates.get()
+        batches = [batch]
+        route_count = len(batch)
+        deadline = time.time() + self.batch_max_delay
+        while route_count < self.batch_max_routes:
+            timeout = deadline - time.time()
+            try:
+                if timeout > 0:
+                    batch = route_updates.get(timeout=timeout)
+                else:
+                    batch = route_updates.get_nowait()
+            except Empty:
+                break
+            batches.append(batch)
+            route_count += len(batch)
+        return batches
 
     def kick_timers(self):
         while True:
             sleep(1)
-            tick = int(time.time())
+            tick = time.time()
             try:
-                self.state_machine.event(EventTimerExpired(), tick)
+                self.handle_events([EventTimerExpired()], tick)
             except IdleError as e:
                 if self.error_handler:
                     self.error_handler("Peering %s: %s" % (self.peer_address, e))
                 self.shutdown()
                 break
 
+    def send_route_changes(self, route_changes, routes_version=None):
+        """Advertise RouteAdditions and withdraw RouteRemovals on this session"""
+        self.queue_output(
+            self.state_machine.advertise_route_changes(route_changes, routes_version),
+            [],
+        )
+        self.reschedule_timers()
+
+    def empty_route_queue(self):
+        route_updates = self.route_updates
+        if self.batch_route_handler:
+            batches = []
+            while route_updates.qsize():
+                batches.append(route_updates.get())
+            if batches:
+                self.batch_route_handler(batches)
+        else:
+            while route_updates.qsize():
+                self.route_handler(route_updates.get())
+
     def shutdown(self):
-        self.empty_message_queue()
-        for eventlet in self.eventlets:
-            eventlet.kill()
+        if self.timer_scheduler is not None:
+            self.timer_scheduler.cancel(self)
+        try:
+            self.queue_output([], self.state_machine.withdraw_all_routes())
+            self.empty_route_queue()
+            try:
+                self.empty_message_queue()
+            except OSError:
+                # the peer has gone, so the last messages cannot be sent
+                pass
+            self.diagnostics.flush()
+        finally:
+            for eventlet in self.eventlets:
+                eventlet.kill()
@@ -0,0 +1,397 @@
+"""Prefix tries and routing information bases"""
+
+from .ip import IP6Prefix, IP6Address, IPPrefix
+from .route import RouteAddition, RouteBatch
+
+
+class PrefixTrieNode:  # pylint: disable=too-few-public-methods
+    """A node in a path-compressed binary trie"""
+
+    __slots__ = ("key", "length", "prefix", "value", "left", "right")
+
+    def __init__(self, key, length, prefix=None, value=None):
+        self.key = key
+        self.length = length
+        self.prefix = prefix
+        self.value = value
+        self.left = None
+        self.right = None
+
+    def child(self, bit):
+        return self.right if bit else self.left
+
+    def set_child(self, bit, node):
+        if bit:
+            self.right = node
+        else:
+            self.left = node
+
+
+class PrefixTrie:
+    """A path-compressed (patricia) binary trie keyed on IP prefixes
+
+    Prefixes are keyed on their packed address bytes and prefix length, so
+    host bits beyond the prefix length are ignored.
+    """
+
+    def __init__(self, width):
+        self.width = width
+        self.root = None
+        self.size = 0
+
+    def key(self, prefix):
+        """Return the prefix bits as an integer, with host bits cleared"""
+
+        host_bits = self.width - prefix.length
+        return (int(prefix) >> host_bits) << host_bits
+
+    def bit(self, key, index):
+        """Return bit number index (counting from the top) of key"""
+
+        return (key >> (self.width - 1 - index)) & 1
+
+    def common_length(self, key, length, node):
+        """Return how many leading bits key/length shares with node"""
+
+        shortest = min(length, node.length)
+        difference = (key ^ node.key) >> (self.width - shortest)
+        return shortest - difference.bit_length()
+
+    def insert(self, prefix, value):
+        """Add or replace the value for a prefix"""
+
+        width = self.width
+        length = prefix.length
+        key = self.key(prefix)
+        parent = None
+        node = self.root
+
+        while node is not None:
+            node_length = node.length
+            shortest = length if length < node_length else node_length
+            difference = (key ^ node.key) >> (width - shortest)
+            if difference or length < node_length:
+                common = shortest - difference.bit_length()
+                self.split(parent, node, key, length, common, prefix, value)
+                self.size += 1
+                return
+            if node_length == length:
+                if node.prefix is None:
+                    self.size += 1
+                node.prefix = prefix
+                node.value = value
+                return
+            parent = node
+            node = node.right if (key >> (width - 1 - node_length)) & 1 else node.left
+
+        leaf = PrefixTrieNode(key, length, prefix, value)
+        self.replace_child(parent, None, leaf, key)
+        self.size += 1
+
+    def split(self, parent, node, key, length, common, prefix, value):
+        """Insert a new prefix above node, which it shares common bits with"""
+
+        if common == length:
+            branch = PrefixTrieNode(key, length, prefix, value)
+        else:
+            host_bits = self.width - common
+            branch = PrefixTrieNode((key >> host_bits) << host_bits, common)
+            leaf = PrefixTrieNode(key, length, prefix, value)
+            branch.set_child(self.bit(key, common), leaf)
+        branch.set_child(self.bit(node.key, common), node)
+        self.replace_child(parent, node, branch, key)
+
+    def replace_child(self, parent, old_node, new_node, key):
+        """Point the link that led to old_node at new_node instead"""
+
+        if parent is None:
+            self.root = new_node
+        else:
+            side = self.bit(key, parent.length)
+            assert parent.child(side) is old_node
+            parent.set_child(side, new_node)
+
+    def find_node(self, prefix):
+        """Return the list of nodes from the root to prefix's node"""
+
+        key = self.key(prefix)
+        length = prefix.length
+        path = []
+        node = self.root
+
+        while node is not None and node.length <= length:
+            if self.common_length(key, length, node) < node.length:
+                break
+            path.append(node)
+            if node.length == length:
+                return path
+            node = node.child(self.bit(key, node.length))
+
+        return None
+
+    def get(self, prefix, default=None):
+        """Return the value stored for exactly this prefix"""
+
+        path = self.find_node(prefix)
+        if path is None or path[-1].prefix is None:
+            return default
+        return path[-1].value
+
+    def __contains__(self, prefix):
+        path = self.find_node(prefix)
+        return path is not None and path[-1].prefix is not None
+
+    def delete(self, prefix):
+        """Remove a prefix, returning its value (or None if it was not found)"""
+
+        path = self.find_node(prefix)
+        if path is None or path[-1].prefix is None:
+            return None
+
+        node = path.pop()
+        value = node.value
+        node.prefix = None
+        node.value = None
+        self.size -= 1
+
+        # prune nodes that no longer hold a prefix or separate two branches
+        while node is not None and node.prefix is None:
+            parent = path.pop() if path else None
+            if node.left is not None and node.right is not None:
+                break
+            replacement = node.left if node.left is not None else node.right
+            self.replace_child(parent, node, replacement, node.key)
+            node = parent
+
+        return value
+
+    def nodes(self, root=None):
+        """Yield the nodes holding prefixes, in address order"""
+
+        if root is None:
+            root = self.root
+        stack = [root] if root is not None else []
+        while stack:
+            node = stack.pop()
+            if node.prefix is not None:
+                yield node
+            if node.right is not None:
+                stack.append(node.right)
+            if node.left is not None:
+                stack.append(node.left)
+
+    def search_key(self, item):
+        """Return the (key, length) to search for an address or a prefix"""
+
+        if isinstance(item, IPPrefix):
+            return self.key(item), item.length
+        return int(item), self.width
+
+    def longest_match(self, item):
+        """Return the (prefix, value) of the most specific prefix covering an
+        address or prefix, or None if nothing covers it"""
+
+        key, length = self.search_key(item)
+        width = self.width
+        best = None
+        node = self.root
+
+        while node is not None:
+            node_length = node.length
+            if node_length > length or (key ^ node.key) >> (width - node_length):
+                break
+            if node.prefix is not None:
+                best = node
+            if node_length == length:
+                break
+            node = node.right if (key >> (width - 1 - node_length)) & 1 else node.left
+
+        if best is None:
+            return None
+        return best.prefix, best.value
+
+    def covering(self, item):
+        """Yield (prefix, value) for every prefix that covers an address or
+        prefix, least specific first"""
+
+        key, length = self.search_key(item)
+        width = self.width
+        node = self.root
+
+        while node is not None:
+            node_length = node.length
+            if node_length > length or (key ^ node.key) >> (width - node_length):
+                break
+            if node.prefix is not None:
+                yield node.prefix, node.value
+            if node_length == length:
+                break
+            node = node.right if (key >> (width - 1 - node_length)) & 1 else node.left
+
+    def covered(self, prefix):
+        """Yield (prefix, value) for prefix and every more specific prefix
+        within it, in address order"""
+
+        key = self.key(prefix)
+        length = prefix.length
+        width = self.width
+        node = self.root
+
+        while node is not None:
+            if node.length >= length:
+                # node sits at or below prefix's depth: it is inside prefix
+                # if it shares prefix's leading bits
+                if (key ^ node.key) >> (width - length) == 0:
+                    for found in self.nodes(node):
+                        yield found.prefix, found.value
+                return
+            if (key ^ node.key) >> (width - node.length):
+                return
+            node = node.child(self.bit(key, node.length))
+
+    def items(self):
+        for node in self.nodes():
+            yield node.prefix, node.value
+
+    def prefixes(self):
+        for node in self.nodes():
+            yield node.prefix
+
+    def values(self):
+        for node in self.nodes():
+            yield node.value
+
+    def __iter__(self):
+        return self.prefixes()
+
+    def __len__(self):
+        return self.size
+
+    def clear(self):
+        self.root = None
+        self.size = 0
+
+
+class AdjRibIn:
+    """The routes received from one peer, before any policy is applied
+
+    Used to suppress announcements that do not change anything and to
+    synthesise withdrawals when the session goes down.
+    """
+
+    def __init__(self):
+        self.ipv4 = PrefixTrie(32)
+        self.ipv6 = PrefixTrie(128)
+
+    def table(self, prefix):
+        if isinstance(prefix, IP6Prefix):
+            return self.ipv6
+        return self.ipv4
+
+    def add(self, prefix, attributes):
+        """Store a route, returning True if it is new or its attributes changed"""
+
+        table = self.table(prefix)
+        existing = table.get(prefix)
+        if existing is not None and existing == attributes:
+            return False
+        table.insert(prefix, attributes)
+        return True
+
+    def remove(self, prefix):
+        """Remove a route, returning True if it was present"""
+
+        return self.table(prefix).delete(prefix) is not None
+
+    def get(self, prefix):
+        return self.table(prefix).get(prefix)
+
+    def withdraw_all(self):
+        """Empty the RIB, returning the (ipv4, ipv6) prefixes it held"""
+
+        ipv4_prefixes = list(self.ipv4.prefixes())
+        ipv6_prefixes = list(self.ipv6.prefixes())
+        self.ipv4.clear()
+        self.ipv6.clear()
+        return ipv4_prefixes, ipv6_prefixes
+
+    def __len__(self):
+        return len(self.ipv4) + len(self.ipv6)
+
+
+class RouteTable:
+    """A longest-prefix-match table of received routes for IPv4 and IPv6
+
+    Pass apply as a Beka route_handler, or apply_batches as a
+    batch_route_handler, to keep the table in step with a peer.
+    """
+
+    def __init__(self):
+        self.ipv4 = PrefixTrie(32)
+        self.ipv6 = PrefixTrie(128)
+
+    def table(self, item):
+        if isinstance(item, (IP6Prefix, IP6Address)):
+            return self.ipv6
+        return self.ipv4
+
+    def apply(self, route_update):
+        """Apply a RouteAddition, RouteRemoval or RouteBatch"""
+
+        if isinstance(route_update, RouteBatch):
+            self.apply_batch(route_update)
+        elif isinstance(route_update, RouteAddition):
+            self.insert(route_update.prefix, route_update)
+        else:
+            self.delete(route_update.prefix)
+
+    def apply_batch(self, batch):
+        for prefix in batch.withdrawals:
+            self.delete(prefix)
+        for route in batch.additions():
+            self.insert(route.prefix, route)
+
+    def apply_batches(self, batches):
+        for batch in batches:
+            self.apply_batch(batch)
+
+    def insert(self, prefix, route):
+        self.table(prefix).insert(prefix, route)
+
+    def delete(self, prefix):
+        """Remove a prefix, returning its route (or None if it was not found)"""
+
+        return self.table(prefix).delete(prefix)
+
+    def get(self, prefix):
+        """Return the route for exactly this prefix"""
+
+        return self.table(prefix).get(prefix)
+
+    def lookup(self, item):
+        """Return the route for the most specific prefix covering an address
+        or prefix, or None"""
+
+        match = self.table(item).longest_match(item)
+        if match is None:
+            return None
+        return match[1]
+
+    def covering(self, item):
+        """Yield routes for prefixes covering an address or prefix"""
+
+        for _prefix, route in self.table(item).covering(item):
+            yield route
+
+    def covered(self, prefix):
+        """Yield routes for prefix and every more specific prefix within it"""
+
+        for _prefix, route in self.table(prefix).covered(prefix):
+            yield route
+
+    def __iter__(self):
+        yield from self.ipv4.values()
+        yield from self.ipv6.values()
+
+    def __len__(self):
+        return len(self.ipv4) + len(self.ipv6)
@@ -1,10 +1,95 @@
-class RouteAddition:
-    def __init__(self, prefix, next_hop, as_path, origin):
-        self.prefix = prefix
+import weakref
+
+from .as_path import AsPath
+
+
+class PathAttributes:
+    """Immutable path attributes, shared by every route learned from an UPDATE
+
+    Use PathAttributes.intern() so that identical attributes received in
+    different UPDATEs (or from different peers) resolve to one object. A
+    string as_path is parsed into an AsPath.
+    """
+
+    __slots__ = ("next_hop", "as_path", "origin", "_hash", "__weakref__")
+
+    _interned = weakref.WeakValueDictionary()
+
+    def __init__(self, next_hop, as_path, origin):
+        as_path = AsPath.coerce(as_path)
         self.next_hop = next_hop
         self.as_path = as_path
         self.origin = origin
-        self.is_withdraw = False
+        # set last, as it marks the object as complete
+        self._hash = hash((next_hop, as_path, origin))
+
+    @classmethod
+    def intern(cls, next_hop, as_path, origin):
+        # an AsPath equals its string form, so a str key would find (or
+        # become) attributes holding a different type
+        as_path = AsPath.coerce(as_path)
+        key = (next_hop, as_path, origin)
+        attributes = cls._interned.get(key)
+        if attributes is None:
+            attributes = cls(next_hop, as_path, origin)
+            cls._interned[key] = attributes
+        return attributes
+
+    def __setattr__(self, name, value):
+        if hasattr(self, "_hash"):
+            raise AttributeError("PathAttributes are immutable")
+        object.__setattr__(self, name, value)
+
+    def __delattr__(self, name):
+        raise AttributeError("PathAttributes are immutable")
+
+    def __hash__(self):
+        return self._hash
+
+    def __eq__(self, other):
+        if self is other:
+            return True
+        if not isinstance(other, PathAttributes):
+            return NotImplemented
+        return (
+            self._hash == other._hash
+            and self.next_hop == other.next_hop
+            and self.as_path == other.as_path
+            and self.origin == other.origin
+        )
+
+    def __str__(self):
+        return "via %s (%s) %s" % (self.next_hop, self.as_path, self.origin)
+
+
+class RouteAddition:
+    __slots__ = ("prefix", "attributes")
+
+    is_withdraw = False
+
+    def __init__(self, prefix, next_hop, as_path, origin):
+        self.prefix = prefix
+        self.attributes = PathAttributes.intern(next_hop, as_path, origin)
+
+    @classmethod
+    def from_attributes(cls, prefix, attributes):
+        """Build a route that shares an existing PathAttributes object"""
+        route = cls.__new__(cls)
+        route.prefix = prefix
+        route.attributes = attributes
+        return route
+
+    @property
+    def next_hop(self):
+        return self.attributes.next_hop
+
+    @property
+    def as_path(self):
+        return self.attributes.as_path
+
+    @property
+    def origin(self):
+        return self.attributes.origin
 
     def __str__(self):
         return "%s via %s (%s) %s" % (
@@ -15,22 +100,80 @@ class RouteAddition:
         )
 
     def __eq__(self, other):
-        return (
-            self.prefix == other.prefix
-            and self.next_hop == other.next_hop
-            and self.as_path == other.as_path
-            and self.origin == other.origin
-        )
+        if not isinstance(other, RouteAddition):
+            return False
+        return self.prefix == other.prefix and self.attributes == other.attributes
 
 
 class RouteRemoval:
+    __slots__ = ("prefix",)
+
+    next_hop = None
+    is_withdraw = True
+
     def __init__(self, prefix):
         self.prefix = prefix
-        self.next_hop = None
-        self.is_withdraw = True
 
     def __str__(self):
         return str(self.prefix)
 
     def __eq__(self, other):
         return self.prefix == other.prefix
+
+
+class RouteBatch:
+    """The routes carried by one UPDATE, sharing a single set of path attributes
+
+    The IPv4 NLRI and the MP_REACH_NLRI of an UPDATE have different next
+    hops, so an UPDATE carrying both gives two batches, the IPv4 one first.
+    """
+
+    __slots__ = ("prefixes", "withdrawals", "attributes")
+
+    def __init__(self, prefixes, withdrawals, attributes=None):
+        self.prefixes = prefixes
+        self.withdrawals = withdrawals
+        self.attributes = attributes
+
+    @property
+    def next_hop(self):
+        return self.attributes.next_hop if self.attributes else None
+
+    @property
+    def as_path(self):
+        return self.attributes.as_path if self.attributes else None
+
+    @property
+    def origin(self):
+        return self.attributes.origin if self.attributes else None
+
+    def additions(self):
+        for prefix in self.prefixes:
+            yield RouteAddition.from_attributes(prefix, self.attributes)
+
+    def removals(self):
+        for prefix in self.withdrawals:
+            yield RouteRemoval(prefix)
+
+    def __iter__(self):
+        yield from self.additions()
+        yield from self.removals()
+
+    def __len__(self):
+        return len(self.prefixes) + len(self.withdrawals)
+
+    def __str__(self):
+        return "%d routes via %s (%s) %s, %d withdrawals" % (
+            len(self.prefixes),
+            self.next_hop,
+            self.as_path,
+            self.origin,
+            len(self.withdrawals),
+        )
+
+    def __eq__(self, other):
+        return (
+            self.prefixes == other.prefixes
+            and self.withdrawals == other.withdrawals
+            and self.attributes == other.attributes
+        )
@@ -0,0 +1,491 @@
+"""Run passive peerings in several worker processes
+
+ShardedBeka accepts connections on the BGP port itself, checks them against
+its neighbors and passes each socket to the least busy of its worker
+processes with multiprocessing.reduction.send_handle. Every worker runs an
+ordinary Beka on its own eventlet hub, so a peer sending a full table only
+slows down the peers that share its worker.
+
+Received routes come back to the supervisor over a pipe as compact binary
+frames (see encode_route_batches) and are passed to the route handlers
+there, in the supervisor process. Each worker also sends the neighbor
+states of its peerings every STATES_INTERVAL seconds, which the
+supervisor's neighbor_states() returns.
+"""
+
+from collections import OrderedDict
+import json
+import multiprocessing
+from multiprocessing.reduction import recv_handle, send_handle
+import os
+import socket
+import struct
+
+from eventlet import sleep, spawn
+from eventlet.green import select
+from eventlet.greenio import GreenSocket
+from eventlet.hubs import trampoline
+
+from .as_path import AsPath
+from .beka import Beka, DEFAULT_BGP_PORT
+from .bgp_message import pack_prefix, unpack_prefixes
+from .bgp_message import IP4_LENGTH, IP6_LENGTH
+from .ip import IPAddress, IPPrefix
+from .ip import IP4Address, IP6Address, IP4Prefix, IP6Prefix
+from .route import PathAttributes, RouteAddition, RouteBatch, RouteRemoval
+
+# frames sent from a worker to the supervisor
+ROUTES = 1
+PEER_UP = 2
+PEER_DOWN = 3
+ERROR = 4
+STATES = 8
+
+# frames sent from the supervisor to a worker
+CONNECTION = 5
+ORIGINATE = 6
+SHUTDOWN = 7
+
+ORIGINS = ("IGP", "EGP", "INCOMPLETE")
+ORIGIN_NUMBERS = {origin: number for number, origin in enumerate(ORIGINS)}
+
+PREFIXES_HEADER = struct.Struct("!II")
+PEER_HEADER = struct.Struct("!I")
+
+
+def pack_prefixes(prefixes):
+    packed = []
+    for prefix in prefixes:
+        packed.append(bytes((prefix.length,)))
+        packed.append(pack_prefix(prefix.prefix, prefix.length))
+    return b"".join(packed)
+
+
+def encode_prefixes(prefixes):
+    """Pack prefixes as NLRI, IPv4 first then IPv6, each after its length"""
+    ipv4 = pack_prefixes(prefix for prefix in prefixes if prefix.VERSION == 4)
+    ipv6 = pack_prefixes(prefix for prefix in prefixes if prefix.VERSION == 6)
+    return PREFIXES_HEADER.pack(len(ipv4), len(ipv6)) + ipv4 + ipv6
+
+
+def decode_prefixes(view, offset):
+    ipv4_length, ipv6_length = PREFIXES_HEADER.unpack_from(view, offset)
+    offset += PREFIXES_HEADER.size
+    end = offset + ipv4_length
+    prefixes = unpack_prefixes(view, offset, end, IP4Prefix, IP4_LENGTH)
+    offset, end = end, end + ipv6_length
+    prefixes += unpack_prefixes(view, offset, end, IP6Prefix, IP6_LENGTH)
+    return prefixes, end
+
+
+def encode_attributes(attributes):
+    if attributes is None:
+        return b"\x00"
+    as_path = AsPath.coerce(attributes.as_path).pack(4)
+    next_hop = attributes.next_hop.address
+    return b"".join(
+        (
+            bytes((len(next_hop), ORIGIN_NUMBERS[attributes.origin])),
+            next_hop,
+            struct.pack("!H", len(as_path)),
+            as_path,
+        )
+    )
+
+
+def decode_attributes(view, offset):
+    next_hop_length = view[offset]
+    if not next_hop_length:
+        return None, offset + 1
+    origin = ORIGINS[view[offset + 1]]
+    offset += 2
+    next_hop = view[offset : offset + next_hop_length].tobytes()
+    offset += next_hop_length
+    if next_hop_length == IP4_LENGTH:
+        next_hop = IP4Address(next_hop)
+    else:
+        next_hop = IP6Address(next_hop)
+    (as_path_length,) = struct.unpack_from("!H", view, offset)
+    offset += 2
+    as_path = AsPath.unpack(view[offset : offset + as_path_length], 4)
+    offset += as_path_length
+    return PathAttributes.intern(next_hop, as_path, origin), offset
+
+
+def as_route_batches(route_updates):
+    """Turn a list of RouteBatches, RouteAdditions and RouteRemovals into
+    RouteBatches"""
+    batches = []
+    for route_update in route_updates:
+        if isinstance(route_update, RouteBatch):
+            batches.append(route_update)
+        elif route_update.is_withdraw:
+            batches.append(RouteBatch([], [route_update.prefix]))
+        else:
+            batches.append(
+                RouteBatch([route_update.prefix], [], route_update.attributes)
+            )
+    return batches
+
+
+def encode_route_batches(batches):
+    """Pack RouteBatches (or single route updates) into one binary frame
+
+    Prefixes are packed as BGP NLRI and path attributes once per batch, so
+    a frame is a little smaller than the UPDATEs the routes arrived in.
+    """
+    encoded = []
+    for batch in as_route_batches(batches):
+        encoded.append(encode_attributes(batch.attributes))
+        encoded.append(encode_prefixes(batch.prefixes))
+        encoded.append(encode_prefixes(batch.withdrawals))
+    return b"".join(encoded)
+
+
+def decode_route_batches(data):
+    """Unpack a frame made by encode_route_batches into RouteBatches"""
+    view = memoryview(data)
+    batches = []
+    offset = 0
+    while offset < len(view):
+        attributes, offset = decode_attributes(view, offset)
+        prefixes, offset = decode_prefixes(view, offset)
+        withdrawals, offset = decode_prefixes(view, offset)
+        batches.append(RouteBatch(prefixes, withdrawals, attributes))
+    return batches
+
+
+def encode_peer(peer_ip, peer_as):
+    return PEER_HEADER.pack(peer_as) + peer_ip.encode()
+
+
+def decode_peer(data):
+    (peer_as,) = PEER_HEADER.unpack_from(data)
+    return bytes(data[PEER_HEADER.size :]).decode(), peer_as
+
+
+def encode_states(states):
+    return json.dumps(states).encode()
+
+
+def decode_states(data):
+    return [(peer_address, state) for peer_address, state in json.loads(bytes(data))]
+
+
+class ShardWorker:
+    """The Beka running in one worker process, and its pipes to the supervisor"""
+
+    def __init__(self, control, updates, config):
+        self.control = control
+        self.updates = updates
+        self.beka = Beka(
+            config["local_address"],
+            config["bgp_port"],
+            config["local_as"],
+            config["router_id"],
+            self.peer_up_handler,
+            self.peer_down_handler,
+            None,
+            self.error_handler,
+            batch_route_handler=self.batch_route_handler,
+            batch_max_routes=config["batch_max_routes"],
+            batch_max_delay=config["batch_max_delay"],
+            adj_rib_in=config["adj_rib_in"],
+        )
+        for peer_ip, peer_as in config["peers"]:
+            self.beka.add_neighbor("passive", peer_ip, peer_as)
+        self.originate(config["routes"])
+        self.states_interval = config["states_interval"]
+
+    def send(self, frame_type, payload):
+        self.updates.send_bytes(bytes((frame_type,)) + payload)
+
+    def peer_up_handler(self, peer_ip, peer_as):
+        self.send(PEER_UP, encode_peer(peer_ip, peer_as))
+
+    def peer_down_handler(self, peer_ip, peer_as):
+        self.send(PEER_DOWN, encode_peer(peer_ip, peer_as))
+
+    def error_handler(self, msg):
+        self.send(ERROR, msg.encode())
+
+    def batch_route_handler(self, batches):
+        self.send(ROUTES, encode_route_batches(batches))
+
+    def send_states(self):
+        while True:
+            sleep(self.states_interval)
+            self.send(STATES, encode_states(self.beka.neighbor_states()))
+
+    def originate(self, data):
+        for batch in decode_route_batches(data):
+            self.beka.withdraw_routes([str(prefix) for prefix in batch.withdrawals])
+            self.beka.add_routes(
+                [(str(prefix), str(batch.next_hop)) for prefix in batch.prefixes]
+            )
+
+    def accept(self):
+        # the socket follows straight after the CONNECTION frame
+        fd = recv_handle(self.control)
+        sock = GreenSocket(socket.socket(fileno=fd))
+        spawn(self.beka.handle, sock, sock.getpeername())
+
+    def run(self):
+        self.beka.timer_greenlet = spawn(self.beka.timer_scheduler.run)
+        states_greenlet = spawn(self.send_states)
+        while True:
+            trampoline(self.control.fileno(), read=True)
+            try:
+                frame = self.control.recv_bytes()
+            except EOFError:
+                break
+            frame_type = frame[0]
+            if frame_type == CONNECTION:
+                self.accept()
+            elif frame_type == ORIGINATE:
+                self.originate(frame[1:])
+            elif frame_type == SHUTDOWN:
+                break
+        states_greenlet.kill()
+        self.beka.shutdown()
+
+
+def run_worker(control, updates, config):
+    """The entry point of a worker process"""
+    ShardWorker(control, updates, config).run()
+
+
+class Shard:  # pylint: disable=too-few-public-methods
+    """The supervisor's handle on one worker process"""
+
+    def __init__(self, process, control, updates):
+        self.process = process
+        self.control = control
+        self.updates = updates
+        self.sessions = 0
+        # (peer address, {"info": ...}) as last sent by the worker
+        self.states = []
+
+
+class ShardedBeka:
+    """A Beka that spreads its passive peerings over several processes
+
+    Takes the same arguments as Beka, plus the number of worker processes
+    (one per CPU by default). Route handlers are called in this process.
+    neighbor_states() returns the states the workers last sent, which are
+    up to STATES_INTERVAL seconds old.
+    """
+
+    POLL_INTERVAL = 0.5
+    STATES_INTERVAL = 1.0
+
+    def __init__(
+        self,
+        local_address,
+        bgp_port,
+        local_as,
+        router_id,
+        peer_up_handler,
+        peer_down_handler,
+        route_handler,
+        error_handler,
+        batch_route_handler=None,
+        batch_max_routes=10000,
+        batch_max_delay=0.1,
+        adj_rib_in=False,
+        workers=None,
+    ):
+        self.local_address = local_address
+        self.bgp_port = bgp_port or DEFAULT_BGP_PORT
+        self.local_as = local_as
+        self.router_id = router_id
+        self.peer_up_handler = peer_up_handler
+        self.peer_down_handler = peer_down_handler
+        self.route_handler = route_handler
+        self.error_handler = error_handler
+        self.batch_route_handler = batch_route_handler
+        self.batch_max_routes = batch_max_routes
+        self.batch_max_delay = batch_max_delay
+        self.adj_rib_in = adj_rib_in
+        self.workers = workers or os.cpu_count() or 1
+
+        self.peers = {}
+        self.routes = OrderedDict()
+        self.shards = []
+        self.server = None
+        self.running = False
+
+    def add_neighbor(self, connect_mode, peer_ip, peer_as):
+        if connect_mode != "passive":
+            raise ValueError("Only passive BGP supported")
+        if peer_ip in self.peers:
+            raise ValueError("Peer already added: %s %d" % (peer_ip, peer_as))
+
+        self.peers[peer_ip] = {"peer_ip": peer_ip, "peer_as": peer_as}
+
+    def add_route(self, prefix, next_hop):
+        self.add_routes([(prefix, next_hop)])
+
+    def add_routes(self, routes):
+        """Originate (prefix, next_hop) routes on every worker"""
+        route_updates = []
+        for prefix, next_hop in routes:
+            route = RouteAddition(
+                IPPrefix.from_string(prefix),
+                IPAddress.from_string(next_hop),
+                AsPath.from_sequence([]),
+                "IGP",
+            )
+            self.routes[route.prefix] = route
+            route_updates.append(route)
+        self.originate(route_updates)
+
+    def withdraw_route(self, prefix):
+        self.withdraw_routes([prefix])
+
+    def withdraw_routes(self, prefixes):
+        route_updates = []
+        for prefix in prefixes:
+            prefix = IPPrefix.from_string(prefix)
+            if self.routes.pop(prefix, None) is not None:
+                route_updates.append(RouteRemoval(prefix))
+        self.originate(route_updates)
+
+    def originate(self, route_updates):
+        """Pass changes to the originated routes on to every worker"""
+        if not route_updates:
+            return
+        frame = bytes((ORIGINATE,)) + encode_route_batches(route_updates)
+        for shard in self.shards:
+            shard.control.send_bytes(frame)
+
+    def config(self):
+        return {
+            "local_address": self.local_address,
+            "bgp_port": self.bgp_port,
+            "local_as": self.local_as,
+            "router_id": self.router_id,
+            "peers": [
+                (peer["peer_ip"], peer["peer_as"]) for peer in self.peers.values()
+            ],
+            "routes": encode_route_batches(list(self.routes.values())),
+            "batch_max_routes": self.batch_max_routes,
+            "batch_max_delay": self.batch_max_delay,
+            "adj_rib_in": self.adj_rib_in,
+            "states_interval": self.STATES_INTERVAL,
+        }
+
+    def start(self):
+        """Listen on the BGP port and start the worker processes"""
+        family = socket.AF_INET6 if ":" in self.local_address else socket.AF_INET
+        self.server = socket.socket(family, socket.SOCK_STREAM)
+        self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server.bind((self.local_address, self.bgp_port))
+        self.server.listen(128)
+        self.server.setblocking(False)
+
+        context = multiprocessing.get_context("spawn")
+        config = self.config()
+        for _ in range(self.workers):
+            control, worker_control = context.Pipe()
+            updates, worker_updates = context.Pipe(duplex=False)
+            process = context.Process(
+                target=run_worker,
+                args=(worker_control, worker_updates, config),
+                daemon=True,
+            )
+            process.start()
+            worker_control.close()
+            worker_updates.close()
+            self.shards.append(Shard(process, control, updates))
+        self.running = True
+
+    def run(self):
+        if self.server is None:
+            self.start()
+        while self.running:
+            readers = [self.server] + [shard.updates for shard in self.shards]
+            ready, _, _ = select.select(readers, [], [], self.POLL_INTERVAL)
+            for reader in ready:
+                if reader is self.server:
+                    self.accept()
+                else:
+                    self.receive(reader)
+        self.stop_workers()
+
+    def accept(self):
+        try:
+            sock, address = self.server.accept()
+        except (BlockingIOError, OSError):
+            return
+        with sock:
+            if address[0] not in self.peers:
+                if self.error_handler:
+                    self.error_handler("Rejecting connection from %s:%d" % address[:2])
+                return
+            if not self.shards:
+                return
+            shard = min(self.shards, key=lambda shard: shard.sessions)
+            shard.sessions += 1
+            shard.control.send_bytes(bytes((CONNECTION,)))
+            send_handle(shard.control, sock.fileno(), shard.process.pid)
+
+    def receive(self, updates):
+        shard = next(shard for shard in self.shards if shard.updates is updates)
+        try:
+            frame = updates.recv_bytes()
+        except EOFError:
+            self.shards.remove(shard)
+            if self.error_handler:
+                self.error_handler("Worker %d exited" % shard.process.pid)
+            return
+        frame_type = frame[0]
+        payload = memoryview(frame)[1:]
+        if frame_type == ROUTES:
+            self.deliver_routes(decode_route_batches(payload))
+        elif frame_type == PEER_UP:
+            if self.peer_up_handler:
+                self.peer_up_handler(*decode_peer(payload))
+        elif frame_type == PEER_DOWN:
+            shard.sessions -= 1
+            peer_ip, peer_as = decode_peer(payload)
+            shard.states = [state for state in shard.states if state[0] != peer_ip]
+            if self.peer_down_handler:
+                self.peer_down_handler(peer_ip, peer_as)
+        elif frame_type == ERROR:
+            if self.error_handler:
+                self.error_handler(bytes(payload).decode())
+        elif frame_type == STATES:
+            shard.states = decode_states(payload)
+
+    def deliver_routes(self, batches):
+        if self.batch_route_handler:
+            self.batch_route_handler(batches)
+        elif self.route_handler:
+            for batch in batches:
+                for route_update in batch:
+                    self.route_handler(route_update)
+
+    def neighbor_states(self):
+        return [state for shard in self.shards for state in shard.states]
+
+    def stop_workers(self):
+        for shard in self.shards:
+            try:
+                shard.control.send_bytes(bytes((SHUTDOWN,)))
+            except OSError:
+                pass
+        for shard in self.shards:
+            shard.process.join(timeout=5)
+            if shard.process.is_alive():
+                shard.process.terminate()
+        self.shards = []
+        if self.server is not None:
+            self.server.close()
+            self.server = None
+
+    def shutdown(self):
+        self.running = False
+
+    def listening_on(self, address, port):
+        return self.local_address == address and self.bgp_port == port
@@ -1,18 +1,27 @@
-from eventlet.queue import Queue
 from collections import OrderedDict
+import math
 
 from .event import Event
 from .bgp_message import BgpMessage, BgpOpenMessage, BgpUpdateMessage
 from .bgp_message import BgpKeepaliveMessage, BgpNotificationMessage
-from .route import RouteAddition, RouteRemoval
+from .bgp_message import UpdateMessageBuilder, TREAT_AS_WITHDRAW
+from .route import PathAttributes, RouteAddition, RouteRemoval, RouteBatch
 from .ip import IPAddress, IPPrefix
 from .ip import IP4Address, IP4Prefix
 from .ip import IP6Address, IP6Prefix
+from .rib import AdjRibIn
 from .timer import Timer
 from .error import IdleError
 
 
 class StateMachine:
+    """The BGP finite state machine for one session, without any I/O
+
+    Each call to event() returns the messages to send to the peer and the
+    route updates for the application as lists. Sockets, queues and timers
+    belong to whatever drives the state machine, such as Peering.
+    """
+
     DEFAULT_HOLD_TIME = 240
     DEFAULT_KEEPALIVE_TIME = DEFAULT_HOLD_TIME // 3
 
@@ -25,6 +34,8 @@ class StateMachine:
         neighbor,
         hold_time=DEFAULT_HOLD_TIME,
         open_handler=None,
+        batch_route_updates=False,
+        adj_rib_in=False,
     ):
         self.local_as = local_as
         if local_as > 65535:
@@ -37,12 +48,27 @@ class StateMachine:
         self.neighbor = IPAddress.from_string(neighbor)
         self.hold_time = hold_time
         self.open_handler = open_handler
+        self.batch_route_updates = batch_route_updates
+        self.adj_rib_in = AdjRibIn() if adj_rib_in else None
 
-        self.keepalive_time = hold_time // 3
-        self.output_messages = Queue()
-        self.route_updates = Queue()
+        # a float hold_time gives sub-second timers, eg for tests
+        if isinstance(hold_time, float):
+            self.keepalive_time = hold_time / 3
+        else:
+            self.keepalive_time = hold_time // 3
+        self.output_messages = []
+        self.route_updates = []
         self.routes_to_advertise = []
+        self.routes_version = 0
+        self.update_cache = None
         self.fourbyteas = False
+        self.max_message_length = BgpMessage.MAX_LENGTH
+        self.ipv4_prefixes_accepted = 0
+        self.ipv6_prefixes_accepted = 0
+        self.ipv4_prefixes_withdrawn = 0
+        self.ipv6_prefixes_withdrawn = 0
+        self.updates_treated_as_withdraw = 0
+        self.attributes_discarded = 0
 
         self.timers = {
             "hold": Timer(self.hold_time),
@@ -50,24 +76,47 @@ class StateMachine:
         }
         self.state = "active"
 
-    def event(self, event, tick):
+    def event(self, event, tick, output_messages=None, route_updates=None):
+        """Handle an event, returning (output_messages, route_updates)
+
+        Messages and route updates are appended to the lists passed in, or
+        to new lists. If the session goes idle, IdleError is raised and
+        whatever was produced first (such as a NOTIFICATION) is left in the
+        lists passed in, and in the output_messages and route_updates
+        attributes.
+        """
+        self.use_buffers(output_messages, route_updates)
         if event.type == Event.TIMER_EXPIRED:
             self.handle_timers(tick)
         elif event.type == Event.MESSAGE_RECEIVED:
             self.handle_message(event.message, tick)
         elif event.type == Event.SHUTDOWN:
             self.handle_shutdown()
+        return self.output_messages, self.route_updates
+
+    def use_buffers(self, output_messages=None, route_updates=None):
+        self.output_messages = [] if output_messages is None else output_messages
+        self.route_updates = [] if route_updates is None else route_updates
 
     def handle_shutdown(self):
         if self.state == "open_confirm" or self.state == "established":
             notification_message = BgpNotificationMessage(BgpNotificationMessage.CEASE)
-            self.output_messages.put(notification_message)
+            self.output_messages.append(notification_message)
         self.shutdown("Shutdown requested")
 
     def shutdown(self, message):
         self.state = "idle"
         raise IdleError("State machine stopping: %s" % message)
 
+    def next_deadline(self):
+        """Return the tick at which a timer next expires, or None"""
+        deadlines = [
+            deadline
+            for deadline in (timer.deadline() for timer in self.timers.values())
+            if deadline is not None
+        ]
+        return min(deadlines) if deadlines else None
+
     def handle_timers(self, tick):
         if self.timers["hold"].expired(tick):
             self.handle_hold_timer()
@@ -78,13 +127,13 @@ class StateMachine:
         notification_message = BgpNotificationMessage(
             BgpNotificationMessage.HOLD_TIMER_EXPIRED
         )
-        self.output_messages.put(notification_message)
+        self.output_messages.append(notification_message)
         self.shutdown("Hold timer expired")
 
     def handle_keepalive_timer(self, tick):
         self.timers["keepalive"].reset(tick)
         message = BgpKeepaliveMessage()
-        self.output_messages.put(message)
+        self.output_messages.append(message)
 
     def handle_message(self, message, tick):  # state machine
         if self.state == "active":
@@ -101,11 +150,16 @@ class StateMachine:
             # TODO sanity check incoming open message
             if "fourbyteas" in message.capabilities:
                 self.fourbyteas = message.capabilities["fourbyteas"]
+            if "extendedmessage" in message.capabilities:
+                self.max_message_length = BgpMessage.EXTENDED_MAX_LENGTH
 
             if self.open_handler:
                 self.open_handler(message.capabilities)
 
-            capabilities = {"fourbyteas": [self.local_as]}
+            capabilities = {
+                "fourbyteas": [self.local_as],
+                "extendedmessage": [True],
+            }
             ipv4_capabilities = {"multiprotocol": ["ipv4-unicast"]}
             ipv6_capabilities = {"multiprotocol": ["ipv6-unicast"]}
             if isinstance(self.local_address, IP4Address):
@@ -113,11 +167,15 @@ class StateMachine:
             elif isinstance(self.local_address, IP6Address):
                 capabilities.update(ipv6_capabilities)
             open_message = BgpOpenMessage(
-                4, self.local_as2, self.hold_time, self.router_id, capabilities
+                4,
+                self.local_as2,
+                math.ceil(self.hold_time),
+                self.router_id,
+                capabilities,
             )
             keepalive_message = BgpKeepaliveMessage()
-            self.output_messages.put(open_message)
-            self.output_messages.put(keepalive_message)
+            self.output_messages.append(open_message)
+            self.output_messages.append(keepalive_message)
             self.timers["hold"].reset(tick)
             self.timers["keepalive"].reset(tick)
             self.state = "open_confirm"
@@ -129,11 +187,16 @@ class StateMachine:
             # TODO sanity check incoming open message
             if "fourbyteas" in message.capabilities:
                 self.fourbyteas = message.capabilities["fourbyteas"]
+            if "extendedmessage" in message.capabilities:
+                self.max_message_length = BgpMessage.EXTENDED_MAX_LENGTH
 
             if self.open_handler:
                 self.open_handler(message.capabilities)
 
-            capabilities = {"fourbyteas": [self.local_as]}
+            capabilities = {
+                "fourbyteas": [self.local_as],
+                "extendedmessage": [True],
+            }
             ipv4_capabilities = {"multiprotocol": ["ipv4-unicast"]}
             ipv6_capabilities = {"multiprotocol": ["ipv6-unicast"]}
             if isinstance(self.local_address, IP4Address):
@@ -141,7 +204,7 @@ class StateMachine:
             elif isinstance(self.local_address, IP6Address):
                 capabilities.update(ipv6_capabilities)
             keepalive_message = BgpKeepaliveMessage()
-            self.output_messages.put(keepalive_message)
+            self.output_messages.append(keepalive_message)
             self.timers["hold"].reset(tick)
             self.timers["keepalive"].reset(tick)
             self.state = "open_confirm"
@@ -151,7 +214,7 @@ class StateMachine:
     def handle_message_open_confirm_state(self, message, tick):
         if isinstance(message, BgpKeepaliveMessage):
             for message in self.build_update_messages():
-                self.output_messages.put(message)
+                self.output_messages.append(message)
             self.timers["hold"].reset(tick)
             self.timers["keepalive"].reset(tick)
             self.state = "established"
@@ -159,13 +222,13 @@ class StateMachine:
             self.shutdown("Notification message received %s" % str(message))
         elif isinstance(message, BgpOpenMessage):
             notification_message = BgpNotificationMessage(BgpNotificationMessage.CEASE)
-            self.output_messages.put(notification_message)
+            self.output_messages.append(notification_message)
             self.shutdown("Received Open message in OpenConfirm state")
         elif isinstance(message, BgpUpdateMessage):
             notification_message = BgpNotificationMessage(
                 BgpNotificationMessage.FINITE_STATE_MACHINE_ERROR
             )
-            self.output_messages.put(notification_message)
+            self.output_messages.append(notification_message)
             self.shutdown("Received Update message in OpenConfirm state")
 
     def handle_message_established_state(self, message, tick):
@@ -177,94 +240,280 @@ class StateMachine:
             self.shutdown("Notification message received %s" % str(message))
         elif isinstance(message, BgpOpenMessage):
             notification_message = BgpNotificationMessage(BgpNotificationMessage.CEASE)
-            self.output_messages.put(notification_message)
+            self.output_messages.append(notification_message)
             self.shutdown("Received Open message in Established state")
 
     def process_route_update(self, update_message):
+        if self.treat_as_withdraw(update_message):
+            self.process_treat_as_withdraw(update_message)
+            return
+        if self.batch_route_updates:
+            self.process_route_update_batch(update_message)
+            return
         # we handle both v4 and v6 here, in theory
         # this shouldn't happen in the real world though right?
-        for prefix in update_message.nlri:
-            route = RouteAddition(
-                prefix,
-                update_message.path_attributes["next_hop"],
-                update_message.path_attributes["as_path"],
-                update_message.path_attributes["origin"],
+        path_attributes = update_message.path_attributes
+        if update_message.nlri:
+            attributes = self.ipv4_path_attributes(path_attributes)
+            nlri = self.accept_additions(update_message.nlri, attributes)
+            self.ipv4_prefixes_accepted += len(nlri)
+            for prefix in nlri:
+                route = RouteAddition.from_attributes(prefix, attributes)
+                self.route_updates.append(route)
+        if "mp_reach_nlri" in path_attributes:
+            attributes = self.ipv6_path_attributes(path_attributes)
+            nlri6 = self.accept_additions(
+                path_attributes["mp_reach_nlri"]["nlri"], attributes
             )
-            self.route_updates.put(route)
-        if "mp_reach_nlri" in update_message.path_attributes:
-            for prefix in update_message.path_attributes["mp_reach_nlri"]["nlri"]:
-                route = RouteAddition(
-                    prefix,
-                    update_message.path_attributes["mp_reach_nlri"]["next_hop"][0],
-                    update_message.path_attributes["as_path"],
-                    update_message.path_attributes["origin"],
-                )
-                self.route_updates.put(route)
-        for withdrawal in update_message.withdrawn_routes:
+            self.ipv6_prefixes_accepted += len(nlri6)
+            for prefix in nlri6:
+                route = RouteAddition.from_attributes(prefix, attributes)
+                self.route_updates.append(route)
+        withdrawals = self.accept_withdrawals(update_message.withdrawn_routes)
+        self.ipv4_prefixes_withdrawn += len(withdrawals)
+        for withdrawal in withdrawals:
             route = RouteRemoval(withdrawal)
-            self.route_updates.put(route)
-        if "mp_unreach_nlri" in update_message.path_attributes:
-            for withdrawal in update_message.path_attributes["mp_unreach_nlri"][
-                "withdrawn_routes"
-            ]:
+            self.route_updates.append(route)
+        if "mp_unreach_nlri" in path_attributes:
+            withdrawals6 = self.accept_withdrawals(
+                path_attributes["mp_unreach_nlri"]["withdrawn_routes"]
+            )
+            self.ipv6_prefixes_withdrawn += len(withdrawals6)
+            for withdrawal in withdrawals6:
                 route = RouteRemoval(withdrawal)
-                self.route_updates.put(route)
+                self.route_updates.append(route)
 
-    def build_update_messages(self):
-        # TODO handle withdrawals
-        route_additions = list(
-            filter(lambda x: isinstance(x, RouteAddition), self.routes_to_advertise)
+    def process_route_update_batch(self, update_message):
+        """Put a RouteBatch for each address family the UPDATE carries,
+        as the families do not share a next hop"""
+        path_attributes = update_message.path_attributes
+        nlri = []
+        attributes = None
+        withdrawals = self.accept_withdrawals(update_message.withdrawn_routes)
+        if update_message.nlri:
+            attributes = self.ipv4_path_attributes(path_attributes)
+            nlri = self.accept_additions(update_message.nlri, attributes)
+        self.ipv4_prefixes_accepted += len(nlri)
+        self.ipv4_prefixes_withdrawn += len(withdrawals)
+        self.put_route_batch(nlri, withdrawals, attributes)
+
+        nlri6 = []
+        attributes6 = None
+        withdrawals6 = []
+        if "mp_unreach_nlri" in path_attributes:
+            withdrawals6 = self.accept_withdrawals(
+                path_attributes["mp_unreach_nlri"]["withdrawn_routes"]
+            )
+        if "mp_reach_nlri" in path_attributes:
+            attributes6 = self.ipv6_path_attributes(path_attributes)
+            nlri6 = self.accept_additions(
+                path_attributes["mp_reach_nlri"]["nlri"], attributes6
+            )
+        self.ipv6_prefixes_accepted += len(nlri6)
+        self.ipv6_prefixes_withdrawn += len(withdrawals6)
+        self.put_route_batch(nlri6, withdrawals6, attributes6)
+
+    def treat_as_withdraw(self, update_message):
+        """True if the routes an UPDATE announces must be withdrawn instead,
+        as its path attributes are malformed or incomplete (RFC 7606)"""
+        path_attributes = update_message.path_attributes
+        if "attribute_errors" in path_attributes:
+            actions = [
+                action
+                for _type_code, action, _reason in path_attributes["attribute_errors"]
+            ]
+            if TREAT_AS_WITHDRAW in actions:
+                return True
+            self.attributes_discarded += len(actions)
+        if not update_message.nlri and "mp_reach_nlri" not in path_attributes:
+            return False
+        if "origin" not in path_attributes or "as_path" not in path_attributes:
+            return True
+        return bool(update_message.nlri) and "next_hop" not in path_attributes
+
+    def process_treat_as_withdraw(self, update_message):
+        """Withdraw everything an UPDATE announces or withdraws"""
+        self.updates_treated_as_withdraw += 1
+        path_attributes = update_message.path_attributes
+        withdrawals = self.accept_withdrawals(
+            list(update_message.withdrawn_routes) + list(update_message.nlri)
         )
-        ipv4_route_additions = filter(
-            lambda x: isinstance(x.prefix, IP4Prefix), route_additions
+        prefixes6 = []
+        if "mp_unreach_nlri" in path_attributes:
+            prefixes6.extend(path_attributes["mp_unreach_nlri"]["withdrawn_routes"])
+        if "mp_reach_nlri" in path_attributes:
+            prefixes6.extend(path_attributes["mp_reach_nlri"]["nlri"])
+        withdrawals6 = self.accept_withdrawals(prefixes6)
+        self.ipv4_prefixes_withdrawn += len(withdrawals)
+        self.ipv6_prefixes_withdrawn += len(withdrawals6)
+        if self.batch_route_updates:
+            self.put_route_batch([], withdrawals, None)
+            self.put_route_batch([], withdrawals6, None)
+            return
+        for withdrawal in withdrawals + withdrawals6:
+            self.route_updates.append(RouteRemoval(withdrawal))
+
+    def put_route_batch(self, nlri, withdrawals, attributes):
+        if nlri:
+            self.route_updates.append(RouteBatch(nlri, withdrawals, attributes))
+        elif withdrawals:
+            self.route_updates.append(RouteBatch([], withdrawals))
+
+    def accept_additions(self, prefixes, attributes):
+        """Drop announcements the Adj-RIB-In already holds unchanged"""
+        if self.adj_rib_in is None:
+            return prefixes
+        return [
+            prefix for prefix in prefixes if self.adj_rib_in.add(prefix, attributes)
+        ]
+
+    def accept_withdrawals(self, prefixes):
+        """Drop withdrawals for prefixes the Adj-RIB-In does not hold"""
+        if self.adj_rib_in is None:
+            return prefixes
+        return [prefix for prefix in prefixes if self.adj_rib_in.remove(prefix)]
+
+    def withdraw_all_routes(self, route_updates=None):
+        """Withdraw everything learned from this peer, e.g. on session loss,
+        returning the route updates"""
+        self.use_buffers(route_updates=route_updates)
+        if self.adj_rib_in is None:
+            return self.route_updates
+        ipv4_prefixes, ipv6_prefixes = self.adj_rib_in.withdraw_all()
+        for prefixes in (ipv4_prefixes, ipv6_prefixes):
+            if not prefixes:
+                continue
+            if self.batch_route_updates:
+                self.route_updates.append(RouteBatch([], prefixes))
+            else:
+                for prefix in prefixes:
+                    self.route_updates.append(RouteRemoval(prefix))
+        return self.route_updates
+
+    @staticmethod
+    def ipv4_path_attributes(path_attributes):
+        return PathAttributes.intern(
+            path_attributes["next_hop"],
+            path_attributes["as_path"],
+            path_attributes["origin"],
         )
-        ipv6_route_additions = filter(
-            lambda x: isinstance(x.prefix, IP6Prefix), route_additions
+
+    @staticmethod
+    def ipv6_path_attributes(path_attributes):
+        return PathAttributes.intern(
+            path_attributes["mp_reach_nlri"]["next_hop"][0],
+            path_attributes["as_path"],
+            path_attributes["origin"],
         )
 
-        return self.build_ipv4_update_messages(
-            ipv4_route_additions
-        ) + self.build_ipv6_update_messages(ipv6_route_additions)
+    def build_update_messages(self):
+        """Return the UPDATEs advertising routes_to_advertise
 
-    def build_ipv4_update_messages(self, ipv4_route_additions):
-        update_messages = []
-        nlri_by_path = OrderedDict()
-        for route_addition in ipv4_route_additions:
-            path_key = (
-                ("next_hop", route_addition.next_hop),
-                ("as_path", route_addition.as_path),
-                ("origin", route_addition.origin),
+        If an update_cache is shared with other peers these are the packed
+        bytes, otherwise they are BgpUpdateMessages.
+        """
+        return self.encoded_update_messages(
+            "ipv4-unicast", self.build_ipv4_update_messages
+        ) + self.encoded_update_messages(
+            "ipv6-unicast", self.build_ipv6_update_messages
+        )
+
+    def encoded_update_messages(self, afi, build):
+        if self.update_cache is None:
+            return list(build())
+        return list(
+            self.update_cache.get(
+                self.routes_version,
+                self.fourbyteas,
+                afi,
+                self.max_message_length,
+                build,
             )
-            nlri_by_path.setdefault(path_key, []).append(route_addition.prefix)
+        )
 
-        for path_attributes, nlri in nlri_by_path.items():
-            update_messages.append(BgpUpdateMessage([], dict(path_attributes), nlri))
+    def route_additions(self, prefix_class, routes=None):
+        if routes is None:
+            routes = self.routes_to_advertise
+        return [
+            route
+            for route in routes
+            if isinstance(route, RouteAddition)
+            and isinstance(route.prefix, prefix_class)
+        ]
 
-        return update_messages
+    def advertise_route_changes(
+        self, route_changes, routes_version=None, output_messages=None
+    ):
+        """Apply RouteAdditions and RouteRemovals to routes_to_advertise,
+        returning the messages to send
 
-    def build_ipv6_update_messages(self, ipv6_route_additions):
-        update_messages = []
+        Once established the changes are sent straight away as UPDATEs,
+        otherwise they will be included in the initial advertisement.
+        """
+        self.use_buffers(output_messages)
+        if self.state == "established":
+            for message in self.build_route_change_messages(route_changes):
+                self.output_messages.append(message)
+        else:
+            changed = {route.prefix for route in route_changes}
+            self.routes_to_advertise = [
+                route
+                for route in self.routes_to_advertise
+                if route.prefix not in changed
+            ] + [route for route in route_changes if not route.is_withdraw]
+        if routes_version is not None:
+            self.routes_version = routes_version
+        return self.output_messages
+
+    def build_route_change_messages(self, route_changes):
+        builder = self.update_message_builder()
+        ipv4_withdrawals = []
+        ipv6_withdrawals = []
+        for route in route_changes:
+            if route.is_withdraw:
+                if isinstance(route.prefix, IP6Prefix):
+                    ipv6_withdrawals.append(route.prefix)
+                else:
+                    ipv4_withdrawals.append(route.prefix)
+        yield from builder.ipv4_withdrawals(ipv4_withdrawals)
+        yield from builder.ipv6_withdrawals(ipv6_withdrawals)
+        yield from self.build_ipv4_update_messages(route_changes)
+        yield from self.build_ipv6_update_messages(route_changes)
+
+    def update_message_builder(self):
+        return UpdateMessageBuilder(
+            fourbyteas=bool(self.fourbyteas),
+            max_message_length=self.max_message_length,
+        )
+
+    @staticmethod
+    def group_by_path(route_additions):
         nlri_by_path = OrderedDict()
-        for route_addition in ipv6_route_additions:
-            path_key = (
-                ("next_hop", route_addition.next_hop),
-                ("as_path", route_addition.as_path),
-                ("origin", route_addition.origin),
+        for route_addition in route_additions:
+            nlri_by_path.setdefault(route_addition.attributes, []).append(
+                route_addition.prefix
             )
-            nlri_by_path.setdefault(path_key, []).append(route_addition.prefix)
-
-        for path_attributes, nlri in nlri_by_path.items():
-            path_attributes_dict = dict(path_attributes)
-            path_attributes_v6 = {
-                "as_path": path_attributes_dict["as_path"],
-                "origin": path_attributes_dict["origin"],
-                "mp_reach_nlri": {
-                    "next_hop": [
-                        path_attributes_dict["next_hop"],
-                    ],
-                    "nlri": nlri,
-                },
+        return nlri_by_path
+
+    def build_ipv4_update_messages(self, routes=None):
+        builder = self.update_message_builder()
+        ipv4_route_additions = self.route_additions(IP4Prefix, routes)
+        for attributes, nlri in self.group_by_path(ipv4_route_additions).items():
+            path_attributes = {
+                "next_hop": attributes.next_hop,
+                "as_path": attributes.as_path,
+                "origin": attributes.origin,
             }
-            update_messages.append(BgpUpdateMessage([], path_attributes_v6, []))
+            yield from builder.ipv4_updates(path_attributes, nlri)
 
-        return update_messages
+    def build_ipv6_update_messages(self, routes=None):
+        builder = self.update_message_builder()
+        ipv6_route_additions = self.route_additions(IP6Prefix, routes)
+        for attributes, nlri in self.group_by_path(ipv6_route_additions).items():
+            path_attributes = {
+                "as_path": attributes.as_path,
+                "origin": attributes.origin,
+            }
+            yield from builder.ipv6_updates(
+                path_attributes, [attributes.next_hop], nlri
+            )
@@ -1,3 +1,7 @@
+import heapq
+import itertools
+
+
 class Timer:
     def __init__(self, count):
         self.count = count
@@ -9,7 +13,13 @@ class Timer:
 
     def expired(self, tick):
         """Return true if time has elapsed"""
-        return self.running() and tick > self.tick + self.count
+        return self.running() and tick >= self.tick + self.count
+
+    def deadline(self):
+        """Return the tick at which the timer expires, or None if stopped"""
+        if not self.running():
+            return None
+        return self.tick + self.count
 
     def reset(self, tick):
         """Reset time on timer"""
@@ -18,3 +28,61 @@ class Timer:
     def stop(self):
         """Stop timer"""
         self.tick = None
+
+
+class TimerHeap:
+    """Deadlines for many sessions, ordered so the next one is cheap to find
+
+    Each session has at most one deadline. Rescheduling leaves the old heap
+    entry behind, and it is skipped when it reaches the top.
+    """
+
+    def __init__(self):
+        self.heap = []
+        self.deadlines = {}
+        self.counter = itertools.count()
+
+    def schedule(self, session, deadline):
+        """Set (or with None, clear) the deadline for a session"""
+        if deadline is None:
+            self.deadlines.pop(session, None)
+            return
+        if self.deadlines.get(session) == deadline:
+            return
+        self.deadlines[session] = deadline
+        heapq.heappush(self.heap, (deadline, next(self.counter), session))
+        if len(self.heap) > 4 * len(self.deadlines) + 64:
+            self.compact()
+
+    def compact(self):
+        """Drop the entries left behind by rescheduling"""
+        self.heap = [
+            entry for entry in self.heap if self.deadlines.get(entry[2]) == entry[0]
+        ]
+        heapq.heapify(self.heap)
+
+    def cancel(self, session):
+        self.schedule(session, None)
+
+    def next_deadline(self):
+        heap = self.heap
+        while heap:
+            deadline, _, session = heap[0]
+            if self.deadlines.get(session) == deadline:
+                return deadline
+            heapq.heappop(heap)
+        return None
+
+    def pop_due(self, tick):
+        """Remove and return the sessions whose deadline is at or before tick"""
+        due = []
+        while True:
+            deadline = self.next_deadline()
+            if deadline is None or deadline > tick:
+                return due
+            _, _, session = heapq.heappop(self.heap)
+            del self.deadlines[session]
+            due.append(session)
+
+    def __len__(self):
+        return len(self.deadlines)
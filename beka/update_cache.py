@@ -0,0 +1,49 @@
+"""A cache of packed UPDATE messages shared between peers"""
+
+from .bgp_message import BgpMessagePacker
+
+
+class UpdateCache:
+    """Packed UPDATEs for the originated routes, shared by every peer
+
+    Entries are keyed by the route set version plus everything negotiated
+    that changes how the UPDATEs are encoded, so peers with equivalent
+    capabilities are sent the same bytes. Entries for older versions are
+    dropped once a newer version is requested.
+    """
+
+    def __init__(self):
+        self.version = None
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(version, fourbyteas, afi, max_message_length):
+        return (version, bool(fourbyteas), afi, max_message_length)
+
+    def get(self, version, fourbyteas, afi, max_message_length, build):
+        """Return the packed UPDATEs for a key, calling build() to make the
+        BgpUpdateMessages if they are not already cached"""
+
+        if self.version is None or version > self.version:
+            self.entries.clear()
+            self.version = version
+        key = self.key(version, fourbyteas, afi, max_message_length)
+        packed_messages = self.entries.get(key)
+        if packed_messages is not None:
+            self.hits += 1
+            return packed_messages
+
+        self.misses += 1
+        packer = BgpMessagePacker()
+        if fourbyteas:
+            packer.capabilities = {"fourbyteas": fourbyteas}
+        packed_messages = tuple(packer.pack(message) for message in build())
+        if version == self.version:
+            # a peer still advertising an older route set is not cached
+            self.entries[key] = packed_messages
+        return packed_messages
+
+    def __len__(self):
+        return len(self.entries)
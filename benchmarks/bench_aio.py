@@ -0,0 +1,167 @@
+"""Benchmark a BGP session on eventlet against one on asyncio
+
+A peer sends OPEN, KEEPALIVE and a stream of UPDATEs over a socketpair.
+For each transport this reports how quickly the routes reach the route
+handler (session throughput), then the per-message latency of single
+UPDATEs sent one at a time. Run from the repository root:
+
+    PYTHONPATH=. python3 benchmarks/bench_aio.py
+"""
+
+import argparse
+import asyncio
+import socket
+import statistics
+import time
+
+import eventlet
+from eventlet.green import socket as green_socket
+
+from beka.aio import BgpProtocol
+from beka.peering import Peering
+from beka.state_machine import StateMachine
+
+from synthetic import build_streams
+
+
+def build_state_machine(**kwargs):
+    return StateMachine(
+        local_as=65001,
+        peer_as=65002,
+        router_id="1.1.1.1",
+        local_address="1.1.1.1",
+        neighbor="2.2.2.2",
+        **kwargs
+    )
+
+
+class RouteCounter:
+    def __init__(self):
+        self.count = 0
+        self.waiting_for = None
+        self.done = None
+
+    def handle(self, _route_update):
+        self.count += 1
+        if self.count == self.waiting_for:
+            self.done()
+
+
+def report(name, routes, elapsed, latencies):
+    latencies = sorted(latencies)
+    print(
+        "  %-9s %9.0f routes/s   latency median %6.1f us, p99 %6.1f us"
+        % (
+            name,
+            routes / elapsed,
+            statistics.median(latencies) * 1e6,
+            latencies[int(len(latencies) * 0.99)] * 1e6,
+        )
+    )
+
+
+def run_eventlet(session_start, packed_updates, prefixes_per_update, samples):
+    ours, theirs = green_socket.socketpair()
+    counter = RouteCounter()
+    peering = Peering(build_state_machine(), ("2.2.2.2", 179), ours, counter.handle)
+    pool = eventlet.GreenPool()
+    greenthreads = [pool.spawn(peering.run)]
+
+    def drain():
+        while theirs.recv(65536):
+            pass
+
+    greenthreads.append(pool.spawn(drain))
+
+    def wait_for(count):
+        finished = eventlet.event.Event()
+        counter.waiting_for = count
+        counter.done = finished.send
+        finished.wait()
+
+    theirs.sendall(session_start)
+    start = time.perf_counter()
+    theirs.sendall(b"".join(packed_updates))
+    wait_for(len(packed_updates) * prefixes_per_update)
+    elapsed = time.perf_counter() - start
+
+    latencies = []
+    for packed_update in packed_updates[:samples]:
+        sent = time.perf_counter()
+        theirs.sendall(packed_update)
+        wait_for(counter.count + prefixes_per_update)
+        latencies.append(time.perf_counter() - sent)
+
+    report(
+        "eventlet", counter.count - samples * prefixes_per_update, elapsed, latencies
+    )
+    for greenthread in greenthreads:
+        greenthread.kill()
+    for eventlet_ in peering.eventlets:
+        eventlet_.kill()
+    theirs.close()
+    ours.close()
+
+
+async def run_asyncio(session_start, packed_updates, prefixes_per_update, samples):
+    loop = asyncio.get_running_loop()
+    ours, theirs = socket.socketpair()
+    counter = RouteCounter()
+    protocol = BgpProtocol(build_state_machine(), counter.handle)
+    await loop.connect_accepted_socket(lambda: protocol, ours)
+    reader, writer = await asyncio.open_connection(sock=theirs)
+
+    async def drain():
+        while await reader.read(65536):
+            pass
+
+    draining = asyncio.ensure_future(drain())
+
+    async def wait_for(count):
+        finished = loop.create_future()
+        counter.waiting_for = count
+        counter.done = lambda: finished.set_result(None)
+        await finished
+
+    writer.write(session_start)
+    start = time.perf_counter()
+    writer.write(b"".join(packed_updates))
+    await wait_for(len(packed_updates) * prefixes_per_update)
+    elapsed = time.perf_counter() - start
+
+    latencies = []
+    for packed_update in packed_updates[:samples]:
+        sent = time.perf_counter()
+        writer.write(packed_update)
+        await wait_for(counter.count + prefixes_per_update)
+        latencies.append(time.perf_counter() - sent)
+
+    report("asyncio", counter.count - samples * prefixes_per_update, elapsed, latencies)
+    writer.close()
+    await draining
+
+
+def main():
+    argparser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    argparser.add_argument("--updates", type=int, default=50000)
+    argparser.add_argument("--prefixes-per-update", type=int, default=4)
+    argparser.add_argument("--samples", type=int, default=2000)
+    args = argparser.parse_args()
+
+    session_start, packed_updates = build_streams(
+        args.updates, args.prefixes_per_update
+    )
+    print(
+        "%d UPDATEs of %d prefixes, %d latency samples:"
+        % (args.updates, args.prefixes_per_update, args.samples)
+    )
+    run_eventlet(session_start, packed_updates, args.prefixes_per_update, args.samples)
+    asyncio.run(
+        run_asyncio(
+            session_start, packed_updates, args.prefixes_per_update, args.samples
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""Benchmark AsPath against the space separated strings it replaced
+
+Paths are drawn from a distribution shaped like a full Internet table:
+mostly three to five hops, a small set of busy transit ASes, some
+prepending and the odd AS_SET. Each operation is timed over the whole
+set of paths. Run from the repository root:
+
+    PYTHONPATH=. python3 benchmarks/bench_as_path.py
+"""
+
+import argparse
+import random
+import struct
+import time
+
+from beka.as_path import AsPath
+
+PATH_LENGTHS = [1, 2, 3, 4, 5, 6, 7, 8, 10]
+PATH_LENGTH_WEIGHTS = [2, 10, 28, 30, 17, 8, 3, 1, 1]
+
+
+def random_path(rand, transit):
+    hops = rand.choices(PATH_LENGTHS, PATH_LENGTH_WEIGHTS)[0]
+    path = [rand.choice(transit) for _ in range(hops - 1)]
+    origin = rand.randint(1, 400000)
+    path.append(origin)
+    if rand.random() < 0.1:
+        path.extend([origin] * rand.randint(1, 4))
+    return path
+
+
+def build_packed_paths(count, distinct, seed=0):
+    """Return count packed 4 byte AS_PATHs, drawn from distinct paths"""
+    rand = random.Random(seed)
+    transit = [rand.randint(1, 65000) for _ in range(40)]
+    paths = []
+    for _ in range(distinct):
+        path = random_path(rand, transit)
+        packed = struct.pack("!BB%dI" % len(path), 2, len(path), *path)
+        if rand.random() < 0.01:
+            members = [rand.randint(1, 400000) for _ in range(3)]
+            packed += struct.pack("!BB3I", 1, 3, *members)
+        paths.append(packed)
+    return [rand.choice(paths) for _ in range(count)]
+
+
+def string_parse(packed_as_path):
+    as_numbers = []
+    offset = 0
+    while offset < len(packed_as_path):
+        _type_code, count = struct.unpack_from("!BB", packed_as_path, offset)
+        offset += 2
+        as_numbers += struct.unpack_from("!%dI" % count, packed_as_path, offset)
+        offset += count * 4
+    return " ".join(["%d" % x for x in as_numbers])
+
+
+def string_pack(as_path):
+    if not as_path:
+        return b""
+    as_numbers = [int(x) for x in as_path.split(" ")]
+    count = len(as_numbers)
+    return struct.pack("!BB", 2, count) + struct.pack("!%dI" % count, *as_numbers)
+
+
+def time_it(function, items):
+    start = time.perf_counter()
+    for item in items:
+        function(item)
+    return time.perf_counter() - start
+
+
+def main():
+    argparser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    argparser.add_argument("--paths", type=int, default=200000)
+    argparser.add_argument("--distinct", type=int, default=50000)
+    args = argparser.parse_args()
+
+    packed_paths = build_packed_paths(args.paths, args.distinct)
+    strings = [string_parse(packed) for packed in packed_paths]
+    as_paths = [AsPath.unpack(packed) for packed in packed_paths]
+    needle = 174
+
+    operations = [
+        ("parse", string_parse, packed_paths, AsPath.unpack, packed_paths),
+        ("pack", string_pack, strings, AsPath.pack, as_paths),
+        ("length", lambda s: len(s.split()), strings, len, as_paths),
+        (
+            "contains",
+            lambda s: str(needle) in s.split(),
+            strings,
+            lambda p: needle in p,
+            as_paths,
+        ),
+        (
+            "prepend",
+            lambda s: ("65001 " + s).strip(),
+            strings,
+            lambda p: p.prepend(65001),
+            as_paths,
+        ),
+    ]
+    print("%d AS paths (%d distinct), ns per operation:" % (args.paths, args.distinct))
+    print("  %-9s %9s %9s" % ("", "string", "AsPath"))
+    for name, string_op, string_items, as_path_op, as_path_items in operations:
+        string_time = time_it(string_op, string_items)
+        as_path_time = time_it(as_path_op, as_path_items)
+        print(
+            "  %-9s %9.0f %9.0f"
+            % (
+                name,
+                string_time / args.paths * 1e9,
+                as_path_time / args.paths * 1e9,
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""Benchmark the parser's path attribute cache on a full table feed
+
+Two feeds of the synthetic full table from synthetic.py are parsed, with
+the cache disabled and then enabled. In the packed feed each origin's
+prefixes share as few UPDATEs as possible, so attribute blocks rarely
+repeat and the cache only adds its overhead. In the unpacked feed, as from
+a speaker that sends one prefix per UPDATE, consecutive UPDATEs repeat the
+same attribute bytes. Run from the repository root:
+
+    PYTHONPATH=. python3 benchmarks/bench_attribute_cache.py
+"""
+
+import argparse
+import time
+
+from beka.attribute_cache import AttributeCache
+from beka.bgp_message import BgpMessage, BgpMessageParser
+from beka.chopper import Chopper
+
+from synthetic import build_full_table
+
+
+def frame(packed_updates):
+    chopper = Chopper(None)
+    return [
+        serialised_message
+        for message_type, serialised_message in chopper.feed(b"".join(packed_updates))
+        if message_type == BgpMessage.UPDATE_MESSAGE
+    ]
+
+
+def run(name, bodies, cache_size, repeat):
+    best = None
+    for _ in range(repeat):
+        parser = BgpMessageParser(attribute_cache_size=cache_size)
+        parser.capabilities = {"fourbyteas": 65000}
+        start = time.perf_counter()
+        for body in bodies:
+            parser.parse(BgpMessage.UPDATE_MESSAGE, body)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    line = "  %-9s %9.0f UPDATEs/s" % (name, len(bodies) / best)
+    if parser.attribute_cache is not None:
+        line += "  (hit rate %.1f%%)" % (
+            parser.attribute_cache.stats()["hit_rate"] * 100
+        )
+    print(line)
+
+
+def main():
+    argparser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    argparser.add_argument("--ipv4", type=int, default=200000)
+    argparser.add_argument("--ipv6", type=int, default=40000)
+    argparser.add_argument(
+        "--cache-size", type=int, default=AttributeCache.DEFAULT_MAX_SIZE
+    )
+    argparser.add_argument("--unpacked-prefixes-per-update", type=int, default=1)
+    argparser.add_argument("--repeat", type=int, default=3)
+    args = argparser.parse_args()
+
+    for feed, prefixes_per_update in (
+        ("Packed", None),
+        ("Unpacked", args.unpacked_prefixes_per_update),
+    ):
+        _session_start, packed_updates = build_full_table(
+            args.ipv4, args.ipv6, prefixes_per_update=prefixes_per_update
+        )
+        bodies = frame(packed_updates)
+        print(
+            "%s feed, %d UPDATEs carrying %d IPv4 and %d IPv6 prefixes:"
+            % (feed, len(bodies), args.ipv4, args.ipv6)
+        )
+        run("uncached", bodies, 0, args.repeat)
+        run("cached", bodies, args.cache_size, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
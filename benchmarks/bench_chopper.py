@@ -0,0 +1,119 @@
+"""Benchmark framing a recorded stream of UPDATEs
+
+Compares Chopper.next_batch and Chopper.next against the two-reads-per-
+message Chopper they replaced. The stream is recorded to a file and read
+back through a buffered reader, as socket.makefile would. Each is run bare
+and inside Peering's receive loop, which yields to the hub and reads the
+clock once per iteration. Run from the repository root:
+
+    PYTHONPATH=. python3 benchmarks/bench_chopper.py
+"""
+
+import argparse
+import os
+import struct
+import tempfile
+import time
+
+from eventlet import sleep
+
+from beka.bgp_message import BgpMessage
+from beka.chopper import Chopper
+
+from synthetic import build_update_bodies
+
+
+class ReferenceChopper(object):
+    """The header-then-body Chopper, kept for comparison"""
+
+    def __init__(self, input_stream):
+        self.input_stream = input_stream
+
+    def next(self):
+        header = self.input_stream.read(19)
+        marker, length, message_type = struct.unpack("!16sHB", header)
+        if marker != BgpMessage.MARKER:
+            raise ValueError("BGP marker missing")
+        return message_type, self.input_stream.read(length - 19)
+
+
+def record_stream(count, prefixes_per_update):
+    return b"".join(
+        struct.pack("!16sHB", BgpMessage.MARKER, 19 + len(body), 2) + body
+        for body in build_update_bodies(count, prefixes_per_update)
+    )
+
+
+def reference_batches(input_stream):
+    chopper = ReferenceChopper(input_stream)
+    while True:
+        yield [chopper.next()]
+
+
+def next_batches(input_stream):
+    chopper = Chopper(input_stream)
+    while True:
+        yield [chopper.next()]
+
+
+def next_batch_batches(input_stream):
+    chopper = Chopper(input_stream)
+    while True:
+        yield chopper.next_batch()
+
+
+def frame(batches, count):
+    framed = 0
+    for messages in batches:
+        framed += len(messages)
+        if framed >= count:
+            return framed
+
+
+def receive_loop(batches, count):
+    framed = 0
+    for messages in batches:
+        sleep(0)
+        int(time.time())
+        framed += len(messages)
+        if framed >= count:
+            return framed
+
+
+def run(name, path, count, batches, loop):
+    best = None
+    for _ in range(3):
+        with open(path, "rb") as input_stream:
+            start = time.perf_counter()
+            framed = loop(batches(input_stream), count)
+            elapsed = time.perf_counter() - start
+        assert framed == count
+        best = elapsed if best is None else min(best, elapsed)
+    print("    %-24s %9.0f messages/s" % (name, count / best))
+
+
+def main():
+    argparser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    argparser.add_argument("--updates", type=int, default=100000)
+    argparser.add_argument("--prefixes-per-update", type=int, default=2)
+    args = argparser.parse_args()
+
+    data = record_stream(args.updates, args.prefixes_per_update)
+    with tempfile.NamedTemporaryFile(delete=False) as recording:
+        recording.write(data)
+    print("%d UPDATEs, %d bytes:" % (args.updates, len(data)))
+    try:
+        for loop_name, loop in (("framing", frame), ("receive loop", receive_loop)):
+            print("  %s:" % loop_name)
+            for name, batches in (
+                ("reference Chopper.next", reference_batches),
+                ("Chopper.next", next_batches),
+                ("Chopper.next_batch", next_batch_batches),
+            ):
+                run(name, recording.name, args.updates, batches, loop)
+    finally:
+        os.unlink(recording.name)
+
+
+if __name__ == "__main__":
+    main()
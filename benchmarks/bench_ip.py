@@ -0,0 +1,91 @@
+"""Benchmark IP prefix construction, hashing and formatting
+
+Compares the slotted prefix types with a dict-backed reference class
+that formats with inet_ntop on every str() call. Run from the repository
+root:
+
+    PYTHONPATH=. python3 benchmarks/bench_ip.py
+"""
+
+import argparse
+import random
+import socket
+import struct
+import time
+
+from beka.ip import IP4Prefix
+
+
+class ReferencePrefix:  # pylint: disable=too-few-public-methods
+    """A dict-backed prefix without cached hash or string"""
+
+    def __init__(self, prefix, length):
+        self.prefix = prefix
+        self.length = length
+
+    def __str__(self):
+        prefix_string = socket.inet_ntop(socket.AF_INET, self.prefix)
+        return "%s/%d" % (prefix_string, self.length)
+
+    def __eq__(self, other):
+        return self.prefix == other.prefix and self.length == other.length
+
+    def __hash__(self):
+        return hash((self.prefix, self.length))
+
+
+def timed(function):
+    start = time.perf_counter()
+    result = function()
+    return time.perf_counter() - start, result
+
+
+def run(name, prefix_class, packed_prefixes):
+    count = len(packed_prefixes)
+    construct_time, prefixes = timed(
+        lambda: [prefix_class(packed, length) for packed, length in packed_prefixes]
+    )
+    hash_time, _ = timed(lambda: [hash(prefix) for prefix in prefixes])
+    rehash_time, _ = timed(lambda: [hash(prefix) for prefix in prefixes])
+    string_time, _ = timed(lambda: [str(prefix) for prefix in prefixes])
+    restring_time, _ = timed(lambda: [str(prefix) for prefix in prefixes])
+    sort_time, _ = timed(
+        lambda: (
+            sorted(prefixes, key=IP4Prefix.sort_key)
+            if prefix_class is IP4Prefix
+            else None
+        )
+    )
+    print(
+        "%-10s construct %6.0f ns  hash %5.0f/%5.0f ns  str %5.0f/%5.0f ns  sort %s"
+        % (
+            name,
+            1e9 * construct_time / count,
+            1e9 * hash_time / count,
+            1e9 * rehash_time / count,
+            1e9 * string_time / count,
+            1e9 * restring_time / count,
+            "%.2f s" % sort_time if prefix_class is IP4Prefix else "n/a",
+        )
+    )
+
+
+def main():
+    argparser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    argparser.add_argument("--prefixes", type=int, default=1000000)
+    args = argparser.parse_args()
+
+    rand = random.Random(0)
+    packed_prefixes = []
+    for _ in range(args.prefixes):
+        length = rand.randint(8, 24)
+        address = rand.getrandbits(length) << (32 - length)
+        packed_prefixes.append((struct.pack("!I", address), length))
+
+    print("%d prefixes, per prefix times (first/repeat call)" % args.prefixes)
+    run("reference", ReferencePrefix, packed_prefixes)
+    run("beka", IP4Prefix, packed_prefixes)
+
+
+if __name__ == "__main__":
+    main()
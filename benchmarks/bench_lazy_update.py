@@ -0,0 +1,75 @@
+"""Benchmark lazy UPDATE decoding on a filter-and-forward workload
+
+Each UPDATE is parsed, dropped if its AS path contains an AS number from
+a deny list, and otherwise has its prefixes counted and is packed again to
+be forwarded, as a route reflector or collector might. Compares the eager
+parser against BgpMessageParser(lazy=True). Run from the repository root:
+
+    PYTHONPATH=. python3 benchmarks/bench_lazy_update.py
+"""
+
+import argparse
+import time
+
+from beka.bgp_message import BgpMessage, BgpMessageParser, BgpMessagePacker
+
+from synthetic import build_update_bodies
+
+
+def filter_and_forward(bodies, parser, packer, denied):
+    forwarded = []
+    prefixes = 0
+    for body in bodies:
+        message = parser.parse(BgpMessage.UPDATE_MESSAGE, body)
+        if parser.lazy:
+            as_path = message.get_attribute("as_path")
+            count = message.nlri_count()
+        else:
+            as_path = message.path_attributes["as_path"]
+            count = len(message.nlri)
+        if not denied.isdisjoint(as_path):
+            continue
+        prefixes += count
+        forwarded.append(packer.pack(message))
+    return forwarded, prefixes
+
+
+def run(name, bodies, lazy, denied, repeat):
+    parser = BgpMessageParser(lazy=lazy)
+    parser.capabilities = {"fourbyteas": [65000]}
+    packer = BgpMessagePacker()
+    packer.capabilities = parser.capabilities
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        forwarded, prefixes = filter_and_forward(bodies, parser, packer, denied)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    print(
+        "  %-6s %9.0f UPDATEs/s  (%d forwarded, %d prefixes)"
+        % (name, len(bodies) / best, len(forwarded), prefixes)
+    )
+    return forwarded
+
+
+def main():
+    argparser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    argparser.add_argument("--updates", type=int, default=50000)
+    argparser.add_argument("--prefixes-per-update", type=int, default=8)
+    argparser.add_argument("--repeat", type=int, default=3)
+    args = argparser.parse_args()
+
+    bodies = build_update_bodies(args.updates, args.prefixes_per_update)
+    # random_as_path picks from 1-400000, so this denies roughly a tenth
+    denied = set(range(1, 400001, 40))
+    print(
+        "%d UPDATEs of %d prefixes, filtered on AS path then forwarded:"
+        % (args.updates, args.prefixes_per_update)
+    )
+    eager = run("eager", bodies, False, denied, args.repeat)
+    lazy = run("lazy", bodies, True, denied, args.repeat)
+    assert eager == lazy
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""Measure the memory saved by interning prefixes across peers
+
+Every peer sends the same synthetic full table, which is parsed by a
+parser per peer, and the prefixes are kept as an Adj-RIB-In would keep
+them. This is done once with separate prefix objects for each peer and
+once with intern_prefixes(), each in its own process so that the growth
+in RSS can be compared. Run from the repository root:
+
+    PYTHONPATH=. python3 benchmarks/bench_prefix_pool.py
+"""
+
+import argparse
+import os
+import resource
+import subprocess
+import sys
+import time
+
+from beka.bgp_message import BgpMessage, BgpMessageParser, intern_prefixes
+from beka.chopper import Chopper
+
+from synthetic import build_full_table
+
+
+def rss_kib():
+    # the current RSS, which ru_maxrss would not show as it falls
+    with open("/proc/self/statm", encoding="ascii") as statm:
+        return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") // 1024
+
+
+def peak_rss_kib():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def receive_tables(peers, prefixes, interned):
+    _session_start, packed_updates = build_full_table(prefixes, 0)
+    bodies = [
+        serialised_message
+        for _message_type, serialised_message in Chopper(None).feed(
+            b"".join(packed_updates)
+        )
+    ]
+    del packed_updates
+    if interned:
+        intern_prefixes()
+
+    before = rss_kib()
+    start = time.perf_counter()
+    ribs = []
+    for _ in range(peers):
+        parser = BgpMessageParser()
+        parser.capabilities = {"fourbyteas": 65002}
+        rib = []
+        for body in bodies:
+            rib.extend(parser.parse(BgpMessage.UPDATE_MESSAGE, body).nlri)
+        ribs.append(rib)
+    elapsed = time.perf_counter() - start
+    distinct = len({id(prefix) for rib in ribs for prefix in rib})
+    print("%d %d %f %d" % (rss_kib() - before, peak_rss_kib(), elapsed, distinct))
+
+
+def main():
+    argparser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    argparser.add_argument("--peers", type=int, default=10)
+    argparser.add_argument("--prefixes", type=int, default=900000)
+    argparser.add_argument("--interned", choices=["yes", "no"])
+    args = argparser.parse_args()
+
+    if args.interned:
+        receive_tables(args.peers, args.prefixes, args.interned == "yes")
+        return
+
+    print("%d peers each sending %d prefixes:" % (args.peers, args.prefixes))
+    for interned in ("no", "yes"):
+        output = subprocess.run(
+            [
+                sys.executable,
+                os.path.abspath(__file__),
+                "--peers",
+                str(args.peers),
+                "--prefixes",
+                str(args.prefixes),
+                "--interned",
+                interned,
+            ],
+            check=True,
+            stdout=subprocess.PIPE,
+            encoding="ascii",
+        ).stdout
+        growth, peak, elapsed, distinct = output.split()
+        print(
+            "  %-9s %8.1f MiB held  %8.1f MiB peak RSS  %9d prefix objects"
+            "  %6.1f s to parse"
+            % (
+                "interned" if interned == "yes" else "separate",
+                int(growth) / 1024,
+                int(peak) / 1024,
+                int(distinct),
+                float(elapsed),
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
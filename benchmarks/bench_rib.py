@@ -0,0 +1,71 @@
+"""Benchmark the prefix trie behind RouteTable
+
+Reports insert rate, longest-prefix-match lookups per second and memory
+per prefix. Run from the repository root:
+
+    PYTHONPATH=. python3 benchmarks/bench_rib.py
+"""
+
+import argparse
+import random
+import struct
+import time
+import tracemalloc
+
+from beka.ip import IP4Address, IP4Prefix
+from beka.rib import PrefixTrie
+
+
+def main():
+    argparser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    argparser.add_argument("--prefixes", type=int, default=1000000)
+    argparser.add_argument("--lookups", type=int, default=1000000)
+    args = argparser.parse_args()
+
+    rand = random.Random(0)
+    prefixes = []
+    for _ in range(args.prefixes):
+        length = rand.choice([16, 20, 22, 23, 24, 24, 24, 24])
+        address = rand.getrandbits(length) << (32 - length)
+        prefixes.append(IP4Prefix(struct.pack("!I", address), length))
+    addresses = [
+        IP4Address(struct.pack("!I", rand.getrandbits(32))) for _ in range(args.lookups)
+    ]
+    for prefix in prefixes:
+        int(prefix)
+
+    trie = PrefixTrie(32)
+    start = time.perf_counter()
+    for prefix in prefixes:
+        trie.insert(prefix, prefix)
+    insert_time = time.perf_counter() - start
+
+    # measured separately as tracing allocations slows the inserts down
+    tracemalloc.start()
+    traced_trie = PrefixTrie(32)
+    for prefix in prefixes:
+        traced_trie.insert(prefix, prefix)
+    trie_memory, _peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del traced_trie
+
+    start = time.perf_counter()
+    matched = 0
+    for address in addresses:
+        if trie.longest_match(address) is not None:
+            matched += 1
+    lookup_time = time.perf_counter() - start
+
+    print(
+        "inserted %d prefixes (%d unique) at %.0f inserts/s"
+        % (len(prefixes), len(trie), len(prefixes) / insert_time)
+    )
+    print(
+        "%d LPM lookups (%d matched) at %.0f lookups/s"
+        % (len(addresses), matched, len(addresses) / lookup_time)
+    )
+    print("trie overhead %.1f bytes/prefix" % (trie_memory / len(trie)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""Benchmark memory used per received route
+
+Feeds a synthetic full table through StateMachine.process_route_update and
+reports the bytes allocated per route, compared with dict-backed route
+objects that each hold their own attributes. Run from the repository root:
+
+    PYTHONPATH=. python3 benchmarks/bench_route_memory.py
+"""
+
+import argparse
+import gc
+import tracemalloc
+
+from beka.bgp_message import BgpMessage, BgpMessageParser
+from beka.state_machine import StateMachine
+
+from synthetic import build_update_bodies
+
+
+class ReferenceRouteAddition:  # pylint: disable=too-few-public-methods
+    """A dict-backed route that holds its own attributes"""
+
+    def __init__(self, prefix, next_hop, as_path, origin):
+        self.prefix = prefix
+        self.next_hop = next_hop
+        self.as_path = as_path
+        self.origin = origin
+        self.is_withdraw = False
+
+
+class ListQueue(list):
+    put = list.append
+
+
+def parse_feed(updates, prefixes_per_update):
+    parser = BgpMessageParser()
+    parser.capabilities = {"fourbyteas": [65000]}
+    return [
+        parser.parse(BgpMessage.UPDATE_MESSAGE, body)
+        for body in build_update_bodies(updates, prefixes_per_update)
+    ]
+
+
+def reference_routes(messages):
+    routes = []
+    for message in messages:
+        for prefix in message.nlri:
+            routes.append(
+                ReferenceRouteAddition(
+                    prefix,
+                    message.path_attributes["next_hop"],
+                    message.path_attributes["as_path"],
+                    message.path_attributes["origin"],
+                )
+            )
+    return routes
+
+
+def beka_routes(messages):
+    state_machine = StateMachine(
+        local_as=65000,
+        peer_as=65001,
+        router_id="192.0.2.2",
+        local_address="192.0.2.2",
+        neighbor="192.0.2.1",
+    )
+    state_machine.route_updates = ListQueue()
+    for message in messages:
+        state_machine.process_route_update(message)
+    return state_machine.route_updates
+
+
+def measure(name, build, messages, route_count):
+    gc.collect()
+    tracemalloc.start()
+    routes = build(messages)
+    current, _peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    assert len(routes) == route_count
+    print(
+        "%-10s %10d routes %8.1f bytes/route"
+        % (name, route_count, current / route_count)
+    )
+    return current
+
+
+def main():
+    argparser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    argparser.add_argument("--updates", type=int, default=50000)
+    argparser.add_argument("--prefixes-per-update", type=int, default=12)
+    args = argparser.parse_args()
+
+    messages = parse_feed(args.updates, args.prefixes_per_update)
+    route_count = args.updates * args.prefixes_per_update
+    reference = measure("reference", reference_routes, messages, route_count)
+    current = measure("beka", beka_routes, messages, route_count)
+    print("saving     %10.1f%%" % (100.0 * (reference - current) / reference))
+
+
+if __name__ == "__main__":
+    main()
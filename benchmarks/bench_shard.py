@@ -0,0 +1,131 @@
+"""Benchmark how ShardedBeka throughput scales with worker processes
+
+Several peers connect over loopback, each from its own 127.0.0.x address,
+and send a full stream of UPDATEs at once. For each worker count this
+reports the aggregate rate at which prefixes reach the supervisor's
+batch_route_handler. Run from the repository root:
+
+    PYTHONPATH=. python3 benchmarks/bench_shard.py --workers 1 2 4
+"""
+
+import argparse
+import os
+import socket
+import threading
+import time
+
+from beka.shard import ShardedBeka
+
+from synthetic import build_streams
+
+
+class PrefixCounter:
+    def __init__(self):
+        self.count = 0
+        self.done = threading.Event()
+        self.waiting_for = None
+
+    def handle(self, batches):
+        for batch in batches:
+            self.count += len(batch)
+        if self.count >= self.waiting_for:
+            self.done.set()
+
+
+def drain(client):
+    try:
+        while client.recv(65536):
+            pass
+    except OSError:
+        pass
+
+
+def run(workers, sessions, session_start, packed_updates, prefixes_per_update):
+    counter = PrefixCounter()
+    counter.waiting_for = sessions * len(packed_updates) * prefixes_per_update
+    beka = ShardedBeka(
+        "127.0.0.1",
+        0,
+        65001,
+        "1.1.1.1",
+        None,
+        None,
+        None,
+        None,
+        batch_route_handler=counter.handle,
+        workers=workers,
+    )
+    peer_ips = ["127.0.0.%d" % (2 + i) for i in range(sessions)]
+    for peer_ip in peer_ips:
+        beka.add_neighbor("passive", peer_ip, 65002)
+    beka.start()
+    port = beka.server.getsockname()[1]
+    supervisor = threading.Thread(target=beka.run)
+    supervisor.start()
+    # give the worker processes time to import beka and start their hubs
+    time.sleep(1)
+
+    stream = session_start + b"".join(packed_updates)
+    clients = []
+    for peer_ip in peer_ips:
+        client = socket.create_connection(
+            ("127.0.0.1", port), source_address=(peer_ip, 0)
+        )
+        threading.Thread(target=drain, args=(client,), daemon=True).start()
+        clients.append(client)
+
+    start = time.perf_counter()
+    senders = [
+        threading.Thread(target=client.sendall, args=(stream,)) for client in clients
+    ]
+    for sender in senders:
+        sender.start()
+    for sender in senders:
+        sender.join()
+    counter.done.wait()
+    elapsed = time.perf_counter() - start
+
+    print("  %2d workers %12.0f prefixes/s" % (workers, counter.count / elapsed))
+    for client in clients:
+        client.close()
+    beka.shutdown()
+    supervisor.join()
+
+
+def main():
+    argparser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    argparser.add_argument("--workers", type=int, nargs="+", default=None)
+    argparser.add_argument("--sessions", type=int, default=8)
+    argparser.add_argument("--updates", type=int, default=20000)
+    argparser.add_argument("--prefixes-per-update", type=int, default=4)
+    args = argparser.parse_args()
+
+    worker_counts = args.workers
+    if worker_counts is None:
+        cpus = os.cpu_count() or 1
+        worker_counts = sorted({1, max(1, cpus // 2), cpus})
+
+    session_start, packed_updates = build_streams(
+        args.updates, args.prefixes_per_update
+    )
+    print(
+        "%d sessions each sending %d UPDATEs of %d prefixes, on %d CPUs:"
+        % (
+            args.sessions,
+            args.updates,
+            args.prefixes_per_update,
+            os.cpu_count() or 1,
+        )
+    )
+    for workers in worker_counts:
+        run(
+            workers,
+            args.sessions,
+            session_start,
+            packed_updates,
+            args.prefixes_per_update,
+        )
+
+
+if __name__ == "__main__":
+    main()
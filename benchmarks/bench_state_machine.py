@@ -0,0 +1,75 @@
+"""Benchmark replaying a recorded session through the StateMachine
+
+The StateMachine does no I/O, so a recorded byte stream can be framed,
+parsed and run through it deterministically, without eventlet or asyncio.
+Events are fed in the batches Chopper.feed produces, sharing one pair of
+output buffers per batch as Peering does. Run from the repository root:
+
+    PYTHONPATH=. python3 benchmarks/bench_state_machine.py
+"""
+
+import argparse
+import time
+
+from beka.bgp_message import BgpMessageParser
+from beka.chopper import Chopper
+from beka.event import EventMessageReceived
+from beka.state_machine import StateMachine
+
+from synthetic import build_streams
+
+
+def replay(stream, chunk_size, batch_route_updates):
+    state_machine = StateMachine(
+        local_as=65001,
+        peer_as=65002,
+        router_id="1.1.1.1",
+        local_address="1.1.1.1",
+        neighbor="2.2.2.2",
+        batch_route_updates=batch_route_updates,
+    )
+    parser = BgpMessageParser()
+    state_machine.open_handler = lambda capabilities: setattr(
+        parser, "capabilities", capabilities
+    )
+    chopper = Chopper(None)
+    route_count = 0
+    for offset in range(0, len(stream), chunk_size):
+        output_messages, route_updates = [], []
+        for message_type, serialised_message in chopper.feed(
+            stream[offset : offset + chunk_size]
+        ):
+            event = EventMessageReceived(parser.parse(message_type, serialised_message))
+            state_machine.event(event, 0, output_messages, route_updates)
+        route_count += sum(
+            len(route_update) if batch_route_updates else 1
+            for route_update in route_updates
+        )
+    return route_count
+
+
+def main():
+    argparser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    argparser.add_argument("--updates", type=int, default=50000)
+    argparser.add_argument("--prefixes-per-update", type=int, default=4)
+    argparser.add_argument("--chunk-size", type=int, default=65536)
+    args = argparser.parse_args()
+
+    session_start, packed_updates = build_streams(
+        args.updates, args.prefixes_per_update
+    )
+    stream = session_start + b"".join(packed_updates)
+    print("%d UPDATEs of %d prefixes:" % (args.updates, args.prefixes_per_update))
+    for batch_route_updates in (False, True):
+        start = time.perf_counter()
+        route_count = replay(stream, args.chunk_size, batch_route_updates)
+        elapsed = time.perf_counter() - start
+        assert route_count == args.updates * args.prefixes_per_update
+        print(
+            "  %-16s %9.0f routes/s"
+            % ("batched" if batch_route_updates else "per route", route_count / elapsed)
+        )
+
+
+if __name__ == "__main__":
+    main()
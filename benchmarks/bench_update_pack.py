@@ -0,0 +1,89 @@
+"""Benchmark building and packing UPDATEs for originated routes
+
+Builds the UPDATEs a StateMachine sends for a table of originated routes
+and packs them, reporting routes/s and the number of messages used. Run
+from the repository root:
+
+    PYTHONPATH=. python3 benchmarks/bench_update_pack.py
+"""
+
+import argparse
+import random
+import time
+
+from beka.bgp_message import BgpMessage, BgpMessagePacker
+from beka.ip import IP4Address, IP6Address
+from beka.route import RouteAddition
+from beka.state_machine import StateMachine
+
+from synthetic import random_ipv4_prefix, random_ipv6_prefix, random_as_path
+
+
+def build_routes(count, paths, ipv6, seed=0):
+    rand = random.Random(seed)
+    if ipv6:
+        next_hop = IP6Address.from_string("2001:db8::1")
+        random_prefix = random_ipv6_prefix
+    else:
+        next_hop = IP4Address.from_string("192.0.2.1")
+        random_prefix = random_ipv4_prefix
+    as_paths = [random_as_path(rand) for _ in range(paths)]
+    return [
+        RouteAddition(random_prefix(rand), next_hop, rand.choice(as_paths), "IGP")
+        for _ in range(count)
+    ]
+
+
+def run(routes, max_message_length):
+    state_machine = StateMachine(
+        local_as=65000,
+        peer_as=65001,
+        router_id="192.0.2.2",
+        local_address="192.0.2.2",
+        neighbor="192.0.2.1",
+    )
+    state_machine.fourbyteas = [65001]
+    state_machine.max_message_length = max_message_length
+    state_machine.routes_to_advertise = routes
+    packer = BgpMessagePacker()
+    packer.capabilities = {"fourbyteas": [65001]}
+
+    start = time.perf_counter()
+    packed_messages = [
+        packer.pack(message) for message in state_machine.build_update_messages()
+    ]
+    elapsed = time.perf_counter() - start
+
+    assert max(len(packed) for packed in packed_messages) <= max_message_length
+    print(
+        "  max %5d bytes: %6d messages %9d bytes %9.0f routes/s"
+        % (
+            max_message_length,
+            len(packed_messages),
+            sum(len(packed) for packed in packed_messages),
+            len(routes) / elapsed,
+        )
+    )
+
+
+def main():
+    argparser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    argparser.add_argument("--routes", type=int, default=100000)
+    argparser.add_argument("--paths", type=int, default=20)
+    args = argparser.parse_args()
+
+    for ipv6 in (False, True):
+        print(
+            "%d %s routes over %d paths:"
+            % (args.routes, "IPv6" if ipv6 else "IPv4", args.paths)
+        )
+        routes = build_routes(args.routes, args.paths, ipv6)
+        for max_message_length in (
+            BgpMessage.MAX_LENGTH,
+            BgpMessage.EXTENDED_MAX_LENGTH,
+        ):
+            run(routes, max_message_length)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+"""Benchmark UPDATE parsing throughput
+
+Compares BgpUpdateMessage.parse against the BytesIO based reference parser
+it replaced. Run from the repository root:
+
+    PYTHONPATH=. python3 benchmarks/bench_update_parse.py
+"""
+
+import argparse
+import struct
+import time
+from io import BytesIO
+
+from beka.bgp_message import BgpMessage, BgpMessageParser
+from beka.bgp_message import ORIGIN_CODES, prefix_byte_length
+from beka.ip import IP4Address, IP4Prefix, IP6Address, IP6Prefix
+
+from synthetic import build_update_bodies
+
+
+def reference_parse_prefixes(stream, prefix_class, address_length):
+    prefixes = []
+    while True:
+        serialised_length = stream.read(1)
+        if len(serialised_length) == 0:
+            break
+        prefix_length = ord(serialised_length)
+        packed_prefix = stream.read(prefix_byte_length(prefix_length))
+        packed_prefix += b"\x00" * (address_length - len(packed_prefix))
+        prefixes.append(prefix_class(packed_prefix, prefix_length))
+    return prefixes
+
+
+def reference_parse_as4_path(packed_as_path):
+    stream = BytesIO(packed_as_path)
+    as_numbers = []
+    while True:
+        packed_type_and_count = stream.read(2)
+        if len(packed_type_and_count) == 0:
+            break
+        _type_code, count = struct.unpack("!BB", packed_type_and_count)
+        as_numbers += struct.unpack("!" + ("I" * count), stream.read(count * 4))
+    return " ".join(["%d" % x for x in as_numbers])
+
+
+def reference_parse_mp_reach_nlri(packed):
+    stream = BytesIO(packed)
+    _afi, _safi, next_hop_length = struct.unpack("!HBB", stream.read(4))
+    next_hops = [IP6Address(stream.read(16)) for _ in range(next_hop_length // 16)]
+    stream.read(1)
+    return {
+        "next_hop": next_hops,
+        "nlri": reference_parse_prefixes(stream, IP6Prefix, 16),
+    }
+
+
+REFERENCE_ATTRIBUTE_PARSERS = {
+    1: ("origin", lambda packed: ORIGIN_CODES[ord(packed)]),
+    2: ("as_path", reference_parse_as4_path),
+    3: ("next_hop", IP4Address),
+    14: ("mp_reach_nlri", reference_parse_mp_reach_nlri),
+}
+
+
+def reference_parse(serialised_message):
+    """The BytesIO based UPDATE parser, kept for comparison"""
+
+    stream = BytesIO(serialised_message)
+    (withdrawn_length,) = struct.unpack("!H", stream.read(2))
+    withdrawn = reference_parse_prefixes(
+        BytesIO(stream.read(withdrawn_length)), IP4Prefix, 4
+    )
+    (attributes_length,) = struct.unpack("!H", stream.read(2))
+    attribute_stream = BytesIO(stream.read(attributes_length))
+    path_attributes = {}
+    while True:
+        header = attribute_stream.read(2)
+        if len(header) == 0:
+            break
+        flags, type_code = struct.unpack("!BB", header)
+        if flags & 0x10:
+            (length,) = struct.unpack("!H", attribute_stream.read(2))
+        else:
+            (length,) = struct.unpack("!B", attribute_stream.read(1))
+        packed = attribute_stream.read(length)
+        if type_code in REFERENCE_ATTRIBUTE_PARSERS:
+            key, parser = REFERENCE_ATTRIBUTE_PARSERS[type_code]
+            path_attributes[key] = parser(packed)
+    nlri = reference_parse_prefixes(stream, IP4Prefix, 4)
+    return withdrawn, path_attributes, nlri
+
+
+def run(name, parse, bodies, prefix_count, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for body in bodies:
+            parse(body)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    print(
+        "%-10s %10.0f updates/s %12.0f prefixes/s"
+        % (name, len(bodies) / best, prefix_count / best)
+    )
+    return best
+
+
+def main():
+    argparser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    argparser.add_argument("--updates", type=int, default=20000)
+    argparser.add_argument("--prefixes-per-update", type=int, default=8)
+    argparser.add_argument("--repeat", type=int, default=3)
+    args = argparser.parse_args()
+
+    parser = BgpMessageParser()
+    parser.capabilities = {"fourbyteas": [65000]}
+
+    for ipv6 in (False, True):
+        bodies = build_update_bodies(args.updates, args.prefixes_per_update, ipv6=ipv6)
+        prefix_count = args.updates * args.prefixes_per_update
+        print("IPv6 UPDATEs:" if ipv6 else "IPv4 UPDATEs:")
+        reference = run("reference", reference_parse, bodies, prefix_count, args.repeat)
+        current = run(
+            "beka",
+            lambda body: parser.parse(BgpMessage.UPDATE_MESSAGE, body),
+            bodies,
+            prefix_count,
+            args.repeat,
+        )
+        print("speedup    %10.2fx" % (reference / current))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,339 @@
+"""Replay a recorded BGP session through each stage of beka
+
+The session is a file of wire format messages, as written by synthetic.py
+(or captured from a real peer), starting with the peer's OPEN. It is
+replayed through:
+
+    chopper        framing with Chopper.feed
+    parser         BgpMessageParser.parse of each framed message
+    state_machine  framing, parsing and StateMachine.event, batch by batch
+    peering        a Peering on an eventlet socketpair, until every route
+                   has reached the route handler
+
+Each stage runs in its own process so that its peak RSS can be reported.
+Results are written as JSON for regression tracking. Run from the
+repository root:
+
+    PYTHONPATH=. python3 benchmarks/replay.py --json results.json
+    PYTHONPATH=. python3 benchmarks/replay.py --input table.bgp --stage parser
+"""
+
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+from beka.bgp_message import BgpMessage, BgpMessageParser
+from beka.chopper import Chopper
+from beka.event import EventMessageReceived
+from beka.state_machine import StateMachine
+
+from synthetic import build_full_table
+
+STAGES = ["chopper", "parser", "state_machine", "peering"]
+CHUNK_SIZE = 65536
+
+
+def percentiles(latencies):
+    """Return latency percentiles in microseconds"""
+    if not latencies:
+        return {}
+    latencies = sorted(latencies)
+    last = len(latencies) - 1
+    return {
+        "p50": latencies[last // 2] * 1e6,
+        "p90": latencies[last * 90 // 100] * 1e6,
+        "p99": latencies[last * 99 // 100] * 1e6,
+        "max": latencies[last] * 1e6,
+    }
+
+
+def peak_rss_kib():
+    # ru_maxrss is in KiB on Linux and in bytes on macOS
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        peak_rss //= 1024
+    return peak_rss
+
+
+def chunks(stream):
+    for offset in range(0, len(stream), CHUNK_SIZE):
+        yield stream[offset : offset + CHUNK_SIZE]
+
+
+def frame(stream):
+    chopper = Chopper(None)
+    messages = []
+    for chunk in chunks(stream):
+        messages.extend(chopper.feed(chunk))
+    return messages
+
+
+def parse(messages):
+    """Parse framed messages with the capabilities of the leading OPEN"""
+    parser = BgpMessageParser()
+    parser.capabilities = parser.parse(*messages[0]).capabilities
+    return [
+        parser.parse(message_type, serialised_message)
+        for message_type, serialised_message in messages
+    ]
+
+
+def count_prefixes(message):
+    if not isinstance(message, BgpMessage) or message.MSG_TYPE != 2:
+        return 0
+    count = len(message.nlri) + len(message.withdrawn_routes)
+    for key, field in (
+        ("mp_reach_nlri", "nlri"),
+        ("mp_unreach_nlri", "withdrawn_routes"),
+    ):
+        if key in message.path_attributes:
+            count += len(message.path_attributes[key][field])
+    return count
+
+
+def build_state_machine():
+    return StateMachine(
+        local_as=65001,
+        peer_as=65002,
+        router_id="1.1.1.1",
+        local_address="1.1.1.1",
+        neighbor="2.2.2.2",
+    )
+
+
+def result(messages, prefixes, elapsed, latencies):
+    return {
+        "messages": messages,
+        "prefixes": prefixes,
+        "seconds": elapsed,
+        "messages_per_second": messages / elapsed,
+        "prefixes_per_second": prefixes / elapsed,
+        "latency_us": percentiles(latencies),
+    }
+
+
+def run_chopper(stream):
+    """Latencies are per CHUNK_SIZE chunk of input"""
+    chopper = Chopper(None)
+    messages = 0
+    latencies = []
+    start = time.perf_counter()
+    for chunk in chunks(stream):
+        chunk_start = time.perf_counter()
+        messages += len(chopper.feed(chunk))
+        latencies.append(time.perf_counter() - chunk_start)
+    elapsed = time.perf_counter() - start
+    return result(messages, 0, elapsed, latencies)
+
+
+def run_parser(stream):
+    """Latencies are per message"""
+    messages = frame(stream)
+    parser = BgpMessageParser()
+    parser.capabilities = parser.parse(*messages[0]).capabilities
+    parsed = []
+    latencies = []
+    start = time.perf_counter()
+    for message_type, serialised_message in messages:
+        message_start = time.perf_counter()
+        parsed.append(parser.parse(message_type, serialised_message))
+        latencies.append(time.perf_counter() - message_start)
+    elapsed = time.perf_counter() - start
+    prefixes = sum(count_prefixes(message) for message in parsed)
+    return result(len(messages), prefixes, elapsed, latencies)
+
+
+def run_state_machine(stream):
+    """Latencies are per CHUNK_SIZE chunk of input, from framing to the
+    route updates coming out of the state machine"""
+    state_machine = build_state_machine()
+    parser = BgpMessageParser()
+    state_machine.open_handler = lambda capabilities: setattr(
+        parser, "capabilities", capabilities
+    )
+    chopper = Chopper(None)
+    messages = 0
+    routes = 0
+    latencies = []
+    start = time.perf_counter()
+    for chunk in chunks(stream):
+        chunk_start = time.perf_counter()
+        output_messages, route_updates = [], []
+        for message_type, serialised_message in chopper.feed(chunk):
+            event = EventMessageReceived(parser.parse(message_type, serialised_message))
+            state_machine.event(event, 0, output_messages, route_updates)
+            messages += 1
+        routes += len(route_updates)
+        latencies.append(time.perf_counter() - chunk_start)
+    elapsed = time.perf_counter() - start
+    return result(messages, routes, elapsed, latencies)
+
+
+def run_peering(stream):
+    """Latencies are for single UPDATEs sent once the table is loaded, from
+    the send until their routes reach the route handler"""
+    import eventlet  # pylint: disable=import-outside-toplevel
+    from eventlet.green import socket  # pylint: disable=import-outside-toplevel
+    from beka.peering import Peering  # pylint: disable=import-outside-toplevel
+
+    messages = frame(stream)
+    prefix_counts = [count_prefixes(message) for message in parse(messages)]
+    prefixes = sum(prefix_counts)
+    ours, theirs = socket.socketpair()
+    routes = []
+    waiting = {}
+
+    def route_handler(route_update):
+        routes.append(route_update)
+        if len(routes) == waiting.get("count"):
+            waiting["done"].send()
+
+    def wait_for(count):
+        if len(routes) >= count:
+            return
+        waiting["count"] = count
+        waiting["done"] = eventlet.event.Event()
+        waiting["done"].wait()
+
+    peering = Peering(build_state_machine(), ("2.2.2.2", 179), ours, route_handler)
+    pool = eventlet.GreenPool()
+    greenthreads = [pool.spawn(peering.run)]
+
+    def drain():
+        while theirs.recv(65536):
+            pass
+
+    greenthreads.append(pool.spawn(drain))
+
+    start = time.perf_counter()
+    theirs.sendall(stream)
+    wait_for(prefixes)
+    elapsed = time.perf_counter() - start
+
+    latencies = []
+    samples = [
+        (message, prefix_count)
+        for message, prefix_count in zip(messages, prefix_counts)
+        if prefix_count
+    ][:1000]
+    for (message_type, serialised_message), prefix_count in samples:
+        packed = (
+            BgpMessage.MARKER
+            + (BgpMessage.HEADER_LENGTH + len(serialised_message)).to_bytes(2, "big")
+            + bytes((message_type,))
+            + serialised_message
+        )
+        count = len(routes) + prefix_count
+        sent = time.perf_counter()
+        theirs.sendall(packed)
+        wait_for(count)
+        latencies.append(time.perf_counter() - sent)
+
+    for greenthread in greenthreads + peering.eventlets:
+        greenthread.kill()
+    theirs.close()
+    ours.close()
+    return result(len(messages), prefixes, elapsed, latencies)
+
+
+RUNNERS = {
+    "chopper": run_chopper,
+    "parser": run_parser,
+    "state_machine": run_state_machine,
+    "peering": run_peering,
+}
+
+
+def run_stage(stage, path):
+    with open(path, "rb") as stream_file:
+        stream = stream_file.read()
+    stage_result = RUNNERS[stage](stream)
+    stage_result["peak_rss_kib"] = peak_rss_kib()
+    return stage_result
+
+
+def run_stage_in_subprocess(stage, path):
+    output = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), "--input", path, "--stage", stage],
+        check=True,
+        stdout=subprocess.PIPE,
+    ).stdout
+    return json.loads(output)["stages"][stage]
+
+
+def report(stage, stage_result):
+    latency = stage_result["latency_us"]
+    sys.stderr.write(
+        "  %-13s %10.0f messages/s %11.0f prefixes/s  p50 %8.1f us  p99 %8.1f us"
+        "  peak RSS %6.1f MiB\n"
+        % (
+            stage,
+            stage_result["messages_per_second"],
+            stage_result["prefixes_per_second"],
+            latency.get("p50", 0),
+            latency.get("p99", 0),
+            stage_result["peak_rss_kib"] / 1024,
+        )
+    )
+
+
+def main():
+    argparser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    argparser.add_argument("--input", help="recorded session to replay")
+    argparser.add_argument("--ipv4", type=int, default=200000)
+    argparser.add_argument("--ipv6", type=int, default=40000)
+    argparser.add_argument("--seed", type=int, default=0)
+    argparser.add_argument("--stage", choices=STAGES, action="append")
+    argparser.add_argument("--json", help="write results here, - for stdout")
+    args = argparser.parse_args()
+
+    path = args.input
+    if path is None:
+        # pylint: disable=consider-using-with
+        stream_file = tempfile.NamedTemporaryFile(suffix=".bgp", delete=False)
+        session_start, packed_updates = build_full_table(
+            args.ipv4, args.ipv6, args.seed
+        )
+        stream_file.write(session_start + b"".join(packed_updates))
+        stream_file.close()
+        path = stream_file.name
+
+    results = {
+        "benchmark": "replay",
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "stream": {"path": args.input, "bytes": os.path.getsize(path)},
+        "stages": {},
+    }
+    if args.input is None:
+        results["stream"].update(ipv4=args.ipv4, ipv6=args.ipv6, seed=args.seed)
+
+    try:
+        if args.stage and len(args.stage) == 1 and args.json is None:
+            # a single stage, run in this process by run_stage_in_subprocess
+            results["stages"][args.stage[0]] = run_stage(args.stage[0], path)
+            json.dump(results, sys.stdout)
+            return
+        for stage in args.stage or STAGES:
+            results["stages"][stage] = run_stage_in_subprocess(stage, path)
+            report(stage, results["stages"][stage])
+    finally:
+        if args.input is None:
+            os.unlink(path)
+
+    if args.json == "-":
+        json.dump(results, sys.stdout, indent=2)
+        sys.stdout.write("\n")
+    elif args.json:
+        with open(args.json, "w", encoding="utf-8") as json_file:
+            json.dump(results, json_file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
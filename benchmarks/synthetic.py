@@ -0,0 +1,253 @@
+"""Synthetic BGP UPDATE streams for the benchmarks
+
+Run as a script to write a full table session to a file for replay.py:
+
+    PYTHONPATH=. python3 benchmarks/synthetic.py --output table.bgp
+"""
+
+import argparse
+import random
+import struct
+
+from beka.bgp_message import BgpMessage, BgpMessagePacker, BgpUpdateMessage
+from beka.bgp_message import BgpKeepaliveMessage, BgpOpenMessage
+from beka.bgp_message import UpdateMessageBuilder
+from beka.ip import IP4Address, IP4Prefix
+from beka.ip import IP6Address, IP6Prefix
+
+
+def random_ipv4_prefix(rand):
+    length = rand.choice([16, 19, 20, 21, 22, 22, 23, 24, 24, 24, 24, 24])
+    address = rand.getrandbits(length) << (32 - length)
+    return IP4Prefix(struct.pack("!I", address), length)
+
+
+def random_ipv6_prefix(rand):
+    length = rand.choice([29, 32, 32, 36, 40, 44, 48, 48, 48, 48])
+    address = (0x2 << 125) | (rand.getrandbits(length - 3) << (128 - length))
+    return IP6Prefix(address.to_bytes(16, "big"), length)
+
+
+def random_as_path(rand):
+    return " ".join("%d" % rand.randint(1, 400000) for _ in range(rand.randint(1, 7)))
+
+
+def build_update_messages(count, prefixes_per_update=8, ipv6=False, seed=0):
+    """Build a list of BgpUpdateMessage objects with random paths"""
+
+    rand = random.Random(seed)
+    messages = []
+    for _ in range(count):
+        as_path = random_as_path(rand)
+        if ipv6:
+            nlri = [random_ipv6_prefix(rand) for _ in range(prefixes_per_update)]
+            path_attributes = {
+                "origin": "IGP",
+                "as_path": as_path,
+                "mp_reach_nlri": {
+                    "next_hop": [IP6Address.from_string("2001:db8::1")],
+                    "nlri": nlri,
+                },
+            }
+            messages.append(BgpUpdateMessage([], path_attributes, []))
+        else:
+            nlri = [random_ipv4_prefix(rand) for _ in range(prefixes_per_update)]
+            path_attributes = {
+                "origin": "IGP",
+                "as_path": as_path,
+                "next_hop": IP4Address.from_string("192.0.2.1"),
+            }
+            messages.append(BgpUpdateMessage([], path_attributes, nlri))
+    return messages
+
+
+def build_update_bodies(count, prefixes_per_update=8, ipv6=False, seed=0):
+    """Build serialised UPDATE bodies (without the 19 byte header)"""
+
+    packer = BgpMessagePacker()
+    packer.capabilities = {"fourbyteas": [65000]}
+    return [
+        packer.pack(message)[BgpMessage.HEADER_LENGTH :]
+        for message in build_update_messages(count, prefixes_per_update, ipv6, seed)
+    ]
+
+
+def build_streams(updates, prefixes_per_update):
+    """Build the packed OPEN and KEEPALIVE a peer starts with, and a list
+    of packed UPDATEs to follow them"""
+
+    packer = BgpMessagePacker()
+    session_start = packer.pack(
+        BgpOpenMessage(
+            4,
+            65002,
+            240,
+            IP4Address.from_string("2.2.2.2"),
+            {"fourbyteas": [65002]},
+        )
+    ) + packer.pack(BgpKeepaliveMessage())
+    packer.capabilities = {"fourbyteas": [65002]}
+    packed_updates = [
+        packer.pack(message)
+        for message in build_update_messages(updates, prefixes_per_update)
+    ]
+    return session_start, packed_updates
+
+
+# prefix lengths and how common they are, roughly as in a full table
+IPV4_LENGTHS = {
+    8: 1,
+    12: 2,
+    14: 6,
+    16: 130,
+    17: 80,
+    18: 140,
+    19: 250,
+    20: 380,
+    21: 420,
+    22: 1100,
+    23: 800,
+    24: 5900,
+}
+IPV6_LENGTHS = {
+    28: 30,
+    29: 300,
+    32: 1300,
+    33: 70,
+    34: 60,
+    36: 500,
+    40: 800,
+    44: 850,
+    46: 250,
+    47: 200,
+    48: 5300,
+    56: 50,
+    64: 40,
+}
+PATH_LENGTHS = {1: 2, 2: 10, 3: 28, 4: 30, 5: 17, 6: 8, 7: 3, 8: 1, 10: 1}
+
+
+def weighted_choices(rand, weights, count):
+    return rand.choices(list(weights), list(weights.values()), k=count)
+
+
+def table_as_path(rand, transit):
+    """An AS path from a few busy transit ASes to an origin, sometimes
+    prepended by the origin"""
+    hops = weighted_choices(rand, PATH_LENGTHS, 1)[0]
+    path = [rand.choice(transit) for _ in range(hops - 1)]
+    origin = rand.randint(1, 400000)
+    path.append(origin)
+    if rand.random() < 0.1:
+        path.extend([origin] * rand.randint(1, 4))
+    return " ".join("%d" % number for number in path)
+
+
+def table_prefixes(rand, count, lengths, width, prefix_class, top_bits=0):
+    """Return count distinct prefixes with lengths drawn from lengths"""
+    prefixes = set()
+    while len(prefixes) < count:
+        for length in weighted_choices(rand, lengths, count - len(prefixes)):
+            address = rand.getrandbits(length) << (width - length)
+            if top_bits:
+                address |= top_bits
+            prefixes.add(prefix_class(address.to_bytes(width // 8, "big"), length))
+    return sorted(prefixes)
+
+
+def origin_sizes(rand, count):
+    """Split count prefixes between origins: most announce one or two,
+    a few announce hundreds"""
+    sizes = []
+    while count > 0:
+        size = min(count, int(rand.paretovariate(1.2)))
+        sizes.append(size)
+        count -= size
+    return sizes
+
+
+def chunked(prefixes, size):
+    if size is None:
+        return [prefixes]
+    return [
+        prefixes[offset : offset + size] for offset in range(0, len(prefixes), size)
+    ]
+
+
+def build_full_table(ipv4_prefixes, ipv6_prefixes, seed=0, prefixes_per_update=None):
+    """Build the packed OPEN and KEEPALIVE a full table peer starts with,
+    and the packed UPDATEs that carry its table
+
+    Prefixes from the same origin share an AS path and are packed into as
+    few UPDATEs as possible, or into UPDATEs of at most prefixes_per_update
+    prefixes, as sent by speakers that do not pack NLRI. The output only
+    depends on the arguments.
+    """
+    rand = random.Random(seed)
+    transit = [rand.randint(1, 65000) for _ in range(40)]
+    builder = UpdateMessageBuilder(fourbyteas=True)
+    packer = BgpMessagePacker()
+    capabilities = {
+        "fourbyteas": [65002],
+        "multiprotocol": ["ipv4-unicast", "ipv6-unicast"],
+    }
+    session_start = packer.pack(
+        BgpOpenMessage(4, 65002, 240, IP4Address.from_string("2.2.2.2"), capabilities)
+    ) + packer.pack(BgpKeepaliveMessage())
+    packer.capabilities = capabilities
+
+    messages = []
+    ipv4 = table_prefixes(rand, ipv4_prefixes, IPV4_LENGTHS, 32, IP4Prefix)
+    rand.shuffle(ipv4)
+    next_hop = IP4Address.from_string("192.0.2.1")
+    offset = 0
+    for size in origin_sizes(rand, len(ipv4)):
+        path_attributes = {
+            "origin": "IGP",
+            "as_path": table_as_path(rand, transit),
+            "next_hop": next_hop,
+        }
+        nlri = sorted(ipv4[offset : offset + size])
+        for chunk in chunked(nlri, prefixes_per_update):
+            messages.extend(builder.ipv4_updates(path_attributes, chunk))
+        offset += size
+
+    # IPv6 unicast is allocated from 2000::/3
+    ipv6 = table_prefixes(rand, ipv6_prefixes, IPV6_LENGTHS, 128, IP6Prefix, 1 << 125)
+    rand.shuffle(ipv6)
+    next_hops = [IP6Address.from_string("2001:db8::1")]
+    offset = 0
+    for size in origin_sizes(rand, len(ipv6)):
+        path_attributes = {"origin": "IGP", "as_path": table_as_path(rand, transit)}
+        nlri = sorted(ipv6[offset : offset + size])
+        for chunk in chunked(nlri, prefixes_per_update):
+            messages.extend(builder.ipv6_updates(path_attributes, next_hops, chunk))
+        offset += size
+
+    return session_start, [packer.pack(message) for message in messages]
+
+
+def main():
+    argparser = argparse.ArgumentParser(description="Write a synthetic full table")
+    argparser.add_argument("--ipv4", type=int, default=950000)
+    argparser.add_argument("--ipv6", type=int, default=200000)
+    argparser.add_argument("--seed", type=int, default=0)
+    argparser.add_argument("--prefixes-per-update", type=int)
+    argparser.add_argument("--output", required=True)
+    args = argparser.parse_args()
+
+    session_start, packed_updates = build_full_table(
+        args.ipv4, args.ipv6, args.seed, args.prefixes_per_update
+    )
+    with open(args.output, "wb") as stream:
+        stream.write(session_start)
+        for packed_update in packed_updates:
+            stream.write(packed_update)
+    print(
+        "Wrote %d UPDATEs carrying %d IPv4 and %d IPv6 prefixes to %s"
+        % (len(packed_updates), args.ipv4, args.ipv6, args.output)
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -5,6 +5,7 @@ import yaml
 from eventlet import GreenPool
 
 from beka.beka import Beka
+from beka.shard import ShardedBeka
 
 
 def printmsg(msg):
@@ -26,7 +27,7 @@ class Server:
             config = yaml.safe_load(file.read())
         for router in config["routers"]:
             printmsg("Starting Beka on %s" % router["local_address"])
-            beka = Beka(
+            args = (
                 router["local_address"],
                 router["bgp_port"],
                 router["local_as"],
@@ -36,6 +37,19 @@ class Server:
                 self.route_handler,
                 self.error_handler,
             )
+            if "workers" in router and "metrics_port" in router:
+                # each worker has its own peerings, and no exporter
+                raise ValueError(
+                    "Router %s: metrics_port is not supported with workers"
+                    % router["local_address"]
+                )
+            if "workers" in router:
+                beka = ShardedBeka(*args, workers=router["workers"])
+            elif "metrics_port" in router:
+                metrics_address = (router["local_address"], router["metrics_port"])
+                beka = Beka(*args, metrics_address=metrics_address)
+            else:
+                beka = Beka(*args)
             for peer in router["peers"]:
                 beka.add_neighbor(
                     "passive",
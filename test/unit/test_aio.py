@@ -0,0 +1,207 @@
+import asyncio
+import struct
+import unittest
+
+from beka.aio import AsyncBeka, BekaProtocol, BgpProtocol
+from beka.bgp_message import BgpMessage, BgpMessagePacker, BgpMessageParser
+from beka.bgp_message import BgpKeepaliveMessage, BgpOpenMessage, BgpUpdateMessage
+from beka.chopper import Chopper
+from beka.ip import IP4Address, IP4Prefix
+from beka.metrics import MetricsExporter
+from beka.route import RouteAddition
+from beka.state_machine import StateMachine
+
+
+class FakeTransport:  # pylint: disable=too-few-public-methods
+    """Mocked asyncio Transport"""
+
+    def __init__(self):
+        self.written = b""
+        self.closed = False
+        self.reading = True
+
+    def get_extra_info(self, name):  # pylint: disable=unused-argument
+        return ("2.2.2.2", 179)
+
+    def write(self, data):
+        self.written += data
+
+    def close(self):
+        self.closed = True
+
+    def pause_reading(self):
+        self.reading = False
+
+    def resume_reading(self):
+        self.reading = True
+
+
+def pack_messages(*messages):
+    packer = BgpMessagePacker()
+    return b"".join(packer.pack(message) for message in messages)
+
+
+def parse_messages(data):
+    parser = BgpMessageParser()
+    return [
+        parser.parse(message_type, body)
+        for message_type, body in Chopper(None).feed(data)
+    ]
+
+
+OPEN_MESSAGE = BgpOpenMessage(
+    4,
+    65002,
+    240,
+    IP4Address.from_string("2.2.2.2"),
+    {"multiprotocol": ["ipv4-unicast"]},
+)
+
+
+class BgpProtocolTestCase(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.route_updates = []
+        self.errors = []
+        self.state_machine = StateMachine(
+            local_as=65001,
+            peer_as=65002,
+            local_address="1.1.1.1",
+            router_id="1.1.1.1",
+            neighbor="2.2.2.2",
+        )
+        self.state_machine.routes_to_advertise = [
+            RouteAddition(
+                IP4Prefix.from_string("10.0.0.0/8"),
+                IP4Address.from_string("1.1.1.1"),
+                "",
+                "IGP",
+            )
+        ]
+        self.transport = FakeTransport()
+
+    def build_protocol(self, route_handler=None):
+        protocol = BgpProtocol(
+            self.state_machine,
+            route_handler=route_handler,
+            error_handler=self.errors.append,
+        )
+        protocol.connection_made(self.transport)
+        return protocol
+
+    async def test_session_establishes_and_advertises_routes(self):
+        protocol = self.build_protocol(self.route_updates.append)
+        data = pack_messages(OPEN_MESSAGE, BgpKeepaliveMessage())
+        # deliver the data in awkward pieces
+        for index in range(0, len(data), 7):
+            protocol.data_received(data[index : index + 7])
+        self.assertEqual(self.state_machine.state, "established")
+        messages = parse_messages(self.transport.written)
+        self.assertEqual(
+            [type(message) for message in messages],
+            [BgpOpenMessage, BgpKeepaliveMessage, BgpUpdateMessage],
+        )
+        self.assertEqual(messages[2].nlri, [IP4Prefix.from_string("10.0.0.0/8")])
+        self.assertEqual(protocol.messages_sent, 3)
+        protocol.connection_lost(None)
+
+    async def test_route_updates_iterates_until_connection_lost(self):
+        protocol = self.build_protocol()
+        update = BgpUpdateMessage(
+            [],
+            {
+                "next_hop": IP4Address.from_string("2.2.2.2"),
+                "as_path": "65002",
+                "origin": "IGP",
+            },
+            [IP4Prefix.from_string("192.168.0.0/16")],
+        )
+        protocol.data_received(
+            pack_messages(OPEN_MESSAGE, BgpKeepaliveMessage(), update)
+        )
+        protocol.connection_lost(None)
+        route_updates = [
+            route_update async for route_update in protocol.route_updates()
+        ]
+        self.assertEqual(
+            [route_update.prefix for route_update in route_updates],
+            [IP4Prefix.from_string("192.168.0.0/16")],
+        )
+        self.assertIsNone(await protocol.closed)
+
+    async def test_bad_marker_closes_session(self):
+        protocol = self.build_protocol()
+        protocol.data_received(b"\x00" * 19)
+        self.assertTrue(self.transport.closed)
+        self.assertEqual(self.errors, ["Peering 2.2.2.2: BGP marker missing"])
+        protocol.connection_lost(None)
+
+    async def test_pause_writing_pauses_reading(self):
+        protocol = self.build_protocol()
+        protocol.pause_writing()
+        self.assertFalse(self.transport.reading)
+        protocol.resume_writing()
+        self.assertTrue(self.transport.reading)
+        protocol.connection_lost(None)
+
+
+class AsyncBekaTestCase(unittest.IsolatedAsyncioTestCase):
+    def test_unsupported_arguments_are_rejected(self):
+        args = ("127.0.0.1", 179, 65001, "1.1.1.1", None, None, None, None)
+        for kwargs in (
+            {"batch_route_handler": print},
+            {"parse_pool": object()},
+            {"metrics_address": ("127.0.0.1", 9179)},
+        ):
+            with self.assertRaises(ValueError):
+                AsyncBeka(*args, **kwargs)
+        beka = AsyncBeka(*args)
+        self.assertIsNone(beka.timer_scheduler)
+        self.assertIsNone(beka.metrics_exporter)
+
+    async def test_peering_over_tcp(self):
+        events = []
+        beka = AsyncBeka(
+            local_address="127.0.0.1",
+            bgp_port=179,
+            local_as=65001,
+            router_id="1.1.1.1",
+            peer_up_handler=lambda *peer: events.append(("up",) + peer),
+            peer_down_handler=lambda *peer: events.append(("down",) + peer),
+            route_handler=None,
+            error_handler=None,
+        )
+        beka.add_neighbor("passive", "127.0.0.1", 65002)
+        beka.add_route("10.0.0.0/8", "1.1.1.1")
+        loop = asyncio.get_running_loop()
+        server = await loop.create_server(lambda: BekaProtocol(beka), "127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        writer.write(pack_messages(OPEN_MESSAGE, BgpKeepaliveMessage()))
+        data = b""
+        while len(parse_messages(data)) < 3:
+            data += await reader.read(4096)
+        self.assertEqual(
+            parse_messages(data)[2].nlri, [IP4Prefix.from_string("10.0.0.0/8")]
+        )
+        self.assertEqual(len(beka.peerings), 1)
+        [(peer_address, state)] = beka.neighbor_states()
+        self.assertEqual(peer_address, "127.0.0.1")
+        self.assertEqual(state["info"]["messages_received"]["open"], 1)
+        self.assertEqual(state["info"]["messages_sent"]["update"], 1)
+        self.assertIn(
+            'beka_messages_received_total{peer="127.0.0.1",type="keepalive"} 1',
+            MetricsExporter(beka).render().splitlines(),
+        )
+
+        beka.shutdown()
+        self.assertEqual(
+            await reader.read(), struct.pack("!16sHBBB", BgpMessage.MARKER, 21, 3, 6, 0)
+        )
+        writer.close()
+        server.close()
+        await server.wait_closed()
+        self.assertEqual(
+            events, [("up", "127.0.0.1", 65002), ("down", "127.0.0.1", 65002)]
+        )
+        self.assertEqual(beka.peerings, [])
@@ -0,0 +1,100 @@
+import pickle
+import unittest
+from unittest.mock import patch
+
+from beka.as_path import AsPath, AS_SET, AS_SEQUENCE
+
+
+class AsPathTestCase(unittest.TestCase):
+    def test_string_round_trip(self):
+        for string in ("", "65001", "65001 65002 {65003 65004} 65005"):
+            self.assertEqual(str(AsPath.from_string(string)), string)
+
+    def test_equal_to_and_hashes_like_string(self):
+        as_path = AsPath.from_string("65001 65002")
+        self.assertEqual(as_path, "65001 65002")
+        self.assertNotEqual(as_path, "65001")
+        self.assertEqual(hash(as_path), hash("65001 65002"))
+        self.assertIn("65001 65002", {as_path: True})
+
+    def test_identical_paths_are_interned(self):
+        as_path = AsPath.from_string("65001 65002")
+        self.assertIs(AsPath.from_sequence([65001, 65002]), as_path)
+        self.assertIs(AsPath.unpack(as_path.pack(2), 2), as_path)
+        self.assertIs(AsPath.unpack(as_path.pack(4), 4), as_path)
+        self.assertIs(pickle.loads(pickle.dumps(as_path)), as_path)
+
+    def test_intern_table_is_emptied_when_full(self):
+        with patch.object(AsPath, "MAX_INTERNED", 2), patch.object(
+            AsPath, "_interned", {}
+        ):
+            first = AsPath.unpack(bytes.fromhex("02010000fde9"), 4)
+            self.assertIs(AsPath.unpack(bytes.fromhex("02010000fde9"), 4), first)
+            AsPath.unpack(bytes.fromhex("02010000fdea"), 4)
+            AsPath.unpack(bytes.fromhex("02010000fdeb"), 4)
+            self.assertEqual(len(AsPath._interned), 1)
+            self.assertEqual(AsPath.unpack(bytes.fromhex("02010000fde9"), 4), first)
+
+    def test_unpack_interns_paths_with_empty_segments(self):
+        as_path = AsPath.from_string("65001 65002")
+        packed = bytes.fromhex("0200" + "02020000fde90000fdea")
+        self.assertIs(AsPath.unpack(packed, 4), as_path)
+        self.assertIs(AsPath.unpack(packed, 4), as_path)
+        self.assertEqual(as_path.pack(4), bytes.fromhex("02020000fde90000fdea"))
+
+    def test_unpack_preserves_as_set(self):
+        packed = bytes.fromhex("0201fdea" + "0102fdebfdec")
+        as_path = AsPath.unpack(packed, 2)
+        self.assertEqual(
+            [
+                (segment_type, list(numbers))
+                for segment_type, numbers in as_path.segments
+            ],
+            [(AS_SEQUENCE, [65002]), (AS_SET, [65003, 65004])],
+        )
+        self.assertEqual(as_path.pack(2), packed)
+        self.assertEqual(str(as_path), "65002 {65003 65004}")
+
+    def test_pack(self):
+        as_path = AsPath.from_string("65001 4200000000")
+        self.assertEqual(as_path.pack(4).hex(), "02020000fde9fa56ea00")
+        # 4 byte AS numbers become AS_TRANS in 2 byte paths
+        self.assertEqual(as_path.pack(2).hex(), "0202fde95ba0")
+        self.assertEqual(AsPath.from_string("").pack(4), b"")
+
+    def test_long_sequences_are_split_into_segments(self):
+        as_path = AsPath.from_sequence(range(1, 301))
+        packed = as_path.pack(4)
+        self.assertEqual(packed[:2], bytes((AS_SEQUENCE, 255)))
+        self.assertEqual(packed[2 + 255 * 4 : 4 + 255 * 4], bytes((AS_SEQUENCE, 45)))
+        self.assertEqual(len(AsPath.unpack(packed)), 300)
+
+    def test_length_membership_and_loops(self):
+        as_path = AsPath.from_string("65001 65002 {65003 65004}")
+        self.assertEqual(len(as_path), 3)
+        self.assertEqual(list(as_path), [65001, 65002, 65003, 65004])
+        self.assertIn(65004, as_path)
+        self.assertTrue(as_path.has_loop(65003))
+        self.assertFalse(as_path.has_loop(65005))
+        self.assertFalse(AsPath.from_string(""))
+
+    def test_prepend(self):
+        as_path = AsPath.from_string("65002 {65003 65004}")
+        self.assertEqual(as_path.prepend(65001, 2), "65001 65001 65002 {65003 65004}")
+        self.assertEqual(AsPath.from_string("{65003}").prepend(65001), "65001 {65003}")
+        self.assertEqual(AsPath.from_string("").prepend(65001), "65001")
+        self.assertEqual(str(as_path), "65002 {65003 65004}")
+
+    def test_first_and_origin_as(self):
+        as_path = AsPath.from_string("65001 65002 65003")
+        self.assertEqual(as_path.first_as(), 65001)
+        self.assertEqual(as_path.origin_as(), 65003)
+        self.assertIsNone(AsPath.from_string("65001 {65003 65004}").origin_as())
+
+    def test_bad_input_raises(self):
+        with self.assertRaises(ValueError):
+            AsPath.unpack(bytes.fromhex("0203fde9"), 2)
+        with self.assertRaises(ValueError):
+            AsPath.unpack(bytes.fromhex("0501fde9"), 2)
+        with self.assertRaises(ValueError):
+            AsPath.from_string("65001 {65002")
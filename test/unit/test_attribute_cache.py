@@ -0,0 +1,30 @@
+import unittest
+
+from beka.attribute_cache import AttributeCache
+
+
+class AttributeCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.cache = AttributeCache(max_size=2)
+
+    def test_get_counts_hits_and_misses(self):
+        self.assertIsNone(self.cache.get(b"a"))
+        self.cache.put(b"a", {"origin": "IGP"})
+        self.assertEqual(self.cache.get(b"a"), {"origin": "IGP"})
+        self.assertEqual(
+            self.cache.stats(), {"hits": 1, "misses": 1, "size": 1, "hit_rate": 0.5}
+        )
+
+    def test_least_recently_used_entry_is_dropped(self):
+        self.cache.put(b"a", {"origin": "IGP"})
+        self.cache.put(b"b", {"origin": "EGP"})
+        self.cache.get(b"a")
+        self.cache.put(b"c", {"origin": "INCOMPLETE"})
+        self.assertEqual(len(self.cache), 2)
+        self.assertIsNone(self.cache.get(b"b"))
+        self.assertIsNotNone(self.cache.get(b"a"))
+
+    def test_clear(self):
+        self.cache.put(b"a", {"origin": "IGP"})
+        self.cache.clear()
+        self.assertEqual(len(self.cache), 0)
@@ -1,7 +1,10 @@
 import unittest
+from unittest.mock import MagicMock
 
+from beka import bgp_message
+from beka.as_path import AsPath
 from beka.beka import Beka
-from beka.route import RouteAddition
+from beka.route import RouteAddition, RouteRemoval
 from beka.ip import IPPrefix, IPAddress
 
 
@@ -18,6 +21,14 @@ class BekaTestCase(unittest.TestCase):
             error_handler=None,
         )
 
+    def test_share_prefixes_interns_parsed_prefixes(self):
+        self.addCleanup(bgp_message.intern_prefixes, False)
+        self.assertIsNone(bgp_message.prefix_pool)
+        beka = Beka(None, None, None, None, None, None, None, None, share_prefixes=True)
+        self.assertIsNotNone(bgp_message.prefix_pool)
+        beka.shutdown()
+        self.assertIsNone(bgp_message.prefix_pool)
+
     def test_add_neighbor_must_be_passive(self):
         with self.assertRaises(ValueError) as context:
             self.beka.add_neighbor("active", "10.1.1.1", 65004)
@@ -48,6 +59,63 @@ class BekaTestCase(unittest.TestCase):
                 origin="IGP",
             ),
         )
+        self.assertIsInstance(self.beka.routes_to_advertise[0].as_path, AsPath)
+
+    def test_add_route_bumps_routes_version(self):
+        version = self.beka.routes_version
+        self.beka.add_route("10.1.0.0/16", "192.168.1.3")
+        self.assertEqual(self.beka.routes_version, version + 1)
+
+    def test_add_route_replaces_route_for_prefix(self):
+        self.beka.add_routes(
+            [("10.1.0.0/16", "192.168.1.3"), ("10.2.0.0/16", "192.168.1.3")]
+        )
+        self.beka.add_route("10.1.0.0/16", "192.168.1.4")
+        self.assertEqual(len(self.beka.routes_to_advertise), 2)
+        self.assertEqual(
+            self.beka.routes[IPPrefix.from_string("10.1.0.0/16")].next_hop,
+            IPAddress.from_string("192.168.1.4"),
+        )
+
+    def test_add_same_route_is_not_a_change(self):
+        self.beka.add_route("10.1.0.0/16", "192.168.1.3")
+        version = self.beka.routes_version
+        self.beka.add_route("10.1.0.0/16", "192.168.1.3")
+        self.assertEqual(self.beka.routes_version, version)
+
+    def test_withdraw_route_removes_route(self):
+        self.beka.add_routes(
+            [("10.1.0.0/16", "192.168.1.3"), ("10.2.0.0/16", "192.168.1.3")]
+        )
+        self.beka.withdraw_route("10.1.0.0/16")
+        self.beka.withdraw_routes(["10.3.0.0/16"])
+        self.assertEqual(
+            [route.prefix for route in self.beka.routes_to_advertise],
+            [IPPrefix.from_string("10.2.0.0/16")],
+        )
+
+    def test_route_changes_are_coalesced_and_sent_to_peerings(self):
+        peering = MagicMock()
+        self.beka.peerings.append(peering)
+        self.beka.add_route("10.1.0.0/16", "192.168.1.3")
+        self.beka.add_route("10.2.0.0/16", "192.168.1.3")
+        self.beka.withdraw_route("10.1.0.0/16")
+        self.beka.add_route("10.2.0.0/16", "192.168.1.4")
+        self.assertIsNotNone(self.beka.route_change_timer)
+        self.beka.flush_route_changes()
+        self.beka.shutdown()
+        peering.send_route_changes.assert_called_once_with(
+            [
+                RouteRemoval(IPPrefix.from_string("10.1.0.0/16")),
+                RouteAddition(
+                    prefix=IPPrefix.from_string("10.2.0.0/16"),
+                    next_hop=IPAddress.from_string("192.168.1.4"),
+                    as_path="",
+                    origin="IGP",
+                ),
+            ],
+            self.beka.routes_version,
+        )
 
     def test_listening_on(self):
         beka = Beka(
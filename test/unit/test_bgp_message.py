@@ -1,3 +1,8 @@
+from array import array
+import contextlib
+import io
+import logging
+import pickle
 import struct
 import unittest
 
@@ -11,7 +16,12 @@ from beka.bgp_message import (
     BgpUpdateMessage,
     BgpNotificationMessage,
     BgpKeepaliveMessage,
+    UpdateMessageBuilder,
+    LazyBgpUpdateMessage,
+    MessageParseError,
+    intern_prefixes,
 )
+from beka.diagnostics import Diagnostics
 from beka.ip import IP4Prefix, IP4Address
 from beka.ip import IP6Prefix, IP6Address
 
@@ -328,3 +338,746 @@ class BgpMessageTestCase(unittest.TestCase):
         message = BgpUpdateMessage([], path_attributes, [])
         serialised_message = BgpMessagePacker().pack(message)
         self.assertEqual(serialised_message[19:], expected_serialised_message)
+
+    def test_update_message_parses_from_memoryview(self):
+        serialised_message = build_byte_string(
+            "0004180a0101000e40010101400200400304c0a80021080a17c0a840"
+        )
+        buffer = bytearray(b"\x00" * 3 + serialised_message)
+        message = BgpMessageParser().parse(
+            BgpMessage.UPDATE_MESSAGE, memoryview(buffer)[3:]
+        )
+        self.assertEqual(
+            message.withdrawn_routes, [IP4Prefix.from_string("10.1.1.0/24")]
+        )
+        self.assertEqual(
+            message.nlri,
+            [
+                IP4Prefix.from_string("10.0.0.0/8"),
+                IP4Prefix.from_string("192.168.64.0/23"),
+            ],
+        )
+        self.assertEqual(
+            message.path_attributes["next_hop"], IP4Address.from_string("192.168.0.33")
+        )
+
+    def test_update_message_truncated_nlri_raises(self):
+        serialised_message = build_byte_string(
+            "0000000e40010101400200400304c0a8002118c0a8"
+        )
+        with self.assertRaises(ValueError) as context:
+            BgpMessageParser().parse(BgpMessage.UPDATE_MESSAGE, serialised_message)
+        self.assertTrue("past end" in str(context.exception))
+
+    def test_update_message_invalid_prefix_length_raises(self):
+        serialised_message = build_byte_string("0000000e40010101400200400304c0a8002121")
+        with self.assertRaises(ValueError) as context:
+            BgpMessageParser().parse(BgpMessage.UPDATE_MESSAGE, serialised_message)
+        self.assertTrue("invalid prefix length" in str(context.exception))
+
+
+def build_attribute(flags, type_code, value):
+    return struct.pack("!BBB", flags, type_code, len(value)) + value
+
+
+def build_update(*attributes, nlri=b"\x08\x0a"):
+    packed_attributes = b"".join(attributes)
+    return struct.pack("!HH", 0, len(packed_attributes)) + packed_attributes + nlri
+
+
+class PathAttributeTestCase(unittest.TestCase):
+    MANDATORY = (
+        build_attribute(0x40, 1, b"\x00"),
+        build_attribute(0x40, 2, struct.pack("!BBI", 2, 1, 65001)),
+        build_attribute(0x40, 3, bytes([192, 0, 2, 1])),
+    )
+
+    def setUp(self):
+        self.parser = BgpMessageParser(attribute_cache_size=0)
+        self.parser.capabilities = {"fourbyteas": [65001]}
+        self.packer = BgpMessagePacker()
+        self.packer.capabilities = self.parser.capabilities
+
+    def parse(self, serialised_message):
+        return self.parser.parse(BgpMessage.UPDATE_MESSAGE, serialised_message)
+
+    def test_optional_attributes_are_decoded(self):
+        serialised_message = build_update(
+            *self.MANDATORY,
+            build_attribute(0x80, 4, struct.pack("!I", 100)),
+            build_attribute(0x40, 5, struct.pack("!I", 200)),
+            build_attribute(0x40, 6, b""),
+            build_attribute(0xC0, 7, struct.pack("!I4B", 4200000000, 10, 0, 0, 1)),
+            build_attribute(0xC0, 8, struct.pack("!II", 0xFDE90064, 0xFFFFFF01)),
+            build_attribute(0x80, 9, bytes([10, 0, 0, 2])),
+            build_attribute(0x80, 10, struct.pack("!I", 0x0A000003)),
+            build_attribute(0xC0, 16, struct.pack("!Q", 0x0002FDE900000064)),
+            build_attribute(0xC0, 32, struct.pack("!III", 4200000000, 1, 2)),
+        )
+        path_attributes = self.parse(serialised_message).path_attributes
+        self.assertEqual(path_attributes["med"], 100)
+        self.assertEqual(path_attributes["local_pref"], 200)
+        self.assertTrue(path_attributes["atomic_aggregate"])
+        self.assertEqual(
+            path_attributes["aggregator"],
+            (4200000000, IP4Address.from_string("10.0.0.1")),
+        )
+        self.assertEqual(
+            path_attributes["communities"], array("I", [0xFDE90064, 0xFFFFFF01])
+        )
+        self.assertEqual(
+            path_attributes["originator_id"], IP4Address.from_string("10.0.0.2")
+        )
+        self.assertEqual(path_attributes["cluster_list"], array("I", [0x0A000003]))
+        self.assertEqual(
+            path_attributes["extended_communities"], array("Q", [0x0002FDE900000064])
+        )
+        self.assertEqual(
+            path_attributes["large_communities"], array("I", [4200000000, 1, 2])
+        )
+        self.assertEqual(
+            self.packer.pack(self.parse(serialised_message))[19:], serialised_message
+        )
+
+    def test_two_byte_aggregator(self):
+        self.parser.capabilities = {}
+        serialised_message = build_update(
+            build_attribute(0x40, 1, b"\x00"),
+            build_attribute(0x40, 2, struct.pack("!BBH", 2, 1, 65001)),
+            build_attribute(0x40, 3, bytes([192, 0, 2, 1])),
+            build_attribute(0xC0, 7, struct.pack("!H4B", 65001, 10, 0, 0, 1)),
+        )
+        message = self.parse(serialised_message)
+        self.assertEqual(
+            message.path_attributes["aggregator"],
+            (65001, IP4Address.from_string("10.0.0.1")),
+        )
+        self.assertEqual(BgpMessagePacker().pack(message)[19:], serialised_message)
+
+    def test_four_byte_aggregator_is_packed_as_as_trans_for_two_byte_peers(self):
+        message = self.parse(
+            build_update(
+                *self.MANDATORY,
+                build_attribute(0xC0, 7, struct.pack("!I4B", 4200000000, 10, 0, 0, 1)),
+            )
+        )
+        packed = BgpMessagePacker().pack(message)
+        self.assertIn(
+            build_attribute(0xC0, 7, struct.pack("!H4B", 23456, 10, 0, 0, 1)), packed
+        )
+
+    def test_unknown_transitive_attributes_are_passed_on_as_partial(self):
+        serialised_message = build_update(
+            *self.MANDATORY,
+            build_attribute(0xC0, 99, b"opaque"),
+            build_attribute(0x80, 98, b"dropped"),
+        )
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            message = self.parse(serialised_message)
+        self.assertEqual(output.getvalue(), "")
+        self.assertEqual(
+            message.path_attributes["unknown_attributes"], ((0xC0, 99, b"opaque"),)
+        )
+        self.assertEqual(
+            self.packer.pack(message)[19:],
+            build_update(*self.MANDATORY, build_attribute(0xE0, 99, b"opaque")),
+        )
+
+    def test_malformed_attributes_are_listed_in_attribute_errors(self):
+        message = self.parse(
+            build_update(*self.MANDATORY, build_attribute(0x80, 4, b"\x01"))
+        )
+        self.assertNotIn("med", message.path_attributes)
+        self.assertEqual(
+            message.path_attributes["attribute_errors"],
+            ((4, "treat-as-withdraw", "MULTI_EXIT_DISC: Got invalid length: 1"),),
+        )
+        message = self.parse(
+            build_update(
+                *self.MANDATORY,
+                build_attribute(0xC0, 7, b"\x00" * 5),
+                build_attribute(0xC0, 32, b"\x00" * 8),
+            )
+        )
+        self.assertEqual(
+            [
+                (type_code, action)
+                for type_code, action, _reason in message.path_attributes[
+                    "attribute_errors"
+                ]
+            ],
+            [(7, "attribute-discard"), (32, "treat-as-withdraw")],
+        )
+        self.assertEqual(message.path_attributes["origin"], "IGP")
+        self.assertEqual(self.packer.pack(message)[19:], build_update(*self.MANDATORY))
+
+    def test_malformed_well_known_attributes(self):
+        for attribute in (
+            build_attribute(0x40, 1, b"\x03"),
+            build_attribute(0x40, 1, b""),
+            build_attribute(0x40, 2, b"\x02\x02\x00"),
+            build_attribute(0x40, 3, b"\x0a\x00\x00"),
+        ):
+            message = self.parse(build_update(attribute, *self.MANDATORY))
+            ((type_code, action, _reason),) = message.path_attributes[
+                "attribute_errors"
+            ]
+            self.assertEqual(type_code, attribute[1])
+            self.assertEqual(action, "treat-as-withdraw")
+
+    def test_repeated_attributes_keep_the_first(self):
+        message = self.parse(
+            build_update(*self.MANDATORY, build_attribute(0x40, 1, b"\x02"))
+        )
+        self.assertEqual(message.path_attributes["origin"], "IGP")
+        self.assertNotIn("attribute_errors", message.path_attributes)
+
+    def test_malformed_mp_reach_nlri_raises(self):
+        mp_reach_nlri = build_attribute(0x80, 14, struct.pack("!HBB", 2, 1, 16))
+        with self.assertRaises(ValueError):
+            self.parse(build_update(*self.MANDATORY, mp_reach_nlri))
+        mp_unreach_nlri = build_attribute(0x80, 15, struct.pack("!HB", 2, 1))
+        with self.assertRaises(ValueError):
+            self.parse(build_update(*self.MANDATORY, mp_unreach_nlri, mp_unreach_nlri))
+
+    def test_attribute_overrun_is_treat_as_withdraw(self):
+        overrun = struct.pack("!BBB", 0xC0, 8, 8) + b"\x00\x00\x00\x01"
+        for parser in (self.parser, BgpMessageParser()):
+            parser.capabilities = self.parser.capabilities
+            message = parser.parse(
+                BgpMessage.UPDATE_MESSAGE, build_update(*self.MANDATORY, overrun)
+            )
+            self.assertEqual(message.path_attributes["origin"], "IGP")
+            self.assertEqual(
+                message.path_attributes["attribute_errors"],
+                ((8, "treat-as-withdraw", "Path attribute 8 runs past end of field"),),
+            )
+            self.assertEqual(message.nlri, [IP4Prefix.from_string("10.0.0.0/8")])
+
+    def test_attributes_with_wrong_flags_are_malformed(self):
+        message = self.parse(
+            build_update(
+                build_attribute(0x80, 1, b"\x00"),
+                *self.MANDATORY[1:],
+                build_attribute(
+                    0x40, 7, struct.pack("!H4s", 65001, b"\x0a\x00\x00\x01")
+                ),
+            )
+        )
+        self.assertNotIn("origin", message.path_attributes)
+        self.assertEqual(
+            message.path_attributes["attribute_errors"],
+            (
+                (1, "treat-as-withdraw", "Path attribute 1: Got invalid flags: 0x80"),
+                (7, "attribute-discard", "Path attribute 7: Got invalid flags: 0x40"),
+            ),
+        )
+        # the Partial bit may be set on optional transitive attributes
+        message = self.parse(
+            build_update(*self.MANDATORY, build_attribute(0xE0, 8, b"\x00" * 4))
+        )
+        self.assertNotIn("attribute_errors", message.path_attributes)
+
+    def test_session_reset_errors_carry_a_notification(self):
+        with self.assertRaises(MessageParseError) as context:
+            self.parse(b"\x00")
+        error = context.exception
+        self.assertEqual(str(error), "UPDATE: Message too short")
+        notification = error.notification()
+        self.assertEqual((notification.error_code, notification.error_subcode), (3, 1))
+        error = pickle.loads(pickle.dumps(error))
+        self.assertEqual(error.message_type, BgpMessage.UPDATE_MESSAGE)
+        self.assertEqual(str(error), "UPDATE: Message too short")
+
+    def test_truncated_mp_attributes_raise_value_error(self):
+        for attribute in (
+            build_attribute(0x80, 14, struct.pack("!HB", 2, 1)),
+            build_attribute(0x80, 14, b""),
+            build_attribute(0x80, 15, struct.pack("!H", 2)),
+        ):
+            with self.assertRaises(ValueError):
+                self.parse(build_update(*self.MANDATORY, attribute))
+
+    def test_mp_reach_nlri_next_hop_must_be_one_or_two_addresses(self):
+        for next_hop_length in (0, 48):
+            attribute = build_attribute(
+                0x80,
+                14,
+                struct.pack("!HBB", 2, 1, next_hop_length)
+                + b"\x00" * next_hop_length
+                + b"\x00",
+            )
+            with self.assertRaises(MessageParseError) as context:
+                self.parse(build_update(*self.MANDATORY, attribute, nlri=b""))
+            self.assertEqual(
+                str(context.exception),
+                "MP_REACH_NLRI: Got unsupported next hop length: %d" % next_hop_length,
+            )
+
+
+class ParserDiagnosticsTestCase(unittest.TestCase):
+    MANDATORY = PathAttributeTestCase.MANDATORY
+
+    def setUp(self):
+        self.errors = []
+        self.parser = BgpMessageParser(
+            attribute_cache_size=16,
+            diagnostics=Diagnostics("192.0.2.1", self.errors.append),
+        )
+        self.parser.capabilities = {"fourbyteas": [65001]}
+
+    def parse(self, serialised_message):
+        return self.parser.parse(BgpMessage.UPDATE_MESSAGE, serialised_message)
+
+    def test_unknown_attributes_are_reported_for_every_update(self):
+        serialised_message = build_update(
+            *self.MANDATORY,
+            build_attribute(0xC0, 99, b"opaque"),
+            build_attribute(0x80, 98, b"opaque"),
+        )
+        self.parse(serialised_message)
+        self.parse(serialised_message)
+        self.assertEqual(self.parser.attribute_cache.hits, 1)
+        self.assertEqual(
+            self.parser.diagnostics.counts,
+            {("unknown_attribute", 99): 2, ("unknown_attribute", 98): 2},
+        )
+        self.assertEqual(
+            self.errors,
+            [
+                "Peering 192.0.2.1: unknown path attribute 99",
+                "Peering 192.0.2.1: unknown path attribute 98",
+            ]
+            * 2,
+        )
+
+    def test_attributes_cached_while_disabled_are_reported(self):
+        serialised_message = build_update(
+            *self.MANDATORY, build_attribute(0xC0, 99, b"opaque")
+        )
+        self.parser.diagnostics.error_handler = None
+        logger = logging.getLogger("beka")
+        level = logger.level
+        logger.setLevel(logging.ERROR)
+        try:
+            self.parse(serialised_message)
+        finally:
+            logger.setLevel(level)
+        self.parser.diagnostics.error_handler = self.errors.append
+        self.parse(serialised_message)
+        self.assertEqual(self.parser.attribute_cache.hits, 1)
+        self.assertEqual(self.errors, ["Peering 192.0.2.1: unknown path attribute 99"])
+
+    def test_as_set_is_reported(self):
+        self.parse(
+            build_update(
+                build_attribute(0x40, 1, b"\x00"),
+                build_attribute(0x40, 2, struct.pack("!BBIBBI", 2, 1, 65001, 1, 1, 3)),
+                build_attribute(0x40, 3, bytes([192, 0, 2, 1])),
+            )
+        )
+        self.parse(build_update(*self.MANDATORY))
+        self.assertEqual(self.parser.diagnostics.counts, {("as_set", None): 1})
+
+    def test_unknown_capabilities_are_reported(self):
+        open_message = BgpOpenMessage(
+            4, 65001, 240, IP4Address.from_string("192.0.2.1"), {}
+        )
+        serialised_message = open_message.pack({})
+        capability = struct.pack("!BBBB", 73, 2, 0, 0)
+        serialised_message = (
+            serialised_message[:9]
+            + bytes([len(capability) + 2, 2, len(capability)])
+            + capability
+        )
+        message = self.parser.parse(BgpMessage.OPEN_MESSAGE, serialised_message)
+        self.assertEqual(message.capabilities, {})
+        self.assertEqual(self.errors, ["Peering 192.0.2.1: unknown capability 73"])
+
+    def test_nothing_is_noted_when_disabled(self):
+        logger = logging.getLogger("beka")
+        level = logger.level
+        logger.setLevel(logging.ERROR)
+        try:
+            self.parse(build_update(*self.MANDATORY, build_attribute(0xC0, 99, b"")))
+        finally:
+            logger.setLevel(level)
+        self.assertEqual(self.parser.diagnostics.counts, {})
+
+
+class LazyBgpUpdateMessageTestCase(unittest.TestCase):
+    AS4_UPDATE = (
+        "0000001c4001010040020e020300bc614e0000fe080001b2e5400304ac1900042009090909"
+    )
+    V4_UPDATE = "0004180a0101000e40010101400200400304c0a80021080a17c0a840"
+    V6_UPDATE = "0000004b400101004002040201fdeb800e3d0002012020010db80001000000000242ac110002fe800000000000000042acfffe110002007f20010db40000000000000000000000002f20010db30000"
+
+    def parse(self, hex_stream, capabilities=None):
+        parser = BgpMessageParser(lazy=True)
+        parser.capabilities = capabilities or {}
+        return parser.parse(BgpMessage.UPDATE_MESSAGE, build_byte_string(hex_stream))
+
+    def assert_same_as_eager(self, hex_stream, capabilities=None):
+        parser = BgpMessageParser()
+        parser.capabilities = capabilities or {}
+        eager = parser.parse(BgpMessage.UPDATE_MESSAGE, build_byte_string(hex_stream))
+        lazy = self.parse(hex_stream, capabilities)
+        self.assertIsInstance(lazy, LazyBgpUpdateMessage)
+        self.assertEqual(lazy.withdrawn_routes, eager.withdrawn_routes)
+        self.assertEqual(lazy.path_attributes, eager.path_attributes)
+        self.assertEqual(lazy.nlri, eager.nlri)
+
+    def test_decodes_like_eager_parser(self):
+        self.assert_same_as_eager(self.V4_UPDATE)
+        self.assert_same_as_eager(self.V6_UPDATE)
+        self.assert_same_as_eager(self.AS4_UPDATE, {"fourbyteas": 12345})
+
+    def test_get_attribute_decodes_one_attribute(self):
+        message = self.parse(self.AS4_UPDATE, {"fourbyteas": 12345})
+        self.assertEqual(message.get_attribute("as_path"), "12345678 65032 111333")
+        self.assertIsNone(message.get_attribute("mp_reach_nlri"))
+        self.assertEqual(message._attributes.keys(), {"as_path", "mp_reach_nlri"})
+        self.assertIsNone(message._path_attributes)
+
+    def test_get_attribute_checks_attributes_like_eager_parser(self):
+        parser = BgpMessageParser(lazy=True)
+        parser.capabilities = {"fourbyteas": [65001]}
+        message = parser.parse(
+            BgpMessage.UPDATE_MESSAGE,
+            build_update(
+                build_attribute(0x80, 1, b"\x00"), *PathAttributeTestCase.MANDATORY[1:]
+            ),
+        )
+        self.assertIsNone(message.get_attribute("origin"))
+        self.assertEqual(
+            message.get_attribute("next_hop"), IP4Address.from_string("192.0.2.1")
+        )
+        self.assertEqual(
+            message.get_attribute("attribute_errors"),
+            ((1, "treat-as-withdraw", "Path attribute 1: Got invalid flags: 0x80"),),
+        )
+
+    def test_get_attribute_raises_message_parse_error(self):
+        parser = BgpMessageParser(lazy=True)
+        parser.capabilities = {"fourbyteas": [65001]}
+        mp_reach_nlri = build_attribute(0x80, 14, struct.pack("!HBB", 2, 1, 16))
+        message = parser.parse(
+            BgpMessage.UPDATE_MESSAGE,
+            build_update(*PathAttributeTestCase.MANDATORY, mp_reach_nlri),
+        )
+        with self.assertRaises(MessageParseError):
+            message.get_attribute("mp_reach_nlri")
+        with self.assertRaises(MessageParseError):
+            message.path_attributes  # pylint: disable=pointless-statement
+
+    def test_decoded_attributes_are_noted(self):
+        errors = []
+        parser = BgpMessageParser(
+            lazy=True, diagnostics=Diagnostics("192.0.2.1", errors.append)
+        )
+        parser.capabilities = {"fourbyteas": [65001]}
+        message = parser.parse(
+            BgpMessage.UPDATE_MESSAGE,
+            build_update(
+                *PathAttributeTestCase.MANDATORY, build_attribute(0xC0, 99, b"")
+            ),
+        )
+        self.assertEqual(errors, [])
+        message.get_attribute("unknown_attributes")
+        self.assertEqual(errors, ["Peering 192.0.2.1: unknown path attribute 99"])
+
+    def test_iter_nlri_and_count(self):
+        message = self.parse(self.V4_UPDATE)
+        self.assertEqual(message.nlri_count(), 2)
+        self.assertEqual(
+            list(message.iter_nlri()),
+            [
+                IP4Prefix.from_string("10.0.0.0/8"),
+                IP4Prefix.from_string("192.168.64.0/23"),
+            ],
+        )
+        self.assertEqual(
+            list(message.iter_withdrawn_routes()),
+            [IP4Prefix.from_string("10.1.1.0/24")],
+        )
+        self.assertIsNone(message._nlri)
+
+    def test_unchanged_message_packs_original_bytes(self):
+        serialised_message = build_byte_string(self.V4_UPDATE)
+        message = self.parse(self.V4_UPDATE)
+        self.assertEqual(message.path_attributes["origin"], "EGP")
+        self.assertEqual(BgpMessagePacker().pack(message)[19:], serialised_message)
+
+    def test_changed_message_is_packed_again(self):
+        message = self.parse(self.V4_UPDATE)
+        message.nlri = [IP4Prefix.from_string("10.0.0.0/8")]
+        self.assertEqual(
+            BgpMessagePacker().pack(message)[19:],
+            build_byte_string("0004180a0101000e40010101400200400304c0a80021080a"),
+        )
+
+    def test_different_as_size_is_packed_again(self):
+        message = self.parse(self.V6_UPDATE)
+        packer = BgpMessagePacker()
+        packer.capabilities = {"fourbyteas": 12345}
+        packed = packer.pack(message)[19:]
+        self.assertNotEqual(packed, build_byte_string(self.V6_UPDATE))
+        parser = BgpMessageParser()
+        parser.capabilities = {"fourbyteas": 12345}
+        self.assertEqual(
+            parser.parse(BgpMessage.UPDATE_MESSAGE, packed).path_attributes,
+            message.path_attributes,
+        )
+
+    def test_truncated_field_raises(self):
+        with self.assertRaises(ValueError):
+            self.parse("0000000e40010101")
+
+
+class AttributeCacheTestCase(unittest.TestCase):
+    V4_UPDATE = LazyBgpUpdateMessageTestCase.V4_UPDATE
+    V6_UPDATE = LazyBgpUpdateMessageTestCase.V6_UPDATE
+    # the same path attributes as V4_UPDATE with only 10.0.0.0/8 in the NLRI
+    V4_UPDATE_OTHER_NLRI = "0004180a0101000e40010101400200400304c0a80021080a"
+    # V4_UPDATE_OTHER_NLRI with a COMMUNITIES attribute of 65001:1
+    V4_UPDATE_COMMUNITIES = (
+        "0004180a0101001540010101400200400304c0a80021c00804fde90001080a"
+    )
+
+    def setUp(self):
+        self.parser = BgpMessageParser(attribute_cache_size=16)
+
+    def parse(self, hex_stream):
+        return self.parser.parse(
+            BgpMessage.UPDATE_MESSAGE, build_byte_string(hex_stream)
+        )
+
+    def test_same_attribute_bytes_are_decoded_once(self):
+        first = self.parse(self.V4_UPDATE)
+        second = self.parse(self.V4_UPDATE_OTHER_NLRI)
+        self.assertEqual(self.parser.attribute_cache.stats()["hits"], 1)
+        self.assertEqual(self.parser.attribute_cache.stats()["misses"], 1)
+        self.assertEqual(first.path_attributes, second.path_attributes)
+        self.assertIsNot(first.path_attributes, second.path_attributes)
+        self.assertEqual(second.nlri, [IP4Prefix.from_string("10.0.0.0/8")])
+
+    def test_cached_communities_are_immutable(self):
+        first = self.parse(self.V4_UPDATE_COMMUNITIES)
+        second = self.parse(self.V4_UPDATE_COMMUNITIES)
+        self.assertEqual(self.parser.attribute_cache.hits, 1)
+        self.assertEqual(first.path_attributes["communities"], (0xFDE90001,))
+        self.assertIs(
+            second.path_attributes["communities"], first.path_attributes["communities"]
+        )
+
+    def test_multiprotocol_attributes_are_decoded_every_time(self):
+        first = self.parse(self.V6_UPDATE)
+        second = self.parse(self.V6_UPDATE)
+        self.assertEqual(self.parser.attribute_cache.hits, 1)
+        self.assertEqual(first.path_attributes, second.path_attributes)
+        self.assertEqual(
+            second.path_attributes["mp_reach_nlri"]["nlri"],
+            [
+                IP6Prefix.from_string("2001:db4::/127"),
+                IP6Prefix.from_string("2001:db3::/47"),
+            ],
+        )
+
+    def test_four_byte_as_numbers_are_cached_separately(self):
+        self.parse(self.V4_UPDATE)
+        self.parser.capabilities = {"fourbyteas": 12345}
+        self.parse(self.V4_UPDATE)
+        self.assertEqual(self.parser.attribute_cache.misses, 2)
+
+    def test_least_recently_used_entries_are_dropped(self):
+        parser = BgpMessageParser(attribute_cache_size=1)
+        parser.parse(BgpMessage.UPDATE_MESSAGE, build_byte_string(self.V4_UPDATE))
+        parser.parse(BgpMessage.UPDATE_MESSAGE, build_byte_string(self.V6_UPDATE))
+        parser.parse(BgpMessage.UPDATE_MESSAGE, build_byte_string(self.V4_UPDATE))
+        self.assertEqual(parser.attribute_cache.misses, 3)
+        self.assertEqual(len(parser.attribute_cache), 1)
+
+    def test_cache_is_off_by_default(self):
+        parser = BgpMessageParser()
+        self.assertIsNone(parser.attribute_cache)
+        message = parser.parse(
+            BgpMessage.UPDATE_MESSAGE, build_byte_string(self.V4_UPDATE)
+        )
+        self.assertEqual(message.path_attributes["origin"], "EGP")
+
+    def test_lazy_messages_use_the_cache(self):
+        parser = BgpMessageParser(lazy=True, attribute_cache_size=16)
+        for _ in range(2):
+            message = parser.parse(
+                BgpMessage.UPDATE_MESSAGE, build_byte_string(self.V4_UPDATE)
+            )
+            self.assertEqual(message.path_attributes["origin"], "EGP")
+        self.assertEqual(parser.attribute_cache.hits, 1)
+
+
+class InternPrefixesTestCase(unittest.TestCase):
+    V4_UPDATE = LazyBgpUpdateMessageTestCase.V4_UPDATE
+    V6_UPDATE = LazyBgpUpdateMessageTestCase.V6_UPDATE
+
+    def setUp(self):
+        self.prefix_pool = intern_prefixes()
+
+    def tearDown(self):
+        intern_prefixes(False)
+
+    @staticmethod
+    def parse(hex_stream):
+        return BgpMessageParser().parse(
+            BgpMessage.UPDATE_MESSAGE, build_byte_string(hex_stream)
+        )
+
+    def test_parsers_share_prefixes(self):
+        first = self.parse(self.V4_UPDATE)
+        second = self.parse(self.V4_UPDATE)
+        self.assertEqual(
+            first.nlri,
+            [
+                IP4Prefix.from_string("10.0.0.0/8"),
+                IP4Prefix.from_string("192.168.64.0/23"),
+            ],
+        )
+        self.assertIs(first.nlri[0], second.nlri[0])
+        self.assertIs(first.withdrawn_routes[0], second.withdrawn_routes[0])
+
+    def test_ipv6_prefixes_are_interned(self):
+        first = self.parse(self.V6_UPDATE).path_attributes["mp_reach_nlri"]["nlri"]
+        second = self.parse(self.V6_UPDATE).path_attributes["mp_reach_nlri"]["nlri"]
+        self.assertEqual(first[0], IP6Prefix.from_string("2001:db4::/127"))
+        self.assertIs(first[1], second[1])
+
+    def test_disabled_by_default(self):
+        intern_prefixes(False)
+        first = self.parse(self.V4_UPDATE)
+        second = self.parse(self.V4_UPDATE)
+        self.assertEqual(first.nlri, second.nlri)
+        self.assertIsNot(first.nlri[0], second.nlri[0])
+
+    def test_invalid_prefixes_raise(self):
+        with self.assertRaises(ValueError):
+            self.parse("0000000e40010101400200400304c0a8002121")
+
+
+def build_prefixes(prefix_class, count, length, address_length):
+    return [
+        prefix_class(
+            (index << (address_length * 8 - length)).to_bytes(address_length, "big"),
+            length,
+        )
+        for index in range(count)
+    ]
+
+
+class UpdateMessageBuilderTestCase(unittest.TestCase):
+    def pack_and_parse(self, messages):
+        packer = BgpMessagePacker()
+        parser = BgpMessageParser()
+        parsed_messages = []
+        for message in messages:
+            serialised_message = packer.pack(message)
+            self.assertTrue(len(serialised_message) <= BgpMessage.MAX_LENGTH)
+            parsed_messages.append(
+                parser.parse(
+                    BgpMessage.UPDATE_MESSAGE,
+                    serialised_message[BgpMessage.HEADER_LENGTH :],
+                )
+            )
+        return parsed_messages
+
+    def test_open_message_parses_extended_message(self):
+        serialised_message = build_byte_string("04fe0900b4c0a8000f0402020600")
+        message = BgpMessageParser().parse(BgpMessage.OPEN_MESSAGE, serialised_message)
+        self.assertEqual(message.capabilities["extendedmessage"], [True])
+
+    def test_ipv4_updates_split_at_message_limit(self):
+        nlri = build_prefixes(IP4Prefix, 2500, 24, 4)
+        path_attributes = {
+            "next_hop": IP4Address.from_string("192.168.0.33"),
+            "origin": "IGP",
+            "as_path": "",
+        }
+        messages = list(UpdateMessageBuilder().ipv4_updates(path_attributes, nlri))
+        # 14 bytes of path attributes leave room for 1014 /24s per message
+        self.assertEqual([len(message.nlri) for message in messages], [1014, 1014, 472])
+        parsed_nlri = []
+        for message in self.pack_and_parse(messages):
+            parsed_nlri += message.nlri
+        self.assertEqual(parsed_nlri, nlri)
+
+    def test_ipv4_updates_use_extended_message_length(self):
+        nlri = build_prefixes(IP4Prefix, 2500, 24, 4)
+        path_attributes = {
+            "next_hop": IP4Address.from_string("192.168.0.33"),
+            "origin": "IGP",
+            "as_path": "",
+        }
+        builder = UpdateMessageBuilder(
+            max_message_length=BgpMessage.EXTENDED_MAX_LENGTH
+        )
+        messages = list(builder.ipv4_updates(path_attributes, nlri))
+        self.assertEqual(len(messages), 1)
+
+    def test_ipv4_withdrawals_split_at_message_limit(self):
+        withdrawn_routes = build_prefixes(IP4Prefix, 2000, 32, 4)
+        messages = list(UpdateMessageBuilder().ipv4_withdrawals(withdrawn_routes))
+        self.assertEqual([len(m.withdrawn_routes) for m in messages], [814, 814, 372])
+        parsed_routes = []
+        for message in self.pack_and_parse(messages):
+            parsed_routes += message.withdrawn_routes
+        self.assertEqual(parsed_routes, withdrawn_routes)
+
+    def test_ipv6_updates_split_and_use_extended_attribute_length(self):
+        nlri = build_prefixes(IP6Prefix, 1000, 48, 16)
+        path_attributes = {"origin": "IGP", "as_path": ""}
+        next_hops = [IP6Address.from_string("2001:db8::1")]
+        messages = list(
+            UpdateMessageBuilder().ipv6_updates(path_attributes, next_hops, nlri)
+        )
+        self.assertEqual(len(messages), 2)
+        serialised_message = BgpMessagePacker().pack(messages[0])
+        # a /48 packs into 7 bytes and the first message has no room for another
+        self.assertTrue(BgpMessage.MAX_LENGTH - 7 < len(serialised_message))
+        # MP_REACH_NLRI is sent with the extended length flag set
+        self.assertEqual(serialised_message[30:32], b"\x90\x0e")
+        parsed_nlri = []
+        for message in self.pack_and_parse(messages):
+            self.assertEqual(
+                message.path_attributes["mp_reach_nlri"]["next_hop"], next_hops
+            )
+            parsed_nlri += message.path_attributes["mp_reach_nlri"]["nlri"]
+        self.assertEqual(parsed_nlri, nlri)
+
+    def test_ipv6_withdrawals_split_at_message_limit(self):
+        withdrawn_routes = build_prefixes(IP6Prefix, 1000, 64, 16)
+        messages = list(UpdateMessageBuilder().ipv6_withdrawals(withdrawn_routes))
+        self.assertEqual(len(messages), 3)
+        parsed_routes = []
+        for message in self.pack_and_parse(messages):
+            parsed_routes += message.path_attributes["mp_unreach_nlri"][
+                "withdrawn_routes"
+            ]
+        self.assertEqual(parsed_routes, withdrawn_routes)
+
+    def test_long_as_path_uses_extended_attribute_length(self):
+        as_path = " ".join(["65001"] * 100)
+        path_attributes = {
+            "next_hop": IP4Address.from_string("192.168.0.33"),
+            "origin": "IGP",
+            "as_path": as_path,
+        }
+        nlri = [IP4Prefix.from_string("10.0.0.0/8")]
+        packer = BgpMessagePacker()
+        packer.capabilities = {"fourbyteas": [65001]}
+        serialised_message = packer.pack(BgpUpdateMessage([], path_attributes, nlri))
+        parser = BgpMessageParser()
+        parser.capabilities = {"fourbyteas": [65001]}
+        message = parser.parse(
+            BgpMessage.UPDATE_MESSAGE, serialised_message[BgpMessage.HEADER_LENGTH :]
+        )
+        self.assertEqual(message.path_attributes["as_path"], as_path)
+        self.assertEqual(message.nlri, nlri)
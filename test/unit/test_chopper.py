@@ -3,6 +3,22 @@ import unittest
 from io import BytesIO
 
 from beka import chopper
+from beka.error import SocketClosedError
+
+
+class TrickleStream:  # pylint: disable=too-few-public-methods
+    """Stream that returns at most chunk_size bytes per read"""
+
+    def __init__(self, data, chunk_size):
+        self.stream = BytesIO(data)
+        self.chunk_size = chunk_size
+
+    def read1(self, size):
+        return self.stream.read(min(size, self.chunk_size))
+
+
+def build_message(message_type, body):
+    return struct.pack("!16sHB", b"\xFF" * 16, 19 + len(body), message_type) + body
 
 
 class ChopperTestCase(unittest.TestCase):
@@ -38,3 +54,73 @@ class ChopperTestCase(unittest.TestCase):
             chopper.Chopper(input_stream).next()
 
         self.assertEqual("Invalid BGP length field", str(context.exception))
+
+    def test_next_batch_frames_every_buffered_message(self):
+        serialised_data = (
+            build_message(4, b"")
+            + build_message(2, b"update")
+            + build_message(3, b"\x06\x00")
+        )
+        messages = chopper.Chopper(BytesIO(serialised_data)).next_batch()
+
+        self.assertEqual(
+            messages,
+            [(4, b""), (2, b"update"), (3, b"\x06\x00")],
+        )
+
+    def test_messages_split_across_reads(self):
+        bodies = [bytes([index]) * index * 7 for index in range(20)]
+        serialised_data = b"".join(build_message(2, body) for body in bodies)
+        message_chopper = chopper.Chopper(TrickleStream(serialised_data, 5))
+
+        self.assertEqual([message_chopper.next()[1] for _ in bodies], bodies)
+        with self.assertRaises(SocketClosedError):
+            message_chopper.next()
+
+    def test_next_after_next_batch_returns_bytes(self):
+        serialised_data = build_message(2, b"first") + build_message(2, b"second")
+        message_chopper = chopper.Chopper(BytesIO(serialised_data))
+
+        self.assertEqual(message_chopper.next(), (2, b"first"))
+        self.assertEqual(message_chopper.next_batch(), [(2, b"second")])
+
+    def test_extended_length_message(self):
+        body = b"x" * (65535 - 19)
+        serialised_data = build_message(2, body) * 3
+        message_chopper = chopper.Chopper(TrickleStream(serialised_data, 40000))
+
+        for _ in range(3):
+            self.assertEqual(message_chopper.next(), (2, body))
+
+    def test_truncated_message(self):
+        serialised_data = build_message(2, b"update")[:-1]
+        message_chopper = chopper.Chopper(BytesIO(serialised_data))
+
+        with self.assertRaises(SocketClosedError) as context:
+            message_chopper.next()
+
+        self.assertEqual(
+            "Tried to read 25 bytes but only got 24", str(context.exception)
+        )
+
+    def test_feed_frames_messages_split_across_calls(self):
+        bodies = [bytes([index]) * index * 7 for index in range(20)]
+        serialised_data = b"".join(build_message(2, body) for body in bodies)
+        message_chopper = chopper.Chopper(None)
+
+        messages = []
+        for index in range(0, len(serialised_data), 5):
+            messages += message_chopper.feed(serialised_data[index : index + 5])
+
+        self.assertEqual(messages, [(2, body) for body in bodies])
+        self.assertTrue(all(isinstance(body, bytes) for _, body in messages))
+        self.assertEqual(len(message_chopper.buffer), 0)
+
+    def test_feed_raises_on_invalid_marker(self):
+        message_chopper = chopper.Chopper(None)
+
+        self.assertEqual(message_chopper.feed(build_message(4, b"")), [(4, b"")])
+        with self.assertRaises(ValueError) as context:
+            message_chopper.feed(b"\x00" * 16 + b"\xff\xff\x02")
+
+        self.assertEqual("BGP marker missing", str(context.exception))
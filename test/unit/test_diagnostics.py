@@ -0,0 +1,101 @@
+import logging
+import unittest
+
+from beka.diagnostics import Diagnostics, TokenBucket
+
+
+class FakeClock:  # pylint: disable=too-few-public-methods
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+class TokenBucketTestCase(unittest.TestCase):
+    def test_burst_then_rate(self):
+        clock = FakeClock()
+        bucket = TokenBucket(rate=2, burst=3, clock=clock)
+        self.assertEqual([bucket.take() for _ in range(4)], [True] * 3 + [False])
+        clock.now += 0.5
+        self.assertTrue(bucket.take())
+        self.assertFalse(bucket.take())
+        clock.now += 100
+        self.assertEqual([bucket.take() for _ in range(4)], [True] * 3 + [False])
+
+
+class DiagnosticsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.errors = []
+        self.diagnostics = Diagnostics(
+            "192.0.2.1",
+            self.errors.append,
+            rate=1,
+            burst=2,
+            interval=10,
+            clock=self.clock,
+        )
+
+    def test_reports_are_rate_limited_and_summarised(self):
+        for _ in range(1000):
+            self.diagnostics.report("unknown_attribute", 99)
+        self.assertEqual(
+            self.errors,
+            ["Peering 192.0.2.1: unknown path attribute 99"] * 2,
+        )
+        self.clock.now += 10
+        self.diagnostics.report("unknown_attribute", 99)
+        self.assertEqual(
+            self.errors[2:],
+            [
+                "Peering 192.0.2.1: 998 unknown path attribute 99 in last 10s",
+                "Peering 192.0.2.1: unknown path attribute 99",
+            ],
+        )
+        self.assertEqual(self.diagnostics.totals(), {"unknown_attribute": 1001})
+
+    def test_kinds_are_limited_separately(self):
+        for _ in range(5):
+            self.diagnostics.report("unknown_capability", 73)
+            self.diagnostics.report("as_set")
+        self.assertEqual(
+            self.errors,
+            [
+                "Peering 192.0.2.1: unknown capability 73",
+                "Peering 192.0.2.1: AS_SET in AS_PATH",
+            ]
+            * 2,
+        )
+        self.diagnostics.flush()
+        self.assertEqual(
+            self.errors[4:],
+            [
+                "Peering 192.0.2.1: 3 unknown capability 73 in last 0s",
+                "Peering 192.0.2.1: 3 AS_SET in AS_PATH in last 0s",
+            ],
+        )
+        self.diagnostics.flush()
+        self.assertEqual(len(self.errors), 6)
+
+    def test_without_error_handler_reports_are_logged(self):
+        diagnostics = Diagnostics("192.0.2.1", clock=self.clock)
+        with self.assertLogs("beka", logging.WARNING) as logs:
+            diagnostics.report("unknown_attribute", 99)
+        self.assertEqual(
+            logs.output, ["WARNING:beka:Peering 192.0.2.1: unknown path attribute 99"]
+        )
+
+    def test_enabled(self):
+        diagnostics = Diagnostics("192.0.2.1", clock=self.clock)
+        logger = logging.getLogger("beka")
+        level = logger.level
+        logger.setLevel(logging.ERROR)
+        try:
+            self.assertFalse(diagnostics.enabled())
+            # the logger level decides, even with an error_handler
+            self.assertFalse(self.diagnostics.enabled())
+        finally:
+            logger.setLevel(level)
+        self.assertTrue(diagnostics.enabled())
+        self.assertTrue(self.diagnostics.enabled())
@@ -1,6 +1,7 @@
-from beka.ip import IPAddress, IPPrefix
+from beka.ip import IPBase, IPAddress, IPPrefix
 from beka.ip import IP4Address, IP4Prefix
-from beka.ip import IP6Address, IP6Prefix
+from beka.ip import IP6Address, IP6Prefix, PrefixPool
+import gc
 import unittest
 
 
@@ -77,3 +78,84 @@ class IPPrefixTestCase(unittest.TestCase):
             self.assertEqual(
                 repr(prefix), 'IP6Prefix.from_string("%s")' % prefix_string
             )
+
+
+class IPValueTypeTestCase(unittest.TestCase):
+    """Test hashing, ordering and containment of addresses and prefixes"""
+
+    def test_base_class_needs_sort_key(self):
+        with self.assertRaises(TypeError):
+            IPBase()
+
+    def test_prefixes_can_key_dicts_and_sets(self):
+        routes = {IPPrefix.from_string("10.0.0.0/8"): "a"}
+        routes[IPPrefix.from_string("2404:138::/32")] = "b"
+        self.assertEqual(routes[IP4Prefix.from_string("10.0.0.0/8")], "a")
+        self.assertEqual(routes[IP6Prefix.from_string("2404:138::/32")], "b")
+        self.assertEqual(
+            len(
+                {
+                    IPPrefix.from_string("10.0.0.0/8"),
+                    IPPrefix.from_string("10.0.0.0/8"),
+                    IPPrefix.from_string("10.0.0.0/16"),
+                }
+            ),
+            2,
+        )
+
+    def test_prefixes_sort_by_version_address_and_length(self):
+        prefix_strings = [
+            "2404:138::/32",
+            "192.168.0.0/16",
+            "10.0.0.0/16",
+            "10.0.0.0/8",
+            "::/0",
+        ]
+        prefixes = sorted(IPPrefix.from_string(x) for x in prefix_strings)
+        self.assertEqual(
+            [str(prefix) for prefix in prefixes],
+            ["10.0.0.0/8", "10.0.0.0/16", "192.168.0.0/16", "::/0", "2404:138::/32"],
+        )
+        self.assertTrue(
+            IPAddress.from_string("10.0.0.1") < IPAddress.from_string("10.0.0.2")
+        )
+        self.assertTrue(
+            IPAddress.from_string("255.0.0.1") < IPAddress.from_string("::1")
+        )
+
+    def test_prefix_containment(self):
+        supernet = IPPrefix.from_string("10.0.0.0/8")
+        self.assertTrue(IPAddress.from_string("10.2.3.4") in supernet)
+        self.assertFalse(IPAddress.from_string("11.2.3.4") in supernet)
+        self.assertTrue(IPPrefix.from_string("10.1.0.0/16") in supernet)
+        self.assertTrue(supernet in supernet)
+        self.assertFalse(IPPrefix.from_string("10.0.0.0/7") in supernet)
+        self.assertFalse(IPAddress.from_string("::a00:1") in supernet)
+        self.assertTrue(supernet.supernet_of(IPPrefix.from_string("10.1.0.0/16")))
+        self.assertTrue(IPPrefix.from_string("10.1.0.0/16").subnet_of(supernet))
+        self.assertTrue(IPAddress.from_string("::1") in IPPrefix.from_string("::/0"))
+
+    def test_int_and_network(self):
+        prefix = IPPrefix.from_string("192.168.0.128/20")
+        self.assertEqual(int(prefix), 0xC0A80080)
+        self.assertEqual(prefix.network(), 0xC0A80000)
+        self.assertEqual(int(IPAddress.from_string("::1")), 1)
+
+    def test_equality_with_other_types(self):
+        self.assertNotEqual(IPPrefix.from_string("10.0.0.0/8"), "10.0.0.0/8")
+        self.assertNotEqual(IPAddress.from_string("10.0.0.1"), None)
+
+    def test_no_instance_dict(self):
+        self.assertFalse(hasattr(IPPrefix.from_string("10.0.0.0/8"), "__dict__"))
+        self.assertFalse(hasattr(IPAddress.from_string("::1"), "__dict__"))
+
+
+class PrefixPoolTestCase(unittest.TestCase):
+    def test_pool_holds_weak_references(self):
+        prefix_pool = PrefixPool()
+        prefix = IPPrefix.from_string("10.0.0.0/8")
+        prefix_pool.pool(IP4Prefix)[b"\x08\x0a"] = prefix
+        prefix_pool.pool(IP6Prefix)[b"\x00"] = IPPrefix.from_string("::/0")
+        gc.collect()
+        self.assertEqual(len(prefix_pool), 1)
+        self.assertIs(prefix_pool.pool(IP4Prefix)[b"\x08\x0a"], prefix)
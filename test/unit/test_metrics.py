@@ -0,0 +1,171 @@
+import unittest
+
+from beka.aio import BgpProtocol
+from beka.bgp_message import BgpKeepaliveMessage, BgpMessageParser, BgpMessagePacker
+from beka.bgp_message import BgpOpenMessage
+from beka.ip import IP4Address
+from beka.metrics import LatencyHistogram, MetricsExporter
+from beka.peering import Peering
+from beka.state_machine import StateMachine
+
+
+class FakeSocket:  # pylint: disable=too-few-public-methods
+    def send(self, data):
+        return len(data)
+
+
+class FakeTransport:  # pylint: disable=too-few-public-methods
+    def get_extra_info(self, name):  # pylint: disable=unused-argument
+        return ("3.3.3.3", 179)
+
+    def write(self, data):
+        pass
+
+
+class FakeBeka:  # pylint: disable=too-few-public-methods
+    def __init__(self, peerings):
+        self.peerings = peerings
+
+
+def build_state_machine():
+    return StateMachine(
+        local_as=65001,
+        peer_as=65002,
+        router_id="1.1.1.1",
+        local_address="1.1.1.1",
+        neighbor="2.2.2.2",
+    )
+
+
+def build_peering():
+    state_machine = build_state_machine()
+    peering = Peering(state_machine, ("2.2.2.2", 179), FakeSocket(), None)
+    peering.packer = BgpMessagePacker()
+    return peering
+
+
+class LatencyHistogramTestCase(unittest.TestCase):
+    def test_sample_times_one_call_in_sample_interval(self):
+        histogram = LatencyHistogram(sample_interval=4)
+        samples = [histogram.sample() for _ in range(8)]
+        self.assertEqual(samples, [False, False, False, True] * 2)
+
+    def test_observe_counts_into_cumulative_buckets(self):
+        histogram = LatencyHistogram(buckets=(0.001, 0.01))
+        for seconds in (0.0005, 0.001, 0.005, 2.0):
+            histogram.observe(seconds)
+        self.assertEqual(
+            histogram.cumulative_counts(), [(0.001, 2), (0.01, 3), ("+Inf", 4)]
+        )
+        self.assertEqual(histogram.count, 4)
+        self.assertAlmostEqual(histogram.sum, 2.0065)
+
+
+class MetricsExporterTestCase(unittest.TestCase):
+    def setUp(self):
+        self.peering = build_peering()
+        self.peering.send_output([BgpKeepaliveMessage()])
+        self.peering.state_machine.ipv6_prefixes_accepted = 7
+        self.peering.parse_latency.observe(0.002)
+        self.exporter = MetricsExporter(FakeBeka([self.peering]))
+
+    def test_render_includes_counters_with_peer_labels(self):
+        lines = self.exporter.render().splitlines()
+        self.assertIn("# TYPE beka_messages_sent_total counter", lines)
+        self.assertIn(
+            'beka_messages_sent_total{peer="2.2.2.2",type="keepalive"} 1', lines
+        )
+        self.assertIn('beka_bytes_sent_total{peer="2.2.2.2"} 19', lines)
+        self.assertIn(
+            'beka_prefixes_accepted_total{peer="2.2.2.2",afi="ipv6"} 7', lines
+        )
+        self.assertIn('beka_output_queue_messages{peer="2.2.2.2"} 0', lines)
+
+    def test_render_includes_histograms(self):
+        lines = self.exporter.render().splitlines()
+        self.assertIn("# TYPE beka_parse_seconds histogram", lines)
+        self.assertIn('beka_parse_seconds_bucket{peer="2.2.2.2",le="0.001"} 0', lines)
+        self.assertIn('beka_parse_seconds_bucket{peer="2.2.2.2",le="0.005"} 1', lines)
+        self.assertIn('beka_parse_seconds_bucket{peer="2.2.2.2",le="+Inf"} 1', lines)
+        self.assertIn('beka_parse_seconds_count{peer="2.2.2.2"} 1', lines)
+
+    def test_render_includes_diagnostics_counters(self):
+        with self.assertLogs("beka"):
+            self.peering.diagnostics.report("unknown_attribute", 99)
+            self.peering.diagnostics.report("unknown_attribute", 98)
+        lines = self.exporter.render().splitlines()
+        self.assertIn(
+            'beka_diagnostics_total{peer="2.2.2.2",kind="unknown_attribute"} 2', lines
+        )
+
+    def test_render_includes_attribute_cache_counters(self):
+        self.peering.parser = BgpMessageParser(attribute_cache_size=16)
+        self.peering.parser.attribute_cache.hits = 3
+        lines = self.exporter.render().splitlines()
+        self.assertIn('beka_attribute_cache_hits_total{peer="2.2.2.2"} 3', lines)
+        self.assertIn('beka_attribute_cache_misses_total{peer="2.2.2.2"} 0', lines)
+
+    def test_each_family_is_declared_once(self):
+        self.exporter.beka.peerings.append(build_peering())
+        lines = self.exporter.render().splitlines()
+        self.assertEqual(lines.count("# TYPE beka_bytes_sent_total counter"), 1)
+
+    def test_application_serves_metrics(self):
+        responses = []
+        body = self.exporter.application(
+            {"PATH_INFO": "/metrics"},
+            lambda status, headers: responses.append((status, dict(headers))),
+        )
+        status, headers = responses[0]
+        self.assertEqual(status, "200 OK")
+        self.assertTrue(headers["Content-Type"].startswith("text/plain"))
+        self.assertEqual(body, [self.exporter.render().encode("utf-8")])
+
+    def test_application_rejects_other_paths(self):
+        responses = []
+        self.exporter.application(
+            {"PATH_INFO": "/other"},
+            lambda status, headers: responses.append(status),
+        )
+        self.assertEqual(responses, ["404 Not Found"])
+
+    def test_peering_counters(self):
+        counters = self.peering.counters()
+        self.assertEqual(counters["messages_sent"]["keepalive"], 1)
+        self.assertEqual(counters["prefixes_accepted"], {"ipv4": 0, "ipv6": 7})
+        self.assertEqual(counters["bytes_sent"], 19)
+
+
+class BgpProtocolMetricsTestCase(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.protocol = BgpProtocol(build_state_machine())
+        self.protocol.connection_made(FakeTransport())
+        packer = BgpMessagePacker()
+        self.protocol.data_received(
+            packer.pack(
+                BgpOpenMessage(
+                    4,
+                    65002,
+                    240,
+                    IP4Address.from_string("2.2.2.2"),
+                    {"multiprotocol": ["ipv4-unicast"]},
+                )
+            )
+            + packer.pack(BgpKeepaliveMessage())
+        )
+        self.exporter = MetricsExporter(FakeBeka([self.protocol]))
+
+    def test_render_includes_counters_with_peer_labels(self):
+        lines = self.exporter.render().splitlines()
+        self.assertIn('beka_messages_sent_total{peer="3.3.3.3",type="open"} 1', lines)
+        self.assertIn(
+            'beka_messages_received_total{peer="3.3.3.3",type="keepalive"} 1', lines
+        )
+        self.assertIn(
+            'beka_messages_received_total{peer="3.3.3.3",type="open"} 1', lines
+        )
+        self.assertIn('beka_route_queue_updates{peer="3.3.3.3"} 0', lines)
+        self.assertIn("# TYPE beka_parse_seconds histogram", lines)
+
+    def test_counters_match_peering_counters(self):
+        self.assertEqual(set(self.protocol.counters()), set(build_peering().counters()))
@@ -0,0 +1,88 @@
+from concurrent.futures import ThreadPoolExecutor
+import unittest
+
+from beka.bgp_message import BgpMessage, BgpMessageParser, BgpMessagePacker
+from beka.bgp_message import BgpKeepaliveMessage, BgpUpdateMessage
+from beka.diagnostics import Diagnostics
+from beka.ip import IP4Address, IP4Prefix
+from beka.parse_pool import ParsePool
+
+
+def build_messages(count, unknown_attributes=()):
+    """Return count UPDATE bodies with a KEEPALIVE after every third"""
+    packer = BgpMessagePacker()
+    messages = []
+    for i in range(count):
+        path_attributes = {
+            "next_hop": IP4Address.from_string("192.168.0.1"),
+            "origin": "IGP",
+            "as_path": "65002",
+        }
+        if unknown_attributes:
+            path_attributes["unknown_attributes"] = unknown_attributes
+        update = BgpUpdateMessage(
+            [], path_attributes, [IP4Prefix.from_string("10.%d.0.0/16" % i)]
+        )
+        messages.append((BgpMessage.UPDATE_MESSAGE, packer.pack(update)[19:]))
+        if i % 3 == 2:
+            messages.append((BgpMessage.KEEPALIVE_MESSAGE, b""))
+    return messages
+
+
+class ParsePoolTestCase(unittest.TestCase):
+    def setUp(self):
+        self.parser = BgpMessageParser()
+        self.messages = build_messages(30)
+
+    def assert_parsed_in_order(self, parsed):
+        self.assertEqual(len(parsed), len(self.messages))
+        prefixes = []
+        for (message_type, _), message in zip(self.messages, parsed):
+            if message_type == BgpMessage.KEEPALIVE_MESSAGE:
+                self.assertIsInstance(message, BgpKeepaliveMessage)
+            else:
+                prefixes += message.nlri
+        self.assertEqual(
+            prefixes, [IP4Prefix.from_string("10.%d.0.0/16" % i) for i in range(30)]
+        )
+
+    def test_small_batches_are_parsed_inline(self):
+        parse_pool = ParsePool(min_offload=100)
+        self.assert_parsed_in_order(parse_pool.parse(self.parser, self.messages))
+        self.assertIsNone(parse_pool.executor)
+        self.assertEqual(parse_pool.stats()["inline"], len(self.messages))
+
+    def test_updates_are_offloaded_in_order(self):
+        with ThreadPoolExecutor(4) as executor:
+            parse_pool = ParsePool(batch_size=7, min_offload=1, executor=executor)
+            self.assert_parsed_in_order(parse_pool.parse(self.parser, self.messages))
+        stats = parse_pool.stats()
+        self.assertEqual(stats["offloaded"], 30)
+        self.assertEqual(stats["inline"], 10)
+        self.assertEqual(stats["batches"], 5)
+        self.assertEqual(stats["max_queue_depth"], 30)
+        self.assertEqual(stats["queue_depth"], 0)
+        self.assertGreater(stats["max_parse_latency"], 0)
+
+    def test_process_pool(self):
+        parse_pool = ParsePool(workers=1, min_offload=1)
+        try:
+            self.assert_parsed_in_order(parse_pool.parse(self.parser, self.messages))
+        finally:
+            parse_pool.shutdown()
+        self.assertEqual(parse_pool.stats()["offloaded"], 30)
+
+    def test_process_pool_reports_notes(self):
+        errors = []
+        self.parser.diagnostics = Diagnostics("192.0.2.1", errors.append, burst=100)
+        self.messages = build_messages(30, ((0xC0, 99, b"opaque"),))
+        parse_pool = ParsePool(workers=1, batch_size=7, min_offload=1)
+        try:
+            parsed = parse_pool.parse(self.parser, self.messages)
+        finally:
+            parse_pool.shutdown()
+        self.assert_parsed_in_order(parsed)
+        [(_flags, type_code, value)] = parsed[0].path_attributes["unknown_attributes"]
+        self.assertEqual((type_code, value), (99, b"opaque"))
+        self.assertEqual(self.parser.diagnostics.totals(), {"unknown_attribute": 30})
+        self.assertEqual(errors[0], "Peering 192.0.2.1: unknown path attribute 99")
@@ -2,9 +2,12 @@ import unittest
 from unittest.mock import patch, call
 
 from eventlet import GreenPool, sleep
-from eventlet.queue import Queue
+from eventlet.event import Event
 
-from beka.peering import Peering
+from beka.bgp_message import BgpMessageParser, BgpMessagePacker, BgpKeepaliveMessage
+from beka.error import IdleError, SocketClosedError
+from beka.peering import Peering, TimerScheduler
+from beka.state_machine import StateMachine
 
 
 class RouteCatcher:  # pylint: disable=too-few-public-methods
@@ -19,8 +22,26 @@ class FakeStateMachine:  # pylint: disable=too-few-public-methods
     """Mocked StateMachine"""
 
     def __init__(self):
-        self.output_messages = Queue()
-        self.route_updates = Queue()
+        self.events = []
+
+    def withdraw_all_routes(self):
+        return ["FAKE ROUTE REMOVAL"]
+
+    def event(
+        self, event, tick, output_messages, route_updates
+    ):  # pylint: disable=unused-argument
+        self.events.append(event)
+        return output_messages, route_updates
+
+
+class IdleStateMachine(FakeStateMachine):  # pylint: disable=too-few-public-methods
+    """Mocked StateMachine that goes idle on the first event"""
+
+    def event(
+        self, event, tick, output_messages, route_updates
+    ):  # pylint: disable=unused-argument
+        output_messages.append("FAKE NOTIFICATION")
+        raise IdleError("State machine stopping: test")
 
 
 class FakeSocket:  # pylint: disable=too-few-public-methods
@@ -33,11 +54,51 @@ class FakeSocket:  # pylint: disable=too-few-public-methods
         return None
 
 
+class TrickleSocket:  # pylint: disable=too-few-public-methods
+    """Socket that accepts at most max_send bytes per send call"""
+
+    def __init__(self, max_send):
+        self.max_send = max_send
+        self.sent = b""
+
+    def send(self, data):
+        data = bytes(data[: self.max_send])
+        self.sent += data
+        return len(data)
+
+
+class BrokenSocket:  # pylint: disable=too-few-public-methods
+    """Socket whose peer has gone away"""
+
+    def send(self, data):
+        raise BrokenPipeError("Broken pipe")
+
+
+class FakeEventlet:  # pylint: disable=too-few-public-methods
+    def __init__(self):
+        self.killed = False
+
+    def kill(self):
+        self.killed = True
+
+
+class FakePacker:  # pylint: disable=too-few-public-methods
+    """Mocked BgpMessagePacker"""
+
+    def pack(self, message):
+        return message
+
+
 class FakeChopper:  # pylint: disable=too-few-public-methods
     """Mocked Chopper"""
 
-    def __init__(self):
-        pass
+    def __init__(self, batches=()):
+        self.batches = list(batches)
+
+    def next_batch(self):
+        if not self.batches:
+            raise SocketClosedError("Tried to read 19 bytes but only got 0")
+        return self.batches.pop(0)
 
 
 class PeeringTestCase(unittest.TestCase):
@@ -54,7 +115,7 @@ class PeeringTestCase(unittest.TestCase):
 
     def test_print_route_updates(self):
         fake_route_update = "FAKE ROUTE UPDATE"
-        self.state_machine.route_updates.put(fake_route_update)
+        self.peering.route_updates.put(fake_route_update)
         pool = GreenPool()
         eventlet = pool.spawn(self.peering.print_route_updates)
         for _ in range(10):
@@ -65,6 +126,194 @@ class PeeringTestCase(unittest.TestCase):
         self.assertEqual(self.route_catcher.route_updates[0], fake_route_update)
         eventlet.kill()
 
+    def test_collect_route_batches_coalesces_by_count(self):
+        peering = Peering(
+            state_machine=self.state_machine,
+            peer_address="1.2.3.4:179",
+            socket=FakeSocket(),
+            route_handler=None,
+            batch_route_handler=self.route_catcher.handle,
+            batch_max_routes=4,
+            batch_max_delay=0,
+        )
+        for batch in (["a", "b"], ["c"], ["d", "e"], ["f"]):
+            peering.route_updates.put(batch)
+        self.assertEqual(
+            peering.collect_route_batches(), [["a", "b"], ["c"], ["d", "e"]]
+        )
+        self.assertEqual(peering.collect_route_batches(), [["f"]])
+
+    def test_deliver_route_batches(self):
+        peering = Peering(
+            state_machine=self.state_machine,
+            peer_address="1.2.3.4:179",
+            socket=FakeSocket(),
+            route_handler=None,
+            batch_route_handler=self.route_catcher.handle,
+            batch_max_delay=0.01,
+        )
+        peering.route_updates.put(["a"])
+        peering.route_updates.put(["b", "c"])
+        pool = GreenPool()
+        eventlet = pool.spawn(peering.deliver_route_batches)
+        for _ in range(10):
+            sleep(0.01)
+            if self.route_catcher.route_updates:
+                break
+        self.assertEqual(self.route_catcher.route_updates, [[["a"], ["b", "c"]]])
+        eventlet.kill()
+
+    def test_send_output_coalesces_queued_messages(self):
+        socket = TrickleSocket(1000)
+        self.peering.socket = socket
+        self.peering.packer = FakePacker()
+        for message in (b"bb", b"ccc"):
+            self.peering.output_messages.put(message)
+        self.peering.send_output([b"a"])
+        self.assertEqual(socket.sent, b"abbccc")
+        self.assertEqual(self.peering.send_calls, 1)
+        self.assertEqual(self.peering.messages_sent, 3)
+        self.assertEqual(self.peering.send_stats()["messages_per_send"], 3.0)
+
+    def test_send_output_stops_at_send_buffer_size(self):
+        self.peering.socket = TrickleSocket(1000)
+        self.peering.packer = FakePacker()
+        self.peering.send_buffer_size = 4
+        for message in (b"bb", b"ccc", b"d"):
+            self.peering.output_messages.put(message)
+        self.peering.send_output([b"a"])
+        self.assertEqual(self.peering.socket.sent, b"abbccc")
+        self.assertEqual(self.peering.output_messages.qsize(), 1)
+
+    def test_send_buffer_handles_partial_writes(self):
+        socket = TrickleSocket(3)
+        self.peering.socket = socket
+        self.peering.send_buffer(b"0123456789")
+        self.assertEqual(socket.sent, b"0123456789")
+        self.assertEqual(self.peering.send_calls, 4)
+        self.assertEqual(self.peering.bytes_sent, 10)
+
+    def test_empty_message_queue_sends_everything(self):
+        self.peering.socket = TrickleSocket(1000)
+        self.peering.packer = FakePacker()
+        self.peering.send_buffer_size = 2
+        for message in (b"aa", b"bb", b"cc"):
+            self.peering.output_messages.put(message)
+        self.peering.empty_message_queue()
+        self.assertEqual(self.peering.socket.sent, b"aabbcc")
+        self.assertEqual(self.peering.send_calls, 3)
+
+    def test_wait_for_output_space_pauses_until_output_drains(self):
+        self.peering.socket = TrickleSocket(1000)
+        self.peering.packer = FakePacker()
+        self.peering.max_output_messages = 2
+        for message in (b"aa", b"bb", b"cc"):
+            self.peering.output_messages.put(message)
+        self.assertTrue(self.peering.output_congested())
+        pool = GreenPool()
+        eventlet = pool.spawn(self.peering.wait_for_output_space)
+        sleep(0)
+        self.assertFalse(eventlet.dead)
+        self.peering.empty_message_queue()
+        eventlet.wait()
+        self.assertEqual(self.peering.output_pauses, 1)
+
+    def test_receive_messages_handles_each_message_in_a_batch(self):
+        errors = []
+        self.peering.error_handler = errors.append
+        self.peering.parser = BgpMessageParser()
+        self.peering.eventlets = []
+        self.peering.chopper = FakeChopper([[(4, b""), (4, b"")], [(4, b"")]])
+        self.peering.receive_messages()
+        self.assertEqual(len(self.state_machine.events), 3)
+        self.assertIsInstance(self.state_machine.events[0].message, BgpKeepaliveMessage)
+        self.assertEqual(errors, ["Peering 1: Tried to read 19 bytes but only got 0"])
+        self.assertEqual(self.peering.messages_received[4], 3)
+        self.assertEqual(self.peering.bytes_received, 3 * 19)
+
+    def test_receive_messages_shuts_down_on_malformed_message(self):
+        errors = []
+        self.peering.error_handler = errors.append
+        self.peering.parser = BgpMessageParser()
+        self.peering.eventlets = []
+        self.peering.socket = TrickleSocket(1000)
+        self.peering.packer = BgpMessagePacker()
+        self.peering.chopper = FakeChopper([[(2, b"\x00")]])
+        self.peering.receive_messages()
+        self.assertEqual(
+            errors, ["Peering 1: Malformed message: UPDATE: Message too short"]
+        )
+        self.assertEqual(self.route_catcher.route_updates, ["FAKE ROUTE REMOVAL"])
+        # UPDATE Message Error, Malformed Attribute List
+        self.assertEqual(self.peering.socket.sent[18:], b"\x03\x03\x01")
+
+    def test_receive_messages_shuts_down_on_truncated_mp_reach_nlri(self):
+        errors = []
+        self.peering.error_handler = errors.append
+        self.peering.parser = BgpMessageParser()
+        self.peering.eventlets = []
+        # an UPDATE whose only attribute is a two byte MP_REACH_NLRI
+        update = b"\x00\x00\x00\x05\x80\x0e\x02\x00\x02"
+        self.peering.socket = TrickleSocket(1000)
+        self.peering.packer = BgpMessagePacker()
+        self.peering.chopper = FakeChopper([[(2, update)]])
+        self.peering.receive_messages()
+        self.assertEqual(
+            errors,
+            ["Peering 1: Malformed message: MP_REACH_NLRI: Got invalid length: 2"],
+        )
+        self.assertEqual(self.route_catcher.route_updates, ["FAKE ROUTE REMOVAL"])
+
+    def test_receive_messages_shuts_down_on_empty_mp_reach_next_hop(self):
+        errors = []
+        self.peering.error_handler = errors.append
+        self.peering.parser = BgpMessageParser()
+        self.peering.eventlets = []
+        # an UPDATE whose only attribute is an MP_REACH_NLRI with no next hop
+        update = b"\x00\x00\x00\x08\x80\x0e\x05\x00\x02\x01\x00\x00"
+        self.peering.socket = TrickleSocket(1000)
+        self.peering.packer = BgpMessagePacker()
+        self.peering.chopper = FakeChopper([[(2, update)]])
+        self.peering.receive_messages()
+        self.assertEqual(
+            errors,
+            [
+                "Peering 1: Malformed message: "
+                "MP_REACH_NLRI: Got unsupported next hop length: 0"
+            ],
+        )
+        self.assertEqual(self.route_catcher.route_updates, ["FAKE ROUTE REMOVAL"])
+        self.assertEqual(self.peering.socket.sent[18:], b"\x03\x03\x01")
+
+    def test_send_output_counts_messages_by_type(self):
+        self.peering.socket = TrickleSocket(1000)
+        self.peering.packer = BgpMessagePacker()
+        self.peering.output_messages.put(b"pre-packed update")
+        self.peering.send_output([BgpKeepaliveMessage()])
+        self.assertEqual(self.peering.messages_sent_by_type[4], 1)
+        self.assertEqual(self.peering.messages_sent_by_type[2], 1)
+
+    def test_handle_events_queues_output_before_going_idle(self):
+        self.peering.state_machine = IdleStateMachine()
+        with self.assertRaises(IdleError):
+            self.peering.handle_events(["FAKE EVENT"], 0)
+        self.assertEqual(self.peering.output_messages.get(), "FAKE NOTIFICATION")
+
+    def test_shutdown_delivers_withdrawals(self):
+        self.peering.eventlets = []
+        self.peering.shutdown()
+        self.assertEqual(self.route_catcher.route_updates, ["FAKE ROUTE REMOVAL"])
+
+    def test_shutdown_withdraws_when_the_socket_is_broken(self):
+        eventlet = FakeEventlet()
+        self.peering.eventlets = [eventlet]
+        self.peering.socket = BrokenSocket()
+        self.peering.packer = BgpMessagePacker()
+        self.peering.output_messages.put(BgpKeepaliveMessage())
+        self.peering.shutdown()
+        self.assertEqual(self.route_catcher.route_updates, ["FAKE ROUTE REMOVAL"])
+        self.assertTrue(eventlet.killed)
+
     def test_run_starts_threads(self):
         with patch("beka.peering.GreenPool") as GreenPool:
             self.peering.run()
@@ -77,3 +326,108 @@ class PeeringTestCase(unittest.TestCase):
             ]
         )
         assert GreenPool().waitall.call_count == 1
+
+
+class VirtualClock:  # pylint: disable=too-few-public-methods
+    def __init__(self, now):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+class VirtualTimerScheduler(TimerScheduler):
+    """TimerScheduler that jumps its clock to each deadline instead of sleeping"""
+
+    def wait(self):
+        self.clock.now = max(self.clock.now, self.next_deadline())
+
+
+def build_established_peering(timer_scheduler, hold_time, tick):
+    state_machine = StateMachine(
+        local_as=65001,
+        peer_as=65002,
+        local_address="1.1.1.1",
+        router_id="1.1.1.1",
+        neighbor="2.2.2.2",
+        hold_time=hold_time,
+    )
+    state_machine.state = "established"
+    state_machine.timers["hold"].reset(tick)
+    state_machine.timers["keepalive"].reset(tick)
+    peering = Peering(
+        state_machine=state_machine,
+        peer_address="2.2.2.2",
+        socket=FakeSocket(),
+        route_handler=RouteCatcher().handle,
+        timer_scheduler=timer_scheduler,
+    )
+    peering.eventlets = []
+    peering.socket = TrickleSocket(65536)
+    peering.packer = BgpMessagePacker()
+    peering.reschedule_timers()
+    return peering
+
+
+class TimerSchedulerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.clock = VirtualClock(10000.0)
+        self.timer_scheduler = VirtualTimerScheduler(self.clock)
+
+    def test_idle_sessions_only_wake_up_for_keepalives(self):
+        sessions = 1000
+        hold_time = 90
+        keepalive_time = hold_time // 3
+        duration = 60
+        start = self.clock.now
+        peerings = []
+        for i in range(sessions):
+            peering = build_established_peering(
+                self.timer_scheduler, hold_time, start + i * keepalive_time / sessions
+            )
+            # stands in for the keepalives the peer sends us
+            peering.state_machine.timers["hold"].stop()
+            peering.reschedule_timers()
+            peerings.append(peering)
+
+        while self.clock.now < start + duration:
+            self.timer_scheduler.run_once()
+
+        wakeups_per_second = self.timer_scheduler.wakeups / duration
+        # one kick_timers greenlet per peering would wake up sessions times a second
+        self.assertLessEqual(wakeups_per_second, 1.05 * sessions / keepalive_time)
+        keepalives = [peering.output_messages.qsize() for peering in peerings]
+        self.assertEqual(min(keepalives), 1)
+        self.assertEqual(sum(keepalives), self.timer_scheduler.wakeups)
+        self.assertEqual(len(self.timer_scheduler), sessions)
+
+    def test_sub_second_keepalives(self):
+        peering = build_established_peering(self.timer_scheduler, 0.75, self.clock.now)
+        peering.state_machine.timers["hold"].stop()
+        peering.reschedule_timers()
+        start = self.clock.now
+        while self.clock.now < start + 1:
+            self.timer_scheduler.run_once()
+        self.assertEqual(peering.output_messages.qsize(), 4)
+        self.assertEqual(self.timer_scheduler.wakeups, 4)
+
+    def test_hold_timer_expiry_shuts_down_peering(self):
+        errors = []
+        peering = build_established_peering(self.timer_scheduler, 0.75, self.clock.now)
+        peering.error_handler = errors.append
+        start = self.clock.now
+        while self.clock.now < start + 0.75:
+            self.timer_scheduler.run_once()
+        self.assertEqual(len(errors), 1)
+        self.assertIn("Hold timer expired", errors[0])
+        self.assertEqual(len(self.timer_scheduler), 0)
+
+    def test_earlier_deadline_wakes_scheduler(self):
+        timer_scheduler = TimerScheduler()
+        timer_scheduler.schedule("a", 100)
+        self.assertTrue(timer_scheduler.rescheduled.ready())
+        timer_scheduler.rescheduled = Event()
+        timer_scheduler.schedule("b", 150)
+        self.assertFalse(timer_scheduler.rescheduled.ready())
+        timer_scheduler.schedule("c", 50)
+        self.assertTrue(timer_scheduler.rescheduled.ready())
@@ -0,0 +1,268 @@
+import random
+import struct
+import unittest
+
+from beka.rib import PrefixTrie, AdjRibIn, RouteTable
+from beka.route import PathAttributes, RouteAddition, RouteRemoval, RouteBatch
+from beka.ip import IP4Prefix, IP4Address
+from beka.ip import IP6Prefix, IP6Address
+
+
+def prefixes_from_strings(prefix_strings):
+    return [IP4Prefix.from_string(prefix_string) for prefix_string in prefix_strings]
+
+
+class PrefixTrieTestCase(unittest.TestCase):
+    def test_insert_and_get(self):
+        trie = PrefixTrie(32)
+        prefixes = prefixes_from_strings(
+            ["10.0.0.0/8", "10.1.0.0/16", "10.0.0.0/16", "0.0.0.0/0", "10.1.2.3/32"]
+        )
+        for index, prefix in enumerate(prefixes):
+            trie.insert(prefix, index)
+        self.assertEqual(len(trie), 5)
+        for index, prefix in enumerate(prefixes):
+            self.assertEqual(trie.get(prefix), index)
+            self.assertTrue(prefix in trie)
+        self.assertIsNone(trie.get(IP4Prefix.from_string("10.0.0.0/9")))
+        self.assertIsNone(trie.get(IP4Prefix.from_string("11.0.0.0/8")))
+
+    def test_insert_replaces_value(self):
+        trie = PrefixTrie(32)
+        trie.insert(IP4Prefix.from_string("10.0.0.0/8"), "first")
+        trie.insert(IP4Prefix.from_string("10.0.0.0/8"), "second")
+        self.assertEqual(len(trie), 1)
+        self.assertEqual(trie.get(IP4Prefix.from_string("10.0.0.0/8")), "second")
+
+    def test_iterates_in_address_order(self):
+        trie = PrefixTrie(32)
+        prefix_strings = ["192.168.0.0/16", "10.1.0.0/16", "10.0.0.0/8", "10.0.0.0/16"]
+        for prefix in prefixes_from_strings(prefix_strings):
+            trie.insert(prefix, str(prefix))
+        self.assertEqual(
+            list(trie.values()),
+            ["10.0.0.0/8", "10.0.0.0/16", "10.1.0.0/16", "192.168.0.0/16"],
+        )
+
+    def test_delete_prunes_nodes(self):
+        trie = PrefixTrie(32)
+        prefixes = prefixes_from_strings(["10.0.0.0/16", "10.1.0.0/16", "10.0.0.0/8"])
+        for prefix in prefixes:
+            trie.insert(prefix, str(prefix))
+        self.assertEqual(trie.delete(prefixes[0]), "10.0.0.0/16")
+        self.assertIsNone(trie.delete(prefixes[0]))
+        self.assertEqual(trie.delete(prefixes[2]), "10.0.0.0/8")
+        self.assertEqual(trie.root.prefix, prefixes[1])
+        self.assertIsNone(trie.root.left)
+        self.assertIsNone(trie.root.right)
+        self.assertEqual(trie.delete(prefixes[1]), "10.1.0.0/16")
+        self.assertIsNone(trie.root)
+        self.assertEqual(len(trie), 0)
+
+    def test_matches_dict_under_random_operations(self):
+        rand = random.Random(1)
+        trie = PrefixTrie(32)
+        expected = {}
+        for _ in range(5000):
+            length = rand.randint(0, 32)
+            address = rand.getrandbits(length) << (32 - length) if length else 0
+            # keep the address space small so prefixes collide and nest
+            address &= 0xFF0F0000
+            prefix = IP4Prefix(struct.pack("!I", address), length)
+            key = (address, length)
+            if rand.random() < 0.6:
+                trie.insert(prefix, key)
+                expected[key] = key
+            else:
+                self.assertEqual(trie.delete(prefix), expected.pop(key, None))
+        self.assertEqual(len(trie), len(expected))
+        self.assertEqual(sorted(trie.values()), sorted(expected.values()))
+
+    def test_ipv6(self):
+        trie = PrefixTrie(128)
+        prefix = IP6Prefix.from_string("2001:db8::/32")
+        trie.insert(prefix, "v6")
+        self.assertEqual(trie.get(IP6Prefix.from_string("2001:db8::/32")), "v6")
+        self.assertIsNone(trie.get(IP6Prefix.from_string("2001:db8::/48")))
+
+
+class PrefixTrieMatchTestCase(unittest.TestCase):
+    def setUp(self):
+        self.trie = PrefixTrie(32)
+        self.prefix_strings = [
+            "0.0.0.0/0",
+            "10.0.0.0/8",
+            "10.1.0.0/16",
+            "10.1.2.0/24",
+            "10.2.0.0/16",
+            "192.168.0.0/16",
+        ]
+        for prefix in prefixes_from_strings(self.prefix_strings):
+            self.trie.insert(prefix, str(prefix))
+
+    def test_longest_match_address(self):
+        self.assertEqual(
+            self.trie.longest_match(IP4Address.from_string("10.1.2.3"))[1],
+            "10.1.2.0/24",
+        )
+        self.assertEqual(
+            self.trie.longest_match(IP4Address.from_string("10.1.3.3"))[1],
+            "10.1.0.0/16",
+        )
+        self.assertEqual(
+            self.trie.longest_match(IP4Address.from_string("10.3.0.1"))[1],
+            "10.0.0.0/8",
+        )
+        self.assertEqual(
+            self.trie.longest_match(IP4Address.from_string("8.8.8.8"))[1],
+            "0.0.0.0/0",
+        )
+
+    def test_longest_match_prefix(self):
+        self.assertEqual(
+            self.trie.longest_match(IP4Prefix.from_string("10.1.0.0/17"))[1],
+            "10.1.0.0/16",
+        )
+        self.assertEqual(
+            self.trie.longest_match(IP4Prefix.from_string("10.1.0.0/16"))[1],
+            "10.1.0.0/16",
+        )
+
+    def test_longest_match_without_default(self):
+        self.trie.delete(IP4Prefix.from_string("0.0.0.0/0"))
+        self.assertIsNone(self.trie.longest_match(IP4Address.from_string("8.8.8.8")))
+
+    def test_covering(self):
+        self.assertEqual(
+            [
+                value
+                for _, value in self.trie.covering(IP4Address.from_string("10.1.2.3"))
+            ],
+            ["0.0.0.0/0", "10.0.0.0/8", "10.1.0.0/16", "10.1.2.0/24"],
+        )
+
+    def test_covered(self):
+        self.assertEqual(
+            [
+                value
+                for _, value in self.trie.covered(IP4Prefix.from_string("10.0.0.0/8"))
+            ],
+            ["10.0.0.0/8", "10.1.0.0/16", "10.1.2.0/24", "10.2.0.0/16"],
+        )
+        self.assertEqual(
+            [
+                value
+                for _, value in self.trie.covered(IP4Prefix.from_string("10.1.0.0/15"))
+            ],
+            ["10.1.0.0/16", "10.1.2.0/24"],
+        )
+        self.assertEqual(
+            list(self.trie.covered(IP4Prefix.from_string("11.0.0.0/8"))), []
+        )
+        self.assertEqual(
+            len(list(self.trie.covered(IP4Prefix.from_string("0.0.0.0/0")))), 6
+        )
+
+    def test_matches_linear_scan(self):
+        rand = random.Random(2)
+        trie = PrefixTrie(32)
+        prefixes = []
+        for _ in range(500):
+            length = rand.randint(0, 24)
+            address = rand.getrandbits(length) << (32 - length) if length else 0
+            address &= 0x0F0F0000
+            prefix = IP4Prefix(struct.pack("!I", address), length)
+            trie.insert(prefix, prefix)
+            prefixes.append(prefix)
+        for _ in range(500):
+            address = IP4Address(struct.pack("!I", rand.getrandbits(32) & 0x0F0FFFFF))
+            matches = [prefix for prefix in prefixes if address in prefix]
+            expected = max(matches, key=lambda x: x.length) if matches else None
+            match = trie.longest_match(address)
+            self.assertEqual(match[1] if match else None, expected)
+
+
+class RouteTableTestCase(unittest.TestCase):
+    def setUp(self):
+        self.table = RouteTable()
+        self.attributes = PathAttributes.intern(
+            IP4Address.from_string("192.168.1.1"), "65001", "IGP"
+        )
+
+    def test_apply_routes(self):
+        route = RouteAddition(
+            IP4Prefix.from_string("10.0.0.0/8"),
+            IP4Address.from_string("192.168.1.1"),
+            "65001",
+            "IGP",
+        )
+        route6 = RouteAddition(
+            IP6Prefix.from_string("2001:db8::/32"),
+            IP6Address.from_string("2001:db8::1"),
+            "65001",
+            "IGP",
+        )
+        self.table.apply(route)
+        self.table.apply(route6)
+        self.assertEqual(len(self.table), 2)
+        self.assertIs(self.table.lookup(IP4Address.from_string("10.1.1.1")), route)
+        self.assertIs(self.table.lookup(IP6Address.from_string("2001:db8::5")), route6)
+        self.assertIsNone(self.table.lookup(IP4Address.from_string("11.1.1.1")))
+        self.table.apply(RouteRemoval(IP4Prefix.from_string("10.0.0.0/8")))
+        self.assertIsNone(self.table.lookup(IP4Address.from_string("10.1.1.1")))
+        self.assertEqual(list(self.table), [route6])
+
+    def test_apply_batches(self):
+        prefixes = prefixes_from_strings(["10.0.0.0/8", "10.1.0.0/16"])
+        self.table.apply_batches([RouteBatch(prefixes, [], self.attributes)])
+        self.assertEqual(len(self.table), 2)
+        self.assertEqual(
+            self.table.lookup(IP4Address.from_string("10.1.0.1")).prefix, prefixes[1]
+        )
+        self.assertEqual(
+            [route.prefix for route in self.table.covered(prefixes[0])], prefixes
+        )
+        self.assertEqual(
+            [route.prefix for route in self.table.covering(prefixes[1])], prefixes
+        )
+        self.table.apply(RouteBatch([], [prefixes[1]]))
+        self.assertEqual(self.table.get(prefixes[1]), None)
+        self.assertEqual(self.table.get(prefixes[0]).attributes, self.attributes)
+
+
+class AdjRibInTestCase(unittest.TestCase):
+    def setUp(self):
+        self.rib = AdjRibIn()
+        self.attributes = PathAttributes.intern(
+            IP4Address.from_string("192.168.1.1"), "65001", "IGP"
+        )
+
+    def test_add_suppresses_duplicates(self):
+        prefix = IP4Prefix.from_string("10.0.0.0/8")
+        self.assertTrue(self.rib.add(prefix, self.attributes))
+        self.assertFalse(self.rib.add(prefix, self.attributes))
+        changed_attributes = PathAttributes.intern(
+            IP4Address.from_string("192.168.1.2"), "65001", "IGP"
+        )
+        self.assertTrue(self.rib.add(prefix, changed_attributes))
+        self.assertIs(self.rib.get(prefix), changed_attributes)
+
+    def test_remove_suppresses_unknown_prefixes(self):
+        prefix = IP4Prefix.from_string("10.0.0.0/8")
+        self.assertFalse(self.rib.remove(prefix))
+        self.rib.add(prefix, self.attributes)
+        self.assertTrue(self.rib.remove(prefix))
+        self.assertFalse(self.rib.remove(prefix))
+
+    def test_withdraw_all(self):
+        self.rib.add(IP4Prefix.from_string("10.0.0.0/8"), self.attributes)
+        self.rib.add(IP6Prefix.from_string("2001:db8::/32"), self.attributes)
+        self.assertEqual(len(self.rib), 2)
+        self.assertEqual(
+            self.rib.withdraw_all(),
+            (
+                [IP4Prefix.from_string("10.0.0.0/8")],
+                [IP6Prefix.from_string("2001:db8::/32")],
+            ),
+        )
+        self.assertEqual(len(self.rib), 0)
@@ -0,0 +1,96 @@
+import unittest
+
+from beka.as_path import AsPath
+from beka.route import PathAttributes, RouteAddition, RouteRemoval, RouteBatch
+from beka.ip import IP4Prefix, IP4Address
+
+
+class PathAttributesTestCase(unittest.TestCase):
+    def test_intern_returns_shared_object(self):
+        first = PathAttributes.intern(
+            IP4Address.from_string("192.168.1.1"), "65001 65002", "IGP"
+        )
+        second = PathAttributes.intern(
+            IP4Address.from_string("192.168.1.1"), "65001 65002", "IGP"
+        )
+        third = PathAttributes.intern(
+            IP4Address.from_string("192.168.1.2"), "65001 65002", "IGP"
+        )
+        self.assertIs(first, second)
+        self.assertIsNot(first, third)
+        self.assertNotEqual(first, third)
+
+    def test_string_as_path_is_parsed(self):
+        next_hop = IP4Address.from_string("192.168.1.1")
+        as_path = AsPath.from_string("65001 65002")
+        from_string = PathAttributes.intern(next_hop, "65001 65002", "IGP")
+        from_as_path = PathAttributes.intern(next_hop, as_path, "IGP")
+        self.assertIs(from_string, from_as_path)
+        self.assertIs(from_string.as_path, as_path)
+        self.assertIsInstance(
+            PathAttributes.intern(next_hop, "", "IGP").as_path, AsPath
+        )
+
+    def test_path_attributes_are_immutable(self):
+        attributes = PathAttributes(
+            IP4Address.from_string("192.168.1.1"), "65001", "IGP"
+        )
+        with self.assertRaises(AttributeError):
+            attributes.origin = "EGP"
+        self.assertEqual(attributes.origin, "IGP")
+
+
+class RouteTestCase(unittest.TestCase):
+    def test_routes_with_same_attributes_share_them(self):
+        first = RouteAddition(
+            IP4Prefix.from_string("10.0.0.0/8"),
+            IP4Address.from_string("192.168.1.1"),
+            "65001",
+            "IGP",
+        )
+        second = RouteAddition(
+            IP4Prefix.from_string("10.1.0.0/16"),
+            IP4Address.from_string("192.168.1.1"),
+            "65001",
+            "IGP",
+        )
+        self.assertIs(first.attributes, second.attributes)
+        self.assertEqual(first.next_hop, IP4Address.from_string("192.168.1.1"))
+        self.assertEqual(first.as_path, "65001")
+        self.assertEqual(first.origin, "IGP")
+        self.assertFalse(first.is_withdraw)
+
+    def test_routes_have_no_instance_dict(self):
+        route = RouteAddition(
+            IP4Prefix.from_string("10.0.0.0/8"),
+            IP4Address.from_string("192.168.1.1"),
+            "",
+            "IGP",
+        )
+        removal = RouteRemoval(IP4Prefix.from_string("10.0.0.0/8"))
+        self.assertFalse(hasattr(route, "__dict__"))
+        self.assertFalse(hasattr(removal, "__dict__"))
+        self.assertTrue(removal.is_withdraw)
+        self.assertIsNone(removal.next_hop)
+
+    def test_route_addition_is_not_equal_to_removal(self):
+        route = RouteAddition(
+            IP4Prefix.from_string("10.0.0.0/8"),
+            IP4Address.from_string("192.168.1.1"),
+            "65001",
+            "IGP",
+        )
+        self.assertNotEqual(route, RouteRemoval(IP4Prefix.from_string("10.0.0.0/8")))
+        self.assertNotEqual(route, None)
+
+    def test_route_batch_additions_share_attributes(self):
+        attributes = PathAttributes.intern(
+            IP4Address.from_string("192.168.1.1"), "65001", "IGP"
+        )
+        batch = RouteBatch(
+            [IP4Prefix.from_string("10.0.0.0/8"), IP4Prefix.from_string("10.1.0.0/16")],
+            [],
+            attributes,
+        )
+        for route in batch.additions():
+            self.assertIs(route.attributes, attributes)
@@ -0,0 +1,135 @@
+import socket
+import threading
+import time
+import unittest
+
+from beka.bgp_message import BgpMessagePacker, BgpOpenMessage, BgpKeepaliveMessage
+from beka.bgp_message import BgpUpdateMessage
+from beka.ip import IP4Prefix, IP4Address, IP6Prefix, IP6Address
+from beka.route import PathAttributes, RouteAddition, RouteBatch, RouteRemoval
+from beka.shard import ShardedBeka, decode_route_batches, encode_route_batches
+
+
+class RouteCodecTestCase(unittest.TestCase):
+    def test_route_batches_round_trip(self):
+        attributes = PathAttributes(
+            IP4Address.from_string("192.168.1.1"), "65002 4200000000", "EGP"
+        )
+        batches = [
+            RouteBatch(
+                [
+                    IP4Prefix.from_string("10.0.0.0/8"),
+                    IP4Prefix.from_string("0.0.0.0/0"),
+                ],
+                [IP6Prefix.from_string("2001:db8::/32")],
+                attributes,
+            ),
+            RouteBatch([], [IP4Prefix.from_string("10.1.2.3/32")]),
+            RouteBatch(
+                [IP6Prefix.from_string("2001:db8:1::/48")],
+                [],
+                PathAttributes(IP6Address.from_string("2001:db8::1"), "", "IGP"),
+            ),
+        ]
+        self.assertEqual(decode_route_batches(encode_route_batches(batches)), batches)
+
+    def test_single_routes_become_batches(self):
+        attributes = PathAttributes(IP4Address.from_string("192.168.1.1"), "", "IGP")
+        route_updates = [
+            RouteAddition.from_attributes(
+                IP4Prefix.from_string("10.0.0.0/8"), attributes
+            ),
+            RouteRemoval(IP4Prefix.from_string("10.1.0.0/16")),
+        ]
+        self.assertEqual(
+            decode_route_batches(encode_route_batches(route_updates)),
+            [
+                RouteBatch([IP4Prefix.from_string("10.0.0.0/8")], [], attributes),
+                RouteBatch([], [IP4Prefix.from_string("10.1.0.0/16")]),
+            ],
+        )
+
+    def test_decoded_attributes_are_interned(self):
+        attributes = PathAttributes.intern(
+            IP4Address.from_string("192.168.1.1"), "65002", "IGP"
+        )
+        batch = RouteBatch([IP4Prefix.from_string("10.0.0.0/8")], [], attributes)
+        decoded = decode_route_batches(encode_route_batches([batch, batch]))
+        self.assertIs(decoded[0].attributes, attributes)
+        self.assertIs(decoded[1].attributes, attributes)
+
+
+def updates_received(states):
+    return sum(state["info"]["messages_received"]["update"] for _, state in states)
+
+
+class ShardedBekaTestCase(unittest.TestCase):
+    def test_routes_from_workers_reach_route_handler(self):
+        route_updates = []
+        peers_up = []
+        beka = ShardedBeka(
+            "127.0.0.1",
+            0,
+            65001,
+            "1.1.1.1",
+            lambda peer_ip, peer_as: peers_up.append((peer_ip, peer_as)),
+            None,
+            route_updates.append,
+            None,
+            batch_max_delay=0.01,
+            workers=2,
+        )
+        beka.add_neighbor("passive", "127.0.0.1", 65002)
+        beka.add_route("10.9.0.0/16", "127.0.0.1")
+        beka.STATES_INTERVAL = 0.05
+        beka.start()
+        port = beka.server.getsockname()[1]
+        thread = threading.Thread(target=beka.run)
+        thread.start()
+        try:
+            packer = BgpMessagePacker()
+            client = socket.create_connection(("127.0.0.1", port))
+            client.sendall(
+                packer.pack(
+                    BgpOpenMessage(4, 65002, 240, IP4Address.from_string("2.2.2.2"), {})
+                )
+                + packer.pack(BgpKeepaliveMessage())
+                + packer.pack(
+                    BgpUpdateMessage(
+                        [],
+                        {
+                            "origin": "IGP",
+                            "as_path": "65002",
+                            "next_hop": IP4Address.from_string("127.0.0.1"),
+                        },
+                        [IP4Prefix.from_string("10.2.0.0/16")],
+                    )
+                )
+            )
+            deadline = time.time() + 30
+            while not route_updates and time.time() < deadline:
+                time.sleep(0.05)
+            # until a worker sends states that count the UPDATE
+            states = []
+            while not updates_received(states) and time.time() < deadline:
+                time.sleep(0.05)
+                states = beka.neighbor_states()
+            client.close()
+        finally:
+            beka.shutdown()
+            thread.join()
+
+        self.assertEqual(peers_up, [("127.0.0.1", 65002)])
+        self.assertEqual([peer_address for peer_address, _ in states], ["127.0.0.1"])
+        self.assertEqual(states[0][1]["info"]["messages_received"]["update"], 1)
+        self.assertEqual(
+            route_updates,
+            [
+                RouteAddition(
+                    IP4Prefix.from_string("10.2.0.0/16"),
+                    IP4Address.from_string("127.0.0.1"),
+                    "65002",
+                    "IGP",
+                )
+            ],
+        )
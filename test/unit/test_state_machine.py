@@ -13,7 +13,7 @@ from beka.state_machine import StateMachine
 from beka.event import EventTimerExpired, EventMessageReceived, EventShutdown
 from beka.ip import IP4Prefix, IP4Address
 from beka.ip import IP6Prefix, IP6Address
-from beka.route import RouteAddition, RouteRemoval
+from beka.route import PathAttributes, RouteAddition, RouteRemoval, RouteBatch
 from beka.error import IdleError
 
 
@@ -41,7 +41,7 @@ class StateMachinePassiveActiveTestCase(unittest.TestCase):
             open_handler=self.open_handler,
         )
         self.assertEqual(self.state_machine.state, "active")
-        self.assertEqual(self.state_machine.output_messages.qsize(), 0)
+        self.assertEqual(len(self.state_machine.output_messages), 0)
         self.assertFalse(self.state_machine.timers["hold"].running())
         self.assertFalse(self.state_machine.timers["keepalive"].running())
 
@@ -57,8 +57,19 @@ class StateMachinePassiveActiveTestCase(unittest.TestCase):
         self.assertEqual(self.state_machine.state, "active")
         self.assertFalse(self.state_machine.timers["hold"].expired(self.tick))
         self.assertFalse(self.state_machine.timers["keepalive"].expired(self.tick))
-        self.assertEqual(self.state_machine.output_messages.qsize(), 0)
-        self.assertEqual(self.state_machine.route_updates.qsize(), 0)
+        self.assertEqual(len(self.state_machine.output_messages), 0)
+        self.assertEqual(len(self.state_machine.route_updates), 0)
+
+    def test_open_message_negotiates_extended_message(self):
+        self.assertEqual(self.state_machine.max_message_length, 4096)
+        capabilities = {"multiprotocol": ["ipv4-unicast"], "extendedmessage": [True]}
+        message = BgpOpenMessage(
+            4, 65002, 240, IP4Address.from_string("2.2.2.2"), capabilities
+        )
+        self.state_machine.event(EventMessageReceived(message), self.tick)
+        open_message = self.state_machine.output_messages.pop(0)
+        self.assertEqual(open_message.capabilities["extendedmessage"], [True])
+        self.assertEqual(self.state_machine.max_message_length, 65535)
 
     def test_open_message_advances_to_open_confirm_and_sets_timers(self):
         capabilities = {"multiprotocol": "ipv4-unicast"}
@@ -67,13 +78,13 @@ class StateMachinePassiveActiveTestCase(unittest.TestCase):
         )
         self.state_machine.event(EventMessageReceived(message), self.tick)
         self.assertEqual(self.state_machine.state, "open_confirm")
-        self.assertEqual(self.state_machine.output_messages.qsize(), 2)
+        self.assertEqual(len(self.state_machine.output_messages), 2)
         self.open_handler.assert_called_with(capabilities)
         self.assertTrue(
-            isinstance(self.state_machine.output_messages.get(), BgpOpenMessage)
+            isinstance(self.state_machine.output_messages.pop(0), BgpOpenMessage)
         )
         self.assertTrue(
-            isinstance(self.state_machine.output_messages.get(), BgpKeepaliveMessage)
+            isinstance(self.state_machine.output_messages.pop(0), BgpKeepaliveMessage)
         )
         self.assertTrue(self.state_machine.timers["hold"].running())
         self.assertTrue(self.state_machine.timers["keepalive"].running())
@@ -121,7 +132,7 @@ class StateMachineOpenSentTestCase(unittest.TestCase):
         # TODO trigger this correctly
         self.state_machine.state = "open_sent"
         self.state_machine.timers["hold"].reset(self.tick)
-        self.assertEqual(self.state_machine.output_messages.qsize(), 0)
+        self.assertEqual(len(self.state_machine.output_messages), 0)
         self.assertFalse(self.state_machine.timers["keepalive"].running())
         self.assertTrue(self.state_machine.timers["hold"].running())
 
@@ -136,16 +147,16 @@ class StateMachineOpenSentTestCase(unittest.TestCase):
         with self.assertRaises(IdleError) as context:
             self.state_machine.event(EventTimerExpired(), self.tick)
         self.assertEqual(self.state_machine.state, "idle")
-        self.assertEqual(self.state_machine.output_messages.qsize(), 1)
-        message = self.state_machine.output_messages.get()
+        self.assertEqual(len(self.state_machine.output_messages), 1)
+        message = self.state_machine.output_messages.pop(0)
         self.assertEqual(message.error_code, 4)  # Hold Timer Expired
 
     def test_keepalive_timer_expired_event_does_nothing(self):
         reset_timer_if_running(self.state_machine.timers["keepalive"], self.tick - 3600)
         self.state_machine.event(EventTimerExpired(), self.tick)
         self.assertEqual(self.state_machine.state, "open_sent")
-        self.assertEqual(self.state_machine.output_messages.qsize(), 0)
-        self.assertEqual(self.state_machine.route_updates.qsize(), 0)
+        self.assertEqual(len(self.state_machine.output_messages), 0)
+        self.assertEqual(len(self.state_machine.route_updates), 0)
 
     def test_open_message_advances_to_open_confirm_and_sets_timers(self):
         capabilities = {"multiprotocol": "ipv4-unicast"}
@@ -154,10 +165,10 @@ class StateMachineOpenSentTestCase(unittest.TestCase):
         )
         self.state_machine.event(EventMessageReceived(message), self.tick)
         self.assertEqual(self.state_machine.state, "open_confirm")
-        self.assertEqual(self.state_machine.output_messages.qsize(), 1)
+        self.assertEqual(len(self.state_machine.output_messages), 1)
         self.open_handler.assert_called_with(capabilities)
         self.assertTrue(
-            isinstance(self.state_machine.output_messages.get(), BgpKeepaliveMessage)
+            isinstance(self.state_machine.output_messages.pop(0), BgpKeepaliveMessage)
         )
         self.assertTrue(self.state_machine.timers["hold"].running())
         self.assertTrue(self.state_machine.timers["keepalive"].running())
@@ -208,8 +219,8 @@ class StateMachineOpenConfirmTestCase(unittest.TestCase):
         )
         self.state_machine.event(EventMessageReceived(message), self.tick)
         self.assertEqual(self.state_machine.state, "open_confirm")
-        for _ in range(self.state_machine.output_messages.qsize()):
-            self.state_machine.output_messages.get()
+        for _ in range(len(self.state_machine.output_messages)):
+            self.state_machine.output_messages.pop(0)
         self.assertTrue(self.state_machine.timers["keepalive"].running())
         self.assertTrue(self.state_machine.timers["hold"].running())
 
@@ -218,8 +229,8 @@ class StateMachineOpenConfirmTestCase(unittest.TestCase):
             self.state_machine.event(EventShutdown(), self.tick)
         self.assertTrue("Shutdown requested" in str(context.exception))
         self.assertEqual(self.state_machine.state, "idle")
-        self.assertEqual(self.state_machine.output_messages.qsize(), 1)
-        message = self.state_machine.output_messages.get()
+        self.assertEqual(len(self.state_machine.output_messages), 1)
+        message = self.state_machine.output_messages.pop(0)
         self.assertEqual(message.error_code, 6)  # Cease
 
     def test_hold_timer_expired_event_advances_to_idle_and_sends_notification(self):
@@ -227,8 +238,8 @@ class StateMachineOpenConfirmTestCase(unittest.TestCase):
         with self.assertRaises(IdleError) as context:
             self.state_machine.event(EventTimerExpired(), self.tick)
         self.assertEqual(self.state_machine.state, "idle")
-        self.assertEqual(self.state_machine.output_messages.qsize(), 1)
-        message = self.state_machine.output_messages.get()
+        self.assertEqual(len(self.state_machine.output_messages), 1)
+        message = self.state_machine.output_messages.pop(0)
         self.assertEqual(message.error_code, 4)  # Hold Timer Expired
 
     def test_keepalive_timer_expired_event_sends_keepalive_and_resets_keepalive_timer(
@@ -237,8 +248,8 @@ class StateMachineOpenConfirmTestCase(unittest.TestCase):
         reset_timer_if_running(self.state_machine.timers["keepalive"], self.tick - 3600)
         self.state_machine.event(EventTimerExpired(), self.tick)
         self.assertEqual(self.state_machine.state, "open_confirm")
-        self.assertEqual(self.state_machine.output_messages.qsize(), 1)
-        message = self.state_machine.output_messages.get()
+        self.assertEqual(len(self.state_machine.output_messages), 1)
+        message = self.state_machine.output_messages.pop(0)
         self.assertTrue(isinstance(message, BgpKeepaliveMessage))
         self.assertFalse(self.state_machine.timers["keepalive"].expired(self.tick))
         self.assertTrue(self.state_machine.timers["keepalive"].running())
@@ -284,9 +295,9 @@ class StateMachineOpenConfirmTestCase(unittest.TestCase):
         self.assertEqual(self.state_machine.state, "established")
         self.assertTrue(self.state_machine.timers["hold"].running())
         self.assertFalse(self.state_machine.timers["hold"].expired(self.tick))
-        self.assertEqual(self.state_machine.output_messages.qsize(), 2)
-        first_update = self.state_machine.output_messages.get()
-        second_update = self.state_machine.output_messages.get()
+        self.assertEqual(len(self.state_machine.output_messages), 2)
+        first_update = self.state_machine.output_messages.pop(0)
+        second_update = self.state_machine.output_messages.pop(0)
         self.assertTrue(isinstance(first_update, BgpUpdateMessage))
         self.assertTrue(isinstance(second_update, BgpUpdateMessage))
         self.assertEqual(
@@ -335,9 +346,9 @@ class StateMachineOpenConfirmTestCase(unittest.TestCase):
         self.assertEqual(self.state_machine.state, "established")
         self.assertTrue(self.state_machine.timers["hold"].running())
         self.assertFalse(self.state_machine.timers["hold"].expired(self.tick))
-        self.assertEqual(self.state_machine.output_messages.qsize(), 2)
-        first_update = self.state_machine.output_messages.get()
-        second_update = self.state_machine.output_messages.get()
+        self.assertEqual(len(self.state_machine.output_messages), 2)
+        first_update = self.state_machine.output_messages.pop(0)
+        second_update = self.state_machine.output_messages.pop(0)
         self.assertTrue(isinstance(first_update, BgpUpdateMessage))
         self.assertTrue(isinstance(second_update, BgpUpdateMessage))
         self.assertEqual(
@@ -360,6 +371,48 @@ class StateMachineOpenConfirmTestCase(unittest.TestCase):
             [IP6Prefix.from_string("2001:db6::/127")],
         )
 
+    def test_keepalive_message_splits_routes_into_sized_updates(self):
+        self.tick += 3600
+        self.state_machine.routes_to_advertise = [
+            RouteAddition(
+                IP4Prefix(struct.pack("!I", index << 8), 24),
+                IP4Address.from_string("192.168.1.33"),
+                "",
+                "IGP",
+            )
+            for index in range(3000)
+        ]
+        message = BgpKeepaliveMessage()
+        self.state_machine.event(EventMessageReceived(message), self.tick)
+        self.assertEqual(len(self.state_machine.output_messages), 3)
+        nlri = []
+        for _ in range(3):
+            nlri += self.state_machine.output_messages.pop(0).nlri
+        self.assertEqual(
+            nlri, [route.prefix for route in self.state_machine.routes_to_advertise]
+        )
+
+    def test_advertise_route_changes_updates_initial_routes(self):
+        next_hop = IP4Address.from_string("192.168.1.33")
+        self.state_machine.routes_to_advertise = [
+            RouteAddition(IP4Prefix.from_string("10.1.0.0/16"), next_hop, "", "IGP"),
+            RouteAddition(IP4Prefix.from_string("10.2.0.0/16"), next_hop, "", "IGP"),
+        ]
+        route_changes = [
+            RouteRemoval(IP4Prefix.from_string("10.1.0.0/16")),
+            RouteAddition(IP4Prefix.from_string("10.3.0.0/16"), next_hop, "", "IGP"),
+        ]
+        self.state_machine.advertise_route_changes(route_changes, 3)
+        self.assertEqual(len(self.state_machine.output_messages), 0)
+        self.assertEqual(self.state_machine.routes_version, 3)
+        self.assertEqual(
+            [route.prefix for route in self.state_machine.routes_to_advertise],
+            [
+                IP4Prefix.from_string("10.2.0.0/16"),
+                IP4Prefix.from_string("10.3.0.0/16"),
+            ],
+        )
+
     def test_open_message_advances_to_idle_and_sends_notification(self):
         message = BgpOpenMessage(
             4,
@@ -371,8 +424,8 @@ class StateMachineOpenConfirmTestCase(unittest.TestCase):
         with self.assertRaises(IdleError) as context:
             self.state_machine.event(EventMessageReceived(message), self.tick)
         self.assertEqual(self.state_machine.state, "idle")
-        self.assertEqual(self.state_machine.output_messages.qsize(), 1)
-        message = self.state_machine.output_messages.get()
+        self.assertEqual(len(self.state_machine.output_messages), 1)
+        message = self.state_machine.output_messages.pop(0)
         self.assertEqual(message.error_code, 6)  # Cease
 
     def test_update_message_advances_to_idle(self):
@@ -387,8 +440,8 @@ class StateMachineOpenConfirmTestCase(unittest.TestCase):
         with self.assertRaises(IdleError) as context:
             self.state_machine.event(EventMessageReceived(message), self.tick)
         self.assertEqual(self.state_machine.state, "idle")
-        self.assertEqual(self.state_machine.output_messages.qsize(), 1)
-        message = self.state_machine.output_messages.get()
+        self.assertEqual(len(self.state_machine.output_messages), 1)
+        message = self.state_machine.output_messages.pop(0)
         self.assertEqual(message.error_code, 5)  # FSM error
 
 
@@ -411,8 +464,8 @@ class StateMachineEstablishedTestCase(unittest.TestCase):
             {"multiprotocol": "ipv4-unicast"},
         )
         self.state_machine.event(EventMessageReceived(message), self.tick)
-        for _ in range(self.state_machine.output_messages.qsize()):
-            self.state_machine.output_messages.get()
+        for _ in range(len(self.state_machine.output_messages)):
+            self.state_machine.output_messages.pop(0)
         message = BgpKeepaliveMessage()
         self.state_machine.event(EventMessageReceived(message), self.tick)
         self.assertEqual(self.state_machine.state, "established")
@@ -425,12 +478,79 @@ class StateMachineEstablishedTestCase(unittest.TestCase):
         reset_timer_if_running(self.state_machine.timers["keepalive"], self.tick - 3600)
         self.state_machine.event(EventTimerExpired(), self.tick)
         self.assertEqual(self.state_machine.state, "established")
-        self.assertEqual(self.state_machine.output_messages.qsize(), 1)
-        message = self.state_machine.output_messages.get()
+        self.assertEqual(len(self.state_machine.output_messages), 1)
+        message = self.state_machine.output_messages.pop(0)
         self.assertTrue(isinstance(message, BgpKeepaliveMessage))
         self.assertTrue(self.state_machine.timers["keepalive"].running())
         self.assertFalse(self.state_machine.timers["keepalive"].expired(self.tick))
 
+    def test_event_returns_messages_and_route_updates(self):
+        message = BgpUpdateMessage([IP4Prefix.from_string("192.168.0.0/16")], [], [])
+        output_messages, route_updates = self.state_machine.event(
+            EventMessageReceived(message), self.tick
+        )
+        self.assertEqual(output_messages, [])
+        self.assertEqual(
+            route_updates, [RouteRemoval(IP4Prefix.from_string("192.168.0.0/16"))]
+        )
+
+    def test_event_appends_to_supplied_buffers(self):
+        output_messages = []
+        route_updates = []
+        message = BgpUpdateMessage([IP4Prefix.from_string("192.168.0.0/16")], [], [])
+        for _ in range(2):
+            self.state_machine.event(
+                EventMessageReceived(message),
+                self.tick,
+                output_messages,
+                route_updates,
+            )
+        reset_timer_if_running(self.state_machine.timers["hold"], self.tick - 3600)
+        with self.assertRaises(IdleError):
+            self.state_machine.event(
+                EventTimerExpired(), self.tick, output_messages, route_updates
+            )
+        self.assertEqual(len(route_updates), 2)
+        self.assertEqual(output_messages[-1].error_code, 4)  # Hold timer expired
+
+    def test_advertise_route_changes_sends_updates(self):
+        route_changes = [
+            RouteRemoval(IP4Prefix.from_string("10.2.0.0/16")),
+            RouteAddition(
+                IP4Prefix.from_string("10.1.0.0/16"),
+                IP4Address.from_string("192.168.1.33"),
+                "",
+                "IGP",
+            ),
+            RouteRemoval(IP6Prefix.from_string("2001:db4::/32")),
+            RouteAddition(
+                IP4Prefix.from_string("10.3.0.0/16"),
+                IP4Address.from_string("192.168.1.33"),
+                "",
+                "IGP",
+            ),
+        ]
+        self.state_machine.advertise_route_changes(route_changes, 7)
+        self.assertEqual(self.state_machine.routes_version, 7)
+        self.assertEqual(len(self.state_machine.output_messages), 3)
+        message = self.state_machine.output_messages.pop(0)
+        self.assertEqual(
+            message.withdrawn_routes, [IP4Prefix.from_string("10.2.0.0/16")]
+        )
+        message = self.state_machine.output_messages.pop(0)
+        self.assertEqual(
+            message.path_attributes["mp_unreach_nlri"]["withdrawn_routes"],
+            [IP6Prefix.from_string("2001:db4::/32")],
+        )
+        message = self.state_machine.output_messages.pop(0)
+        self.assertEqual(
+            message.nlri,
+            [
+                IP4Prefix.from_string("10.1.0.0/16"),
+                IP4Prefix.from_string("10.3.0.0/16"),
+            ],
+        )
+
     def test_update_message_adds_route(self):
         path_attributes = {
             "next_hop": IP4Address.from_string("5.4.3.2"),
@@ -448,20 +568,21 @@ class StateMachineEstablishedTestCase(unittest.TestCase):
         )
         self.state_machine.event(EventMessageReceived(message), self.tick)
         self.assertEqual(self.state_machine.state, "established")
-        self.assertEqual(self.state_machine.route_updates.qsize(), 1)
+        self.assertEqual(len(self.state_machine.route_updates), 1)
         self.assertEqual(
-            self.state_machine.route_updates.get(), RouteAddition(**route_attributes)
+            self.state_machine.route_updates.pop(0), RouteAddition(**route_attributes)
         )
 
     def test_update_message_removes_route(self):
         message = BgpUpdateMessage([IP4Prefix.from_string("192.168.0.0/16")], [], [])
         self.state_machine.event(EventMessageReceived(message), self.tick)
         self.assertEqual(self.state_machine.state, "established")
-        self.assertEqual(self.state_machine.route_updates.qsize(), 1)
+        self.assertEqual(len(self.state_machine.route_updates), 1)
         self.assertEqual(
-            self.state_machine.route_updates.get(),
+            self.state_machine.route_updates.pop(0),
             RouteRemoval(IP4Prefix.from_string("192.168.0.0/16")),
         )
+        self.assertEqual(self.state_machine.ipv4_prefixes_withdrawn, 1)
 
     def test_update_v6_message_adds_route(self):
         path_attributes = {
@@ -486,18 +607,20 @@ class StateMachineEstablishedTestCase(unittest.TestCase):
         message = BgpUpdateMessage([], path_attributes, [])
         self.state_machine.event(EventMessageReceived(message), self.tick)
         self.assertEqual(self.state_machine.state, "established")
-        self.assertEqual(self.state_machine.route_updates.qsize(), 1)
+        self.assertEqual(len(self.state_machine.route_updates), 1)
         self.assertEqual(
-            self.state_machine.route_updates.get(), RouteAddition(**route_attributes)
+            self.state_machine.route_updates.pop(0), RouteAddition(**route_attributes)
         )
+        self.assertEqual(self.state_machine.ipv6_prefixes_accepted, 1)
+        self.assertEqual(self.state_machine.ipv4_prefixes_accepted, 0)
 
     def test_shutdown_message_advances_to_idle_and_sends_notification(self):
         with self.assertRaises(IdleError) as context:
             self.state_machine.event(EventShutdown(), self.tick)
         self.assertTrue("Shutdown requested" in str(context.exception))
         self.assertEqual(self.state_machine.state, "idle")
-        self.assertEqual(self.state_machine.output_messages.qsize(), 1)
-        message = self.state_machine.output_messages.get()
+        self.assertEqual(len(self.state_machine.output_messages), 1)
+        message = self.state_machine.output_messages.pop(0)
         self.assertEqual(message.error_code, 6)  # Cease
 
     def test_hold_timer_expired_event_advances_to_idle_and_sends_notification(self):
@@ -505,8 +628,8 @@ class StateMachineEstablishedTestCase(unittest.TestCase):
         with self.assertRaises(IdleError) as context:
             self.state_machine.event(EventTimerExpired(), self.tick)
         self.assertEqual(self.state_machine.state, "idle")
-        self.assertEqual(self.state_machine.output_messages.qsize(), 1)
-        message = self.state_machine.output_messages.get()
+        self.assertEqual(len(self.state_machine.output_messages), 1)
+        message = self.state_machine.output_messages.pop(0)
         self.assertEqual(message.error_code, 4)  # Hold Timer Expired
 
     def test_notification_message_advances_to_idle(self):
@@ -526,6 +649,293 @@ class StateMachineEstablishedTestCase(unittest.TestCase):
         with self.assertRaises(IdleError) as context:
             self.state_machine.event(EventMessageReceived(message), self.tick)
         self.assertEqual(self.state_machine.state, "idle")
-        self.assertEqual(self.state_machine.output_messages.qsize(), 1)
-        message = self.state_machine.output_messages.get()
+        self.assertEqual(len(self.state_machine.output_messages), 1)
+        message = self.state_machine.output_messages.pop(0)
         self.assertEqual(message.error_code, 6)  # Cease
+
+
+class StateMachineBatchRouteUpdatesTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tick = 10000
+        self.state_machine = StateMachine(
+            local_as=65001,
+            peer_as=65002,
+            local_address="1.1.1.1",
+            router_id="1.1.1.1",
+            neighbor="2.2.2.2",
+            hold_time=240,
+            batch_route_updates=True,
+        )
+        self.state_machine.state = "established"
+
+    def test_update_message_puts_one_batch(self):
+        path_attributes = {
+            "next_hop": IP4Address.from_string("5.4.3.2"),
+            "as_path": "65032 65011 65002",
+            "origin": "EGP",
+        }
+        nlri = [
+            IP4Prefix.from_string("192.168.0.0/16"),
+            IP4Prefix.from_string("10.0.0.0/8"),
+        ]
+        withdrawn_routes = [IP4Prefix.from_string("172.16.0.0/12")]
+        message = BgpUpdateMessage(withdrawn_routes, path_attributes, nlri)
+        self.state_machine.event(EventMessageReceived(message), self.tick)
+        self.assertEqual(len(self.state_machine.route_updates), 1)
+        batch = self.state_machine.route_updates.pop(0)
+        self.assertEqual(
+            batch,
+            RouteBatch(
+                nlri,
+                withdrawn_routes,
+                PathAttributes(
+                    IP4Address.from_string("5.4.3.2"), "65032 65011 65002", "EGP"
+                ),
+            ),
+        )
+        self.assertEqual(len(batch), 3)
+        self.assertEqual(
+            list(batch),
+            [
+                RouteAddition(
+                    nlri[0], path_attributes["next_hop"], "65032 65011 65002", "EGP"
+                ),
+                RouteAddition(
+                    nlri[1], path_attributes["next_hop"], "65032 65011 65002", "EGP"
+                ),
+                RouteRemoval(withdrawn_routes[0]),
+            ],
+        )
+
+    def test_update_v6_message_puts_batch_per_address_family(self):
+        path_attributes = {
+            "next_hop": IP4Address.from_string("5.4.3.2"),
+            "as_path": "65032",
+            "origin": "IGP",
+            "mp_reach_nlri": {
+                "next_hop": [IP6Address.from_string("2001:db8:1::1")],
+                "nlri": [IP6Prefix.from_string("2001:db4::/48")],
+            },
+            "mp_unreach_nlri": {
+                "withdrawn_routes": [IP6Prefix.from_string("2001:db5::/48")],
+            },
+        }
+        message = BgpUpdateMessage(
+            [], path_attributes, [IP4Prefix.from_string("10.0.0.0/8")]
+        )
+        self.state_machine.event(EventMessageReceived(message), self.tick)
+        self.assertEqual(len(self.state_machine.route_updates), 2)
+        ipv4_batch = self.state_machine.route_updates.pop(0)
+        ipv6_batch = self.state_machine.route_updates.pop(0)
+        self.assertEqual(ipv4_batch.prefixes, [IP4Prefix.from_string("10.0.0.0/8")])
+        self.assertEqual(ipv4_batch.next_hop, IP4Address.from_string("5.4.3.2"))
+        self.assertEqual(ipv6_batch.prefixes, [IP6Prefix.from_string("2001:db4::/48")])
+        self.assertEqual(
+            ipv6_batch.withdrawals, [IP6Prefix.from_string("2001:db5::/48")]
+        )
+        self.assertEqual(ipv6_batch.next_hop, IP6Address.from_string("2001:db8:1::1"))
+
+    def test_update_message_counts_prefixes_per_address_family(self):
+        path_attributes = {
+            "next_hop": IP4Address.from_string("5.4.3.2"),
+            "as_path": "65032",
+            "origin": "IGP",
+            "mp_reach_nlri": {
+                "next_hop": [IP6Address.from_string("2001:db8:1::1")],
+                "nlri": [
+                    IP6Prefix.from_string("2001:db4::/48"),
+                    IP6Prefix.from_string("2001:db6::/48"),
+                ],
+            },
+            "mp_unreach_nlri": {
+                "withdrawn_routes": [IP6Prefix.from_string("2001:db5::/48")],
+            },
+        }
+        message = BgpUpdateMessage(
+            [IP4Prefix.from_string("192.168.0.0/16")],
+            path_attributes,
+            [IP4Prefix.from_string("10.0.0.0/8")],
+        )
+        self.state_machine.event(EventMessageReceived(message), self.tick)
+        self.assertEqual(self.state_machine.ipv4_prefixes_accepted, 1)
+        self.assertEqual(self.state_machine.ipv4_prefixes_withdrawn, 1)
+        self.assertEqual(self.state_machine.ipv6_prefixes_accepted, 2)
+        self.assertEqual(self.state_machine.ipv6_prefixes_withdrawn, 1)
+
+    def test_withdrawal_only_update_puts_batch_without_attributes(self):
+        message = BgpUpdateMessage([IP4Prefix.from_string("192.168.0.0/16")], [], [])
+        self.state_machine.event(EventMessageReceived(message), self.tick)
+        self.assertEqual(len(self.state_machine.route_updates), 1)
+        self.assertEqual(
+            self.state_machine.route_updates.pop(0),
+            RouteBatch([], [IP4Prefix.from_string("192.168.0.0/16")]),
+        )
+
+
+class StateMachineAdjRibInTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tick = 10000
+        self.state_machine = StateMachine(
+            local_as=65001,
+            peer_as=65002,
+            local_address="1.1.1.1",
+            router_id="1.1.1.1",
+            neighbor="2.2.2.2",
+            hold_time=240,
+            adj_rib_in=True,
+        )
+        self.state_machine.state = "established"
+        self.path_attributes = {
+            "next_hop": IP4Address.from_string("5.4.3.2"),
+            "as_path": "65032 65011 65002",
+            "origin": "EGP",
+        }
+
+    def drain_route_updates(self):
+        route_updates = self.state_machine.route_updates
+        self.state_machine.route_updates = []
+        return route_updates
+
+    def test_duplicate_announcement_is_suppressed(self):
+        nlri = [IP4Prefix.from_string("192.168.0.0/16")]
+        message = BgpUpdateMessage([], self.path_attributes, nlri)
+        self.state_machine.event(EventMessageReceived(message), self.tick)
+        self.assertEqual(len(self.drain_route_updates()), 1)
+        self.state_machine.event(EventMessageReceived(message), self.tick)
+        self.assertEqual(self.drain_route_updates(), [])
+
+    def test_changed_announcement_is_sent(self):
+        nlri = [IP4Prefix.from_string("192.168.0.0/16")]
+        message = BgpUpdateMessage([], self.path_attributes, nlri)
+        self.state_machine.event(EventMessageReceived(message), self.tick)
+        self.drain_route_updates()
+        path_attributes = dict(self.path_attributes, as_path="65032 65002")
+        message = BgpUpdateMessage([], path_attributes, nlri)
+        self.state_machine.event(EventMessageReceived(message), self.tick)
+        self.assertEqual(
+            self.drain_route_updates(),
+            [RouteAddition(nlri[0], path_attributes["next_hop"], "65032 65002", "EGP")],
+        )
+
+    def test_unknown_withdrawal_is_suppressed(self):
+        message = BgpUpdateMessage([IP4Prefix.from_string("192.168.0.0/16")], [], [])
+        self.state_machine.event(EventMessageReceived(message), self.tick)
+        self.assertEqual(self.drain_route_updates(), [])
+
+    def test_withdraw_all_routes(self):
+        nlri = [
+            IP4Prefix.from_string("192.168.0.0/16"),
+            IP4Prefix.from_string("10.0.0.0/8"),
+        ]
+        message = BgpUpdateMessage([], self.path_attributes, nlri)
+        self.state_machine.event(EventMessageReceived(message), self.tick)
+        self.drain_route_updates()
+        self.state_machine.withdraw_all_routes()
+        self.assertEqual(
+            self.drain_route_updates(),
+            [RouteRemoval(nlri[1]), RouteRemoval(nlri[0])],
+        )
+        self.state_machine.withdraw_all_routes()
+        self.assertEqual(self.drain_route_updates(), [])
+
+    def test_withdraw_all_routes_batched(self):
+        self.state_machine.batch_route_updates = True
+        nlri = [IP4Prefix.from_string("192.168.0.0/16")]
+        message = BgpUpdateMessage([], self.path_attributes, nlri)
+        _, route_updates = self.state_machine.event(
+            EventMessageReceived(message), self.tick
+        )
+        self.assertEqual(len(route_updates), 1)
+        _, route_updates = self.state_machine.event(
+            EventMessageReceived(message), self.tick
+        )
+        self.assertEqual(route_updates, [])
+        self.assertEqual(
+            self.state_machine.withdraw_all_routes(), [RouteBatch([], nlri)]
+        )
+
+
+class StateMachineTreatAsWithdrawTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tick = 10000
+        self.state_machine = StateMachine(
+            local_as=65001,
+            peer_as=65002,
+            local_address="1.1.1.1",
+            router_id="1.1.1.1",
+            neighbor="2.2.2.2",
+            hold_time=240,
+            adj_rib_in=True,
+        )
+        self.state_machine.state = "established"
+        self.path_attributes = {
+            "next_hop": IP4Address.from_string("5.4.3.2"),
+            "as_path": "65032 65011 65002",
+            "origin": "EGP",
+        }
+        self.nlri = [IP4Prefix.from_string("192.168.0.0/16")]
+        message = BgpUpdateMessage([], self.path_attributes, self.nlri)
+        self.state_machine.event(EventMessageReceived(message), self.tick)
+
+    def receive(self, path_attributes, nlri):
+        message = BgpUpdateMessage([], path_attributes, nlri)
+        _, route_updates = self.state_machine.event(
+            EventMessageReceived(message), self.tick
+        )
+        return route_updates
+
+    def test_malformed_attribute_withdraws_routes(self):
+        path_attributes = dict(self.path_attributes)
+        del path_attributes["as_path"]
+        path_attributes["attribute_errors"] = (
+            (2, "treat-as-withdraw", "AS_PATH: Segment runs past end"),
+        )
+        route_updates = self.receive(
+            path_attributes, self.nlri + [IP4Prefix.from_string("10.0.0.0/8")]
+        )
+        self.assertEqual(route_updates, [RouteRemoval(self.nlri[0])])
+        self.assertEqual(self.state_machine.updates_treated_as_withdraw, 1)
+        self.assertEqual(self.state_machine.ipv4_prefixes_withdrawn, 1)
+        self.assertEqual(self.state_machine.state, "established")
+
+    def test_missing_mandatory_attribute_withdraws_routes(self):
+        path_attributes = dict(self.path_attributes)
+        del path_attributes["next_hop"]
+        self.assertEqual(
+            self.receive(path_attributes, self.nlri), [RouteRemoval(self.nlri[0])]
+        )
+        self.assertEqual(self.state_machine.updates_treated_as_withdraw, 1)
+
+    def test_discarded_attribute_keeps_routes(self):
+        path_attributes = dict(self.path_attributes)
+        path_attributes["attribute_errors"] = (
+            (7, "attribute-discard", "AGGREGATOR: Got invalid length: 5"),
+        )
+        path_attributes["origin"] = "IGP"
+        route_updates = self.receive(path_attributes, self.nlri)
+        self.assertEqual(len(route_updates), 1)
+        self.assertIsInstance(route_updates[0], RouteAddition)
+        self.assertEqual(self.state_machine.attributes_discarded, 1)
+        self.assertEqual(self.state_machine.updates_treated_as_withdraw, 0)
+
+    def test_batched_ipv6_routes_are_withdrawn(self):
+        self.state_machine.batch_route_updates = True
+        nlri6 = [IP6Prefix.from_string("2001:db4::/32")]
+        path_attributes = {
+            "as_path": "65032 65011 65002",
+            "origin": "EGP",
+            "mp_reach_nlri": {
+                "next_hop": [IP6Address.from_string("2001:db8:1::1")],
+                "nlri": nlri6,
+            },
+        }
+        self.receive(path_attributes, [])
+        path_attributes = dict(path_attributes)
+        path_attributes["attribute_errors"] = (
+            (8, "treat-as-withdraw", "COMMUNITIES: Got invalid length: 3"),
+        )
+        self.assertEqual(
+            self.receive(path_attributes, self.nlri),
+            [RouteBatch([], self.nlri), RouteBatch([], nlri6)],
+        )
+        self.assertEqual(self.state_machine.ipv6_prefixes_withdrawn, 1)
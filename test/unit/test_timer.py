@@ -1,6 +1,6 @@
 import unittest
 
-from beka.timer import Timer
+from beka.timer import Timer, TimerHeap
 
 
 class TimerTestCase(unittest.TestCase):
@@ -24,3 +24,54 @@ class TimerTestCase(unittest.TestCase):
         self.assertFalse(timer.expired(base_tick))
         self.assertFalse(timer.expired(base_tick + timer_count - 1))
         self.assertFalse(timer.expired(base_tick + timer_count + 1))
+
+    def test_timer_deadline(self):
+        timer = Timer(60)
+        self.assertIsNone(timer.deadline())
+        timer.reset(10000)
+        self.assertEqual(timer.deadline(), 10060)
+        self.assertTrue(timer.expired(10060))
+
+    def test_sub_second_timer(self):
+        timer = Timer(0.25)
+        timer.reset(10000.5)
+        self.assertFalse(timer.expired(10000.7))
+        self.assertTrue(timer.expired(10000.75))
+
+
+class TimerHeapTestCase(unittest.TestCase):
+    def test_pop_due_returns_sessions_in_deadline_order(self):
+        heap = TimerHeap()
+        heap.schedule("b", 20)
+        heap.schedule("a", 10)
+        heap.schedule("c", 30)
+        self.assertEqual(heap.next_deadline(), 10)
+        self.assertEqual(heap.pop_due(9), [])
+        self.assertEqual(heap.pop_due(20), ["a", "b"])
+        self.assertEqual(heap.next_deadline(), 30)
+        self.assertEqual(len(heap), 1)
+
+    def test_reschedule_replaces_deadline(self):
+        heap = TimerHeap()
+        heap.schedule("a", 10)
+        heap.schedule("a", 40)
+        heap.schedule("b", 20)
+        self.assertEqual(heap.next_deadline(), 20)
+        self.assertEqual(heap.pop_due(30), ["b"])
+        self.assertEqual(heap.pop_due(40), ["a"])
+        self.assertIsNone(heap.next_deadline())
+
+    def test_cancel(self):
+        heap = TimerHeap()
+        heap.schedule("a", 10)
+        heap.cancel("a")
+        self.assertEqual(len(heap), 0)
+        self.assertIsNone(heap.next_deadline())
+        self.assertEqual(heap.pop_due(100), [])
+
+    def test_stale_entries_are_compacted(self):
+        heap = TimerHeap()
+        for deadline in range(1000):
+            heap.schedule("a", deadline)
+        self.assertLess(len(heap.heap), 100)
+        self.assertEqual(heap.pop_due(1000), ["a"])
@@ -0,0 +1,111 @@
+import unittest
+
+from beka.bgp_message import BgpMessage, BgpMessageParser, BgpMessagePacker
+from beka.bgp_message import BgpKeepaliveMessage, BgpOpenMessage
+from beka.event import EventMessageReceived
+from beka.ip import IP4Address, IP4Prefix, IP6Address, IP6Prefix
+from beka.route import RouteAddition
+from beka.state_machine import StateMachine
+from beka.update_cache import UpdateCache
+
+
+class UpdateCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.cache = UpdateCache()
+        self.built = 0
+
+    def build(self):
+        self.built += 1
+        return [BgpKeepaliveMessage()]
+
+    def test_get_packs_once_per_key(self):
+        first = self.cache.get(1, False, "ipv4-unicast", 4096, self.build)
+        second = self.cache.get(1, False, "ipv4-unicast", 4096, self.build)
+        self.assertIs(first, second)
+        self.assertEqual(first, (BgpMessagePacker().pack(BgpKeepaliveMessage()),))
+        self.assertEqual(self.built, 1)
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 1))
+
+    def test_get_keys_on_capabilities(self):
+        self.cache.get(1, False, "ipv4-unicast", 4096, self.build)
+        self.cache.get(1, [65002], "ipv4-unicast", 4096, self.build)
+        self.cache.get(1, [65003], "ipv4-unicast", 4096, self.build)
+        self.cache.get(1, False, "ipv6-unicast", 4096, self.build)
+        self.cache.get(1, False, "ipv4-unicast", 65535, self.build)
+        self.assertEqual(self.built, 4)
+        self.assertEqual(len(self.cache), 4)
+
+    def test_new_version_drops_old_entries(self):
+        self.cache.get(1, False, "ipv4-unicast", 4096, self.build)
+        self.cache.get(2, False, "ipv4-unicast", 4096, self.build)
+        self.assertEqual(len(self.cache), 1)
+        self.cache.get(1, False, "ipv4-unicast", 4096, self.build)
+        self.assertEqual(len(self.cache), 1)
+        self.cache.get(2, False, "ipv4-unicast", 4096, self.build)
+        self.assertEqual(self.built, 3)
+
+
+class StateMachineUpdateCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tick = 10000
+        self.cache = UpdateCache()
+        self.routes = [
+            RouteAddition(
+                IP4Prefix.from_string("10.0.0.0/8"),
+                IP4Address.from_string("192.168.1.33"),
+                "65001",
+                "IGP",
+            ),
+            RouteAddition(
+                IP6Prefix.from_string("2001:db4::/127"),
+                IP6Address.from_string("2001:db4::1"),
+                "65001",
+                "IGP",
+            ),
+        ]
+
+    def establish(self, capabilities):
+        state_machine = StateMachine(
+            local_as=65001,
+            peer_as=65002,
+            local_address="1.1.1.1",
+            router_id="1.1.1.1",
+            neighbor="2.2.2.2",
+        )
+        state_machine.routes_to_advertise = list(self.routes)
+        state_machine.routes_version = 1
+        state_machine.update_cache = self.cache
+        message = BgpOpenMessage(
+            4, 65002, 240, IP4Address.from_string("2.2.2.2"), capabilities
+        )
+        state_machine.event(EventMessageReceived(message), self.tick)
+        output_messages, _ = state_machine.event(
+            EventMessageReceived(BgpKeepaliveMessage()), self.tick
+        )
+        return output_messages
+
+    def test_peers_with_equivalent_capabilities_share_bytes(self):
+        first = self.establish({"fourbyteas": [65002]})
+        second = self.establish({"fourbyteas": [65002]})
+        self.assertEqual(len(first), 2)
+        self.assertIs(first[0], second[0])
+        self.assertIs(first[1], second[1])
+        self.assertEqual((self.cache.hits, self.cache.misses), (2, 2))
+
+    def test_packed_updates_parse_back_to_routes(self):
+        packer = BgpMessagePacker()
+        parser = BgpMessageParser()
+        parser.capabilities = {"fourbyteas": [65002]}
+        first = self.establish({"fourbyteas": [65002]})
+        second = self.establish({})
+        self.assertNotEqual(first[0], second[0])
+        ipv4_update, ipv6_update = [
+            parser.parse(BgpMessage.UPDATE_MESSAGE, packer.pack(packed)[19:])
+            for packed in first
+        ]
+        self.assertEqual(ipv4_update.nlri, [self.routes[0].prefix])
+        self.assertEqual(ipv4_update.path_attributes["as_path"], "65001")
+        self.assertEqual(
+            ipv6_update.path_attributes["mp_reach_nlri"]["nlri"],
+            [self.routes[1].prefix],
+        )